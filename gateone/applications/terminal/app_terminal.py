@@ -27,23 +27,34 @@ from gateone.core.server import StaticHandler, BaseHandler, GOApplication
 from gateone.core.server import ApplicationWebSocket
 from gateone.auth.authorization import require, authenticated
 from gateone.auth.authorization import applicable_policies, policies
-from gateone.core.configuration import get_settings, RUDict
+from gateone.core.configuration import get_settings
 from gateone.core.utils import cmd_var_swap, json_encode, generate_session_id
 from gateone.core.utils import mkdir_p, entry_point_files
 from gateone.core.utils import process_opt_esc_sequence, bind, MimeTypeFail
 from gateone.core.utils import short_hash, create_data_uri, which
 from gateone.core.locale import get_translation
 from gateone.core.log import go_logger, string_to_syslog_facility
+from gateone.core.metrics import Counter, add_collector, summary, hit_ratio
 from gateone.applications.terminal.logviewer import main as logviewer_main
 from gateone.applications.terminal.policy import terminal_policies
 
 # 3rd party imports
-from tornado.escape import json_decode
 from tornado.options import options, define, Error
+from tornado.concurrent import Future
 
 # Globals
 REGISTERED_HANDLERS = [] # So we don't accidentally re-add handlers
 web_handlers = [] # Assigned in init()
+EMULATOR_POOL = None # termio.emulation.EmulatorPool (see emulator_pool())
+# Incremented whenever sharing permissions change anywhere so that every
+# TerminalApplication knows to forget which terminals it may write to:
+SHARING_GENERATION = 0
+REFRESHES_SENT = Counter(
+    'gateone_terminal_refreshes_sent_total',
+    'Screen updates (terminal:termupdate) sent to clients.')
+REFRESHES_SKIPPED = Counter(
+    'gateone_terminal_refreshes_skipped_total',
+    'Screen updates skipped because the client was behind.')
 
 # Localization support
 _ = get_translation()
@@ -78,6 +89,31 @@ if not hasattr(options, 'session_logging'):
         help=_("Kill any running Gate One terminal processes including dtach'd "
                 "processes.")
     )
+    define(
+        "emulator_processes",
+        default=0,
+        type=int,
+        group='terminal',
+        help=_("If non-zero, the output of each terminal will be read, "
+               "emulated, and rendered in one of this many separate emulator "
+               "processes (so a noisy terminal can't slow down everyone "
+               "else).  Default: 0 (do it all in Gate One's own process).")
+    )
+
+def emulator_pool():
+    """
+    Returns the `termio.emulation.EmulatorPool` that terminals get assigned to
+    (starting it the first time it's needed) or ``None`` if the
+    `emulator_processes` setting is 0.
+    """
+    global EMULATOR_POOL
+    if not options.emulator_processes:
+        return None
+    if not EMULATOR_POOL:
+        from termio.emulation import EmulatorPool
+        EMULATOR_POOL = EmulatorPool(options.emulator_processes)
+        EMULATOR_POOL.start()
+    return EMULATOR_POOL
 
 def kill_session(session, kill_dtach=False):
     """
@@ -91,8 +127,10 @@ def kill_session(session, kill_dtach=False):
         `SESSIONS[session]["kill_session_callbacks"]` list inside of
         :meth:`TerminalApplication.authenticate`.
     """
+    from .term_utils import flush_term_settings
     term_log = go_logger("gateone.terminal")
     term_log.debug('kill_session(%s)' % session)
+    flush_term_settings(session)
     if kill_dtach:
         from gateone.core.utils import kill_dtached_proc
     for location, apps in list(SESSIONS[session]['locations'].items()):
@@ -114,9 +152,91 @@ def timeout_session(session):
     """
     kill_session(session, kill_dtach=True)
 
+def terminal_metrics():
+    """
+    Metrics collector (see :ref:`metrics.py`) for the Terminal application:
+    Output read per terminal, `terminal.Terminal.write` and
+    `terminal.Terminal.dump_html` timings, how often the rate limiter kicked
+    in, the `terminal.HTML_CACHE`, and session logging (golog) totals.
+    """
+    import termio, terminal
+    bytes_read = []
+    ratelimited = []
+    for session, session_obj in list(SESSIONS.items()):
+        for location, apps in list(session_obj['locations'].items()):
+            for term, term_obj in list(apps.get('terminal', {}).items()):
+                if not isinstance(term, int) or 'multiplex' not in term_obj:
+                    continue
+                m = term_obj['multiplex']
+                labels = {
+                    'session': short_hash(session),
+                    'location': location,
+                    'term': term,
+                }
+                bytes_read.append((labels, m.bytes_read))
+                ratelimited.append((labels, m.ratelimiter_engaged))
+    stats = termio.multiplex_stats()
+    golog = termio.recording_stats()
+    emulators = []
+    if EMULATOR_POOL:
+        # Most of the work happens in the emulator processes
+        for key, value in EMULATOR_POOL.multiplex_stats().items():
+            stats[key] += value
+        for key, value in EMULATOR_POOL.recording_stats().items():
+            golog[key] += value
+        for emulator in EMULATOR_POOL.emulators:
+            emulators.append(({'emulator': emulator.number}, emulator.load))
+    html_cache = terminal.HTML_CACHE
+    metrics = [
+        ('gateone_terminal_bytes_read_total', 'counter',
+            'Output read from each (open) terminal.', bytes_read),
+        ('gateone_terminal_ratelimited', 'gauge',
+            'Whether or not the rate limiter is engaged on each terminal.',
+            ratelimited),
+        ('gateone_terminals_bytes_read_total', 'counter',
+            'Output read from all terminals (including closed ones).',
+            [(None, stats['bytes_read'])]),
+        ('gateone_terminal_write_seconds', 'summary',
+            'Time spent in Terminal.write() (sampled).',
+            summary(stats['term_writes'], stats['term_write_samples'],
+                stats['term_write_seconds'])),
+        ('gateone_terminal_dump_html_seconds', 'summary',
+            'Time spent in Terminal.dump_html() (sampled).',
+            summary(stats['dump_html_calls'], stats['dump_html_samples'],
+                stats['dump_html_seconds'])),
+        ('gateone_terminal_ratelimiter_engaged_total', 'counter',
+            'Number of times a noisy program kicked off the rate limiter.',
+            [(None, stats['ratelimiter_engaged'])]),
+        ('gateone_golog_bytes_written_total', 'counter',
+            'Bytes written to session logs.',
+            [(None, golog['bytes_written'])]),
+        ('gateone_golog_bytes_queued', 'gauge',
+            'Bytes waiting to be written to session logs.',
+            [(None, golog['bytes_queued'])]),
+        ('gateone_golog_bytes_dropped_total', 'counter',
+            'Bytes dropped because session logs could not keep up.',
+            [(None, golog['bytes_dropped'])]),
+    ]
+    if EMULATOR_POOL:
+        metrics.extend([
+            ('gateone_terminal_emulator_load', 'gauge',
+                'Fraction of a CPU used by each emulator process.', emulators),
+            ('gateone_terminal_emulator_migrations_total', 'counter',
+                'Terminals migrated between emulator processes.',
+                [(None, EMULATOR_POOL.migrations)]),
+        ])
+    metrics.extend(hit_ratio('gateone_terminal_html_cache', 'HTML_CACHE',
+        terminal.HTML_CACHE_STATS,
+        len(html_cache) if html_cache is not None else None))
+    return metrics
+
+add_collector(terminal_metrics)
+
 @atexit.register
 def quit():
     from gateone.core.utils import killall
+    from .term_utils import flush_term_settings
+    flush_term_settings() # Write out any pending term_settings.json changes
     try:
         commands = options.parse_command_line()
     except Error: # options.Error
@@ -192,6 +312,9 @@ class TerminalApplication(GOApplication):
         self.titles = {}
         self.em_dimensions = None
         self.race_check = False
+        # Terminals (term -> term_obj) that policies already let us write to:
+        self.writable_terms = {}
+        self.writable_generation = None
         self.log_metadata = {'application': 'terminal'}
         GOApplication.__init__(self, ws)
 
@@ -220,6 +343,7 @@ class TerminalApplication(GOApplication):
             'terminal:write_chars': self.write_chars,
             'terminal:refresh': self.refresh_screen,
             'terminal:full_refresh': self.full_refresh,
+            'terminal:get_scrollback': self.get_scrollback,
             'terminal:resize': self.resize,
             'terminal:get_bell': self.get_bell,
             'terminal:manual_title': self.manual_title,
@@ -641,32 +765,17 @@ class TerminalApplication(GOApplication):
         .. note:: This method is primarily to aid dtach support.
         """
         self.term_log.debug("save_term_settings(%s, %s)" % (term, settings))
-        from .term_utils import save_term_settings as _save
+        from .term_utils import get_term_settings_store
+        if not self.ws.session:
+            return # Just a viewer of a broadcast terminal
         term = str(term) # JSON wants strings as keys
-        def saved(result): # NOTE: result will always be None
-            """
-            Called when we're done JSON-decoding and re-encoding the given
-            settings.  Just triggers the `terminal:save_term_settings` event.
-            """
-            self.trigger("terminal:save_term_settings", term, settings)
-        # Why bother with an async call for something so small?  Well, we can't
-        # be sure it will *always* be a tiny amount of data.  What if some app
-        # embedding Gate One wants to pass in some huge amount of metadata when
-        # they open new terminals?  Don't want to block while the read, JSON
-        # decode, JSON encode, and write operations take place.
-        # Also note that this function gets called whenever a new terminal is
-        # opened or resumed.  So if you have 100 users each with a dozen or so
-        # terminals it could slow things down quite a bit in the event that a
-        # number of users lose connectivity and reconnect at once (or the server
-        # is restarted with dtach support enabled).
-        self.cpu_async.call_singleton( # Singleton since we're writing async
-            _save,
-            'save_term_settings_%s' % self.ws.session,
-            term,
-            self.ws.location,
-            self.ws.session,
-            settings,
-            callback=saved)
+        # This gets called a lot (e.g. every time the title changes) so the
+        # settings are kept in memory and only written to disk periodically:
+        interval = self.ws.prefs['*']['terminal'].get(
+            'term_settings_save_interval', 1000) # ms
+        store = get_term_settings_store(self.ws.session, interval=interval)
+        store.update(self.ws.location, term, settings)
+        self.trigger("terminal:save_term_settings", term, settings)
 
     def restore_term_settings(self, term):
         """
@@ -692,12 +801,11 @@ class TerminalApplication(GOApplication):
                     self.loc_terms[termNum]['multiplex'].term.title = (
                         self.loc_terms[termNum]['title'])
             self.trigger("terminal:restore_term_settings", term, settings)
-        future = self.cpu_async.call(
-            _restore,
-            self.ws.location,
-            self.ws.session,
-            memoize=False,
-            callback=restore)
+        # The settings are (usually) already in memory so this is quick
+        settings = _restore(self.ws.location, self.ws.session) or {}
+        restore(settings)
+        future = Future()
+        future.set_result(settings)
         return future
 
     def clear_term_settings(self, term):
@@ -707,20 +815,10 @@ class TerminalApplication(GOApplication):
         """
         term = str(term)
         self.term_log.debug("clear_term_settings(%s)" % term)
-        term_settings = RUDict()
-        term_settings[self.ws.location] = {term: {}}
-        session_dir = options.session_dir
-        session_dir = os.path.join(session_dir, self.ws.session)
-        settings_path = os.path.join(session_dir, 'term_settings.json')
-        if not os.path.exists(settings_path):
-            return # Nothing to do
-        # First we read in the existing settings and then update them.
-        if os.path.exists(settings_path):
-            with io.open(settings_path, encoding='utf-8') as f:
-                term_settings.update(json_decode(f.read()))
-        del term_settings[self.ws.location][term]
-        with io.open(settings_path, 'w', encoding='utf-8') as f:
-            f.write(json_encode(term_settings))
+        from .term_utils import get_term_settings_store
+        if not self.ws.session:
+            return # Just a viewer of a broadcast terminal
+        get_term_settings_store(self.ws.session).remove(self.ws.location, term)
         self.trigger("terminal:clear_term_settings", term)
 
     @require(authenticated(), policies('terminal'))
@@ -889,7 +987,8 @@ class TerminalApplication(GOApplication):
         term_emulator.remove_callback(terminal.CALLBACK_BELL, callback_id)
 
     def new_multiplex(self,
-        cmd, term_id, logging=True, encoding='utf-8', debug=False):
+        cmd, term_id, logging=True, encoding='utf-8', debug=False,
+        pooled=False):
         """
         Returns a new instance of :py:class:`termio.Multiplex` with the proper
         global and client-specific settings.
@@ -908,6 +1007,11 @@ class TerminalApplication(GOApplication):
             :debug:
                 If ``True``, will enable debugging on the created Multiplex
                 instance.
+            :pooled:
+                If ``True`` and the `emulator_processes` setting is non-zero
+                a `termio.emulation.EmulatedMultiplex` will be returned
+                instead (its terminal will be emulated in one of the pooled
+                emulator processes).
         """
         import termio
         cls = TerminalApplication
@@ -956,7 +1060,12 @@ class TerminalApplication(GOApplication):
         if enabled_filetypes != 'all':
             # Only need to bother if it is something other than the default
             terminal_emulator_kwargs = {'enabled_filetypes': enabled_filetypes}
-        m = termio.Multiplex(
+        multiplex_class = termio.Multiplex
+        pool = emulator_pool() if pooled else None
+        if pool:
+            from termio.emulation import EmulatedMultiplex
+            multiplex_class = partial(EmulatedMultiplex, pool)
+        m = multiplex_class(
             cmd,
             terminal_emulator_kwargs=terminal_emulator_kwargs,
             log_path=log_path,
@@ -965,6 +1074,10 @@ class TerminalApplication(GOApplication):
             debug=debug,
             syslog=syslog_logging,
             syslog_facility=facility,
+            # Optional: Send directly to this Unix socket (e.g. /dev/log):
+            syslog_address=policies.get('syslog_session_address', None),
+            # Max lines per second (per user) sent to syslog:
+            syslog_rate=policies.get('syslog_session_rate', 100),
             additional_metadata=additional_log_metadata,
             encoding=encoding
         )
@@ -1115,6 +1228,7 @@ class TerminalApplication(GOApplication):
             # Now swap out any variables like $PATH, $HOME, $USER, etc
             cmd = os.path.expandvars(cmd)
             resumed_dtach = False
+            dtach_path = None
             # Create the user's session dir if not already present
             if not os.path.exists(user_session_dir):
                 mkdir_p(user_session_dir)
@@ -1134,7 +1248,10 @@ class TerminalApplication(GOApplication):
                     cmd = "dtach -c %s -E -z -r none %s" % (dtach_path, cmd)
             self.term_log.debug(_("new_terminal cmd: %s" % repr(cmd)))
             m = term_obj['multiplex'] = self.new_multiplex(
-                cmd, term, encoding=encoding)
+                cmd, term, encoding=encoding, pooled=True)
+            if dtach_path and hasattr(m, 'reattach_cmd'):
+                # Lets the emulator pool migrate this terminal if need be
+                m.reattach_cmd = "dtach -a %s -E -z -r none" % dtach_path
             # Set some environment variables so the programs we execute can use
             # them (very handy).  Allows for "tight integration" and "synergy"!
             env = {
@@ -1286,6 +1403,7 @@ class TerminalApplication(GOApplication):
         """
         self.term_log.debug("start_capture(%s)" % repr(term))
         from tempfile import NamedTemporaryFile
+        from termio.vtextract import VTTextExtractor
         from .term_utils import capture_stream
         if not term:
             term = self.current_term
@@ -1298,8 +1416,13 @@ class TerminalApplication(GOApplication):
         term_obj = self.loc_terms[term]
         term_obj["capture"] = {
             "output": io.open(capture_path, 'a', encoding="utf-8"),
+            # Strips escape sequences (keeps state between chunks of output):
+            "extractor": VTTextExtractor(),
             "capture_func": capture_func # So we can call self.off() with it
         }
+        multiplex = term_obj['multiplex']
+        if hasattr(multiplex, 'forward_output'):
+            multiplex.forward_output = True # We need the raw output
         self.on("terminal:refresh_screen", capture_func)
 
     def stop_capture(self, term):
@@ -1320,10 +1443,14 @@ class TerminalApplication(GOApplication):
             return # Nothing to do
         capture = term_obj["capture"]["output"]
         capture_path = capture.name
+        capture.write(term_obj["capture"]["extractor"].flush())
         capture.flush()
         capture.close()
         capture_func = term_obj["capture"]["capture_func"]
         self.off("terminal:refresh_screen", capture_func)
+        multiplex = term_obj['multiplex']
+        if hasattr(multiplex, 'forward_output'):
+            multiplex.forward_output = False
         capture_data = open(capture_path, 'rb').read()
         capture_dict = {
             'term': term,
@@ -1647,10 +1774,19 @@ class TerminalApplication(GOApplication):
         m.write(response)
 
     def _send_refresh(self, term, full=False):
-        """Sends a screen update to the client."""
+        """
+        Sends a screen update to the client.
+
+        If the client hasn't received the last screen update yet (or it has
+        more than the `max_client_buffer` setting waiting to be sent to it) the
+        update will be skipped.  Once the client catches up it will be sent a
+        full refresh (see `_refresh_sent`).  This keeps slow clients from
+        making the server queue up every intermediate screen.
+        """
         try:
             term_obj = self.loc_terms[term]
             term_obj['last_activity'] = datetime.now()
+            client_dict = term_obj[self.ws.client_id]
         except KeyError:
             # This can happen if the user disconnected in the middle of a screen
             # update or if the terminal was closed really quickly before the
@@ -1658,6 +1794,23 @@ class TerminalApplication(GOApplication):
             # be concerned about.
             return # Ignore
         multiplex = term_obj['multiplex']
+        if client_dict.get('pending_refresh'):
+            # Still waiting on the last one; _refresh_sent() will catch it up
+            client_dict['refresh_skipped'] = True
+            REFRESHES_SKIPPED.inc()
+            return
+        if self.ws.output_backlogged():
+            # Something other than screen updates is clogging things up.  Try
+            # again in a bit (refresh_screen() will replace this if the screen
+            # changes again before then).
+            client_dict['refresh_skipped'] = True
+            REFRESHES_SKIPPED.inc()
+            client_dict['refresh_timeout'] = multiplex.io_loop.add_timeout(
+                timedelta(milliseconds=500),
+                partial(self._send_refresh, term, True))
+            return
+        if client_dict.pop('refresh_skipped', False):
+            full = True
         scrollback, screen = multiplex.dump_html(
             full=full, client_id=self.ws.client_id)
         if [a for a in screen if a]: # Checking for non-empty lines here
@@ -1670,13 +1823,37 @@ class TerminalApplication(GOApplication):
                 }
             }
             try:
-                self.write_message(json_encode(output_dict))
+                future = self.write_message(json_encode(output_dict))
+                REFRESHES_SENT.inc()
             except IOError: # Socket was just closed, no biggie
                 self.term_log.info(
                     _("WebSocket closed (%s)") % self.current_user['upn'])
                 multiplex = term_obj['multiplex']
                 multiplex.remove_callback( # Stop trying to write
                     multiplex.CALLBACK_UPDATE, self.callback_id)
+                return
+            if future is not None and not future.done():
+                client_dict['pending_refresh'] = future
+                future.add_done_callback(partial(self._refresh_sent, term))
+
+    def _refresh_sent(self, term, future):
+        """
+        Called when the screen update that was sent (via `_send_refresh`) to
+        the client as *future* has finished being written to the socket.  If
+        any screen updates were skipped in the meantime a full refresh will be
+        sent.
+        """
+        try:
+            client_dict = self.loc_terms[term][self.ws.client_id]
+        except KeyError:
+            return # Terminal was closed or the client disconnected
+        if client_dict.get('pending_refresh') is not future:
+            return
+        del client_dict['pending_refresh']
+        if future.exception():
+            return # Socket was closed
+        if client_dict.get('refresh_skipped'):
+            self._send_refresh(term, full=True)
 
     def refresh_screen(self, term, full=False, stream=None):
         """
@@ -1746,6 +1923,70 @@ class TerminalApplication(GOApplication):
         self.refresh_screen(term, full=True)
         self.trigger("terminal:full_refresh", term)
 
+    @require(authenticated(), policies('terminal'))
+    def get_scrollback(self, settings):
+        """
+        Sends a range of lines from the given terminal's scrollback history
+        (see `terminal.Terminal.get_history`) to the client via the
+        'terminal:scrollback' WebSocket action.  This lets clients page through
+        the history on demand (e.g. after reconnecting or when viewing a shared
+        terminal) instead of getting all of it pushed to them.  Example
+        *settings*::
+
+            {'term': 1, 'start': -100, 'end': null, 'format': 'html'}
+
+        *start* and *end* work like Python slices (negative numbers count back
+        from the most recent line).  *format* may be 'html' (the default) or
+        'text'.  The message sent to the client will look like this::
+
+            {'terminal:scrollback': {
+                'term': 1,
+                'start': 5123, # Index of the first line in 'lines'
+                'total': 5223, # Number of lines that have ever been in history
+                'lines': [...],
+                'format': 'html'
+            }}
+        """
+        try:
+            term = int(settings['term'])
+            term_obj = self.loc_terms[term]
+            multiplex = term_obj['multiplex']
+        except (KeyError, TypeError, ValueError):
+            return # Bad or closed terminal
+        def index(value):
+            if value is None:
+                return None
+            return int(value)
+        try:
+            start = index(settings.get('start', -multiplex.term.rows))
+            end = index(settings.get('end', None))
+        except (TypeError, ValueError):
+            return
+        text_format = settings.get('format', 'html')
+        def send_history(history):
+            first, lines = history
+            message = {
+                'terminal:scrollback': {
+                    'term': term,
+                    'start': first,
+                    'total': multiplex.term.history_count,
+                    'lines': lines,
+                    'format': text_format,
+                }
+            }
+            self.write_message(json_encode(message))
+        history = multiplex.term.get_history(
+            start, end, html=(text_format != 'text'))
+        if isinstance(history, Future): # Emulated in another process
+            def got_history(future):
+                try:
+                    send_history(future.result())
+                except Exception as e: # Terminal closed, emulator died, etc
+                    self.term_log.debug("get_scrollback(): %s" % e)
+            self.io_loop.add_future(history, got_history)
+        else:
+            send_history(history)
+
     @require(authenticated(), policies('terminal'))
     def resize(self, resize_obj):
         """
@@ -1800,16 +2041,54 @@ class TerminalApplication(GOApplication):
             {"terminal:resize": {"term": term, "rows": rows, "columns": cols}})
         self.trigger("terminal:resize", term)
 
-    @require(authenticated(), policies('terminal'))
     def char_handler(self, chars, term=None):
         """
         Writes *chars* (string) to *term*.  If *term* is not provided the
         characters will be sent to the currently-selected terminal.
+
+        Since this gets called for every keystroke the authorization checks
+        (see `checked_char_handler`) only happen the first time a given
+        terminal gets written to.  After that the result is remembered until
+        sharing permissions or settings change (see `can_write`).
         """
-        self.term_log.debug("char_handler(%s, %s)" % (repr(chars), repr(term)))
         if not term:
             term = self.current_term
         term = int(term) # Just in case it was sent as a string
+        if self.can_write(term):
+            self._write_to_terminal(chars, term)
+        else:
+            self.checked_char_handler(chars, term)
+
+    def can_write(self, term):
+        """
+        Returns True if we already know this connection is allowed to write to
+        *term*.  The cache is thrown out whenever sharing permissions change
+        (`SHARING_GENERATION`) or the settings get reloaded.
+        """
+        generation = (SHARING_GENERATION, self.ws.prefs_generation)
+        if generation != self.writable_generation:
+            self.writable_terms = {}
+            self.writable_generation = generation
+        term_obj = self.writable_terms.get(term)
+        return term_obj is not None and self.loc_terms.get(term) is term_obj
+
+    @require(authenticated(), policies('terminal'))
+    def checked_char_handler(self, chars, term):
+        """
+        Does the same thing as `char_handler` but only after the usual
+        authorization checks have passed (and remembers that they did).
+        """
+        self.term_log.debug(
+            "checked_char_handler(%s, %s)" % (repr(chars), repr(term)))
+        if term in self.loc_terms:
+            self.writable_terms[term] = self.loc_terms[term]
+        self._write_to_terminal(chars, term)
+
+    def _write_to_terminal(self, chars, term):
+        """
+        Writes *chars* to *term* without checking anything other than whether
+        or not it's still running.
+        """
         if self.ws.session in SESSIONS and term in self.loc_terms:
             multiplex = self.loc_terms[term]['multiplex']
             if multiplex.isalive():
@@ -1828,11 +2107,14 @@ class TerminalApplication(GOApplication):
                     multiplex.io_loop.add_timeout(
                         timedelta(milliseconds=1050), refresh)
 
-    @require(authenticated(), policies('terminal'))
     def write_chars(self, message):
         """
         Writes *message['chars']* to *message['term']*.  If *message['term']*
         is not present, *self.current_term* will be used.
+
+        .. note::
+
+            Authorization is handled by `char_handler`.
         """
         #self.term_log.debug('write_chars(%s)' % message)
         if 'chars' not in message:
@@ -2047,6 +2329,7 @@ class TerminalApplication(GOApplication):
             *settings['read']* is "AUTHENTICATED" all users will be able to view
             the shared terminal without having to enter a password.
         """
+        global SHARING_GENERATION
         self.term_log.debug("permissions(%s)" % settings)
         from gateone.core.utils import random_words
         share_dict = {}
@@ -2058,6 +2341,7 @@ class TerminalApplication(GOApplication):
         term_obj = self.loc_terms.get(term, None)
         if not term_obj:
             return # Terminal does not exist (anymore)
+        SHARING_GENERATION += 1 # Anyone's write permission might change
         read = settings.get('read', []) # List of who to share with
         if not isinstance(read, (list, tuple)):
             read = [read] # Must be a list even if only one permission
@@ -2229,11 +2513,13 @@ class TerminalApplication(GOApplication):
 
         .. note:: The terminal must already be shared with broadcast enabled.
         """
+        global SHARING_GENERATION
         from gateone.core.utils import random_words
         if 'term' not in settings:
             return # Invalid
         if 'shared' not in self.ws.persist['terminal']:
             return # Nothing to do
+        SHARING_GENERATION += 1
         term = int(settings.get('term', self.current_term))
         random_share_id = '-'.join(random_words(2))
         new_share_id = settings.get('share_id', random_share_id)
@@ -2677,7 +2963,9 @@ def apply_cli_overrides(settings):
     """
     # Figure out which options are being overridden on the command line
     arguments = []
-    terminal_options = ('dtach', 'syslog_session_logging', 'session_logging')
+    terminal_options = (
+        'dtach', 'syslog_session_logging', 'session_logging',
+        'emulator_processes')
     for arg in list(sys.argv)[1:]:
         if not arg.startswith('-'):
             break
@@ -2765,7 +3053,8 @@ def init(settings):
                 '/plugins/ssh/scripts/ssh_connect.py')
             default_command = (
               "{0} -S "
-              r"'%SESSION_DIR%/%SESSION%/%SHORT_SOCKET%' --sshfp "
+              r"'%SESSION_DIR%/ssh_pool/%SHORT_USER%/%SHORT_SOCKET%' "
+              r"--persist=600 --sshfp "
               r"-a '-oUserKnownHostsFile=\"%USERDIR%/%USER%/.ssh/known_hosts\"'"
             ).format(ssh_connect_path)
             settings['*']['terminal'].update({
@@ -25,6 +25,7 @@ except ImportError:
 from gateone import GATEONE_DIR
 from gateone.core.utils import raw
 from gateone.core.configuration import get_settings, combine_css
+from termio.vtextract import VTTextExtractor, strip_vt
 
 # 3rd party imports
 from tornado.escape import json_encode, json_decode
@@ -75,6 +76,15 @@ format:
     Sep 09 21:07:21 why_I_love_gate_one.txt  to_dont_list.txt
     Sep 09 21:07:21 \x1b[1;34mbsmith\x1b[0m@modern-host\x1b[1;34m:~ $\x1b[0m
 
+Lots of logs can be rendered as self-contained HTML playback files at once
+(in parallel) via the --export option:
+
+.. ansi-block::
+
+    \x1b[1;31mroot\x1b[0m@host\x1b[1;34m:/opt/gateone $\x1b[0m ./logviewer.py --export=/tmp/exported users/bsmith/logs/*.golog
+    /tmp/exported/20140228101504012345-10.1.1.100.html
+    /tmp/exported/20140228093312054321-10.1.1.100.html
+
 About Gate One's Log Format
 ===========================
 Gate One's log format (.golog) is a gzip-compressed unicode (UTF-8) text file
@@ -110,6 +120,7 @@ SEPARATOR = u"\U000f0f0f" # The character used to separate frames in the log
 RE_OPT_SEQ = re.compile(r'\x1b\]_\;(.+?)(\x07|\x1b\\)', re.MULTILINE)
 RE_TITLE_SEQ = re.compile(
     r'.*\x1b\][0-2]\;(.+?)(\x07|\x1b\\)', re.DOTALL|re.MULTILINE)
+RE_LINE_BREAKS = re.compile(u'([\n\r\f])')
 
 # TODO: Support Fast forward/rewind/pause like Gate One itself.
 def get_frames(golog_path, chunk_size=131072):
@@ -212,10 +223,8 @@ def playback_log(log_path, file_like, show_esc=False):
 
 def escape_escape_seq(text, preserve_renditions=True, rstrip=True):
     """
-    Escapes escape sequences so they don't muck with the terminal viewing *text*
-    Also replaces special characters with unicode symbol equivalents (e.g. so
-    you can see what they are without having them do anything to your running
-    shell)
+    Removes escape sequences and control characters from *text* so they don't
+    muck with the terminal viewing it (see `termio.vtextract.strip_vt`).
 
     If *preserve_renditions* is True, CSI escape sequences for renditions will
     be preserved as-is (e.g. font color, background, etc).
@@ -223,51 +232,7 @@ def escape_escape_seq(text, preserve_renditions=True, rstrip=True):
     If *rstrip* is true, trailing escape sequences and whitespace will be
     removed.
     """
-    esc_sequence = re.compile(
-        r'\x1b(.*\x1b\\|[ABCDEFGHIJKLMNOQRSTUVWXYZa-z0-9=]|[()# %*+].)')
-    csi_sequence = re.compile(r'\x1B\[([?A-Za-z0-9;@:\!]*?)([A-Za-z@_])')
-    #esc_rstrip = re.compile('[ \t]+\x1b.+$')
-    out = u""
-    esc_buffer = u""
-    # If this seems confusing it is because text parsing is a black art! ARRR!
-    for char in text:
-        if not esc_buffer:
-            if char == u'\x1b': # Start of an ESC sequence
-                esc_buffer = char
-            # TODO: Determine if we should bring this back:
-            #elif ord(char) in replacement_map:
-                #out += replacement_map[ord(char)]
-            else: # Vanilla char.  Booooring.
-                out += raw(char)
-        else: # Something interesting is going on
-            esc_buffer += char
-            if char == u'\x07' or esc_buffer.endswith(u'\x1b\\'): # Likely title
-                esc_buffer = u'' # Nobody wants to see your naked ESC sequence
-                continue
-            elif esc_buffer.endswith('\x1b\\'):
-                esc_buffer = u'' # Ignore
-                continue
-            # Nobody wants to see plain ESC sequences in the buf...
-            match_obj = esc_sequence.match(esc_buffer)
-            if match_obj:
-                #seq_type = match_obj.group(1)
-                esc_buffer = u'' # Just when you thought you've ESC'd...
-                continue
-            # CSI ESC sequences...  These are worth a second look
-            match_obj = csi_sequence.match(esc_buffer)
-            if match_obj:
-                csi_type = match_obj.group(2)
-                if csi_type == 'm' and preserve_renditions: # mmmmmm!
-                    out += esc_buffer # Ooh, naked viewing of pretty things!
-                elif csi_type == 'C': # Move cursor right (we want to do this)
-                    # Will be something like this: \x1b[208C
-                    num_spaces = match_obj.group(1)
-                    if not num_spaces:
-                        num_spaces = 1
-                    spaces = int(num_spaces)
-                    out += u' ' * spaces # Add an equivalent amount of spaces
-                esc_buffer = u'' # Make room for more!
-                continue
+    out = strip_vt(text, preserve_renditions=preserve_renditions)
     if rstrip:
         # Remove trailing whitespace + trailing ESC sequences
         return out.rstrip()
@@ -280,6 +245,25 @@ def flatten_log(log_path, file_like, preserve_renditions=True, show_esc=False):
     within to *file_like*.  Where *file_like* is expected to be any file-like
     object with write() and flush() methods.
 
+    See `flat_log_lines` for the meaning of *preserve_renditions* and
+    *show_esc*.
+    """
+    for line in flat_log_lines(
+            log_path, preserve_renditions=preserve_renditions,
+            show_esc=show_esc):
+        file_like.write(line)
+        file_like.flush()
+
+def flat_log_lines(log_path, preserve_renditions=True, show_esc=False,
+        start=None, end=None):
+    """
+    A generator that yields the lines (UTF-8-encoded bytes, each ending in a
+    newline) of the log file at *log_path* in a flat format.  Only one frame
+    is held in memory at a time so this works fine with huge logs.
+
+    If *start* and/or *end* (milliseconds since the epoch) are given only the
+    frames recorded between those times will be included.
+
     If *preserve_renditions* is True, CSI escape sequences for renditions will
     be preserved as-is (e.g. font color, background, etc).  This is to make the
     output appear as close to how it was originally displayed as possible.
@@ -301,9 +285,18 @@ def flatten_log(log_path, file_like, preserve_renditions=True, show_esc=False):
     if not cols:
         # Try the old metadata format which used 'cols':
         cols = metadata.get('cols', 80)
+    # The Terminal is only used to handle captured files (e.g. images)
     term = Terminal(rows=rows, cols=cols, em_dimensions=0)
+    extractor = VTTextExtractor(
+        preserve_renditions=preserve_renditions, form_feed=True)
     out_line = u""
     cr = False
+    def format_line(line):
+        if show_esc:
+            line = raw(line)
+        else:
+            line = line.rstrip()
+        return (frame_time + u' %s\n' % line).encode('utf-8')
     # We skip the first frame, [1:] because it holds the recording metadata
     for count, frame in enumerate(get_frames(log_path)):
         if count == 0:
@@ -311,14 +304,23 @@ def flatten_log(log_path, file_like, preserve_renditions=True, show_esc=False):
             continue
         # First 13 chars is the timestamp:
         frame_time = float(frame.decode('UTF-8', 'ignore')[:13])
+        if start and frame_time < start:
+            continue
+        if end and frame_time > end:
+            break
         # Convert to datetime object
         frame_time = datetime.fromtimestamp(frame_time/1000)
         if show_esc:
             frame_time = frame_time.strftime(u'\x1b[0m%b %d %H:%M:%S')
         else: # Renditions preserved == I want pretty.  Make the date bold:
             frame_time = frame_time.strftime(u'\x1b[0;1m%b %d %H:%M:%S\x1b[m')
+        frame = frame[14:]
         if not show_esc:
-            term.write(frame[14:])
+            # Only bother the terminal emulator with frames that are (or start)
+            # a file capture
+            if term.capture or term.matched_header or any(
+                    magic.match(frame) for magic in term.magic):
+                term.write(frame)
         if term.capture:
             # Capturing a file...  Keep feeding it frames until complete
             continue
@@ -329,13 +331,12 @@ def flatten_log(log_path, file_like, preserve_renditions=True, show_esc=False):
                     if ord(char) >= SPECIAL:
                         adjusted = escape_escape_seq(out_line, rstrip=True)
                         adjusted = frame_time + u' %s\n' % adjusted
-                        file_like.write(adjusted.encode('utf-8'))
+                        yield adjusted.encode('utf-8')
                         out_line = u""
                         if char in term.captured_files:
                             captured_file = term.captured_files[char].file_obj
                             captured_file.seek(0)
-                            file_like.write(captured_file.read())
-                            file_like.write(b'\n')
+                            yield captured_file.read() + b'\n'
                             del captured_file
                             term.clear_screen()
                             term.close_captured_fds() # Instant cleanup
@@ -344,39 +345,30 @@ def flatten_log(log_path, file_like, preserve_renditions=True, show_esc=False):
             if not out_line:
                 continue
             adjusted = frame_time + u' %s\n' % out_line.strip()
-            file_like.write(adjusted.encode('utf-8'))
+            yield adjusted.encode('utf-8')
             out_line = u""
             continue
+        if show_esc:
+            text = frame.decode('UTF-8', 'ignore')
+            # Make clear screens (usually ctrl-l) stand out like they do below
+            text = text.replace(u'\x1b[H\x1b[2J', u'\x1b[H\x1b[2J\f')
         else:
-            term.clear_screen()
-        frame = frame.decode('UTF-8', 'ignore')
-        for char in frame[14:]:
-            if '\x1b[H\x1b[2J' in out_line: # Clear screen sequence
+            text = extractor.feed(frame)
+        for chunk in RE_LINE_BREAKS.split(text):
+            if not chunk:
+                continue
+            elif chunk == u'\n':
+                if out_line.strip():
+                    yield format_line(out_line)
+                out_line = u"" # Skip empty lines
+                cr = False
+            elif chunk == u'\f':
                 # Handle the clear screen (usually ctrl-l) by outputting
                 # a new log entry line to avoid confusion regarding what
                 # happened at this time.
-                out_line += u"^L" # Clear screen is a ctrl-l or equivalent
-                if show_esc:
-                    adjusted = raw(out_line)
-                else:
-                    adjusted = escape_escape_seq(out_line, rstrip=True)
-                adjusted = frame_time + u' %s\n' % adjusted
-                file_like.write(adjusted.encode('utf-8'))
+                yield format_line(out_line + u"^L") # Clear screen is a ctrl-l
                 out_line = u""
-                continue
-            if char == u'\n':
-                if show_esc:
-                    adjusted = raw(out_line)
-                else:
-                    adjusted = escape_escape_seq(out_line, rstrip=True)
-                if not adjusted:
-                    out_line = u"" # Skip empty lines
-                    continue
-                adjusted = frame_time + u' %s\n' % adjusted
-                file_like.write(adjusted.encode('utf-8'))
-                out_line = u""
-                cr = False
-            elif char == u'\r':
+            elif chunk == u'\r':
                 # Carriage returns need special handling.  Make a note of it
                 cr = True
             else:
@@ -389,17 +381,10 @@ def flatten_log(log_path, file_like, preserve_renditions=True, show_esc=False):
                 # insert a '^M' and start a new line so as to avoid
                 # confusion over these events.
                 if cr:
-                    out_line += "^M"
-                    file_like.write((frame_time + u' ').encode('utf-8'))
-                    if show_esc:
-                        adjusted = raw(out_line)
-                    else:
-                        adjusted = escape_escape_seq(out_line, rstrip=True)
-                    file_like.write((adjusted + u'\n').encode('utf-8'))
+                    yield format_line(out_line + u"^M")
                     out_line = u""
-                out_line += char
+                out_line += chunk
                 cr = False
-        file_like.flush()
     del term
 
 def render_log_frames(golog_path, rows, cols, limit=None):
@@ -411,7 +396,14 @@ def render_log_frames(golog_path, rows, cols, limit=None):
 
     If *limit* is given, only return that number of frames (e.g. for preview)
     """
-    out_frames = []
+    return list(iter_log_frames(golog_path, rows, cols, limit=limit))
+
+def iter_log_frames(golog_path, rows, cols, limit=None):
+    """
+    A generator version of `render_log_frames` that yields each frame as soon
+    as it has been rendered (so the whole recording never has to fit in
+    memory).
+    """
     from terminal import Terminal
     term = Terminal(
         # 14/7 for the em_height should be OK for most browsers to ensure that
@@ -434,9 +426,8 @@ def render_log_frames(golog_path, rows, cols, limit=None):
             if term.capture:
                 continue
             scrollback, screen = term.dump_html()
-            out_frames.append({'screen': screen, 'time': frame_time})
+            yield {'screen': screen, 'time': frame_time}
     del term # Ensures any file capture file descriptors are cleaned up
-    return out_frames # Skip the first frame which is the metadata
 
 def get_256_colors(container="gateone"):
     """
@@ -449,7 +440,7 @@ def get_256_colors(container="gateone"):
     # Using get_settings() as a cool hack to get the color data as a nice dict:
     color_map = get_settings(colors_json_path, add_default=False)
     # Setup our 256-color support CSS:
-    colors_256 = ""
+    colors_256 = []
     for i in xrange(256):
         i = str(i)
         fg = u"#%s span.✈fx%s {color: #%s;}" % (
@@ -462,30 +453,20 @@ def get_256_colors(container="gateone"):
         bg_rev =(
             u"#%s span.✈reverse.bx%s {color: #%s; background-color: "
             u"inherit;} " % (container, i, color_map[i]))
-        colors_256 += "%s %s %s %s\n" % (fg, bg, fg_rev, bg_rev)
-    return colors_256
+        colors_256.append(u"%s %s %s %s\n" % (fg, bg, fg_rev, bg_rev))
+    return u"".join(colors_256)
 
-def render_html_playback(golog_path, render_settings=None):
+def playback_bundle(render_settings=None):
     """
-    Generates a self-contained HTML playback file from the .golog at the given
-    *golog_path*.  The HTML will be output to stdout.  The optional
-    *render_settings* argument (dict) can include the following options
-    to control how the output is rendered:
-
-        :prefix:
-            (Default: `"go_default_"`) The GateOne.prefs.prefix to emulate when
-            rendering the HTML template.
-        :container:
-            (Default: `"gateone"`) The name of the #gateone container to emulate
-            when rendering the HTML template.
-        :theme:
-            (Default: `"black"`) The theme to use when rendering the HTML
-            template.
-        :colors:
-            (Default: `"default"`) The text color scheme to use when rendering
-            the HTML template.
-
-    .. note:: This function returns a byte string (not a unicode string).
+    Renders everything a self-contained HTML playback file needs except the
+    recording itself (the theme, colors, 256-color CSS, and the
+    playback_log.html template) and returns it as a dict of ``{'head': <bytes>,
+    'tail': <bytes>}``.  The recording (a JSON array of frames) goes between
+    the two (see `write_html_playback`).
+
+    Since the result is the same for every log it only needs to be created
+    once no matter how many logs are being rendered.  *render_settings* is the
+    same as in `render_html_playback`.
     """
     # Get the necessary variables out of render_settings
     if not render_settings:
@@ -496,14 +477,16 @@ def render_html_playback(golog_path, render_settings=None):
     colors = render_settings.get('colors', 'default')
     theme = render_settings.get('theme', 'black')
     temploc = tempfile.mkdtemp(prefix='logviewer') # stores rendered CSS
-    # This function renders all themes
-    combine_css(os.path.join(temploc, 'gateone.css'), container)
-    theme_css_file = "gateone_theme_{theme}.css".format(theme=theme)
-    theme_css_path = os.path.join(temploc, theme_css_file)
-    with io.open(theme_css_path, mode='r', encoding='utf-8') as f:
-        theme_css = f.read()
-    # Cleanup the CSS files since we're now done with them
-    shutil.rmtree(temploc)
+    try:
+        # This function renders all themes
+        combine_css(os.path.join(temploc, 'gateone.css'), container)
+        theme_css_file = "gateone_theme_{theme}.css".format(theme=theme)
+        theme_css_path = os.path.join(temploc, theme_css_file)
+        with io.open(theme_css_path, mode='r', encoding='utf-8') as f:
+            theme_css = f.read()
+    finally:
+        # Cleanup the CSS files since we're now done with them
+        shutil.rmtree(temploc)
     # Colors are easiest since they don't need to be rendered
     colors_css_file = "{0}.css".format(colors)
     colors_css_path = os.path.join(
@@ -515,13 +498,7 @@ def render_html_playback(golog_path, render_settings=None):
     asis = lambda x: x # Used to disable autoescape
     loader = tornado.template.Loader(templates_path, autoescape="asis")
     playback_template = loader.load('playback_log.html')
-    metadata = get_log_metadata(golog_path)
-    rows = metadata.get('rows', 24)
-    cols = metadata.get('columns', None)
-    if not cols:
-        # Try the old metadata format which used 'cols':
-        cols = metadata.get('cols', 80)
-    recording = render_log_frames(golog_path, rows, cols)
+    marker = b'\x00RECORDING\x00' # Gets replaced with the actual recording
     playback_html = playback_template.generate(
         asis=asis,
         prefix=prefix,
@@ -530,11 +507,130 @@ def render_html_playback(golog_path, render_settings=None):
         colors=colors_css,
         colors_256=get_256_colors(container),
         preview="false", # Only used by the logging plugin
-        recording=json_encode(recording)
+        recording=marker
     )
     if not isinstance(playback_html, bytes): # It's a Unicode string
         playback_html = playback_html.encode('utf-8') # Convert to bytes
-    return playback_html
+    head, tail = playback_html.split(marker, 1)
+    return {'head': head, 'tail': tail}
+
+def write_html_playback(golog_path, file_like, bundle):
+    """
+    Writes a self-contained HTML playback file of the .golog at the given
+    *golog_path* to *file_like* using *bundle* (from `playback_bundle`).  Frames
+    are written as they're rendered so memory usage doesn't depend on the size
+    of the log.
+    """
+    metadata = get_log_metadata(golog_path)
+    rows = metadata.get('rows', 24)
+    cols = metadata.get('columns', None)
+    if not cols:
+        # Try the old metadata format which used 'cols':
+        cols = metadata.get('cols', 80)
+    file_like.write(bundle['head'])
+    file_like.write(b'[')
+    for i, frame in enumerate(iter_log_frames(golog_path, rows, cols)):
+        if i:
+            file_like.write(b', ')
+        frame = json_encode(frame)
+        if not isinstance(frame, bytes):
+            frame = frame.encode('utf-8')
+        file_like.write(frame)
+    file_like.write(b']')
+    file_like.write(bundle['tail'])
+
+def render_html_playback(golog_path, render_settings=None):
+    """
+    Generates a self-contained HTML playback file from the .golog at the given
+    *golog_path*.  The HTML will be output to stdout.  The optional
+    *render_settings* argument (dict) can include the following options
+    to control how the output is rendered:
+
+        :prefix:
+            (Default: `"go_default_"`) The GateOne.prefs.prefix to emulate when
+            rendering the HTML template.
+        :container:
+            (Default: `"gateone"`) The name of the #gateone container to emulate
+            when rendering the HTML template.
+        :theme:
+            (Default: `"black"`) The theme to use when rendering the HTML
+            template.
+        :colors:
+            (Default: `"default"`) The text color scheme to use when rendering
+            the HTML template.
+
+    .. note:: This function returns a byte string (not a unicode string).
+    """
+    out = io.BytesIO()
+    write_html_playback(golog_path, out, playback_bundle(render_settings))
+    return out.getvalue()
+
+def export_html_playback(golog_path, output_path, bundle):
+    """
+    Writes a self-contained HTML playback file of *golog_path* to
+    *output_path* (see `write_html_playback`).  The file is written under a
+    temporary name and moved into place when complete so a partial file will
+    never be mistaken for a finished one.
+
+    Returns ``(golog_path, output_path, error)`` where *error* will be ``None``
+    if everything went well.  Meant to be called in a worker process by
+    `batch_export`.
+    """
+    temp_path = output_path + '.part'
+    try:
+        with io.open(temp_path, 'wb') as f:
+            write_html_playback(golog_path, f, bundle)
+        os.rename(temp_path, output_path)
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return (golog_path, output_path, u"%s" % e)
+    return (golog_path, output_path, None)
+
+def batch_export(log_paths, output_dir, render_settings=None, processes=None,
+        callback=None):
+    """
+    Renders all the .golog files in *log_paths* as self-contained HTML
+    playback files (named after each log) in *output_dir* using a pool of
+    *processes* (defaults to the number of CPU cores) worker processes.  The
+    theme and CSS are rendered only once (see `playback_bundle`) and shared by
+    all the workers.  *render_settings* is the same as in
+    `render_html_playback`.
+
+    Items in *log_paths* can also be ``(golog_path, output_path)`` tuples in
+    order to control where each file ends up.
+
+    If given, *callback* will be called with ``(golog_path, output_path,
+    error)`` as each log is completed (*error* will be ``None`` on success).
+
+    Returns a list of ``(golog_path, output_path, error)`` tuples.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    jobs = []
+    for log_path in log_paths:
+        if isinstance(log_path, (list, tuple)):
+            log_path, output_path = log_path
+        else:
+            name = os.path.basename(log_path)
+            if name.endswith('.golog'):
+                name = name[:-len('.golog')]
+            output_path = os.path.join(output_dir, name + '.html')
+        if not os.path.isdir(os.path.dirname(output_path)):
+            os.makedirs(os.path.dirname(output_path))
+        jobs.append((log_path, output_path))
+    bundle = playback_bundle(render_settings)
+    results = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = []
+        for log_path, output_path in jobs:
+            futures.append(pool.submit(
+                export_html_playback, log_path, output_path, bundle))
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if callback:
+                callback(*result)
+    return results
 
 def get_terminal_size():
     """
@@ -606,6 +702,22 @@ def main(args=sys.argv):
             "Render a given .golog as a self-contained HTML playback file "
             "(to stdout).")
     )
+    parser.add_option("--export",
+        dest="export",
+        default=None,
+        metavar="DIR",
+        help=(
+            "Render all the given .gologs as self-contained HTML playback "
+            "files in DIR (in parallel).")
+    )
+    parser.add_option("--processes",
+        dest="processes",
+        default=None,
+        type="int",
+        help=(
+            "The number of processes to use with --export (default: the "
+            "number of CPU cores).")
+    )
     parser.add_option("--metadata",
         dest="metadata",
         default=False,
@@ -619,10 +731,21 @@ def main(args=sys.argv):
         sys.exit(1)
     if args[0].endswith('logviewer.py'):
         args.pop(0) # Didn't get filtered out automatically for some reason
+    for log_path in args:
+        if not os.path.exists(log_path):
+            print("ERROR: %s does not exist" % log_path)
+            sys.exit(1)
+    if options.export:
+        def report(log_path, output_path, error):
+            if error:
+                print("ERROR: %s: %s" % (log_path, error))
+            else:
+                print(output_path)
+        results = batch_export(
+            args, options.export, processes=options.processes,
+            callback=report)
+        sys.exit(1 if any(a[2] for a in results) else 0)
     log_path = args[0]
-    if not os.path.exists(log_path):
-        print("ERROR: %s does not exist" % log_path)
-        sys.exit(1)
     sys_stdout = sys.stdout
     if bytes != str: # Python 3
         sys_stdout = sys.stdout.buffer
@@ -643,8 +766,7 @@ def main(args=sys.argv):
                 sys_stdout,
                 preserve_renditions=options.pretty, show_esc=options.raw)
         elif options.html:
-            result = render_html_playback(log_path)
-            print(result)
+            write_html_playback(log_path, sys_stdout, playback_bundle())
         else:
             playback_log(log_path, sys_stdout, show_esc=options.raw)
     except (IOError, KeyboardInterrupt):
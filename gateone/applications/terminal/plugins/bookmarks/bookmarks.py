@@ -38,13 +38,13 @@ __version_info__ = (1, 0)
 __author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
 
 # Python stdlib
-import os, sys, time, json, socket
-from functools import partial
+import os, sys, time, json, base64, bisect
 
 # Our stuff
 from gateone.core.server import BaseHandler
-from gateone.core.utils import noop, json_encode
+from gateone.core.utils import json_encode
 from gateone.auth.authorization import require, authenticated
+from .favicons import FaviconCache
 
 # Tornado stuff
 import tornado.web
@@ -55,6 +55,8 @@ PLUGIN_PATH = os.path.split(__file__)[0]
 #sys.path.append(os.path.join(PLUGIN_PATH, "dependencies"))
 
 # Globals
+FAVICON_CACHE = None # Created on first use by get_favicon_cache()
+JOURNAL_COMPACT = 1000 # Rewrite bookmarks.json after this many changes
 boolean_fix = {
     True: True,
     False: False,
@@ -276,45 +278,141 @@ class BookmarksDB(object):
     Used to read and write bookmarks to a file on disk.  Can also synchronize
     a given list of bookmarks with what's on disk.  Uses a given bookmark's
     ``updateSequenceNum`` to track what wins the "who is newer?" comparison.
+
+    Bookmarks are stored in ``bookmarks.json`` (a JSON-encoded list) but
+    changes get appended to ``bookmarks.journal`` (one JSON-encoded
+    ``[<operation>, <value>]`` per line) instead of rewriting the whole thing
+    every time.  The journal gets folded back into ``bookmarks.json`` every
+    `JOURNAL_COMPACT` changes (or when it gets bigger than
+    ``bookmarks.json`` itself).
+
+    In memory bookmarks are indexed by URL (:attr:`index`) and by
+    ``updateSequenceNum`` (:attr:`usn_index`; a sorted list of
+    ``(updateSequenceNum, url)`` tuples) so lookups and "what changed since
+    X?" queries don't have to scan everything.
     """
     def __init__(self, user_dir, user):
         """
         Sets up our bookmarks database object and reads everything in.
         """
-        self.bookmarks = [] # For temp storage of all bookmarks
+        self.index = {} # URL -> bookmark
+        self.usn_index = [] # Sorted list of (updateSequenceNum, url)
+        self.journal_entries = 0 # Changes since the last compaction
+        self.journal_size = 0
+        self.snapshot_size = 0 # Size of bookmarks.json
         self.user_dir = user_dir
         self.user = user
         users_dir = os.path.join(user_dir, user) # "User's dir"
         self.bookmarks_path = os.path.join(users_dir, "bookmarks.json")
-        # Read existing bookmarks into self.bookmarks
+        self.journal_path = os.path.join(users_dir, "bookmarks.journal")
+        # Read existing bookmarks into self.index
         self.open_bookmarks()
 
+    @property
+    def bookmarks(self):
+        """A list of all bookmarks (in ``updateSequenceNum`` order)."""
+        return [self.index[url] for usn, url in self.usn_index]
+
     def open_bookmarks(self):
         """
-        Opens the bookmarks stored in self.user_dir.  If not present, an
-        empty file will be created.
+        Opens the bookmarks stored in self.user_dir (and replays the journal).
+        If not present, an empty file will be created.
         """
         if not os.path.exists(self.bookmarks_path):
             with open(self.bookmarks_path, 'w') as f:
                 f.write('[]') # That's an empty JSON list
-            return # Default of empty list will do
-        with open(self.bookmarks_path) as f:
-            self.bookmarks = json_decode(f.read())
+        else:
+            with open(self.bookmarks_path) as f:
+                data = f.read()
+            self.snapshot_size = len(data)
+            for bm in json_decode(data):
+                self._put(bm)
+        if not os.path.exists(self.journal_path):
+            return
+        self.journal_size = os.path.getsize(self.journal_path)
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    operation, value = json_decode(line)
+                except ValueError:
+                    break # Incomplete last line (e.g. the disk filled up)
+                if operation == 'put':
+                    self._put(value)
+                elif operation == 'del':
+                    self._remove(value)
+                self.journal_entries += 1
+
+    def _put(self, bookmark):
+        """
+        Adds (or replaces) *bookmark* in :attr:`index` and :attr:`usn_index`.
+        """
+        url = bookmark['url']
+        if url in self.index:
+            self._remove(url)
+        self.index[url] = bookmark
+        bisect.insort(self.usn_index, (bookmark['updateSequenceNum'], url))
+
+    def _remove(self, url):
+        """Removes the bookmark at *url* from our indexes (if present)."""
+        bookmark = self.index.pop(url, None)
+        if bookmark is None:
+            return
+        key = (bookmark['updateSequenceNum'], url)
+        i = bisect.bisect_left(self.usn_index, key)
+        if i < len(self.usn_index) and self.usn_index[i] == key:
+            self.usn_index.pop(i)
+
+    def _set_USN(self, bookmark, updateSequenceNum):
+        """
+        Changes the ``updateSequenceNum`` of *bookmark* (keeping
+        :attr:`usn_index` in order).
+        """
+        self._remove(bookmark['url'])
+        bookmark['updateSequenceNum'] = updateSequenceNum
+        self._put(bookmark)
+
+    def _journal(self, changes):
+        """
+        Appends *changes* (a list of ``(<operation>, <value>)`` tuples) to the
+        journal.  If the journal has gotten long enough it will be compacted
+        via :meth:`save_bookmarks` instead.
+        """
+        if not changes:
+            return
+        lines = u''.join(json_encode(change) + u'\n' for change in changes)
+        self.journal_entries += len(changes)
+        self.journal_size += len(lines)
+        if (self.journal_entries >= JOURNAL_COMPACT
+            or self.journal_size > self.snapshot_size):
+            self.save_bookmarks()
+            return
+        with open(self.journal_path, 'a') as f:
+            f.write(lines)
 
     def save_bookmarks(self):
         """
-        Saves self.bookmarks to self.bookmarks_path as a JSON-encoded list.
+        Saves all bookmarks to self.bookmarks_path as a JSON-encoded list and
+        removes the (now redundant) journal.
         """
-        with open(self.bookmarks_path, 'w') as f:
-            f.write(json_encode(self.bookmarks))
+        data = json_encode(self.bookmarks)
+        temp_path = self.bookmarks_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(data)
+        os.rename(temp_path, self.bookmarks_path)
+        self.snapshot_size = len(data)
+        # NOTE: Replaying the journal is idempotent so if we die before this
+        # happens no harm will be done.
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_entries = 0
+        self.journal_size = 0
 
     def sync_bookmarks(self, bookmarks):
         """
         Given *bookmarks*, synchronize with self.bookmarks doing conflict
         resolution and whatnot.
         """
-        highest_USN = self.get_highest_USN()
-        changed = False # For if there's changes that need to be written
+        changes = []
         updated_bookmarks = [] # For bookmarks that are newer on the server
         for bm in bookmarks:
             if bm['url'] == "web+deleted:bookmarks/":
@@ -323,80 +421,67 @@ class BookmarksDB(object):
                     if deleted_bm['url'] == bm['url']:
                         # Remove the deleted bookmark entry
                         bm['notes'].pop(j)
-            found_existing = False
-            for i, db_bookmark in enumerate(self.bookmarks):
-                if bm['url'] == db_bookmark['url']:
-                    # Bookmark already exists, check which is newer
-                    found_existing = True
-                    if bm['updateSequenceNum'] > db_bookmark['updateSequenceNum']:
-                        # The given bookmark is newer than what's in the DB
-                        self.bookmarks[i] = bm # Replace it
-                        highest_USN += 1 # Increment the USN
-                        self.bookmarks[i]['updateSequenceNum'] = highest_USN
-                        changed = True
-                    elif bm['updateSequenceNum'] < db_bookmark['updateSequenceNum']:
-                        # DB has a newer bookmark.  Add it to the list to send
-                        # to the client.
-                        updated_bookmarks.append(db_bookmark)
-                    # Otherwise the USNs are equal and there's nothing to do
-            if not found_existing:
+            db_bookmark = self.index.get(bm['url'])
+            if db_bookmark is None:
                 # This is a new bookmark.  Add it
-                highest_USN += 1 # Increment the USN
-                bm['updateSequenceNum'] = highest_USN
-                self.bookmarks.append(bm)
-                changed = True # So it will be saved
-        if changed:
-            # Write the changes to disk
-            self.save_bookmarks()
+                bm['updateSequenceNum'] = self.get_highest_USN() + 1
+                self._put(bm)
+                changes.append(('put', bm))
+            elif bm['updateSequenceNum'] > db_bookmark['updateSequenceNum']:
+                # The given bookmark is newer than what's in the DB
+                bm['updateSequenceNum'] = self.get_highest_USN() + 1
+                self._put(bm) # Replace it
+                changes.append(('put', bm))
+            elif bm['updateSequenceNum'] < db_bookmark['updateSequenceNum']:
+                # DB has a newer bookmark.  Add it to the list to send to the
+                # client.
+                updated_bookmarks.append(db_bookmark)
+            # Otherwise the USNs are equal and there's nothing to do
+        # Write the changes to disk
+        self._journal(changes)
         # Let the client know what's newer on the server
         return updated_bookmarks
 
     def delete_bookmark(self, bookmark):
         """Deletes the given *bookmark*."""
+        url = bookmark['url']
+        if url not in self.index:
+            return
         highest_USN = self.get_highest_USN()
-        for i, db_bookmark in enumerate(self.bookmarks):
-            if bookmark['url'] == db_bookmark['url']:
-                # Remove it
-                self.bookmarks.pop(i)
-                # Add it to the list of deleted bookmarks
-                special_deleted_bm = None
-                for bm in self.bookmarks:
-                    if bm['url'] == "web+deleted:bookmarks/":
-                        special_deleted_bm = bm
-                # The deleted bookmarks 'bookmark' is just a list of URLs that
-                # have been deleted along with the time it happened.  This lets
-                # us keep multiple browsers in sync with what's been deleted
-                # so we don't inadvertently end up re-adding bookmarks that were
-                # deleted by another client.
-                if not special_deleted_bm:
-                    # Make our first entry
-                    special_deleted_bm = {
-                        'url': "web+deleted:bookmarks/",
-                        'name': "Deleted Bookmarks",
-                        'tags': [],
-                        'notes': [bookmark],
-                        'visits': highest_USN + 1,
-                        'updated': int(round(time.time() * 1000)),
-                        'created': int(round(time.time() * 1000)),
-                        'updateSequenceNum': 0,
-                        'images': {}
-                    }
-                    self.bookmarks.append(special_deleted_bm)
-                else:
-                    # Check for pre-existing
-                    updated = False
-                    for j, deleted_bm in enumerate(special_deleted_bm['notes']):
-                        if deleted_bm['url'] == bookmark['url']:
-                            # Update it in place
-                            special_deleted_bm['notes'][j] = bookmark
-                            updated = True
-                    if not updated:
-                        special_deleted_bm['notes'].append(bookmark)
-                    highest_USN += 1
-                    special_deleted_bm['updateSequenceNum'] = highest_USN
-                break
+        self._remove(url)
+        # Add it to the list of deleted bookmarks
+        special_deleted_bm = self.index.get("web+deleted:bookmarks/")
+        # The deleted bookmarks 'bookmark' is just a list of URLs that have
+        # been deleted along with the time it happened.  This lets us keep
+        # multiple browsers in sync with what's been deleted so we don't
+        # inadvertently end up re-adding bookmarks that were deleted by
+        # another client.
+        if not special_deleted_bm:
+            # Make our first entry
+            special_deleted_bm = {
+                'url': "web+deleted:bookmarks/",
+                'name': "Deleted Bookmarks",
+                'tags': [],
+                'notes': [bookmark],
+                'visits': highest_USN + 1,
+                'updated': int(round(time.time() * 1000)),
+                'created': int(round(time.time() * 1000)),
+                'updateSequenceNum': 0,
+                'images': {}
+            }
+            self._put(special_deleted_bm)
+        else:
+            # Check for pre-existing
+            notes = special_deleted_bm['notes']
+            for j, deleted_bm in enumerate(notes):
+                if deleted_bm['url'] == url:
+                    notes[j] = bookmark # Update it in place
+                    break
+            else:
+                notes.append(bookmark)
+            self._set_USN(special_deleted_bm, highest_USN + 1)
         # Save the change to disk
-        self.save_bookmarks()
+        self._journal([('del', url), ('put', special_deleted_bm)])
 
     def get_bookmarks(self, updateSequenceNum=0):
         """
@@ -404,55 +489,53 @@ class BookmarksDB(object):
         If *updateSequenceNum* is 0 or undefined, all bookmarks will be
         returned.
         """
-        out_bookmarks = []
-        for bm in self.bookmarks:
-            if bm['updateSequenceNum'] > updateSequenceNum:
-                out_bookmarks.append(bm)
-        return out_bookmarks
+        # (n,) sorts before every (n, url) so this finds the first USN > ours
+        start = bisect.bisect_left(self.usn_index, (updateSequenceNum + 1,))
+        return [self.index[url] for usn, url in self.usn_index[start:]]
 
     def get_highest_USN(self):
         """Returns the highest updateSequenceNum in self.bookmarks"""
-        highest_USN = 0
-        for bm in self.bookmarks:
-            if bm['updateSequenceNum'] > highest_USN:
-                highest_USN = bm['updateSequenceNum']
-        return highest_USN
+        if not self.usn_index:
+            return 0
+        return max(self.usn_index[-1][0], 0)
 
     def rename_tag(self, old_tag, new_tag):
         """
         Goes through all bookmarks and renames all tags named *old_tag* to be
         *new_tag*.
         """
-        highest_USN = self.get_highest_USN()
+        changes = []
         for bm in self.bookmarks:
             if old_tag in bm['tags']:
-                highest_USN += 1
                 i = bm['tags'].index(old_tag)
                 bm['tags'][i] = new_tag
                 # Made a change so we need to increment the USN to ensure sync
-                bm['updateSequenceNum'] = highest_USN
+                self._set_USN(bm, self.get_highest_USN() + 1)
                 bm['updated'] = int(round(time.time() * 1000))
+                changes.append(('put', bm))
         # Save the change to disk
-        self.save_bookmarks()
+        self._journal(changes)
+
+def get_favicon_cache(cache_dir):
+    """
+    Returns the server-wide `FaviconCache` (creating it inside of *cache_dir*
+    the first time it is called).
+    """
+    global FAVICON_CACHE
+    if not FAVICON_CACHE:
+        FAVICON_CACHE = FaviconCache(os.path.join(cache_dir, 'favicons'))
+    return FAVICON_CACHE
 
 # Handlers
 class FaviconHandler(BaseHandler):
     """
-    Retrives the biggest favicon-like icon at the given URL.  It will try to
-    fetch apple-touch-icons (which can be nice and big) before it falls back
-    to grabbing the favicon.
+    Retrives the favicon belonging to the site at the given URL and returns it
+    as a data URI.  Icons are looked up via a server-wide
+    :class:`~favicons.FaviconCache` so each site only gets fetched once no
+    matter how many users have it bookmarked.
 
     .. note:: Works with GET and POST requests but POST is preferred since it keeps the URL from winding up in the server logs.
     """
-    # Valid favicon mime types
-    favicon_mimetypes = [
-        'image/vnd.microsoft.icon',
-        'image/x-icon',
-        'image/png',
-        'image/svg+xml',
-        'image/gif',
-        'image/jpeg'
-    ]
     @tornado.web.asynchronous
     def get(self):
         self.process()
@@ -463,130 +546,19 @@ class FaviconHandler(BaseHandler):
 
     def process(self):
         url = self.get_argument("url")
-        http = tornado.httpclient.AsyncHTTPClient()
-        callback = partial(self.on_response, url)
-        http.fetch(url, callback, connect_timeout=5.0, request_timeout=5.0)
-
-    def get_favicon_url(self, html):
-        """
-        Parses *html* looking for a favicon URL.  Returns a tuple of::
-
-            (<url>, <mimetype>)
-
-        If no favicon can be found, returns::
-
-            (None, None)
-        """
-        import html5lib
-        p = html5lib.HTMLParser(
-            tree=html5lib.treebuilders.getTreeBuilder("dom"))
-        dom_tree = p.parse(html)
-        walker = html5lib.treewalkers.getTreeWalker("dom")
-        stream = walker(dom_tree)
-        fetch_url = None
-        mimetype = None
-        icon = False
-        for token in stream:
-            if 'name' in token:
-                if token['name'] == 'link':
-                    for attr in token['data']:
-                        if attr[0] == 'rel':
-                            if 'shortcut icon' in attr[1].lower():
-                                icon = True
-                        elif attr[0] == 'href':
-                            fetch_url = attr[1]
-                        elif attr[0] == 'type':
-                            mimetype = attr[1]
-                    if fetch_url and icon:
-                        if not mimetype:
-                            mimetype = "image/x-icon"
-                        if mimetype in self.favicon_mimetypes:
-                            return (fetch_url, mimetype)
-        return (None, None)
-
-    def on_response(self, url, response):
-        try:
-            from urlparse import urlparse
-        except ImportError: # Python 3.X
-            from urllib import parse as urlparse
-        if response.error:
-            self.write('Unable to fetch icon.')
-            self.finish()
-            return
-        fetch_url = None
-        try:
-            content = response.body.decode('utf-8')
-        except UnicodeDecodeError:
-            content = response.body
-        parsed_url = urlparse(url)
-        (fetch_url, mimetype) = self.get_favicon_url(content)
-        if fetch_url:
-            if not fetch_url.startswith('http'):
-                fetch_url = '%s://%s%s' % (
-                    parsed_url.scheme, parsed_url.netloc, fetch_url)
-        if not mimetype:
-            mimetype = "image/x-icon" # Default
-        if not fetch_url:
-            fetch_url = '%s://%s/favicon.ico' % (
-                parsed_url.scheme, parsed_url.netloc)
-        if fetch_url.startswith('http://') or fetch_url.startswith('https://'):
-            noop()
-        else:
-            raise tornado.web.HTTPError(404)
-        http = tornado.httpclient.AsyncHTTPClient()
-        callback = partial(self.icon_fetch, url, mimetype)
-        try:
-            http.fetch(
-                fetch_url,
-                callback,
-                connect_timeout=5.0,
-                request_timeout=5.0
-            )
-        except socket.gaierror: # No address associated with hostname
-            self.write('Unable to fetch icon.')
-            self.finish()
-            return
-
-    def icon_multifetch(self, urls, response):
-        """
-        Fetches the icon at the given URLs, stopping when it finds the biggest.
-        If an icon is not found, calls itself again with the next icon URL.
-        If the icon is found, writes it to the client and finishes the request.
-        """
-        if response.error:
-            if urls:
-                url = urls.pop()
-                http = tornado.httpclient.AsyncHTTPClient()
-                callback = partial(self.icon_multifetch, urls)
-                try:
-                    http.fetch(url, callback)
-                except socket.gaierror:
-                    raise tornado.web.HTTPError(404)
-            else:
-                raise tornado.web.HTTPError(404)
-        else:
-            if 'Content-Type' in response.headers:
-                mimetype = response.headers['Content-Type']
-                self.set_header("Content-Type", mimetype)
-            else:
-                mimetype = "image/vnd.microsoft.icon"
-                self.set_header("Content-Type", mimetype)
-            data_uri = "data:%s;base64,%s" % (
-                mimetype,
-                response.body.encode('base64').replace('\n', '')
-            )
-            self.write(data_uri)
-            self.finish()
+        cache = get_favicon_cache(self.settings['cache_dir'])
+        cache.get(url, self.icon_fetch)
 
-    def icon_fetch(self, url, mimetype, response):
-        """Returns the fetched icon to the client."""
-        if response.error:
+    def icon_fetch(self, result):
+        """Returns the fetched icon (*result*) to the client."""
+        if not result:
             self.write('Unable to fetch icon.')
             self.finish()
             return
+        data, mimetype = result
         data_uri = "data:%s;base64,%s" % (
             mimetype,
-            response.body.encode('base64').replace('\n', '')
+            base64.b64encode(data).decode('ascii')
         )
         self.set_header("Content-Type", mimetype)
         self.write(data_uri)
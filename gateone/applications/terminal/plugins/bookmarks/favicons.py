@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+__doc__ = """\
+favicons.py - A server-wide favicon cache for the bookmarks plugin.
+
+Importing a few hundred bookmarks means fetching a few hundred favicons (and
+the pages that point to them).  Since lots of users tend to bookmark the same
+sites `FaviconCache` keeps the icons it finds (and the sites it couldn't find
+one for) around for a while so each site only gets bothered once:
+
+    * Icons are cached by origin (e.g. ``https://github.com``).
+    * Icons are stored on disk under a name derived from their content (so
+      sites sharing the same icon only take up space once).
+    * Failures (no icon, site down) are cached too (for a shorter time).
+    * Concurrent requests for the same origin share a single fetch.
+    * Only the ``<head>`` of each page gets parsed (the icon is fetched as
+      soon as ``</head>`` or ``<body>`` is encountered and the rest of the
+      page is thrown away as it arrives).
+
+Example::
+
+    >>> cache = FaviconCache('/opt/gateone/cache/favicons')
+    >>> def got_icon(result):
+    ...     if result:
+    ...         data, mimetype = result
+    >>> cache.get('https://github.com/liftoff/GateOne', got_icon)
+
+Docstrings
+----------
+"""
+
+# Meta
+__license__ = "GNU AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+# Python stdlib
+import os, io, json, time, hashlib, logging, tempfile
+try:
+    from HTMLParser import HTMLParser, HTMLParseError
+    from urlparse import urlparse, urljoin
+except ImportError: # Python 3.X
+    from html.parser import HTMLParser
+    from urllib.parse import urlparse, urljoin
+    HTMLParseError = Exception
+
+# Tornado stuff
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.concurrent import Future
+
+# Globals
+FAVICON_MIMETYPES = (
+    'image/vnd.microsoft.icon',
+    'image/x-icon',
+    'image/png',
+    'image/svg+xml',
+    'image/gif',
+    'image/jpeg'
+)
+EXTENSIONS = { # For the files in the cache
+    'image/vnd.microsoft.icon': '.ico',
+    'image/x-icon': '.ico',
+    'image/png': '.png',
+    'image/svg+xml': '.svg',
+    'image/gif': '.gif',
+    'image/jpeg': '.jpg',
+}
+MAX_HEAD = 256*1024 # Don't read more than this much looking for </head>
+MAX_ICON = 1024*1024 # Icons bigger than this are ignored
+
+class IconLinkParser(HTMLParser):
+    """
+    A streaming parser that looks for ``<link rel="icon">`` (or "shortcut
+    icon") tags.  Feed it chunks of HTML as they arrive via :meth:`feed`.  Once
+    the ``<head>`` is over (``</head>`` or ``<body>``) :attr:`done` will be
+    set and anything else that gets fed to it is ignored.  The first usable
+    icon link will be stored in :attr:`icon` as ``(href, mimetype)``.
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.icon = None
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'body':
+            self.done = True
+        if tag != 'link' or self.icon or self.done:
+            return
+        attrs = dict((k, v or '') for k, v in attrs)
+        if 'icon' not in attrs.get('rel', '').lower().split():
+            return
+        href = attrs.get('href', '').strip()
+        mimetype = attrs.get('type', '').strip().lower() or 'image/x-icon'
+        if href and mimetype in FAVICON_MIMETYPES:
+            self.icon = (href, mimetype)
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            self.done = True
+
+    def feed(self, data):
+        if self.done:
+            return
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'ignore')
+        try:
+            HTMLParser.feed(self, data)
+        except HTMLParseError:
+            self.done = True # Can't make sense of it; give up
+
+def find_icon_link(html):
+    """
+    Returns the ``(href, mimetype)`` of the first icon ``<link>`` in *html*
+    (only the ``<head>`` is examined) or ``None`` if there isn't one.
+    """
+    parser = IconLinkParser()
+    parser.feed(html)
+    return parser.icon
+
+def get_origin(url):
+    """
+    Returns the origin (scheme and host) of *url* (e.g.
+    ``https://github.com``) or ``None`` if it isn't an HTTP(S) URL.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+        return None
+    return '%s://%s' % (parsed.scheme, parsed.netloc.lower())
+
+class FaviconCache(object):
+    """
+    Finds, fetches, and caches favicons.  Icons are stored in *cache_dir*
+    (along with an index.json that maps origins to icons).  Successful lookups
+    are kept for *ttl* seconds and failures for *negative_ttl* seconds.
+
+    *fetch_timeout* is used as both the connect and request timeout of each
+    HTTP request.
+    """
+    def __init__(self, cache_dir, ttl=86400*7, negative_ttl=3600,
+            fetch_timeout=5.0, io_loop=None):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.fetch_timeout = fetch_timeout
+        self.io_loop = io_loop or IOLoop.current()
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.pending = {} # Origin -> [callbacks waiting on the fetch]
+        self.fetches = 0 # Number of origins actually fetched (for stats)
+        self.index = {}
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.load_index()
+
+    def load_index(self):
+        """Loads the index from disk (if there is one)."""
+        try:
+            with io.open(self.index_path, 'rb') as f:
+                self.index = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            self.index = {}
+
+    def save_index(self):
+        """
+        Saves the index to disk (dropping expired entries along the way).
+        Writes to a temporary file first so it's never left half-written.
+        """
+        now = time.time()
+        self.index = dict(
+            (k, v) for k, v in self.index.items() if v['expires'] > now)
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(self.index).encode('utf-8'))
+        os.rename(temp_path, self.index_path)
+
+    def lookup(self, origin):
+        """
+        Returns the cached result for *origin*:  ``(data, mimetype)`` if an
+        icon was found, ``False`` if we already know there isn't one, or
+        ``None`` if it isn't in the cache (or it expired).
+        """
+        entry = self.index.get(origin)
+        if not entry or entry['expires'] < time.time():
+            return None
+        if not entry['file']:
+            return False # Negative result
+        try:
+            with io.open(os.path.join(self.cache_dir, entry['file']), 'rb') as f:
+                return (f.read(), entry['mimetype'])
+        except (IOError, OSError):
+            return None # Somebody cleaned up the cache dir
+
+    def store(self, origin, result):
+        """
+        Stores *result* (``(data, mimetype)`` or ``None``) in the cache for
+        *origin*.
+        """
+        entry = {'file': None, 'mimetype': None}
+        if result:
+            data, mimetype = result
+            filename = hashlib.sha1(data).hexdigest() + EXTENSIONS.get(
+                mimetype, '')
+            path = os.path.join(self.cache_dir, filename)
+            if not os.path.exists(path):
+                fd, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.rename(temp_path, path)
+            entry = {'file': filename, 'mimetype': mimetype}
+            entry['expires'] = time.time() + self.ttl
+        else:
+            entry['expires'] = time.time() + self.negative_ttl
+        self.index[origin] = entry
+        try:
+            self.save_index()
+        except (IOError, OSError) as e:
+            logging.error("Could not save the favicon index: %s" % e)
+
+    def get(self, url, callback):
+        """
+        Calls *callback* with ``(data, mimetype)`` of the favicon belonging to
+        the site at *url* or ``None`` if one couldn't be found.  The result
+        comes from the cache if possible.  If a fetch for the same origin is
+        already in progress *callback* will be called when it completes.
+        """
+        origin = get_origin(url)
+        if not origin:
+            callback(None)
+            return
+        cached = self.lookup(origin)
+        if cached is not None:
+            callback(cached or None)
+            return
+        if origin in self.pending:
+            self.pending[origin].append(callback)
+            return
+        self.pending[origin] = [callback]
+        self.fetches += 1
+        future = self.fetch(url)
+        self.io_loop.add_future(
+            future, lambda f: self._fetched(origin, f))
+
+    def _fetched(self, origin, future):
+        """
+        Called when the fetch for *origin* completes; stores the result and
+        calls everything that was waiting on it.
+        """
+        try:
+            result = future.result()
+        except Exception as e:
+            logging.debug("Error fetching favicon for %s: %s" % (origin, e))
+            result = None
+        self.store(origin, result)
+        for callback in self.pending.pop(origin, []):
+            try:
+                callback(result)
+            except Exception as e:
+                logging.error("Error in favicon callback: %s" % e)
+
+    def find_icon_url(self, url):
+        """
+        Reads the ``<head>`` of the page at *url* and returns a `Future` that
+        resolves to the ``(icon_url, mimetype)`` it links to (or
+        ``(None, None)``).  The `Future` resolves as soon as the ``<head>`` is
+        over; the rest of the page is discarded as it arrives.
+        """
+        future = Future()
+        parser = IconLinkParser()
+        received = [0]
+        def resolve(base_url):
+            if future.done():
+                return
+            if not parser.icon:
+                future.set_result((None, None))
+                return
+            href, mimetype = parser.icon
+            future.set_result((urljoin(base_url, href), mimetype))
+        def streaming_callback(chunk):
+            if parser.done:
+                return # Still downloading the <body>; ignore it
+            received[0] += len(chunk)
+            if received[0] > MAX_HEAD:
+                parser.done = True
+            parser.feed(chunk)
+            if parser.done:
+                resolve(url)
+        def on_response(response):
+            resolve(response.effective_url or url)
+        request = HTTPRequest(
+            url,
+            connect_timeout=self.fetch_timeout,
+            request_timeout=self.fetch_timeout,
+            streaming_callback=streaming_callback)
+        AsyncHTTPClient().fetch(request, on_response)
+        return future
+
+    @gen.coroutine
+    def fetch(self, url):
+        """
+        Finds and fetches the favicon for the site at *url*.  Returns
+        ``(data, mimetype)`` or ``None``.
+        """
+        icon_url, mimetype = yield self.find_icon_url(url)
+        if not icon_url or get_origin(icon_url) is None:
+            icon_url = '%s/favicon.ico' % get_origin(url)
+            mimetype = 'image/x-icon'
+        http = AsyncHTTPClient()
+        try:
+            response = yield http.fetch(
+                icon_url,
+                connect_timeout=self.fetch_timeout,
+                request_timeout=self.fetch_timeout)
+        except Exception as e: # HTTPError, socket.gaierror, etc
+            logging.debug("Could not fetch %s: %s" % (icon_url, e))
+            raise gen.Return(None)
+        if not response.body or len(response.body) > MAX_ICON:
+            raise gen.Return(None)
+        content_type = response.headers.get('Content-Type', '')
+        content_type = content_type.split(';')[0].strip().lower()
+        if content_type in FAVICON_MIMETYPES:
+            mimetype = content_type
+        elif content_type.startswith('text/'):
+            raise gen.Return(None) # Probably an HTML error page
+        raise gen.Return((response.body, mimetype))
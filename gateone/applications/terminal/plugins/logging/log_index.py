@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+__doc__ = """\
+log_index.py - Full-text search and metadata index for the logging plugin.
+
+Keeps a per-user SQLite database (*user_dir*/<user>/log_index.sqlite) holding
+the text of every line that appeared in the user's session logs (.golog files)
+along with the frame it came from and when.  The index is updated
+incrementally:  Only logs that are new or have grown since the last update get
+read and logs that no longer exist (e.g. removed by ``cleanup_user_logs()``)
+get dropped from the index.  Logs that grew are read starting at the frame
+where the last complete line (i.e. the last newline) ended so that a line that
+was still being written (e.g. the prompt) gets re-indexed as a whole.
+
+If SQLite's full-text search extension (FTS4) isn't available a plain table
+(searched via ``LIKE``) will be used instead.  Slower, but it works.
+
+The same database also stores the metadata of each log (see
+`termio.get_or_update_metadata`) keyed by filename, size, and modification
+time so that listing logs (`list_logs`) doesn't require opening every single
+.golog.  Only logs that are new or have changed since they were last listed
+need to be read.  Logs get added as soon as they're finalized (see
+`record_metadata`).
+
+Example::
+
+    >>> update_index('/opt/gateone/users/bsmith@enterprise')
+    >>> search('/opt/gateone/users/bsmith@enterprise', 'rm -rf /var/lib')
+    [{'log': '20140228101504012345-10.1.1.100.golog', 'matches': [
+        {'frame': 1234, 'time': 1393603310123,
+         'line': 'bsmith@host:~ $ rm -rf /var/lib/foo'}]}]
+
+.. note:: These functions block so they're meant to be called via the `gateone.async` runners (e.g. ``self.cpu_async`` in applications).
+"""
+
+# Meta
+__license__ = "GNU AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+# Python stdlib
+import os
+import re
+import logging
+import sqlite3
+from json import dumps, loads
+from collections import OrderedDict
+
+# Our stuff
+from gateone.applications.terminal.logviewer import get_frames
+from termio import get_or_update_metadata
+from termio.vtextract import VTTextExtractor
+
+# Globals
+INDEX_NAME = 'log_index.sqlite' # Lives in the user's directory
+MAX_LINE = 1024 # Lines longer than this get truncated before being indexed
+RE_WORDS = re.compile(r'\w+', re.UNICODE)
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS logs ("
+        "id INTEGER PRIMARY KEY, filename TEXT UNIQUE, size INTEGER, "
+        "mtime REAL, frames INTEGER)",
+    "CREATE TABLE IF NOT EXISTS lines ("
+        "id INTEGER PRIMARY KEY, log_id INTEGER, frame INTEGER, "
+        "time INTEGER)",
+    "CREATE INDEX IF NOT EXISTS lines_log_id ON lines (log_id)",
+    "CREATE TABLE IF NOT EXISTS metadata ("
+        "filename TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+        "metadata TEXT)",
+)
+# The text of each line lives here (rowid == lines.id).  Tried in order:
+FTS_TABLES = (
+    "CREATE VIRTUAL TABLE lines_text USING fts4(text, tokenize=unicode61)",
+    "CREATE VIRTUAL TABLE lines_text USING fts4(text)",
+    "CREATE TABLE lines_text (text TEXT)", # No FTS; LIKE will be used
+)
+
+def open_index(users_dir):
+    """
+    Returns a `sqlite3.Connection` to the index belonging to the user whose
+    directory is *users_dir* (creating it if necessary).
+    """
+    db = sqlite3.connect(os.path.join(users_dir, INDEX_NAME), timeout=30)
+    for statement in SCHEMA:
+        db.execute(statement)
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'lines_text'").fetchone()
+    if not exists:
+        for statement in FTS_TABLES:
+            try:
+                db.execute(statement)
+                break
+            except sqlite3.OperationalError:
+                continue # Try the next one
+    db.commit()
+    return db
+
+def has_fts(db):
+    """
+    Returns True if the ``lines_text`` table in *db* supports full-text search.
+    """
+    sql = db.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'lines_text'").fetchone()
+    return 'VIRTUAL' in sql[0].upper()
+
+def _remove_log(db, log_id):
+    """Removes everything belonging to the log with the given *log_id*."""
+    db.execute(
+        "DELETE FROM lines_text WHERE rowid IN "
+        "(SELECT id FROM lines WHERE log_id = ?)", (log_id,))
+    db.execute("DELETE FROM lines WHERE log_id = ?", (log_id,))
+    db.execute("DELETE FROM logs WHERE id = ?", (log_id,))
+
+def _log_lines(log_path, skip=0):
+    """
+    A generator that yields ``(frame, time, line)`` for every line of text in
+    the log at *log_path* (ignoring the first *skip* frames).  *frame* is the
+    index of the frame the line started in (not counting the metadata frame so
+    it matches up with playback) and *time* is its timestamp (milliseconds
+    since the epoch).  The last item yielded will always be ``(frames, None,
+    None)`` where *frames* is the number of frames up to (and including) the
+    last one that ended a line.  Reading should resume after that frame next
+    time (*skip*) since any lines that follow it may not be complete yet.
+    """
+    extractor = VTTextExtractor()
+    line = u''
+    line_frame = line_time = None
+    resume = skip
+    try:
+        for count, frame in enumerate(get_frames(log_path), 1):
+            if count <= skip:
+                continue
+            if count == 1: # The first frame is metadata
+                resume = count
+                continue
+            try:
+                frame_time = int(frame[:13])
+            except ValueError:
+                continue # Not a valid frame
+            for text in re.split(u'(\n)', extractor.feed(frame[14:])):
+                if text == u'\n':
+                    if line.strip():
+                        yield (line_frame, line_time, line)
+                    line = u''
+                    continue
+                if not text:
+                    continue
+                if not line:
+                    line_frame, line_time = count - 2, frame_time
+                if u'\r' in text: # Carriage return; overwrite the line
+                    line, text = u'', text.rsplit(u'\r', 1)[1]
+                line = (line + text)[:MAX_LINE]
+            if not line and extractor.idle:
+                resume = count # Nothing carries over into the next frame
+    except (IOError, EOFError):
+        # Log is still being written (or is truncated); we'll get the rest
+        # next time.
+        pass
+    if line.strip(): # Whatever is left over (e.g. the last prompt)
+        yield (line_frame, line_time, line)
+    yield (resume, None, None)
+
+def index_log(db, log_id, log_path, skip=0):
+    """
+    Adds the lines from the log at *log_path* to *db* (under *log_id*),
+    skipping the first *skip* frames (because they've already been indexed).
+    Lines that start after the first *skip* frames get replaced (they may have
+    been incomplete when they were indexed).  Returns the number of frames
+    that were completely indexed (see `_log_lines`).
+    """
+    if skip:
+        # Same numbering as _log_lines(): The metadata frame doesn't count
+        db.execute(
+            "DELETE FROM lines_text WHERE rowid IN "
+            "(SELECT id FROM lines WHERE log_id = ? AND frame >= ?)",
+            (log_id, skip - 1))
+        db.execute("DELETE FROM lines WHERE log_id = ? AND frame >= ?",
+            (log_id, skip - 1))
+    frames = skip
+    for frame, frame_time, line in _log_lines(log_path, skip):
+        if line is None:
+            frames = max(frame, skip)
+            break
+        cursor = db.execute(
+            "INSERT INTO lines (log_id, frame, time) VALUES (?, ?, ?)",
+            (log_id, frame, frame_time))
+        db.execute("INSERT INTO lines_text (rowid, text) VALUES (?, ?)",
+            (cursor.lastrowid, line))
+    return frames
+
+def update_index(users_dir):
+    """
+    Brings the index for the user whose directory is *users_dir* up to date
+    with the logs in *users_dir*/logs.  Returns the number of logs that were
+    (re)indexed.
+    """
+    logs_dir = os.path.join(users_dir, 'logs')
+    if not os.path.isdir(logs_dir):
+        return 0
+    db = open_index(users_dir)
+    updated = 0
+    try:
+        indexed = {}
+        for row in db.execute(
+                "SELECT id, filename, size, mtime, frames FROM logs"):
+            indexed[row[1]] = row
+        on_disk = set(a for a in os.listdir(logs_dir) if a.endswith('.golog'))
+        for filename in set(indexed) - on_disk: # Removed
+            with db:
+                _remove_log(db, indexed[filename][0])
+        for filename in sorted(on_disk):
+            log_path = os.path.join(logs_dir, filename)
+            try:
+                stat = os.stat(log_path)
+            except OSError:
+                continue # Removed in the meantime
+            skip = 0
+            with db:
+                if filename in indexed:
+                    log_id, _name, size, mtime, frames = indexed[filename]
+                    if size == stat.st_size and mtime == stat.st_mtime:
+                        continue # Nothing new
+                    if stat.st_size < size: # Replaced?  Start over
+                        _remove_log(db, log_id)
+                    else: # Grew; pick up where the last complete line ended
+                        skip = frames
+                if skip:
+                    db.execute(
+                        "UPDATE logs SET size = ?, mtime = ? WHERE id = ?",
+                        (stat.st_size, stat.st_mtime, log_id))
+                else:
+                    log_id = db.execute(
+                        "INSERT INTO logs (filename, size, mtime, frames) "
+                        "VALUES (?, ?, ?, 0)",
+                        (filename, stat.st_size, stat.st_mtime)).lastrowid
+                frames = index_log(db, log_id, log_path, skip)
+                db.execute("UPDATE logs SET frames = ? WHERE id = ?",
+                    (frames, log_id))
+            updated += 1
+    finally:
+        db.close()
+    return updated
+
+def parse_limit(limit):
+    """
+    Converts a MySQL-style *limit* string into an ``(offset, count)`` tuple.
+    For example, "5,10" (skip 5, return 10) becomes ``(5, 10)`` and "10"
+    becomes ``(0, 10)``.  A *limit* of ``None`` (or anything invalid) means
+    "everything" and results in ``(0, None)``.
+    """
+    if not limit or limit is True:
+        return (0, None)
+    try:
+        if isinstance(limit, (int, long)):
+            return (0, max(limit, 0))
+        parts = [int(a) for a in limit.split(',')]
+    except (AttributeError, ValueError):
+        return (0, None)
+    if len(parts) == 1:
+        return (0, max(parts[0], 0))
+    return (max(parts[0], 0), max(parts[1], 0))
+
+def record_metadata(users_dir, log_path, metadata):
+    """
+    Stores *metadata* for the log at *log_path* in the index belonging to the
+    user whose directory is *users_dir*.  Meant to be called when a log is
+    finalized so it doesn't need to be read again when the logs are listed.
+    """
+    if not metadata or not os.path.exists(log_path):
+        return
+    stat = os.stat(log_path)
+    metadata = dict(metadata, size=stat.st_size)
+    db = open_index(users_dir)
+    try:
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO metadata "
+                "(filename, size, mtime, metadata) VALUES (?, ?, ?, ?)",
+                (os.path.basename(log_path), stat.st_size, stat.st_mtime,
+                dumps(metadata)))
+    finally:
+        db.close()
+
+def list_logs(users_dir, user, limit=None):
+    """
+    Returns a dict containing the metadata of the logs belonging to *user*
+    (whose directory is *users_dir*), newest first::
+
+        {'logs': [<metadata>, ...], 'total_logs': <int>, 'total_bytes': <int>}
+
+    Metadata comes from the index whenever a log's size and modification time
+    match what was recorded; everything else gets read via
+    `termio.get_or_update_metadata` (and added to the index).  Logs that can't
+    be read (e.g. because they're still being written) are skipped.
+
+    If *limit* is given only the specified logs will be returned.  Works just
+    like `MySQL <http://en.wikipedia.org/wiki/MySQL>`_: limit="5,10" will skip
+    the first 5 logs and return the next 10.  The totals always cover all of
+    the user's logs.
+    """
+    out = {'logs': [], 'total_logs': 0, 'total_bytes': 0}
+    logs_dir = os.path.join(users_dir, 'logs')
+    if not os.path.isdir(logs_dir):
+        return out
+    offset, count = parse_limit(limit)
+    db = open_index(users_dir)
+    try:
+        indexed = {}
+        for filename, size, mtime in db.execute(
+                "SELECT filename, size, mtime FROM metadata"):
+            indexed[filename] = (size, mtime)
+        log_files = [a for a in os.listdir(logs_dir) if a.endswith('.golog')]
+        log_files.sort(reverse=True) # Newest first (they're named by date)
+        with db:
+            for filename in set(indexed) - set(log_files): # Removed
+                db.execute(
+                    "DELETE FROM metadata WHERE filename = ?", (filename,))
+        wanted = []
+        for filename in log_files:
+            log_path = os.path.join(logs_dir, filename)
+            try:
+                stat = os.stat(log_path)
+            except OSError:
+                continue # Removed in the meantime
+            if indexed.get(filename) != (stat.st_size, stat.st_mtime):
+                # New or changed; (re)read it (this may modify the log)
+                try:
+                    metadata = get_or_update_metadata(log_path, user)
+                except (IOError, EOFError):
+                    metadata = None
+                if not metadata:
+                    # Broken log file -- may be being written to
+                    continue # Just skip it
+                stat = os.stat(log_path)
+                metadata['size'] = stat.st_size
+                with db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO metadata "
+                        "(filename, size, mtime, metadata) "
+                        "VALUES (?, ?, ?, ?)",
+                        (filename, stat.st_size, stat.st_mtime,
+                        dumps(metadata)))
+            out['total_logs'] += 1
+            out['total_bytes'] += stat.st_size
+            if out['total_logs'] > offset:
+                if count is None or len(wanted) < count:
+                    wanted.append(filename)
+        for filename in wanted:
+            row = db.execute(
+                "SELECT metadata FROM metadata WHERE filename = ?",
+                (filename,)).fetchone()
+            out['logs'].append(loads(row[0]))
+    finally:
+        db.close()
+    return out
+
+def search(users_dir, query, limit=100):
+    """
+    Updates the index (see `update_index`) then searches it for lines
+    containing *query* (all of its words, in order).  Returns a list of dicts
+    like this (newest logs first)::
+
+        [{'log': <filename>, 'matches': [
+            {'frame': <frame>, 'time': <ms since epoch>, 'line': <text>}, ...
+        ]}, ...]
+
+    No more than *limit* matching lines will be returned.
+    """
+    update_index(users_dir)
+    words = RE_WORDS.findall(query)
+    if not words:
+        return []
+    db = open_index(users_dir)
+    try:
+        if has_fts(db):
+            condition = "lines_text MATCH ?"
+            argument = u'"%s"' % u' '.join(words) # Phrase query
+        else:
+            condition = "lines_text.text LIKE ? ESCAPE '\\'"
+            argument = u'%%%s%%' % re.sub(r'([%_\\])', r'\\\1', query)
+        rows = db.execute(
+            "SELECT logs.filename, lines.frame, lines.time, lines_text.text "
+            "FROM lines_text "
+            "JOIN lines ON lines.id = lines_text.rowid "
+            "JOIN logs ON logs.id = lines.log_id "
+            "WHERE %s "
+            "ORDER BY logs.filename DESC, lines.frame ASC LIMIT ?" % condition,
+            (argument, limit)).fetchall()
+    finally:
+        db.close()
+    results = OrderedDict()
+    for filename, frame, frame_time, line in rows:
+        results.setdefault(filename, []).append(
+            {'frame': frame, 'time': frame_time, 'line': line})
+    return [{'log': a, 'matches': b} for a, b in results.items()]
+
+def search_logs(users_dir, query, limit=100):
+    """
+    Calls `search` and returns a dict suitable for sending to the client as a
+    'terminal:logging_search_results' message.  Errors are logged and returned
+    in the 'error' key instead of being raised (so they make it out of the
+    `~gateone.async.MultiprocessRunner`).
+    """
+    out = {'query': query, 'results': []}
+    try:
+        out['results'] = search(users_dir, query, limit)
+    except (sqlite3.Error, IOError, OSError) as e:
+        logging.error("Error searching logs in %s: %s" % (users_dir, e))
+        out['error'] = u"%s" % e
+    return out
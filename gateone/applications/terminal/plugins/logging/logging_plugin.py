@@ -6,8 +6,6 @@
 #        with the existing logging module
 
 # TODO: Fix the flat log viewing format.  Doesn't look quite right.
-# TODO: Write search functions.
-# TODO: Add some search indexing capabilities so that search will be fast.
 # TODO: Write a handler that displays a page where users can drag & drop .golog files to have them played back in their browser.
 
 __doc__ = """\
@@ -24,7 +22,10 @@ This Python plugin file implements the following hooks::
             'logging_get_log_flat': retrieve_log_flat,
             'logging_get_log_playback': retrieve_log_playback,
             'logging_get_log_file': save_log_playback,
+            'logging_search': search_logs,
+            'logging_export_logs': export_logs,
         },
+        'Multiplex': index_finalized_log,
         'Events': {
             'terminal:authenticate': send_logging_css_template
         }
@@ -50,10 +51,12 @@ from multiprocessing import Process, Queue
 # Our stuff
 from gateone import GATEONE_DIR
 from gateone.auth.authorization import applicable_policies
-from gateone.applications.terminal.logviewer import flatten_log
+from gateone.applications.terminal.logviewer import flat_log_lines
 from gateone.applications.terminal.logviewer import render_log_frames
+from gateone.applications.terminal.logviewer import batch_export
+from .log_index import update_index, list_logs, record_metadata, parse_limit
+from .log_index import search_logs as _search_logs
 from termio import get_or_update_metadata
-from gateone.core.utils import json_encode
 from gateone.core.locale import get_translation
 
 _ = get_translation()
@@ -62,12 +65,13 @@ _ = get_translation()
 import tornado.template
 import tornado.ioloop
 
-# TODO: Make the log retrieval functions work incrementally as logs are read so they don't have to be stored entirely in memory before being sent to the client.
+# TODO: Make the log playback functions work incrementally as logs are read so they don't have to be stored entirely in memory before being sent to the client.
 
 # Globals
 PLUGIN_PATH = os.path.split(__file__)[0] # Path to this plugin's directory
 SEPARATOR = u"\U000f0f0f" # The character used to separate frames in the log
 PROCS = {} # For tracking/cancelling background processes
+FLAT_CHUNK_LINES = 1000 # Max lines per 'terminal:logging_log_flat' message
 # Matches Gate One's special optional escape sequence (ssh plugin only)
 RE_OPT_SSH_SEQ = re.compile(
     r'.*\x1b\]_\;(ssh\|.+?)(\x07|\x1b\\)', re.MULTILINE|re.DOTALL)
@@ -97,17 +101,20 @@ def get_256_colors(self):
 # WebSocket commands (not the same as handlers)
 def enumerate_logs(self, limit=None):
     """
-    Calls _enumerate_logs() via a :py:class:`multiprocessing.Process` so it
-    doesn't cause the :py:class:`~tornado.ioloop.IOLoop` to block.
+    Calls `log_index.list_logs` via ``self.cpu_async`` so it doesn't cause
+    the :py:class:`~tornado.ioloop.IOLoop` to block.  The metadata of each log
+    is kept in the user's log index so only logs that are new (or have
+    changed) since the last time will actually need to be read.
 
     Log objects will be returned to the client one at a time by sending
-    'logging_log' actions to the client over the WebSocket (*self*).
+    'logging_log' actions to the client over the WebSocket (*self*) followed
+    by a 'logging_logs_complete' action.
+
+    If *limit* is given, only return the specified logs.  Works just like
+    `MySQL <http://en.wikipedia.org/wiki/MySQL>`_: limit="5,10" will skip the
+    first 5 logs and return the next 10.
     """
     self.term_log.debug("enumerate_logs(%s, %s)" % (self, limit))
-    # Sometimes IOLoop detects multiple events on the fd before we've finished
-    # doing a get() from the queue.  This variable is used to ensure we don't
-    # send the client duplicates:
-    results = []
     # NOTE: self.policy represents the user's specific settings
     if self.policy['session_logging'] == False:
         message = {'go:notice': _(
@@ -124,97 +131,33 @@ def enumerate_logs(self, limit=None):
         return # Nothing left to do
     user = self.current_user['upn']
     users_dir = os.path.join(self.ws.settings['user_dir'], user) # "User's dir"
-    io_loop = tornado.ioloop.IOLoop.current()
-    global PROCS
-    if user not in PROCS:
-        PROCS[user] = {}
-    else: # Cancel anything that's already running
-        fd = PROCS[user]['queue']._reader.fileno()
-        if fd in io_loop._handlers:
-            io_loop.remove_handler(fd)
-        if PROCS[user]['process']:
-            try:
-                PROCS[user]['process'].terminate()
-            except OSError:
-                # process was already terminated...  Nothing to do
-                pass
-    PROCS[user]['queue'] = q = Queue()
-    PROCS[user]['process'] = Process(
-        target=_enumerate_logs, args=(q, user, users_dir, limit))
-    def send_message(fd, event):
+    def send_logs(result):
         """
-        Sends the log enumeration result to the client.  Necessary because
-        IOLoop doesn't pass anything other than *fd* and *event* when it handles
-        file descriptor events.
+        Sends the log enumeration *result* to the client.
         """
-        message = q.get()
-        #self.term_log.debug('message: %s' % message)
-        if message == 'complete':
-            io_loop.remove_handler(fd)
-            total_bytes = 0
-            logs_dir = os.path.join(users_dir, "logs")
-            log_files = os.listdir(logs_dir)
-            for log in log_files:
-                log_path = os.path.join(logs_dir, log)
-                total_bytes += os.stat(log_path).st_size
-            out_dict = {
-                'total_logs': len(log_files),
-                'total_bytes': total_bytes
-            }
-            # This signals to the client that we're done
-            message = {'terminal:logging_logs_complete': out_dict}
-            self.write_message(message)
-            return
-        message = json_encode(message)
-        if message not in results:
-            # Keep track of how many/how much
-            if results:
-                results.pop() # No need to keep old stuff hanging around
-            results.append(message)
-            self.write_message(message)
-    # This is kind of neat:  multiprocessing.Queue() instances have an
-    # underlying fd that you can access via the _reader:
-    io_loop.add_handler(q._reader.fileno(), send_message, io_loop.READ)
-    # We tell the IOLoop to watch this fd to see if data is ready in the queue.
-    PROCS[user]['process'].start()
-
-def _enumerate_logs(queue, user, users_dir, limit=None):
-    """
-    Enumerates all of the user's logs and sends the client a "logging_logs"
-    message with the result.
-
-    If *limit* is given, only return the specified logs.  Works just like
-    `MySQL <http://en.wikipedia.org/wiki/MySQL>`_: limit="5,10" will retrieve
-    logs 5-10.
-    """
-    logs_dir = os.path.join(users_dir, "logs")
-    log_files = os.listdir(logs_dir)
-    log_files = [a for a in log_files if a.endswith('.golog')] # Only gologs
-    log_files.sort() # Should put them in order by date
-    log_files.reverse() # Make the newest ones first
-    out_dict = {}
-    for log in log_files:
-        log_path = os.path.join(logs_dir, log)
-        logging.debug("Getting metadata from: %s" % log_path)
-        try:
-            metadata = get_or_update_metadata(log_path, user)
-        except EOFError:
-            continue # Something wrong with this log; skip
-        if not metadata:
-            # Broken log file -- may be being written to
-            continue # Just skip it
-        metadata['size'] = os.stat(log_path).st_size
-        out_dict['log'] = metadata
-        message = {'terminal:logging_log': out_dict}
-        queue.put(message)
-        # If we go too quick sometimes the IOLoop will miss a message
-        time.sleep(0.01)
-    queue.put('complete')
+        for metadata in result['logs']:
+            self.write_message({'terminal:logging_log': {'log': metadata}})
+        out_dict = {
+            'total_logs': result['total_logs'],
+            'total_bytes': result['total_bytes']
+        }
+        # This signals to the client that we're done
+        message = {'terminal:logging_logs_complete': out_dict}
+        self.write_message(message)
+    # Everything that touches the user's log index happens one at a time:
+    identifier = 'log_index:%s' % user
+    self.cpu_async.call_singleton(
+        list_logs, identifier, users_dir, user, limit, callback=send_logs)
+    # Get the search index caught up while the user is looking at the list:
+    self.cpu_async.call_singleton(update_index, identifier, users_dir)
 
 def retrieve_log_flat(self, settings):
     """
     Calls :func:`_retrieve_log_flat` via a :py:class:`multiprocessing.Process`
-    so it doesn't cause the :py:class:`~tornado.ioloop.IOLoop` to block.
+    so it doesn't cause the :py:class:`~tornado.ioloop.IOLoop` to block.  The
+    result is streamed to the client in chunks of :data:`FLAT_CHUNK_LINES`
+    lines via multiple 'terminal:logging_log_flat' messages (the last of which
+    will have 'complete' set to ``True``).
 
     :arg dict settings: A dict containing the *log_filename*, *colors*, and *theme* to use when generating the HTML output.
 
@@ -224,6 +167,9 @@ def retrieve_log_flat(self, settings):
     :arg settings['colors']: The CSS color scheme to use when generating output.
     :arg settings['theme']: The CSS theme to use when generating output.
     :arg settings['where']: Whether or not the result should go into a new window or an iframe.
+    :arg settings['limit']: Optional: Only return the specified lines.  Works just like `MySQL <http://en.wikipedia.org/wiki/MySQL>`_: "500,100" will skip the first 500 lines and return the next 100.
+    :arg settings['start']: Optional: Skip everything recorded before this time (milliseconds since the epoch).
+    :arg settings['end']: Optional: Skip everything recorded after this time (milliseconds since the epoch).
     """
     settings['container'] = self.ws.container
     settings['prefix'] = self.ws.prefix
@@ -245,17 +191,19 @@ def retrieve_log_flat(self, settings):
             except OSError:
                 # process was already terminated...  Nothing to do
                 pass
-    PROCS[user]['queue'] = q = Queue()
+    # The maxsize keeps the process from getting too far ahead of the client
+    PROCS[user]['queue'] = q = Queue(maxsize=4)
     PROCS[user]['process'] = Process(
         target=_retrieve_log_flat, args=(q, settings))
     def send_message(fd, event):
         """
-        Sends the log enumeration result to the client.  Necessary because
-        IOLoop doesn't pass anything other than *fd* and *event* when it handles
-        file descriptor events.
+        Sends the next chunk of the flattened log to the client.  Necessary
+        because IOLoop doesn't pass anything other than *fd* and *event* when
+        it handles file descriptor events.
         """
-        io_loop.remove_handler(fd)
         message = q.get()
+        if message['terminal:logging_log_flat'].get('complete', True):
+            io_loop.remove_handler(fd)
         self.write_message(message)
     # This is kind of neat:  multiprocessing.Queue() instances have an
     # underlying fd that you can access via the _reader:
@@ -263,6 +211,51 @@ def retrieve_log_flat(self, settings):
     # We tell the IOLoop to watch this fd to see if data is ready in the queue.
     PROCS[user]['process'].start()
 
+def _flat_log_html(log_path, start=None, end=None):
+    """
+    A generator that yields the lines of the log at *log_path* (flattened via
+    `~gateone.applications.terminal.logviewer.flat_log_lines`) as HTML
+    (rendered by a terminal emulator).  Lines are yielded as soon as they scroll
+    off the emulator's screen so memory use stays the same no matter how big
+    the log is.  *start* and *end* are passed to `flat_log_lines`.
+    """
+    # Use the terminal emulator to create nice HTML-formatted output
+    from terminal import Terminal
+    spanstrip = re.compile(r'\s+\<\/span\>$')
+    tags = re.compile(r'<[^>]+>')
+    term = Terminal(rows=100, cols=300, em_dimensions=0)
+    # Anything beyond max_scrollback gets thrown away so we need to dump the
+    # scrollback well before that happens:
+    max_lines = term.max_scrollback // 2
+    def clean(lines):
+        # rstrip the lines and fix things like
+        # "<span>whatever [lots of whitespace]    </span>"
+        return [spanstrip.sub("</span>", a.rstrip()) for a in lines]
+    try:
+        for line in flat_log_lines(log_path, start=start, end=end):
+            # Needed to emulate an actual term
+            line = line.replace(b'\n', b'\r\n')
+            # NOTE: Using chunking below to emulate how a stream might actually
+            # be written to the terminal emulator.  This is to prevent the
+            # emulator from thinking that any embedded files (like PDFs) are
+            # never going to end.
+            for i in range(0, len(line), 499):
+                term.write(line[i:i+499])
+                if len(term.scrollback_buf) >= max_lines:
+                    scrollback, screen = term.dump_html()
+                    for html_line in clean(scrollback):
+                        yield html_line
+        scrollback, screen = term.dump_html()
+        screen = clean(screen)
+        # No need for trailing blank lines (or the lonely cursor):
+        while screen and not tags.sub('', screen[-1]).strip():
+            screen.pop()
+        for html_line in clean(scrollback) + screen:
+            yield html_line
+    finally:
+        term.clear_screen() # Ensure the function below works...
+        term.close_captured_fds() # Force clean up open file descriptors
+
 def _retrieve_log_flat(queue, settings):
     """
     Writes the given *log_filename* to *queue* in a flat format equivalent to::
@@ -270,59 +263,58 @@ def _retrieve_log_flat(queue, settings):
         ./logviewer.py --flat log_filename
 
     *settings* - A dict containing the *log_filename*, *colors_css*, and
-    *theme_css* to use when generating the HTML output.
+    *theme_css* to use when generating the HTML output (along with the
+    optional *limit*, *start*, and *end*; see `retrieve_log_flat`).
+
+    The lines are put into *queue* in chunks of :data:`FLAT_CHUNK_LINES`.
+    Each chunk's 'offset' is the line number of its first line.
     """
     out_dict = {
         'result': "",
-        'log': "",
+        'log': [],
         'metadata': {},
+        'offset': 0,
+        'complete': True,
     }
-    # Local variables
-    out = []
-    spanstrip = re.compile(r'\s+\<\/span\>$')
     user = settings['user']
     users_dir = settings['users_dir']
     log_filename = settings['log_filename']
     logs_dir = os.path.join(users_dir, "logs")
     log_path = os.path.join(logs_dir, log_filename)
-    if os.path.exists(log_path):
-        out_dict['metadata'] = get_or_update_metadata(log_path, user)
-        out_dict['metadata']['filename'] = log_filename
-        out_dict['result'] = "Success"
-        from io import BytesIO
-        # Use the terminal emulator to create nice HTML-formatted output
-        from terminal import Terminal
-        term = Terminal(rows=100, cols=300, em_dimensions=0)
-        io_obj = BytesIO()
-        flatten_log(log_path, io_obj)
-        io_obj.seek(0)
-        # Needed to emulate an actual term
-        flattened_log = io_obj.read().replace(b'\n', b'\r\n')
-        # NOTE: Using chunking below to emulate how a stream might actually be
-        # written to the terminal emulator.  This is to prevent the emulator
-        # from thinking that any embedded files (like PDFs) are never going to
-        # end.
-        def chunker(s, n):
-            """Produce `n`-character chunks from `s`."""
-            for start in range(0, len(s), n):
-                yield s[start:start+n]
-        for chunk in chunker(flattened_log, 499):
-            term.write(chunk)
-        scrollback, screen = term.dump_html()
-        # Join them together
-        log_lines = scrollback + screen
-        # rstrip the lines
-        log_lines = [a.rstrip() for a in log_lines]
-        # Fix things like "<span>whatever [lots of whitespace]    </span>"
-        for i, line in enumerate(log_lines):
-            out.append(spanstrip.sub("</span>", line))
-        out_dict['log'] = out
-        term.clear_screen() # Ensure the function below works...
-        term.close_captured_fds() # Force clean up open file descriptors
-    else:
+    if not os.path.exists(log_path):
         out_dict['result'] = _("ERROR: Log not found")
-    message = {'terminal:logging_log_flat': out_dict}
-    queue.put(message)
+        queue.put({'terminal:logging_log_flat': out_dict})
+        return
+    out_dict['metadata'] = get_or_update_metadata(log_path, user) or {}
+    out_dict['metadata']['filename'] = log_filename
+    out_dict['result'] = "Success"
+    offset, count = parse_limit(settings.get('limit', None))
+    line_number = 0
+    out = []
+    for line in _flat_log_html(
+            log_path, settings.get('start', None), settings.get('end', None)):
+        if count is not None and line_number >= offset + count:
+            break
+        if line_number >= offset:
+            if len(out) >= FLAT_CHUNK_LINES:
+                # There's more to come so this chunk isn't the last one.
+                # NOTE: Each chunk needs its own dict since the queue doesn't
+                # pickle it right away (so modifying it would change what gets
+                # sent).
+                queue.put({'terminal:logging_log_flat': dict(out_dict,
+                    log=out,
+                    offset=line_number - len(out),
+                    complete=False
+                )})
+                out = []
+            out.append(line)
+        line_number += 1
+    # The last chunk (only empty if there weren't any lines at all)
+    queue.put({'terminal:logging_log_flat': dict(out_dict,
+        log=out,
+        offset=line_number - len(out),
+        complete=True
+    )})
 
 def retrieve_log_playback(self, settings):
     """
@@ -576,6 +568,129 @@ def _save_log_playback(queue, settings):
     message = {'go:save_file': out_dict}
     queue.put(message)
 
+def export_logs(self, settings):
+    """
+    Renders the session logs of the given users as self-contained HTML
+    playback files on the server (in parallel) by calling
+    :func:`_export_logs` via a :py:class:`multiprocessing.Process`.  Meant for
+    administrators (e.g. for compliance purposes) so it requires the
+    'export_logs' policy to be ``True`` (it defaults to ``False``).
+
+    :arg settings['users']: Optional: A list of the users whose logs will be exported (defaults to all users).
+    :arg settings['start']: Optional: Only export logs that were last modified at or after this time (milliseconds since the epoch).
+    :arg settings['end']: Optional: Only export logs that were last modified at or before this time (milliseconds since the epoch).
+    :arg settings['theme']: Optional: The theme to use (default: "black").
+    :arg settings['colors']: Optional: The text color scheme to use (default: "default").
+    :arg settings['processes']: Optional: The number of processes to use (defaults to the number of CPU cores).
+
+    The files will be written to
+    *user_dir*/<administrator>/exports/<date>/<user>/ and the client will be
+    sent a 'terminal:logging_export_complete' message like this when done::
+
+        {'output_dir': <path>, 'exported': <count>, 'errors': [<error>, ...]}
+    """
+    self.term_log.debug("export_logs(%s)" % settings)
+    if not self.policy.get('export_logs', False):
+        message = {'go:notice': _(
+            "You do not have permission to export session logs.")}
+        self.write_message(message)
+        return
+    user_dir = self.ws.settings['user_dir']
+    upn = self.current_user['upn']
+    out_settings = {
+        'user_dir': user_dir,
+        'users': settings.get('users', None),
+        'start': settings.get('start', None),
+        'end': settings.get('end', None),
+        'processes': settings.get('processes', None),
+        'output_dir': os.path.join(
+            user_dir, upn, 'exports', time.strftime('%Y%m%d%H%M%S')),
+        'render_settings': {
+            'prefix': self.ws.prefix,
+            'container': self.ws.container,
+            'theme': settings.get('theme', 'black'),
+            'colors': settings.get('colors', 'default'),
+        }
+    }
+    self.term_log.info(
+        _("Exporting session logs to %s") % out_settings['output_dir'])
+    q = Queue()
+    # NOTE: Not a daemon because daemonic processes can't have children
+    process = Process(target=_export_logs, args=(q, out_settings))
+    io_loop = tornado.ioloop.IOLoop.current()
+    def send_message(fd, event):
+        """
+        Sends the result to the client.  Necessary because IOLoop doesn't pass
+        anything other than *fd* and *event* when it handles file descriptor
+        events.
+        """
+        io_loop.remove_handler(fd)
+        message = q.get()
+        process.join()
+        result = message['terminal:logging_export_complete']
+        self.ws.send_message(_(
+            "Exported %s session logs to %s (%s errors).") % (
+            result['exported'], result['output_dir'], len(result['errors'])))
+        self.write_message(message)
+    # This is kind of neat:  multiprocessing.Queue() instances have an
+    # underlying fd that you can access via the _reader:
+    io_loop.add_handler(q._reader.fileno(), send_message, io_loop.READ)
+    process.start()
+
+def _export_logs(queue, settings):
+    """
+    Exports the logs specified in *settings* (see `export_logs`) via
+    `~gateone.applications.terminal.logviewer.batch_export` and puts a
+    'terminal:logging_export_complete' message in *queue* when done.
+    """
+    user_dir = settings['user_dir']
+    users = settings['users']
+    if not users:
+        users = [
+            a for a in os.listdir(user_dir)
+            if os.path.isdir(os.path.join(user_dir, a, 'logs'))]
+    start = settings['start']
+    end = settings['end']
+    out_dict = {
+        'output_dir': settings['output_dir'],
+        'exported': 0,
+        'errors': [],
+    }
+    jobs = []
+    for user in sorted(users):
+        logs_dir = os.path.join(user_dir, user, 'logs')
+        if os.path.sep in user or user.startswith('.'):
+            continue # Nice try
+        if not os.path.isdir(logs_dir):
+            continue
+        for log in sorted(os.listdir(logs_dir)):
+            if not log.endswith('.golog'):
+                continue
+            log_path = os.path.join(logs_dir, log)
+            modified = os.stat(log_path).st_mtime * 1000
+            if start and modified < start:
+                continue
+            if end and modified > end:
+                continue
+            output_path = os.path.join(
+                settings['output_dir'], user, log[:-len('.golog')] + '.html')
+            jobs.append((log_path, output_path))
+    if jobs:
+        try:
+            results = batch_export(
+                jobs, settings['output_dir'],
+                render_settings=settings['render_settings'],
+                processes=settings['processes'])
+        except Exception as e:
+            results = []
+            out_dict['errors'].append(u"%s" % e)
+        for log_path, output_path, error in results:
+            if error:
+                out_dict['errors'].append(u"%s: %s" % (log_path, error))
+            else:
+                out_dict['exported'] += 1
+    queue.put({'terminal:logging_export_complete': out_dict})
+
 # Temporarily disabled while I work around the problem of gzip files not being
 # downloadable over the websocket.
 #def get_log_file(self, log_filename):
@@ -598,6 +713,50 @@ def _save_log_playback(queue, settings):
     #message = {'save_file': out_dict}
     #self.write_message(message)
 
+def search_logs(self, settings):
+    """
+    Searches the text of the user's session logs for *settings['query']* and
+    replies with a 'terminal:logging_search_results' message like so::
+
+        {'query': <query>, 'results': [
+            {'log': <log filename>, 'matches': [
+                {'frame': <frame number>, 'time': <ms since epoch>,
+                 'line': <the matching line>}, ...]}, ...]}
+
+    The 'frame' of each match can be used to jump straight to that point when
+    playing back the log.  No more than *settings['limit']* (default: 100)
+    matches will be returned.
+
+    The search index (see `log_index`) is brought up to date before each search
+    so new logs (and new output in logs that are still being written) will be
+    found and logs that were removed won't be.
+    """
+    self.term_log.debug("search_logs(%s)" % settings)
+    if self.policy['session_logging'] == False:
+        return # Nothing to search
+    if not self.policy.get('view_logs', True):
+        message = {'go:notice': _(
+            "NOTE: Your access to the log viewer has been restricted.")}
+        self.write_message(message)
+        return
+    query = settings.get('query', u'')
+    try:
+        limit = int(settings.get('limit', 100))
+    except (TypeError, ValueError):
+        limit = 100
+    user = self.current_user['upn']
+    users_dir = os.path.join(self.ws.settings['user_dir'], user) # "User's dir"
+    def send_results(result):
+        if 'error' in result:
+            self.ws.send_message(
+                _("Error searching logs: %s") % result['error'])
+        message = {'terminal:logging_search_results': result}
+        self.write_message(message)
+    # Searches (and index updates) for a given user happen one at a time:
+    self.cpu_async.call_singleton(
+        _search_logs, 'log_index:%s' % user, users_dir, query, limit,
+        callback=send_results)
+
 def session_logging_check(self):
     """
     Attached to the `terminal:session_logging_check` WebSocket action; replies
@@ -617,6 +776,30 @@ def session_logging_check(self):
         message = {'terminal:logging_sessions_disabled': True}
         self.write_message(message)
 
+def index_finalized_log(self, multiplex):
+    """
+    Attached to the 'Multiplex' hook; adds the metadata of *multiplex*'s log
+    to the user's log index as soon as the log is finalized so it won't need
+    to be read again when the user lists their logs.
+    """
+    if not multiplex.log_path:
+        return # Session logging is disabled
+    users_dir = os.path.dirname(os.path.dirname(multiplex.log_path))
+    log_path = multiplex.log_path
+    runner = self.cpu_async
+    io_loop = tornado.ioloop.IOLoop.current()
+    def finalized(future):
+        # NOTE: This gets called from whatever thread finalized the log
+        try:
+            metadata = future.result()
+        except Exception:
+            return # Nothing to record (the error was already logged)
+        io_loop.add_callback(
+            runner.call_singleton, record_metadata,
+            'log_index:%s' % multiplex.user, users_dir, log_path, metadata)
+    multiplex.add_callback(
+        multiplex.CALLBACK_LOG_FINALIZED, finalized, 'logging_plugin')
+
 def send_logging_css_template(self):
     """
     Sends our logging.css template to the client using the 'load_style'
@@ -632,8 +815,11 @@ hooks = {
         'terminal:logging_get_log_flat': retrieve_log_flat,
         'terminal:logging_get_log_playback': retrieve_log_playback,
         'terminal:logging_get_log_file': save_log_playback,
+        'terminal:logging_search': search_logs,
+        'terminal:logging_export_logs': export_logs,
         'terminal:session_logging_check': session_logging_check,
     },
+    'Multiplex': index_finalized_log,
     'Events': {
         'terminal:authenticate': send_logging_css_template
     }
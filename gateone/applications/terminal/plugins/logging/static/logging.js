@@ -37,6 +37,8 @@ go.Base.update(GateOne.TermLogging, {
             GateOne.Net.addAction('terminal:logging_logs_complete', GateOne.TermLogging.incomingLogsCompleteAction);
             GateOne.Net.addAction('terminal:logging_log_flat', GateOne.TermLogging.displayFlatLogAction);
             GateOne.Net.addAction('terminal:logging_log_playback', GateOne.TermLogging.displayPlaybackLogAction);
+            GateOne.Net.addAction('terminal:logging_search_results', GateOne.TermLogging.searchResultsAction);
+            GateOne.Net.addAction('terminal:logging_export_complete', GateOne.TermLogging.exportCompleteAction);
         */
         var l = go.TermLogging,
             prefix = go.prefs.prefix,
@@ -58,6 +60,8 @@ go.Base.update(GateOne.TermLogging, {
         go.Net.addAction('terminal:logging_log_flat', l.displayFlatLogAction);
         go.Net.addAction('terminal:logging_log_playback', l.displayPlaybackLogAction);
         go.Net.addAction('terminal:logging_sessions_disabled', l.sessionLoggingDisabled);
+        go.Net.addAction('terminal:logging_search_results', l.searchResultsAction);
+        go.Net.addAction('terminal:logging_export_complete', l.exportCompleteAction);
         // Have the server tell us if session logging is enabled.  If it isn't we'll get the 'terminal:logging_sessions_disabled' response.
         go.ws.send(JSON.stringify({'terminal:session_logging_check': null}));
     },
@@ -631,6 +635,8 @@ go.Base.update(GateOne.TermLogging, {
         /**:GateOne.TermLogging.displayFlatLogAction(message)
 
         Opens a new window displaying the (flat) log contained within *message* if there are no errors reported.
+
+        Large logs get sent in chunks:  The first one (where *message['offset']* matches the start of the requested range) opens the window and the rest get appended to it.  The last chunk will have *message['complete']* set to ``true``.
         */
         var l = go.TermLogging,
             newWindow, goDiv, css, newContent,
@@ -642,6 +648,11 @@ go.Base.update(GateOne.TermLogging, {
             logContainer = u.createElement('div', {'id': 'logview', 'class': '✈terminal', 'style': {'width': '100%', 'height': 'auto', 'right': 0}});
         if (result != "Success") {
             v.displayMessage(gettext("Could not retrieve log: ") + result);
+        } else if (l.flatLogPre && l.flatLogFile == metadata['filename'] && message['offset'] > l.flatLogOffset) {
+            // Another chunk of the log we're already displaying
+            if (logLines.length) {
+                l.flatLogPre.insertAdjacentHTML('beforeend', '\n' + logLines.join('\n'));
+            }
         } else {
             newWindow = window.open('', '_newtab');
             goDiv = u.createElement('div', {'id': go.prefs.goDiv.split('#')[1], 'style': {'width': '100%', 'height': '100%'}}, true);
@@ -661,6 +672,12 @@ go.Base.update(GateOne.TermLogging, {
             logViewContent.appendChild(logContainer);
             goDiv.style['overflow'] = 'visible';
             goDiv.appendChild(logViewContent);
+            l.flatLogPre = logContainer.firstChild;
+            l.flatLogFile = metadata['filename'];
+            l.flatLogOffset = message['offset'];
+        }
+        if (message['complete']) {
+            l.flatLogPre = null; // Done with it
         }
     },
     displayPlaybackLogAction: function(message) {
@@ -692,10 +709,12 @@ go.Base.update(GateOne.TermLogging, {
             }
         }
     },
-    openLogFlat: function(logFile) {
-        /**:GateOne.TermLogging.openLogFlat(logFile)
+    openLogFlat: function(logFile, /*opt*/limit, /*opt*/start, /*opt*/end) {
+        /**:GateOne.TermLogging.openLogFlat(logFile[, limit[, start[, end]]])
 
         Tells the server to open *logFile* for playback via the 'terminal:logging_get_log_flat' server-side WebSocket action (will end up calling :js:meth:`~GateOne.TermLogging.displayFlatLogAction`.
+
+        If *limit* is given only the specified lines will be retrieved.  It works just like MySQL:  "500,100" will skip the first 500 lines and return the next 100.  If *start* and/or *end* (milliseconds since the epoch) are given only what was recorded between those times will be retrieved.
         */
         var theme_css = u.getNode('#'+prefix+'theme').innerHTML,
             colors_css = u.getNode('#'+prefix+'text_colors').innerHTML,
@@ -704,6 +723,15 @@ go.Base.update(GateOne.TermLogging, {
                 'theme_css': theme_css,
                 'colors_css': colors_css
             };
+        if (limit) {
+            message['limit'] = limit;
+        }
+        if (start) {
+            message['start'] = start;
+        }
+        if (end) {
+            message['end'] = end;
+        }
         go.ws.send(JSON.stringify({'terminal:logging_get_log_flat': message}));
         go.Visual.displayMessage(logFile + gettext(' will be opened in a new window when rendering is complete.  Large logs can take some time so please be patient.'));
     },
@@ -743,6 +771,49 @@ go.Base.update(GateOne.TermLogging, {
         go.ws.send(JSON.stringify({'terminal:logging_get_log_file': message}));
         go.Visual.displayMessage(logFile + gettext(' will be downloaded when rendering is complete.  Large logs can take some time so please be patient.'));
     },
+    search: function(query, /*opt*/limit) {
+        /**:GateOne.TermLogging.search(query[, limit])
+
+        Asks the server to search the text of all the user's session logs for *query* via the 'terminal:logging_search' WebSocket action.  The results will be handled by :js:meth:`~GateOne.TermLogging.searchResultsAction`.  No more than *limit* matching lines will be returned (default: 100).
+        */
+        var message = {'query': query};
+        if (limit) {
+            message['limit'] = limit;
+        }
+        go.ws.send(JSON.stringify({'terminal:logging_search': message}));
+    },
+    searchResultsAction: function(message) {
+        /**:GateOne.TermLogging.searchResultsAction(message)
+
+        Handles the 'terminal:logging_search_results' WebSocket action by triggering the "terminal:logging_search_results" event with *message* which looks like this::
+
+            {'query': 'rm -rf', 'results': [
+                {'log': '20140228101504012345-10.1.1.100.golog', 'matches': [
+                    {'frame': 1234, 'time': 1393603310123, 'line': 'user@host:~ $ rm -rf foo'}
+                ]}
+            ]}
+
+        The 'frame' of each match is where it appeared in the log's playback.
+        */
+        logDebug("searchResultsAction() query: " + message.query);
+        E.trigger("terminal:logging_search_results", message);
+    },
+    exportLogs: function(/*opt*/settings) {
+        /**:GateOne.TermLogging.exportLogs([settings])
+
+        Asks the server to render session logs as self-contained HTML playback files (on the server) via the 'terminal:logging_export_logs' WebSocket action.  Requires the 'export_logs' policy.  *settings* may contain 'users' (an Array), 'start' and 'end' (milliseconds since the epoch), 'theme', 'colors', and 'processes'.  When complete :js:meth:`~GateOne.TermLogging.exportCompleteAction` will be called.
+        */
+        go.ws.send(JSON.stringify({'terminal:logging_export_logs': settings || {}}));
+    },
+    exportCompleteAction: function(message) {
+        /**:GateOne.TermLogging.exportCompleteAction(message)
+
+        Handles the 'terminal:logging_export_complete' WebSocket action by triggering the "terminal:logging_export_complete" event with *message* which looks like this::
+
+            {'output_dir': '/opt/gateone/users/admin@company/exports/20140228101504', 'exported': 123, 'errors': []}
+        */
+        E.trigger("terminal:logging_export_complete", message);
+    },
     sortFunctions: {
         /**:GateOne.TermLogging.sortFunctions
 
@@ -224,6 +224,7 @@ def openssh_connect(
         randomart=False,
         identities=None,
         additional_args=None,
+        persist=None,
         debug=False):
     """
     Starts an interactive SSH session to the given host as the given user on the
@@ -241,7 +242,16 @@ def openssh_connect(
     If *socket* (a file path) is given, this will be passed to the SSH command
     as -S<socket>.  If the socket does not exist, ssh's Master mode switch will
     be set (-M) automatically.  This allows sessions to be duplicated
-    automatically.
+    automatically.  The special string %SHORT_USER% in *socket* will be
+    replaced with a short hash of the Gate One user (so a socket can be shared
+    by all of a user's sessions).
+
+    If *persist* is given (seconds) ssh will be told to use ``ControlMaster=auto``
+    and ``ControlPersist=<persist>`` with *socket* instead of -M.  The first
+    connection to a given user@host:port becomes the master and it will stay
+    up (in the background) until it has gone unused for *persist* seconds.
+    Every terminal connecting to the same place in the meantime will
+    piggyback on it instead of performing its own handshake.
 
     If *sshfp* resolves to True, SSHFP (DNS-based host verification) support
     will be enabled.
@@ -381,15 +391,23 @@ def openssh_connect(
         user_at_host_port = "%s@%s:%s" % (user, host, port)
         hashed = short_hash(user_at_host_port)
         socket_path = socket_path.replace(r'%SHORT_SOCKET%', hashed)
-        if not os.path.exists(socket_path):
+        hashed_user = short_hash(go_user)
+        socket_path = socket_path.replace(r'%SHORT_USER%', hashed_user)
+        if persist:
+            # ssh will figure out whether or not to become the master (and
+            # clean up stale sockets) all by itself:
+            args.insert(0, "-oControlPersist=%s" % persist)
+            args.insert(0, "-oControlMaster=auto")
+        elif not os.path.exists(socket_path):
             args.insert(0, "-M")
-        else:
+        if os.path.exists(socket_path):
             print("\x1b]0;%s@%s (child)\007" % (user, host))
             print(_(
                 "\x1b]_;notice|Existing ssh session detected for ssh://%s@%s:%s;"
                 " utilizing existing tunnel.\007" % (user, host, port)
             ))
         socket = socket.replace(r'%SHORT_SOCKET%', hashed)
+        socket = socket.replace(r'%SHORT_USER%', hashed_user)
         socket_arg = "-S'%s'" % socket
         # Also make sure the base directory exists
         basedir = os.path.split(socket)[0]
@@ -678,6 +696,14 @@ def main():
               "mode and 'man ssh')."),
         metavar="'<filepath>'"
     )
+    parser.add_option("--persist",
+        dest="persist",
+        default=None,
+        help=_("Keep the master connection (see -S) open in the background "
+              "for this many seconds after it was last used (see "
+              "ControlPersist in 'man ssh_config')."),
+        metavar="'<seconds>'"
+    )
     parser.add_option("--sshfp",
         dest="sshfp",
         default=False,
@@ -743,6 +769,7 @@ def main():
                     identities=parsed.get('identities', []),
                     additional_args=options.additional_args,
                     socket=options.socket,
+                    persist=options.persist,
                     debug=parsed.get('debug', False)
                 )
         elif len(args) == 2: # No port given, assume 22
@@ -751,7 +778,8 @@ def main():
                 sshfp=options.sshfp,
                 randomart=options.randomart,
                 additional_args=options.additional_args,
-                socket=options.socket
+                socket=options.socket,
+                persist=options.persist
             )
         elif len(args) == 3:
             openssh_connect(args[0], args[1], args[2],
@@ -759,7 +787,8 @@ def main():
                 sshfp=options.sshfp,
                 randomart=options.randomart,
                 additional_args=options.additional_args,
-                socket=options.socket
+                socket=options.socket,
+                persist=options.persist
             )
     except Exception:
         pass # Something ain't right.  Try the interactive entry method...
@@ -895,6 +924,7 @@ def main():
                 identities=identities,
                 additional_args=options.additional_args,
                 socket=options.socket,
+                persist=options.persist,
                 debug=debug
             )
         elif protocol == 'telnet':
@@ -47,6 +47,7 @@ __author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
 import os, re, io
 from datetime import datetime, timedelta
 from functools import partial
+from collections import deque
 
 # Our stuff
 from gateone.core.server import BaseHandler
@@ -66,7 +67,11 @@ ssh_log = go_logger("gateone.terminal.ssh", plugin='ssh')
 OPENSSH_VERSION = None
 DROPBEAR_VERSION = None
 PLUGIN_PATH = os.path.split(__file__)[0] # Path to this plugin's directory
-OPEN_SUBCHANNELS = {}
+OPEN_SUBCHANNELS = {} # Keyed by the (master's) SSH socket path or pool_ref()
+# Commands waiting their turn on a (shared) sub-channel:
+COMMAND_QUEUES = {} # <Multiplex> -> deque([(self, term, cmd, callback), ...])
+# Tracks which terminals are using which master connections (for sharing):
+SSH_POOL = {} # (upn, 'user@host:port') -> {'socket': path, 'terms': set()}
 SUBCHANNEL_TIMEOUT = timedelta(minutes=5) # How long to wait before auto-closing
 READY_STRING = "GATEONE_SSH_EXEC_CMD_CHANNEL_READY"
 READY_MATCH = re.compile("^%s$" % READY_STRING, re.MULTILINE)
@@ -135,6 +140,16 @@ def get_ssh_dir(self):
                 "Using the .ssh directory." % user))
     return users_ssh_dir
 
+def get_ssh_socket(self, term):
+    """
+    Returns the path to the (master's) SSH control socket *term* is using or
+    `None` if it isn't using one.
+    """
+    socket_path = self.loc_terms.get(int(term), {}).get('ssh_socket', None)
+    if not socket_path or socket_path == 'None':
+        return None # ssh_connect.py was called without -S
+    return socket_path
+
 def open_sub_channel(self, term):
     """
     Opens a sub-channel of communication by executing a new shell on the SSH
@@ -142,12 +157,20 @@ def open_sub_channel(self, term):
     capability (it spawns a new slave) and returns the resulting
     :class:`termio.Multiplex` instance.  If a slave has already been opened for
     this purpose it will re-use the existing channel.
+
+    .. note:: Sub-channels are keyed by the master's socket so all terminals connected to the same user@host:port (via the same pooled master) share a single sub-channel.  That's why :func:`execute_command` runs one command at a time per sub-channel.  Terminals that aren't using a control socket get a sub-channel of their own.
     """
     term = int(term)
     global OPEN_SUBCHANNELS
-    if term in OPEN_SUBCHANNELS and OPEN_SUBCHANNELS[term].isalive():
-        # Use existing sub-channel (much faster this way)
-        return OPEN_SUBCHANNELS[term]
+    socket_path = get_ssh_socket(self, term)
+    if socket_path:
+        channel_key = socket_path
+    else: # Nothing to share
+        channel_key = pool_ref(self, term)
+    if channel_key in OPEN_SUBCHANNELS:
+        if OPEN_SUBCHANNELS[channel_key].isalive():
+            # Use existing sub-channel (much faster this way)
+            return OPEN_SUBCHANNELS[channel_key]
     self.ssh_log.info("Opening SSH sub-channel", metadata={'term': term})
     # NOTE: When connecting a slave via ssh you can't tell it to execute a
     # command like you normally can (e.g. 'ssh user@host <some command>').  This
@@ -158,15 +181,11 @@ def open_sub_channel(self, term):
     if not session_path:
         raise SSHMultiplexingException(_(
             "SSH Plugin: Unable to open slave sub-channel."))
-    socket_path = self.loc_terms[term]['ssh_socket']
     # Interesting: When using an existing socket you don't need to give it all
     # the same options as you used to open it but you still need to give it
     # *something* in place of the hostname or it will report a syntax error and
     # print out the help.  So that's why I've put 'go_ssh_remote_cmd' below.
     # ...but I could have just used 'foo' :)
-    if not socket_path:
-        raise SSHMultiplexingException(_(
-            "SSH Plugin: Unable to open slave sub-channel."))
     users_ssh_dir = get_ssh_dir(self)
     ssh_config_path = os.path.join(users_ssh_dir, 'config')
     if not os.path.exists(ssh_config_path):
@@ -176,9 +195,11 @@ def open_sub_channel(self, term):
     # Hopefully 'go_ssh_remote_cmd' will be a clear enough indication of
     # what is going on by anyone that has to review the logs...
     ssh = which('ssh')
-    ssh_command = "%s -x -S'%s' -F'%s' go_ssh_remote_cmd" % (
-        ssh, socket_path, ssh_config_path)
-    OPEN_SUBCHANNELS[term] = m = self.new_multiplex(
+    ssh_command = "%s -x -F'%s' go_ssh_remote_cmd" % (ssh, ssh_config_path)
+    if socket_path:
+        ssh_command = "%s -x -S'%s' -F'%s' go_ssh_remote_cmd" % (
+            ssh, socket_path, ssh_config_path)
+    OPEN_SUBCHANNELS[channel_key] = m = self.new_multiplex(
         ssh_command, "%s (sub)" % term)
     # Using huge numbers here so we don't miss much (if anything) if the user
     # executes something like "ps -ef".
@@ -237,8 +258,11 @@ def get_cmd_output(term, errorback, callback, m_instance, matched):
         timeout=SUBCHANNEL_TIMEOUT)
     m_instance.scheduler.start() # To ensure the timeout occurs
     cmd_out = "\n".join(out)
-    if callback:
-        callback(cmd_out, None)
+    try:
+        if callback:
+            callback(cmd_out, None)
+    finally:
+        run_next_command(m_instance)
 
 def terminate_sub_channel(m_instance):
     """
@@ -248,9 +272,10 @@ def terminate_sub_channel(m_instance):
         "Closing SSH sub-channel", metadata={'term': repr(m_instance.term_id)})
     global OPEN_SUBCHANNELS
     m_instance.terminate()
+    COMMAND_QUEUES.pop(m_instance, None)
     # Find the Multiplex object inside of OPEN_SUBCHANNELS and remove it
     for key, value in list(OPEN_SUBCHANNELS.items()):
-        # This will be something like: {1: <Multiplex instance>}
+        # This will be something like: {'/path/to/socket': <Multiplex>}
         if hash(value) == hash(m_instance):
             # This is necessary so the interpreter can properly collect garbage:
             del OPEN_SUBCHANNELS[key]
@@ -275,7 +300,12 @@ def got_error(self, m_instance, match=None, term=None, cmd=None):
         "%s: Got an error trying to capture output inside of "
         "execute_command() running: %s" % (m_instance.user, m_instance.cmd)))
     self.ssh_log.debug("output before error: %s" % m_instance.dump())
+    # The first command in the queue is the one that failed
+    pending = list(COMMAND_QUEUES.get(m_instance, []))[1:]
     terminate_sub_channel(m_instance)
+    # Anything that was waiting its turn gets a fresh sub-channel
+    for args in pending:
+        execute_command(*args)
     if self:
         message = {
             'terminal:sshjs_cmd_output': {
@@ -300,6 +330,9 @@ def execute_command(self, term, cmd, callback=None):
     If *callback* is not provided then the command will be executed and any
     output will be ignored.
 
+    If another command is already running on the same sub-channel *cmd* will
+    be run once that one completes (or times out).
+
     .. note:: This will not result in a new terminal being opened on the client--it simply executes a command and returns the result using the existing SSH tunnel.
     """
     self.ssh_log.info(
@@ -325,6 +358,18 @@ def execute_command(self, term, cmd, callback=None):
         except: # This is really just a last-ditch thing
             pass
         return
+    # Sub-channels can be shared so only one command gets to run at a time
+    queue = COMMAND_QUEUES.setdefault(m, deque())
+    queue.append((self, term, cmd, callback))
+    if len(queue) == 1: # Nothing else running
+        run_command(m, self, term, cmd, callback)
+
+def run_command(m, self, term, cmd, callback):
+    """
+    Runs *cmd* on the sub-channel, *m* (see :func:`execute_command`).  When
+    it's done (or fails) the next command waiting in `COMMAND_QUEUES` will be
+    run.
+    """
     # NOTE: We can assume the IOLoop is started and automatically calling read()
     m.unexpect() # Clear out any existing patterns (if existing sub-channel)
     m.term.clear_screen() # Clear the screen so nothing mucks up our regexes
@@ -340,6 +385,20 @@ def execute_command(self, term, cmd, callback=None):
     self.ssh_log.debug("Waiting for READY_MATCH inside execute_command()")
     m.writeline(u'echo -e "\\n%s"' % READY_STRING)
 
+def run_next_command(m_instance):
+    """
+    Removes the command that just finished from the front of *m_instance*'s
+    queue (in `COMMAND_QUEUES`) and runs the next one (if any).
+    """
+    queue = COMMAND_QUEUES.get(m_instance)
+    if not queue:
+        return
+    queue.popleft()
+    if queue:
+        run_command(m_instance, *queue[0])
+    else:
+        del COMMAND_QUEUES[m_instance]
+
 def send_result(self, term, cmd, output, m_instance):
     """
     Called by :func:`ws_exec_command` when the output of the executed command
@@ -484,6 +543,68 @@ def save_known_hosts(self, known_hosts):
             "An error was encountered trying to save the known_hosts file.  "
             "See server logs for details."))
 
+def pool_ref(self, term):
+    """
+    Returns the reference we use to keep track of *term* inside of `SSH_POOL`
+    (terminal numbers alone aren't unique across sessions).
+    """
+    return (self.ws.session, self.ws.location, int(term))
+
+def attach_to_pool(self, term):
+    """
+    Records that *term* is connected via the master (ControlMaster) SSH
+    connection it told us about (via the 'ssh_socket' and 'connect_string'
+    escape sequences).  Masters are tracked per (user, user@host:port).
+
+    .. note:: The master connections themselves are managed by ssh (see the `--persist` option to ssh_connect.py); this just keeps track of who is using them.
+    """
+    term = int(term)
+    term_obj = self.loc_terms.get(term, {})
+    connect_string = term_obj.get('ssh_connect_string', None)
+    socket_path = get_ssh_socket(self, term)
+    if not connect_string or not socket_path:
+        return # Haven't heard about both yet
+    detach_from_pool(self, term) # In case it was connected elsewhere before
+    key = (self.current_user['upn'], connect_string)
+    entry = SSH_POOL.setdefault(key, {'socket': socket_path, 'terms': set()})
+    entry['socket'] = socket_path
+    entry['terms'].add(pool_ref(self, term))
+    self.ssh_log.debug(
+        "%s now has %s terminal(s) attached" % (
+            connect_string, len(entry['terms'])), metadata={'term': term})
+
+def detach_from_pool(self, term):
+    """
+    Removes *term* from `SSH_POOL` (along with any pool entries that no longer
+    have any terminals).
+
+    .. note:: If ``ControlPersist`` is in use the master connection will stick around for a while after the last terminal closes.  A terminal that connects in the meantime will re-use it (ssh takes care of that) and be added back to the pool.
+    """
+    ref = pool_ref(self, term)
+    for key, entry in list(SSH_POOL.items()):
+        entry['terms'].discard(ref)
+        if not entry['terms']:
+            del SSH_POOL[key]
+
+def get_pool_info(self, term):
+    """
+    Returns a dict describing the pooled master connection used by *term*
+    like so::
+
+        {'socket': <path>, 'terminals': <number of terms using it>,
+         'connected': <True if the master is up>}
+
+    Returns `None` if *term* isn't using a pooled connection.
+    """
+    ref = pool_ref(self, term)
+    for key, entry in list(SSH_POOL.items()):
+        if ref in entry['terms']:
+            return {
+                'socket': entry['socket'],
+                'terminals': len(entry['terms']),
+                'connected': os.path.exists(entry['socket']),
+            }
+
 def get_connect_string(self, term):
     """
     Attached to the (server-side) `terminal:ssh_get_connect_string` WebSocket
@@ -495,6 +616,9 @@ def get_connect_string(self, term):
     In ssh.js we attach a WebSocket action to 'terminal:sshjs_reconnect'
     that assigns the connection string sent by this function to
     `GateOne.Terminal.terminals[*term*]['sshConnectString']`.
+
+    If *term* is using a pooled master connection the message will also
+    include a 'pool' (see :func:`get_pool_info`).
     """
     # This is the first function that normally gets called when a user uses SSH
     # so it's a good time to update the logger with extra metadata
@@ -509,7 +633,8 @@ def get_connect_string(self, term):
         message = {
             'terminal:sshjs_reconnect': {
                 'term': term,
-                'connect_string': connect_string
+                'connect_string': connect_string,
+                'pool': get_pool_info(self, term)
             }
         }
         self.write_message(message)
@@ -1109,6 +1234,7 @@ def set_ssh_socket(self, term, path):
     if term in self.loc_terms:
         self.loc_terms[term]['ssh_socket'] = path
         self.save_term_settings(term, {'ssh_socket': path})
+        attach_to_pool(self, term)
 
 def set_ssh_connect_string(self, term, connect_string):
     """
@@ -1121,6 +1247,7 @@ def set_ssh_connect_string(self, term, connect_string):
     if term in self.loc_terms:
         self.loc_terms[term]['ssh_connect_string'] = connect_string
         self.save_term_settings(term, {'ssh_connect_string': connect_string})
+        attach_to_pool(self, term)
     message = {'terminal:sshjs_connect': connect_string}
     self.write_message(message)
 
@@ -1208,6 +1335,8 @@ def initialize(self):
     # the 'Events' hook.  I think this way is better since it is more explicit.
     self.on('terminal:authenticate', bind(send_ssh_css_template, self))
     self.on('terminal:authenticate', bind(create_user_ssh_dir, self))
+    self.on(['terminal:term_ended', 'terminal:kill_terminal'],
+        bind(detach_from_pool, self))
 
 hooks = {
     #'Web': [(r"/ssh", KnownHostsHandler)],
@@ -1053,11 +1053,14 @@ go.Base.update(go.SSH, {
 
         Handles the `terminal:sshjs_reconnect` WebSocket action which should provide an object containing each terminal's SSH connection string.  Example *message*::
 
-            {"term": 1, "connect_string": "user@host1:22"}
+            {"term": 1, "connect_string": "user@host1:22", "pool": {"socket": "/tmp/gateone/ssh_pool/UisnajVr/caD-p7Mi", "terminals": 2, "connected": true}}
+
+        The 'pool' (if present) describes the shared master connection the terminal is using and will be stored in `GateOne.Terminal.terminals[term]['sshPool']`.
         */
         var term = message['term'];
         if (t.terminals[term]) {
             t.terminals[term]['sshConnectString'] = message['connect_string'];
+            t.terminals[term]['sshPool'] = message['pool'] || null;
         }
     },
     keygenComplete: function(message) {
@@ -251,7 +251,8 @@ def terminal_policies(cls):
         'reset_terminal': policy_write_check_arg,
         'manual_title': policy_write_check_dict,
         'share_terminal': policy_share_terminal,
-        'char_handler': policy_char_handler
+        'char_handler': policy_char_handler,
+        'checked_char_handler': policy_char_handler
     }
     auth_log = instance.ws.auth_log
     user = instance.current_user
@@ -408,6 +408,7 @@ go.Base.update(GateOne.Terminal, {
         go.Net.addAction('terminal:colors_list', go.Terminal.enumerateColorsAction);
         go.Net.addAction('terminal:terminals', go.Terminal.reattachTerminalsAction);
         go.Net.addAction('terminal:termupdate', go.Terminal.updateTerminalAction);
+        go.Net.addAction('terminal:scrollback', go.Terminal.scrollbackAction);
         go.Net.addAction('terminal:set_title', go.Terminal.setTitleAction);
         go.Net.addAction('terminal:resize', go.Terminal.resizeAction);
         go.Net.addAction('terminal:term_ended', go.Terminal.closeTerminal);
@@ -839,6 +840,23 @@ go.Base.update(GateOne.Terminal, {
         */
         go.ws.send(JSON.stringify({'terminal:full_refresh': term}));
     },
+    getScrollback: function(term, start, end, /*opt*/format) {
+        /**:GateOne.Terminal.getScrollback(term, start, end[, format])
+
+        Asks the Gate One server for the lines from *start* to *end* in the scrollback history of the given *term*.  *start* and *end* work like Python slices (e.g. ``-100, null`` means "the last 100 lines").  *format* may be 'html' (default) or 'text'.
+
+        The lines will arrive via the `terminal:scrollback` WebSocket action which triggers the "terminal:scrollback" event (see :js:meth:`GateOne.Terminal.scrollbackAction`).
+        */
+        go.ws.send(JSON.stringify({'terminal:get_scrollback': {
+            'term': term, 'start': start, 'end': end, 'format': format || 'html'}}));
+    },
+    scrollbackAction: function(message) {
+        /**:GateOne.Terminal.scrollbackAction(message)
+
+        Attached to the `terminal:scrollback` WebSocket action; triggers the "terminal:scrollback" event with the *message* (which contains 'term', 'start', 'total', 'lines', and 'format') so that whatever requested the lines (via :js:meth:`GateOne.Terminal.getScrollback`) can display them.
+        */
+        E.trigger("terminal:scrollback", message);
+    },
     loadFont: function(font, /*opt*/size) {
         /**:GateOne.Terminal.loadFont(font[, size])
 
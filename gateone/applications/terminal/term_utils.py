@@ -13,17 +13,18 @@ __license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
 __author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
 
 # Standard library imports
-import os, io, re
+import os, io, tempfile
+from datetime import timedelta
 
 # Gate One imports
 from gateone.core.utils import json_encode
-from gateone.core.configuration import RUDict
 from gateone.core.locale import get_translation
 from gateone.core.log import go_logger
 
 # 3rd party imports
 from tornado.escape import json_decode
 from tornado.options import options
+from tornado.ioloop import IOLoop
 
 APPLICATION_PATH = os.path.split(__file__)[0] # Path to our application
 term_log = go_logger("gateone.terminal")
@@ -31,29 +32,142 @@ term_log = go_logger("gateone.terminal")
 # Localization support
 _ = get_translation()
 
+class TermSettingsStore(object):
+    """
+    An in-memory copy of the 'term_settings.json' file inside of a user's
+    session directory.  Updates are applied to the in-memory copy immediately
+    and coalesced into a single (atomic) write of the file at most once every
+    *interval* milliseconds.
+
+    .. note::
+
+        Use `get_term_settings_store` to get the (shared) instance for a given
+        session instead of creating these directly.
+    """
+    def __init__(self, session, interval=1000, io_loop=None):
+        self.session = session
+        self.session_dir = os.path.join(options.session_dir, session)
+        self.path = os.path.join(self.session_dir, 'term_settings.json')
+        self.interval = timedelta(milliseconds=interval)
+        self.io_loop = io_loop or IOLoop.current()
+        self.settings = None # Gets loaded from self.path on first use
+        self.dirty = False
+        self.timeout = None
+
+    def load(self):
+        """
+        Returns the settings dict (reading it from disk if this is the first
+        time it has been requested).
+        """
+        if self.settings is not None:
+            return self.settings
+        self.settings = {}
+        if not os.path.exists(self.path):
+            return self.settings
+        with io.open(self.path, encoding='utf-8') as f:
+            try:
+                self.settings = json_decode(f.read())
+            except ValueError:
+                # Something wrong with the file.  Remove it
+                term_log.error(_(
+                    "Error decoding {0}.  File will be removed.").format(
+                        self.path))
+                os.remove(self.path)
+        return self.settings
+
+    def update(self, location, term, settings):
+        """
+        Updates the settings of the given *term* at *location* with *settings*
+        and schedules a write.
+        """
+        term_settings = self.load().setdefault(location, {})
+        term_settings.setdefault(term, {}).update(settings)
+        self.schedule()
+
+    def remove(self, location, term):
+        """
+        Removes the settings associated with the given *term* at *location* (if
+        any) and schedules a write.
+        """
+        term_settings = self.load().get(location, {})
+        if term in term_settings:
+            del term_settings[term]
+            self.schedule()
+
+    def schedule(self):
+        """
+        Marks the settings as changed and makes sure a `flush` is scheduled.
+        """
+        self.dirty = True
+        if not self.timeout:
+            self.timeout = self.io_loop.add_timeout(self.interval, self.flush)
+
+    def flush(self):
+        """
+        Writes the settings to disk (if anything changed since the last time).
+        The file is written to a temporary location first and then renamed so
+        it is never left half-written.
+        """
+        if self.timeout:
+            self.io_loop.remove_timeout(self.timeout)
+            self.timeout = None
+        if not self.dirty:
+            return
+        self.dirty = False
+        if not os.path.isdir(self.session_dir):
+            return # Session was cleaned up already
+        fd, temp_path = tempfile.mkstemp(
+            prefix='.term_settings', dir=self.session_dir)
+        try:
+            with io.open(fd, 'w', encoding='utf-8') as f:
+                f.write(json_encode(self.settings))
+            os.rename(temp_path, self.path)
+        except (IOError, OSError) as e:
+            term_log.error(_("Could not save {0}: {1}").format(self.path, e))
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+SETTINGS_STORES = {} # {<session ID>: <TermSettingsStore>}
+
+def get_term_settings_store(session, interval=1000):
+    """
+    Returns the `TermSettingsStore` for the given *session* (creating it if
+    necessary).  The *interval* only applies to newly-created stores.
+    """
+    store = SETTINGS_STORES.get(session)
+    if not store:
+        store = SETTINGS_STORES[session] = TermSettingsStore(
+            session, interval=interval)
+    return store
+
+def flush_term_settings(session=None):
+    """
+    Immediately writes any pending changes to 'term_settings.json' for the
+    given *session* and forgets about its `TermSettingsStore`.  If no *session*
+    is given all stores will be flushed (e.g. when Gate One is shutting down).
+    """
+    if session:
+        sessions = [session]
+    else:
+        sessions = list(SETTINGS_STORES.keys())
+    for session in sessions:
+        store = SETTINGS_STORES.pop(session, None)
+        if store:
+            store.flush()
+
 def save_term_settings(term, location, session, settings):
     """
     Saves the *settings* associated with the given *term*, *location*, and
     *session* in the 'term_settings.json' file inside the user's session
     directory.
 
-    When complete the given *callback* will be called (if given).
+    The settings are updated in memory right away but the file itself only
+    gets written periodically (see `TermSettingsStore`).
     """
     if not session:
         return # Just a viewer of a broadcast terminal
     term = str(term) # JSON wants strings as keys
-    term_settings = RUDict()
-    term_settings[location] = {term: settings}
-    session_dir = options.session_dir
-    session_dir = os.path.join(session_dir, session)
-    settings_path = os.path.join(session_dir, 'term_settings.json')
-    # First we read in the existing settings and then update them.
-    if os.path.exists(settings_path):
-        with io.open(settings_path, encoding='utf-8') as f:
-            term_settings.update(json_decode(f.read()))
-        term_settings[location][term].update(settings)
-    with io.open(settings_path, 'w', encoding='utf-8') as f:
-        f.write(json_encode(term_settings))
+    get_term_settings_store(session).update(location, term, settings)
 
 def restore_term_settings(location, session):
     """
@@ -62,22 +176,7 @@ def restore_term_settings(location, session):
     """
     if not session:
         return # Just a viewer of a broadcast terminal
-    session_dir = options.session_dir
-    session_dir = os.path.join(session_dir, session)
-    settings_path = os.path.join(session_dir, 'term_settings.json')
-    if not os.path.exists(settings_path):
-        return # Nothing to do
-    with io.open(settings_path, encoding='utf-8') as f:
-        try:
-            settings = json_decode(f.read())
-        except ValueError:
-            # Something wrong with the file.  Remove it
-            term_log.error(_(
-                "Error decoding {0}.  File will be removed.").format(
-                    settings_path))
-            os.remove(settings_path)
-            return {}
-    return settings
+    return get_term_settings_store(session).load()
 
 def capture_stream(self, term, stream=None):
     """
@@ -88,18 +187,9 @@ def capture_stream(self, term, stream=None):
     This function gets assigned to the "terminal:refresh_screen" event (that's
     how it works).
     """
-    esc_sequence = re.compile( # Behold my regex-fu!
-        r'\x1b(.*\x1b\\|[ABCDEFGHIJKLMNOQRSTUVWXYZa-z0-9=]|[()# %*+].)')
-    csi_sequence = re.compile(r'\x1b\[([?A-Za-z0-9;@:\!]*?)([A-Za-z@_])')
-    title_sequence = re.compile(r'\x1b\][0-2]\;(.*?)(\x07|\x1b\\)')
-    specials = re.compile(r'[\x7f\x08]')
     if stream:
-        # Remove formatting and other unnecessary escape sequences
-        stream = stream.decode('utf-8') # Make it a proper unicode string
-        stream = title_sequence.sub('', stream) # Remove terminal title seq
-        stream = esc_sequence.sub('', stream) # Remove regular esc sequences
-        stream = csi_sequence.sub('', stream) # Remove formatting sequences
-        stream = specials.sub('', stream) # Backspace chars and newlines
-        stream = stream.replace('\r\n', '\n') # Fix ^M
+        # Remove formatting and other unnecessary escape sequences (the
+        # extractor takes care of anything that gets split between chunks)
         term_obj = self.loc_terms[term]
+        stream = term_obj["capture"]["extractor"].feed(stream)
         term_obj["capture"]["output"].write(stream)
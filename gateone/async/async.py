@@ -18,6 +18,8 @@ except ImportError:
     sys.exit(1)
 import pickle, signal, os, logging
 from functools import wraps
+from heapq import heappush, heappop
+from threading import Timer, Lock, RLock
 from datetime import datetime, timedelta
 from itertools import count
 from collections import Iterable
@@ -32,6 +34,7 @@ _ = get_translation()
 
 # A global to old memoized results (so multiple instances can share)
 MEMO = {}
+MEMO_STATS = {'hits': 0, 'misses': 0} # How often MEMO saved us a call
 PID = os.getpid() # So we can tell if we're in the parent process or not
 ONE_CALLS = {} # Tracks functions in progress for call_singleton()
 
@@ -131,7 +134,7 @@ def _call_complete(self, identifier, f=None):
             if not self.running: # Just in case (it happens, actually)
                 self.run()
             self.restart_shutdown_timeout()
-            future = self.executor.submit(safe_call, function, *args, **kwargs)
+            future = self.submit(function, *args, **kwargs)
             ONE_CALLS[identifier]['future'] = future
             exception = future.exception()
             if exception:
@@ -193,6 +196,10 @@ class AsyncRunner(object):
         self.interval = kwargs.pop('interval', None)
         if not self.interval:
             self.interval = "30s"
+        # For keeping track of how many calls are queued/running (see pending)
+        self.submitted = 0
+        self.completed = 0
+        self._completed_lock = Lock()
         global MEMO # Use a global so that instances can share the cache
         if not MEMO:
             MEMO = AutoExpireDict(timeout=self.timeout, interval=self.interval)
@@ -212,6 +219,33 @@ class AsyncRunner(object):
         """
         raise NotImplementedError
 
+    @property
+    def pending(self):
+        """
+        The number of calls that have been submitted to the executor that
+        haven't completed yet (i.e. the depth of the queue).
+        """
+        return self.submitted - self.completed
+
+    def _task_done(self, future):
+        """
+        Increments `self.completed`.  Called (possibly from another thread) when
+        a *future* created by `submit` is done.
+        """
+        with self._completed_lock:
+            self.completed += 1
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Submits *function* to the executor (wrapped in `safe_call`) with the
+        given *args* and *kwargs* and returns the resulting future.  All calls
+        to the executor go through here so `pending` stays accurate.
+        """
+        future = self.executor.submit(safe_call, function, *args, **kwargs)
+        self.submitted += 1
+        future.add_done_callback(self._task_done)
+        return future
+
     def shutdown(self, wait=False):
         """
         Calls :meth:`self.executor.shutdown(wait)` and removes and waiting
@@ -265,13 +299,15 @@ class AsyncRunner(object):
             if kwargs:
                 string += pickle.dumps(kwargs, 0)
             if string and string in MEMO:
+                MEMO_STATS['hits'] += 1
                 f = futures.Future() # Emulate a completed Future()
                 if callback:
                     f.set_result(callback(MEMO[string]))
                 else:
                     f.set_result(MEMO[string])
                 return f
-        future = self.executor.submit(safe_call, function, *args, **kwargs)
+            MEMO_STATS['misses'] += 1
+        future = self.submit(function, *args, **kwargs)
         if callback:
             done_callback(future, lambda f: callback(f.result()))
         if memoize:
@@ -301,7 +337,7 @@ class AsyncRunner(object):
                 (function, args, kwargs, callback))
         else:
             from collections import deque
-            future = self.executor.submit(safe_call, function, *args, **kwargs)
+            future = self.submit(function, *args, **kwargs)
             ONE_CALLS[identifier] = {
                 'future': future,
                 'queue': deque()
@@ -329,8 +365,7 @@ class AsyncRunner(object):
         callback = kwargs.pop('callback', None)
         futures = []
         for i in iterables:
-            futures.append(self.executor.submit(
-                safe_call, function, i, **kwargs))
+            futures.append(self.submit(function, i, **kwargs))
         if callback:
             callback_when_complete(futures, callback)
         return futures
@@ -647,6 +682,8 @@ class Schedule(object):
         'years', 'months', 'days', 'hours', 'minutes', 'seconds', 'weekdays']
     def __init__(self, funcs, identifier, repeat=0, **kwargs):
         self.last_ran = None
+        self.next_run_time = None # Set by the Scheduler
+        self.scheduler = None # The Scheduler this schedule belongs to (if any)
         self.identifier = identifier
         self.repeat = repeat
         if not isinstance(funcs, list):
@@ -706,8 +743,60 @@ class Schedule(object):
                 setattr(self, key, Every(**{key: value}))
             else:
                 raise TypeError("Invalid keyword: %s" % key)
+        if self.scheduler:
+            # Our next run time just changed
+            self.scheduler._push(self)
         return self
 
+    def next_run(self, after=None):
+        """
+        Returns a `datetime.datetime` object representing the next time this
+        schedule should run after *after* (defaults to now).  Returns ``None``
+        if that will never happen (e.g. February 31st).
+
+        Like cron (but with seconds) schedules run on whole seconds.
+        """
+        if after is None:
+            after = datetime.now()
+        when = after.replace(microsecond=0) + timedelta(seconds=1)
+        fields = {}
+        for attr in self.valid_attrs:
+            value = getattr(self, attr)
+            if isinstance(value, Every):
+                # Can't run until the interval has passed
+                due = value.last_run + timedelta(seconds=value.interval)
+                if due.microsecond:
+                    due = due.replace(microsecond=0) + timedelta(seconds=1)
+                when = max(when, due)
+                value = None
+            elif isinstance(value, MatchAll):
+                value = None
+            fields[attr] = value # None means "match anything"
+        months, days, weekdays = (
+            fields['months'], fields['days'], fields['weekdays'])
+        hours, minutes, seconds = (
+            fields['hours'], fields['minutes'], fields['seconds'])
+        # Skip ahead by the largest amount possible until everything matches
+        give_up = when + timedelta(days=366*5)
+        while when < give_up:
+            if months and when.month not in months:
+                year, month = divmod(when.month, 12) # Next month
+                when = datetime(when.year + year, month + 1, 1)
+            elif ((days and when.day not in days) or
+                (weekdays and when.isoweekday() not in weekdays)):
+                when = datetime(when.year, when.month, when.day)
+                when += timedelta(days=1)
+            elif hours and when.hour not in hours:
+                when = when.replace(minute=0, second=0)
+                when += timedelta(hours=1)
+            elif minutes and when.minute not in minutes:
+                when = when.replace(second=0) + timedelta(minutes=1)
+            elif seconds and when.second not in seconds:
+                when += timedelta(seconds=1)
+            else:
+                return when
+        return None
+
     def __call__(self):
         """
         Calls all the functions inside of ``self.funcs``.
@@ -734,12 +823,18 @@ class Schedule(object):
 class Scheduler(object):
     """
     A class that can be used to schedule tasks to run at specific days/times
-    (like cron).  It creates a `PeriodicCallback` using the (optional)
-    *interval* and calls each scheduled function if it's time has come.
+    (like cron).  It keeps track of when each scheduled task needs to run next
+    and only wakes up (via a single `~tornado.ioloop.IOLoop` timeout) when the
+    earliest of them is due.  So if nothing is due nothing happens.
 
     If no *runner* is provided, tasks executed by the scheduler will be run via
     an internal instance of `ThreadedRunner` which will default to using 10
     workers.
+
+    .. note::
+
+        The *interval* argument is no longer used (the scheduler doesn't poll
+        anymore).  It is only accepted for backwards compatibility.
     """
     def __init__(self, interval='1s', io_loop=None, runner=None):
         if isinstance(interval, basestring):
@@ -751,10 +846,14 @@ class Scheduler(object):
         self._running = False
         self.interval = interval
         self.io_loop = io_loop or IOLoop.current()
-        self._pc = PeriodicCallback(
-            self._schedule_check, self.interval, io_loop)
         self._id_counter = count(start=1) # For generating unique IDs
         self._schedules = {}
+        # A heap of (<next run time>, <tie breaker>, <Schedule>):
+        self._heap = []
+        self._heap_counter = count()
+        self._lock = RLock() # In case a Timer is used (see _arm())
+        self._timeout = None
+        self._timeout_deadline = None
 
     def schedule(self, funcs, identifier=None, **kwargs):
         """
@@ -828,7 +927,7 @@ class Scheduler(object):
         # Convert the convenience keyword arguments to their datetime equivalent
         if 'monthly' in kwargs:
             kwargs.pop('monthly') # Remove it
-            kwargs['days'] = 0    # Run on the first day of the month
+            kwargs['days'] = 1    # Run on the first day of the month
             kwargs['hours'] = 0   # ...at midnight
             kwargs['minutes'] = 0 # ...on the hour
             kwargs['seconds'] = 0  # at this specific second
@@ -847,7 +946,9 @@ class Scheduler(object):
             kwargs['hours'] = 0    # ...at midnight
             kwargs['minutes'] = 0  # ...on the hour
         sched = Schedule(funcs, identifier, **kwargs)
+        sched.scheduler = self
         self._schedules.update({identifier: sched})
+        self._push(sched)
         return sched
 
     def reschedule(self, identifier, **kwargs):
@@ -874,7 +975,9 @@ class Scheduler(object):
 
             scheduler.unschedule(sched_obj.identifier)
         """
-        del self._schedules[identifier]
+        # NOTE: Its entry in self._heap gets ignored/discarded by _arm()
+        self._schedules.pop(identifier).scheduler = None
+        self._arm()
 
     def remove(self, identifier):
         """
@@ -894,26 +997,98 @@ class Scheduler(object):
         logging.debug("Starting Scheduler")
         if not self._running:
             self._running = True
-            self._pc.start() # Timer() and PeriodicCallback() both use start()
+            self._arm()
 
     def stop(self):
         """Stops the scheduler."""
         logging.debug("Stopping Scheduler")
         if self._running:
             self._running = False
-            self._pc.stop()
+            self._arm() # Will cancel the timeout
+
+    def _push(self, schedule, after=None):
+        """
+        Calculates the next run time of the given *schedule*, adds it to the
+        heap, and makes sure the timeout is set for whatever is due first.
+        """
+        with self._lock:
+            when = schedule.next_run(after)
+            schedule.next_run_time = when
+            if when:
+                heappush(self._heap, (when, next(self._heap_counter), schedule))
+            self._arm()
+
+    def _valid(self, entry):
+        """
+        Returns ``True`` if the given heap *entry* is still current (schedules
+        that get rescheduled or removed leave their old entries behind).
+        """
+        when, _, schedule = entry
+        return (
+            self._schedules.get(schedule.identifier) is schedule and
+            schedule.next_run_time == when)
+
+    def _arm(self):
+        """
+        Sets (or moves, or cancels) the timeout that calls `_run_due` so that
+        it fires when the earliest schedule is due.
+        """
+        with self._lock:
+            heap = self._heap
+            while heap and not self._valid(heap[0]):
+                heappop(heap) # Discard stale entries
+            deadline = heap[0][0] if heap and self._running else None
+            if deadline == self._timeout_deadline:
+                return # Already set (or nothing to do)
+            if self._timeout:
+                if hasattr(self._timeout, 'cancel'): # threading.Timer
+                    self._timeout.cancel()
+                else:
+                    self.io_loop.remove_timeout(self._timeout)
+                self._timeout = None
+            self._timeout_deadline = deadline
+            if not deadline:
+                return
+            delay = max((deadline - datetime.now()).total_seconds(), 0)
+            if self.io_loop._running:
+                self._timeout = self.io_loop.add_timeout(
+                    timedelta(seconds=delay), self._run_due)
+            else:
+                # Same as our PeriodicCallback; this is mostly for debugging
+                # things in an interactive interpreter.
+                self._timeout = Timer(delay, self._timer_fired)
+                self._timeout.daemon = True
+                self._timeout.start()
+
+    def _timer_fired(self):
+        """
+        Called when a `threading.Timer` (see `_arm`) fires.  Hops back over to
+        the IOLoop's thread if it has been started in the meantime.
+        """
+        if self.io_loop._running:
+            self.io_loop.add_callback(self._run_due)
+        else:
+            self._run_due()
 
-    def _schedule_check(self):
+    def _run_due(self):
         """
-        Iterates over ``self._schedules`` and executes any scheduled tasks who's
-        time has come.
+        Executes any scheduled tasks who's time has come and calculates when
+        they need to run next.
         """
-        now = datetime.now()
-        for schedule in self._schedules.values():
-            if ((now.second       in schedule.seconds) and
-                (now.minute       in schedule.minutes) and
-                (now.hour         in schedule.hours)   and
-                (now.day          in schedule.days)    and
-                (now.month        in schedule.months)  and
-                (now.isoweekday() in schedule.weekdays)):
+        with self._lock:
+            self._timeout = None
+            self._timeout_deadline = None
+            now = datetime.now()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                entry = heappop(self._heap)
+                if self._valid(entry):
+                    due.append(entry)
+            for when, _, schedule in due:
                 self.runner.call(schedule) # Call the scheduled task(s)
+                for attr in schedule.valid_attrs:
+                    value = getattr(schedule, attr)
+                    if isinstance(value, Every):
+                        value.last_run = when
+                self._push(schedule, after=now) # Also calls self._arm()
+            self._arm()
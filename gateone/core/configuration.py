@@ -13,7 +13,7 @@ Settings Module for Gate One
 This module contains functions that deal with Gate One's options/settings
 """
 
-import os, sys, io, re, socket, tempfile, logging
+import os, sys, io, re, socket, tempfile, logging, threading
 from pkg_resources import resource_filename, resource_listdir, resource_string
 from .log import FACILITIES
 from gateone.core.log import go_logger
@@ -34,6 +34,10 @@ comments_re = re.compile(
 )
 trailing_commas_re = re.compile(
     r'(,)\s*}(?=([^"\\]*(\\.|"([^"\\]*\\.)*[^"\\]*"))*[^"]*$)')
+# Used by get_settings() to avoid re-parsing .conf files that haven't changed.
+# Format: {<absolute path>: _CachedSettings}
+SETTINGS_CACHE = {}
+SETTINGS_LOCK = threading.RLock()
 
 class SettingsError(Exception):
     """
@@ -445,6 +449,17 @@ def define_options(installed=True, cli_commands=None):
                % ", ".join(facilities)),
         type=basestring
     )
+    define(
+        "max_client_buffer",
+        default="4M",
+        group='gateone',
+        help=_("Maximum amount of data that will be buffered (waiting to be "
+        "sent) for each connected client.  Clients on slow connections that "
+        "fall further behind than this will have intermediate screen updates "
+        "skipped until they catch up.  Accepts <num>X where X could be one of "
+        "K, M, or G for kilobytes, megabytes, and gigabytes."),
+        type=basestring
+    )
     define(
         "session_timeout",
         default="5d",
@@ -643,6 +658,18 @@ def define_options(installed=True, cli_commands=None):
             "multiprocessing."),
         type=int
     )
+    define(
+        "processes",
+        default=1,
+        group='gateone',
+        help=_(
+            "The number of Gate One (worker) processes to run.  Each user "
+            "session lives in a single worker.  Clients that connect to the "
+            "wrong worker get redirected to the right one which listens on its "
+            "own port:  <port> + 1 + <worker number> (e.g. 8001 and 8002 for "
+            "--port=8000 --processes=2) so those ports must be reachable too."),
+        type=int
+    )
     define(
         "configure",
         default=False,
@@ -956,6 +983,91 @@ def remove_trailing_commas(json_like):
     """
     return trailing_commas_re.sub("}", json_like)
 
+def _parse_settings_file(filepath):
+    """
+    Reads the .conf file at *filepath* (JSON with JS-style comments) and
+    returns the decoded result.  If the file contains a JSON syntax error it
+    will be logged and ``None`` will be returned (unless the error could be
+    pinpointed in which case :class:`SettingsError` will be raised).
+    """
+    with io.open(filepath, encoding='utf-8') as f:
+        # Remove comments
+        almost_json = remove_comments(f.read())
+        proper_json = remove_trailing_commas(almost_json)
+        # Remove blank/empty lines
+        proper_json = os.linesep.join([
+            s for s in proper_json.splitlines() if s.strip()])
+        try:
+            return json_decode(proper_json)
+        except ValueError as e:
+            # Something was wrong with the JSON (syntax error, usually)
+            logging.error(
+                "Error decoding JSON in settings file: %s" % filepath)
+            logging.error(e)
+            # Let's try to be as user-friendly as possible by pointing out
+            # *precisely* where the error occurred (if possible)...
+            try:
+                line_no = int(str(e).split(': line ', 1)[1].split()[0])
+                column = int(str(e).split(': line ', 1)[1].split()[2])
+                for i, line in enumerate(proper_json.splitlines()):
+                    if i == line_no-1:
+                        print(
+                            line[:column] +
+                            _(" <-- Something went wrong right here (or "
+                              "right above it)")
+                        )
+                        break
+                    else:
+                        print(line)
+                raise SettingsError()
+            except (ValueError, IndexError):
+                print(_(
+                    "Got an exception trying to display precisely where "
+                    "the problem was.  This usually happens when you've "
+                    "used single quotes (') instead of double quotes (\")."
+                ))
+                # Couldn't parse the exception message for line/column info
+                pass # No big deal; the user will figure it out eventually
+
+def _copy_settings(obj):
+    """
+    Returns a copy of *obj* (the result of a merge inside :func:`get_settings`)
+    where all dicts and lists have been copied.  This way callers can modify
+    what they get back without tainting `SETTINGS_CACHE`.
+    """
+    if isinstance(obj, dict):
+        return obj.__class__((k, _copy_settings(v)) for k, v in obj.items())
+    elif isinstance(obj, list):
+        return [_copy_settings(v) for v in obj]
+    return obj
+
+class _CachedSettings(object):
+    """
+    Holds everything :func:`get_settings` knows about a given settings *path*:
+
+    :files: An ordered list of ``(<file path>, (<mtime>, <size>), <parsed>)``
+        tuples; one for each .conf file in *path*.
+    :merged: The result of merging every file's parsed JSON (an `RUDict`).
+    :generation: Incremented every time `merged` changes.
+    """
+    def __init__(self):
+        self.files = []
+        self.merged = RUDict()
+        self.generation = 0
+
+def settings_generation(path):
+    """
+    Returns the generation number of the settings loaded from *path* via
+    :func:`get_settings`.  The number changes if (and only if) the merged
+    settings changed the last time :func:`get_settings` was called so it can be
+    used to tell when caches derived from the settings (e.g. policies) need to
+    be invalidated.  Returns 0 if the settings at *path* have never been loaded.
+    """
+    cached = SETTINGS_CACHE.get(os.path.abspath(path))
+    if cached:
+        return cached.generation
+    return 0
+
 def get_settings(path, add_default=True):
     """
     Reads any and all *.conf files containing JSON (JS-style comments are OK)
@@ -965,64 +1077,71 @@ def get_settings(path, add_default=True):
     By default, all returned :class:`RUDict` objects will include a '*' dict
     which indicates "all users".  This behavior can be skipped by setting the
     *add_default* keyword argument to `False`.
+
+    The parsed contents of each .conf file are cached (in `SETTINGS_CACHE`)
+    along with its modification time and size so only files that have changed
+    since the last call will be re-read.  Only the top-level keys (e.g. '*' or
+    'user="bob"') that appear in changed files will be re-merged.  Use
+    :func:`settings_generation` to find out if anything changed.
     """
-    settings = RUDict()
-    if add_default:
-        settings['*'] = {}
-    # Using an RUDict so that subsequent .conf files can safely override
-    # settings way down the chain without clobbering parent keys/dicts.
     if os.path.isdir(path):
         settings_files = [a for a in os.listdir(path) if a.endswith('.conf')]
         settings_files.sort()
+        settings_files = [os.path.join(path, a) for a in settings_files]
     else:
         if not os.path.exists(path):
             raise IOError(_("%s does not exist" % path))
         settings_files = [path]
-    for fname in settings_files:
-        # Use this file to update settings
-        if os.path.isdir(path):
-            filepath = os.path.join(path, fname)
-        else:
-            filepath = path
-        with io.open(filepath, encoding='utf-8') as f:
-            # Remove comments
-            almost_json = remove_comments(f.read())
-            proper_json = remove_trailing_commas(almost_json)
-            # Remove blank/empty lines
-            proper_json = os.linesep.join([
-                s for s in proper_json.splitlines() if s.strip()])
+    with SETTINGS_LOCK:
+        cache_key = os.path.abspath(path)
+        cached = SETTINGS_CACHE.get(cache_key)
+        if not cached:
+            cached = SETTINGS_CACHE[cache_key] = _CachedSettings()
+        previous = dict((f[0], f) for f in cached.files)
+        files = []
+        changed_keys = set()
+        for filepath in settings_files:
             try:
-                settings.update(json_decode(proper_json))
-            except ValueError as e:
-                # Something was wrong with the JSON (syntax error, usually)
-                logging.error(
-                    "Error decoding JSON in settings file: %s"
-                    % os.path.join(path, fname))
-                logging.error(e)
-                # Let's try to be as user-friendly as possible by pointing out
-                # *precisely* where the error occurred (if possible)...
-                try:
-                    line_no = int(str(e).split(': line ', 1)[1].split()[0])
-                    column = int(str(e).split(': line ', 1)[1].split()[2])
-                    for i, line in enumerate(proper_json.splitlines()):
-                        if i == line_no-1:
-                            print(
-                                line[:column] +
-                                _(" <-- Something went wrong right here (or "
-                                  "right above it)")
-                            )
-                            break
-                        else:
-                            print(line)
-                    raise SettingsError()
-                except (ValueError, IndexError):
-                    print(_(
-                        "Got an exception trying to display precisely where "
-                        "the problem was.  This usually happens when you've "
-                        "used single quotes (') instead of double quotes (\")."
-                    ))
-                    # Couldn't parse the exception message for line/column info
-                    pass # No big deal; the user will figure it out eventually
+                stat = os.stat(filepath)
+            except OSError: # Removed out from under us
+                continue
+            signature = (stat.st_mtime, stat.st_size)
+            old = previous.pop(filepath, None)
+            if old and old[1] == signature:
+                files.append(old)
+                continue
+            # New or modified file
+            parsed = _parse_settings_file(filepath)
+            if not isinstance(parsed, dict):
+                parsed = {}
+            if old and old[2] == parsed:
+                parsed = old[2] # Touched but not actually changed
+            else:
+                changed_keys.update(parsed)
+                if old:
+                    changed_keys.update(old[2])
+            files.append((filepath, signature, parsed))
+        for removed in previous.values():
+            changed_keys.update(removed[2])
+        cached.files = files
+        # Each top-level key only depends on the files that contain it so that's
+        # all we need to re-merge:
+        for key in changed_keys:
+            merged = RUDict()
+            for filepath, signature, parsed in files:
+                if key in parsed:
+                    merged.update({key: parsed[key]})
+            if key in merged:
+                cached.merged[key] = merged[key]
+            else:
+                cached.merged.pop(key, None)
+        if changed_keys:
+            cached.generation += 1
+        settings = _copy_settings(cached.merged)
+    # Using an RUDict so that subsequent .conf files can safely override
+    # settings way down the chain without clobbering parent keys/dicts.
+    if add_default and '*' not in settings:
+        settings['*'] = {}
     return settings
 
 def options_to_settings(options):
@@ -1232,7 +1351,8 @@ def combine_css(path, container, settings_dir=None):
     for theme in themes:
         combined_theme_path = "%s_theme_%s" % (
             path.split('.css')[0], theme)
-        theme_writers[theme] = io.open(combined_theme_path, 'w')
+        theme_writers[theme] = io.open(
+            combined_theme_path, 'w', encoding='utf-8')
         theme_relpath = '/templates/themes/' + theme
         themepath = resource_fn(theme_relpath)
         logger.info(_("Concatenating: %s") % theme_relpath)
@@ -1240,7 +1360,7 @@ def combine_css(path, container, settings_dir=None):
             u"\n/* ------ theme_relpath: %s ------ */\n" % theme_relpath)
         theme_writers[theme].write(resource(theme_relpath))
     # NOTE: We skip gateone.css because that isn't used when embedding
-    with io.open(path, 'w') as f:
+    with io.open(path, 'w', encoding='utf-8') as f:
         # Gate One plugins
         for plugin in pluginslist:
             if enabled_plugins and plugin not in enabled_plugins:
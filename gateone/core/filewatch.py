@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+# Meta
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+__doc__ = """\
+.. _filewatch.py:
+
+File Watching for Gate One
+==========================
+Provides the `FileWatcher` class which calls a function whenever a watched file
+(or directory) changes.  On Linux it uses inotify (via ctypes so no compilation
+is necessary) attached to the `~tornado.ioloop.IOLoop`.  Everywhere else (or if
+inotify can't be initialized) it falls back to regularly checking the
+modification time of every watched file via a
+`~tornado.ioloop.PeriodicCallback`.
+
+Changes are debounced:  All events that arrive within the *debounce* window are
+collected and each update function will only be called once per batch.  This
+way an editor that saves a file by writing a temporary file and renaming it
+over the original won't result in the update function being called three
+times.
+
+Example::
+
+    >>> from gateone.core.filewatch import FileWatcher
+    >>> watcher = FileWatcher()
+    >>> watcher.watch('/opt/gateone/settings', load_settings)
+    >>> watcher.start()
+"""
+
+# Import stdlib stuff
+import os
+import sys
+import errno
+import struct
+import logging
+import ctypes
+from ctypes.util import find_library
+from datetime import timedelta
+
+# Import 3rd party stuff
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+# inotify constants (from sys/inotify.h)
+IN_MODIFY =      0x00000002
+IN_ATTRIB =      0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM =  0x00000040
+IN_MOVED_TO =    0x00000080
+IN_CREATE =      0x00000100
+IN_DELETE =      0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF =   0x00000800
+IN_Q_OVERFLOW =  0x00004000
+IN_IGNORED =     0x00008000
+IN_ONLYDIR =     0x01000000
+IN_CLOEXEC =     0o2000000
+IN_NONBLOCK =    0o0004000
+# Everything that indicates a file inside a watched directory was changed:
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+    IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+# struct inotify_event {int wd; uint32_t mask, cookie, len; char name[];}
+EVENT_HEADER = struct.Struct('iIII')
+
+class InotifyUnavailable(Exception):
+    """
+    Raised by `Inotify` if the platform doesn't support inotify or it could not
+    be initialized (e.g. the user's inotify instance limit has been reached).
+    """
+    pass
+
+class Inotify(object):
+    """
+    A minimal ctypes wrapper around Linux's inotify API.  The file descriptor
+    (`Inotify.fd`) is non-blocking so it can be handed directly to
+    :meth:`IOLoop.add_handler`.
+    """
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise InotifyUnavailable("inotify is only available on Linux")
+        try:
+            self.libc = ctypes.CDLL(find_library('c'), use_errno=True)
+            self._init1 = self.libc.inotify_init1
+            self._add_watch = self.libc.inotify_add_watch
+            self._rm_watch = self.libc.inotify_rm_watch
+        except (OSError, AttributeError) as e:
+            raise InotifyUnavailable(str(e))
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self._init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise InotifyUnavailable(os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """
+        Adds an inotify watch on *path* using the given *mask* and returns the
+        resulting watch descriptor.  Raises `OSError` on failure.
+        """
+        if not isinstance(path, bytes):
+            path = path.encode(sys.getfilesystemencoding())
+        wd = self._add_watch(self.fd, path, mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        """
+        Removes the watch identified by the given watch descriptor (*wd*).
+        """
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """
+        Reads all pending events from `Inotify.fd` and returns them as a list
+        of ``(wd, mask, cookie, name)`` tuples.
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except (OSError, IOError) as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset+length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        """
+        Closes the inotify file descriptor (which removes all watches).
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class FileWatcher(object):
+    """
+    Calls a function whenever a watched file or directory is modified.
+
+    :param int interval: How often (in milliseconds) to check files when
+        falling back to polling.
+    :param debounce: How long (in milliseconds or as a
+        `~datetime.timedelta`) to collect inotify events before calling the
+        update functions.
+    :param str backend: One of 'auto', 'inotify', or 'poll'.  'auto' will use
+        inotify if it is available and fall back to polling otherwise.
+    :param io_loop: The `~tornado.ioloop.IOLoop` to use.  Defaults to
+        ``IOLoop.current()`` at the time `start` is called.
+
+    The `watched_files` (``{<path>: <modification time>}``) and
+    `file_update_funcs` (``{<path>: <function>}``) dicts can be inspected to
+    see what is being watched.
+    """
+    def __init__(self, interval=5000, debounce=250, backend='auto',
+            io_loop=None):
+        self.interval = interval
+        self.debounce = debounce
+        self.backend = backend
+        self.io_loop = io_loop
+        self.watched_files = {}
+        self.file_update_funcs = {}
+        self.inotify = None
+        self.poller = None
+        self._wds = {}       # {<watch descriptor>: <directory>}
+        self._dir_wds = {}   # {<directory>: <watch descriptor>}
+        self._pending = set()
+        self._flush_timeout = None
+
+    def __repr__(self):
+        return "<FileWatcher %s watching %s paths>" % (
+            self.mode, len(self.watched_files))
+
+    @property
+    def mode(self):
+        """
+        Returns 'inotify' or 'poll' depending on which backend is currently
+        running (or ``None`` if the watcher isn't running).
+        """
+        if self.inotify:
+            return 'inotify'
+        elif self.poller:
+            return 'poll'
+
+    @property
+    def running(self):
+        """
+        ``True`` if the `FileWatcher` has been started.
+        """
+        return bool(self.inotify or self.poller)
+
+    def watch(self, path, func):
+        """
+        Calls *func* whenever the file or directory at *path* is modified.  If
+        *path* is a directory *func* will be called when any (non-hidden) file
+        inside of it is created, modified, renamed, or removed.
+        """
+        self.watched_files[path] = os.stat(path).st_mtime
+        self.file_update_funcs[path] = func
+        if self.inotify:
+            self._add_inotify_watch(path)
+
+    def unwatch(self, path):
+        """
+        Stops watching the file or directory at *path*.
+        """
+        self.watched_files.pop(path, None)
+        self.file_update_funcs.pop(path, None)
+        self._pending.discard(path)
+        if not self.inotify:
+            return
+        for directory in (path, os.path.dirname(path)):
+            wd = self._dir_wds.get(directory)
+            if wd is None or self._dir_in_use(directory):
+                continue
+            del self._dir_wds[directory]
+            del self._wds[wd]
+            self.inotify.rm_watch(wd)
+
+    def start(self):
+        """
+        Starts watching files using the configured backend.  Does nothing if
+        the watcher is already running.
+        """
+        if self.running:
+            return
+        if not self.io_loop:
+            self.io_loop = IOLoop.current()
+        if self.backend in ('auto', 'inotify'):
+            try:
+                self.inotify = Inotify()
+            except InotifyUnavailable as e:
+                if self.backend == 'inotify':
+                    logging.warning(
+                        "Could not initialize inotify (%s).  Falling back to "
+                        "polling for file changes." % e)
+            else:
+                for path in list(self.watched_files):
+                    self._add_inotify_watch(path)
+                self.io_loop.add_handler(
+                    self.inotify.fd, self._handle_events, IOLoop.READ)
+                logging.debug("FileWatcher: Using inotify")
+                return
+        self.poller = PeriodicCallback(
+            self.check, self.interval, io_loop=self.io_loop)
+        self.poller.start()
+        logging.debug(
+            "FileWatcher: Polling for changes every %sms" % self.interval)
+
+    def stop(self):
+        """
+        Stops watching files.  Watched paths are retained so calling `start`
+        again will resume watching them.
+        """
+        if self._flush_timeout:
+            self.io_loop.remove_timeout(self._flush_timeout)
+            self._flush_timeout = None
+        self._pending.clear()
+        if self.inotify:
+            self.io_loop.remove_handler(self.inotify.fd)
+            self.inotify.close()
+            self.inotify = None
+            self._wds.clear()
+            self._dir_wds.clear()
+        if self.poller:
+            self.poller.stop()
+            self.poller = None
+
+    def check(self):
+        """
+        Checks the modification time of every watched path and calls the
+        update functions of any that have changed.  This is what gets called
+        regularly when polling but it can also be called manually to force a
+        check.
+        """
+        for path, mtime in list(self.watched_files.items()):
+            try:
+                current_mtime = os.stat(path).st_mtime
+            except OSError:
+                current_mtime = None # Will be logged/removed by _flush()
+            if current_mtime != mtime:
+                self._pending.add(path)
+        self._flush()
+
+    def _dir_in_use(self, directory):
+        """
+        Returns ``True`` if *directory* still needs to be watched because it
+        (or a file inside of it) is in `watched_files`.
+        """
+        for path in self.watched_files:
+            if path == directory or os.path.dirname(path) == directory:
+                return True
+        return False
+
+    def _add_inotify_watch(self, path):
+        """
+        Adds an inotify watch for *path*.  Directories are watched directly;
+        files are watched via their parent directory so that atomic saves
+        (write to temp file then rename) are caught too.
+        """
+        directory = path
+        if not os.path.isdir(path):
+            directory = os.path.dirname(path) or os.curdir
+        if directory in self._dir_wds:
+            return
+        try:
+            wd = self.inotify.add_watch(directory)
+        except OSError as e:
+            logging.error(
+                "Could not watch %s for changes: %s" % (directory, e))
+            return
+        self._wds[wd] = directory
+        self._dir_wds[directory] = wd
+
+    def _handle_events(self, fd, events):
+        """
+        Called by the `~tornado.ioloop.IOLoop` whenever there are inotify
+        events to read.  Marks the matching paths as pending and schedules a
+        call to `_flush` (if not already scheduled).
+        """
+        for wd, mask, cookie, name in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # We missed some events; assume everything changed
+                self._pending.update(self.watched_files)
+                continue
+            directory = self._wds.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED: # Watch was removed (directory deleted)
+                del self._wds[wd]
+                self._dir_wds.pop(directory, None)
+                self._pending.update(
+                    p for p in self.watched_files
+                    if p == directory or os.path.dirname(p) == directory)
+                continue
+            if name:
+                name = name.decode(sys.getfilesystemencoding(), 'replace')
+                path = os.path.join(directory, name)
+                if path in self.watched_files:
+                    self._pending.add(path)
+                    continue
+                if name.startswith('.') or name.endswith('~'):
+                    continue # Ignore editor swap/backup files
+            if directory in self.watched_files:
+                self._pending.add(directory)
+        if self._pending and not self._flush_timeout:
+            debounce = self.debounce
+            if not isinstance(debounce, timedelta):
+                debounce = timedelta(milliseconds=debounce)
+            self._flush_timeout = self.io_loop.add_timeout(
+                debounce, self._flush)
+
+    def _flush(self):
+        """
+        Calls the update function of every pending path exactly once (even if
+        the same function is registered for several changed paths).
+        """
+        self._flush_timeout = None
+        pending, self._pending = self._pending, set()
+        funcs = []
+        for path in pending:
+            if path not in self.watched_files:
+                continue
+            if not os.path.exists(path):
+                # Someone deleted something they shouldn't have
+                logging.error(
+                    "%s has been removed.  No longer watching it." % path)
+                self.unwatch(path)
+                continue
+            self.watched_files[path] = os.stat(path).st_mtime
+            func = self.file_update_funcs[path]
+            if func not in funcs:
+                funcs.append(func)
+        for func in funcs:
+            try:
+                func()
+            except Exception as e:
+                logging.error(
+                    "Exception encountered trying to execute the file update "
+                    "function %s: %s" % (getattr(func, '__name__', func), e))
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    import traceback
+                    traceback.print_exc(file=sys.stdout)
@@ -44,6 +44,10 @@ from tornado.options import options
 from tornado.log import LogFormatter
 
 LOGS = set() # Holds a list of all our log paths so we can fix permissions
+# Tracks the options each logger's handlers were created with so go_logger()
+# only has to (re)create them when something changes.
+# Format: {<logger name>: (<log_file_prefix>, <level>, <max size>, <backups>)}
+CONFIGURED = {}
 # These should match what's in the syslog module (hopefully not platform-dependent)
 FACILITIES = {
     'auth': 32,
@@ -74,24 +78,106 @@ class UnknownFacility(Exception):
     """
     pass
 
+def _find_caller():
+    """
+    Returns the filename, line number, and function name of whatever called
+    into the logging machinery (skipping over this module and the `logging`
+    module itself).  Just like `logging.Logger.findCaller` does.
+    """
+    f = sys._getframe(1)
+    while f is not None:
+        filename = os.path.normcase(f.f_code.co_filename)
+        if filename not in (_SRCFILE, logging._srcfile):
+            return (f.f_code.co_filename, f.f_lineno, f.f_code.co_name)
+        f = f.f_back
+    return ("(unknown file)", 0, "(unknown function)")
+
+_SRCFILE = os.path.normcase(_find_caller.__code__.co_filename)
+
 class JSONAdapter(logging.LoggerAdapter):
     """
     A `logging.LoggerAdapter` that prepends keyword argument information to log
     entries.  Expects the passed in dict-like object which will be included.
+
+    The JSON-encoded form of *extra* is cached and only re-encoded if *extra*
+    changes.  Lines are only formatted if the logger is enabled for the level
+    in question.
     """
+    def __init__(self, logger, extra):
+        logging.LoggerAdapter.__init__(self, logger, extra)
+        self._json_extra = None # What self._json_prefix was generated from
+        self._json_prefix = u''
+
+    if sys.version_info[0] < 3:
+        # Python 2's LoggerAdapter calls process() (i.e. formats the line)
+        # *before* checking if the level is even enabled.  These check first.
+        def log(self, level, msg, *args, **kwargs):
+            if self.logger.isEnabledFor(level):
+                msg, kwargs = self.process(msg, kwargs)
+                self._log(level, msg, args, **kwargs)
+
+        def debug(self, msg, *args, **kwargs):
+            self.log(logging.DEBUG, msg, *args, **kwargs)
+
+        def info(self, msg, *args, **kwargs):
+            self.log(logging.INFO, msg, *args, **kwargs)
+
+        def warning(self, msg, *args, **kwargs):
+            self.log(logging.WARNING, msg, *args, **kwargs)
+
+        warn = warning
+
+        def error(self, msg, *args, **kwargs):
+            self.log(logging.ERROR, msg, *args, **kwargs)
+
+        def exception(self, msg, *args, **kwargs):
+            kwargs['exc_info'] = 1
+            self.log(logging.ERROR, msg, *args, **kwargs)
+
+        def critical(self, msg, *args, **kwargs):
+            self.log(logging.CRITICAL, msg, *args, **kwargs)
+
+        def _log(self, level, msg, args, exc_info=None, extra=None):
+            """
+            Does what `logging.Logger._log` does except the record is
+            attributed to whoever called the adapter (see `_find_caller`)
+            instead of the adapter itself.
+            """
+            filename, lineno, func = _find_caller()
+            if exc_info and not isinstance(exc_info, tuple):
+                exc_info = sys.exc_info()
+            record = self.logger.makeRecord(
+                self.logger.name, level, filename, lineno, msg, args,
+                exc_info, func, extra)
+            self.logger.handle(record)
+
+    @property
+    def json_prefix(self):
+        """
+        Returns `self.extra` as JSON (re-encoding it only if it has changed).
+        """
+        if self._json_extra != self.extra:
+            self._json_extra = self.extra.copy()
+            self._json_prefix = json.dumps(
+                self.extra, sort_keys=True, ensure_ascii=False)
+        return self._json_prefix
+
     def process(self, msg, kwargs):
-        extra = self.extra.copy()
         if 'metadata' in kwargs:
+            extra = self.extra.copy()
             extra.update(kwargs.pop('metadata'))
-        if extra:
+            if not extra:
+                return (msg, kwargs)
             json_data = json.dumps(extra, sort_keys=True, ensure_ascii=False)
-            try:
-                line = u'{json_data} {msg}'.format(json_data=json_data, msg=msg)
-            except UnicodeDecodeError:
-                line = u'{json_data} {msg}'.format(
-                    json_data=json_data, msg=repr(msg))
+        elif self.extra:
+            json_data = self.json_prefix
         else:
-            line = msg
+            return (msg, kwargs)
+        try:
+            line = u'{json_data} {msg}'.format(json_data=json_data, msg=msg)
+        except UnicodeDecodeError:
+            line = u'{json_data} {msg}'.format(
+                json_data=json_data, msg=repr(msg))
         return (line, kwargs)
 
 def string_to_syslog_facility(facility):
@@ -139,6 +225,11 @@ def go_logger(name, **kwargs):
 
         >>> auth_logger.info('test3', {"user": "bob", "ip": "10.1.1.100"})
         [I 130828 15:00:56 app.py:10] {"user": "bob", "ip": "10.1.1.100"} test3
+
+    The logger's handlers are only created the first time a given *name* is
+    used (or if the logging options have changed since) so it is cheap to call
+    this function with different *kwargs* over and over (e.g. once per
+    connection).
     """
     logger = logging.getLogger(name)
     if '--help' in sys.argv:
@@ -148,13 +239,22 @@ def go_logger(name, **kwargs):
         # Logging is disabled but we still have to return the adapter so that
         # passing metadata to the logger won't throw exceptions
         return JSONAdapter(logger, kwargs)
+    config = (
+        options.log_file_prefix, options.logging.upper(),
+        options.log_file_max_size, options.log_file_num_backups)
+    if CONFIGURED.get(name) == config:
+        # Already have a file handler for this logger; no need to make another
+        return JSONAdapter(logger, kwargs)
     preserve = None # Save the stdout handler (because it looks nice =)
     if name == None:
         # root logger; make sure we save the pretty-printing stdout handler...
         for handler in logger.handlers:
             if not isinstance(handler, logging.handlers.RotatingFileHandler):
                 preserve = handler
-    # Remove any existing handlers on the logger
+    # Remove (and close) any existing handlers on the logger
+    for handler in logger.handlers:
+        if isinstance(handler, logging.handlers.RotatingFileHandler):
+            handler.close()
     logger.handlers = []
     if preserve: # Add back the one we preserved (if any)
         logger.handlers.append(preserve)
@@ -176,5 +276,6 @@ def go_logger(name, **kwargs):
             backupCount=options.log_file_num_backups)
         channel.setFormatter(LogFormatter(color=False))
         logger.addHandler(channel)
+    CONFIGURED[name] = config
     logger = JSONAdapter(logger, kwargs)
     return logger
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+# Meta
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+__doc__ = """
+.. _metrics.py:
+
+Runtime Metrics
+===============
+Keeps track of what's going on inside of Gate One (bytes read, screen
+refreshes sent, cache hit rates, queue depths, etc) so it can be served up by
+`gateone.core.server.MetricsHandler` in the `Prometheus text format
+<https://prometheus.io/docs/instrumenting/exposition_formats/>`_.
+
+Metrics come from two places:
+
+    * `Counter` objects that get incremented in the code paths being
+      measured.  These are just an integer under the hood so they're cheap
+      enough to leave on all the time.
+    * Collectors: Functions registered via `add_collector` that get called
+      whenever the metrics are requested.  These are used for things that
+      already keep track of themselves (e.g. the size of a cache or
+      `termio.multiplex_stats`) so nothing extra happens in the hot path.
+
+Applications and plugins can add their own metrics like so::
+
+    >>> from gateone.core.metrics import Counter, add_collector
+    >>> FOOS = Counter('gateone_myapp_foos_total', 'Number of foos handled.')
+    >>> FOOS.inc()
+    >>> def myapp_metrics():
+    ...     return [('gateone_myapp_bars', 'gauge', 'Current bars.', [
+    ...         ({'kind': 'big'}, len(BIG_BARS)),
+    ...         ({'kind': 'small'}, len(SMALL_BARS)),
+    ...     ])]
+    >>> add_collector(myapp_metrics)
+
+Collectors must return a list of ``(name, type, help, samples)`` tuples where
+*samples* is a list of ``(labels, value)`` tuples (*labels* can be ``None``).
+Sample names can be given a suffix by using a ``(suffix, labels)`` tuple in
+place of *labels* (e.g. ``('_count', None)`` for summaries).
+"""
+
+import time, logging, resource
+from collections import OrderedDict
+
+# Globals
+COUNTERS = OrderedDict() # Name -> Counter
+COLLECTORS = []
+START_TIME = time.time()
+
+class Counter(object):
+    """
+    A monotonically-increasing value (e.g. the number of refreshes sent).  If a
+    counter with the given *name* already exists it will be returned instead of
+    a new one (so modules can be reloaded without losing track).
+    """
+    def __new__(cls, name, description):
+        if name in COUNTERS:
+            return COUNTERS[name]
+        counter = object.__new__(cls)
+        counter.name = name
+        counter.description = description
+        counter.value = 0
+        COUNTERS[name] = counter
+        return counter
+
+    def __repr__(self):
+        return "<Counter %s=%s>" % (self.name, self.value)
+
+    def inc(self, amount=1):
+        """Increments the counter by *amount*."""
+        self.value += amount
+
+def add_collector(func):
+    """
+    Registers *func* to be called whenever the metrics are rendered.  See the
+    module docs for what it needs to return.
+    """
+    if func not in COLLECTORS:
+        COLLECTORS.append(func)
+
+def remove_collector(func):
+    """Removes *func* from the list of collectors."""
+    if func in COLLECTORS:
+        COLLECTORS.remove(func)
+
+def summary(calls, sampled_calls, sampled_seconds):
+    """
+    Returns summary samples (``_count`` and ``_sum``) for a sampled timer.
+    Since only *sampled_calls* out of *calls* were timed the ``_sum`` is an
+    estimate based on their average.
+    """
+    total = 0.0
+    if sampled_calls:
+        total = sampled_seconds / sampled_calls * calls
+    return [(('_count', None), calls), (('_sum', None), total)]
+
+def hit_ratio(name, description, stats, size=None):
+    """
+    Returns metrics for a cache whose hits and misses are tracked in the
+    *stats* dict (e.g. `gateone.core.utils.MEMO_STATS`).  If *size* is given
+    the number of entries in the cache will be included.
+    """
+    metrics = [
+        (name + '_hits_total', 'counter', description + ' hits.',
+            [(None, stats['hits'])]),
+        (name + '_misses_total', 'counter', description + ' misses.',
+            [(None, stats['misses'])]),
+    ]
+    if size is not None:
+        metrics.append((name + '_entries', 'gauge',
+            description + ' entries.', [(None, size)]))
+    return metrics
+
+def process_metrics():
+    """
+    Collector for process-wide metrics (memory, CPU time, uptime) and the
+    `gateone.core.utils.memoize` / `gateone.async.AsyncRunner` caches.
+    """
+    from gateone.core import utils
+    from gateone.async import async
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    metrics = [
+        ('gateone_process_cpu_seconds_total', 'counter',
+            'User and system CPU time used by this process.',
+            [(None, usage.ru_utime + usage.ru_stime)]),
+        ('gateone_process_max_rss_bytes', 'gauge',
+            'Peak resident memory of this process.',
+            [(None, usage.ru_maxrss * 1024)]),
+        ('gateone_process_uptime_seconds', 'gauge',
+            'Time since this process started.',
+            [(None, time.time() - START_TIME)]),
+    ]
+    metrics.extend(hit_ratio('gateone_memoize', 'memoize cache',
+        utils.MEMO_STATS, len(utils.MEMO)))
+    metrics.extend(hit_ratio('gateone_async_memo', 'AsyncRunner result cache',
+        async.MEMO_STATS, len(async.MEMO)))
+    return metrics
+
+def _escape(value):
+    """Escapes *value* for use as a label value."""
+    return (u'%s' % value).replace(
+        u'\\', u'\\\\').replace(u'"', u'\\"').replace(u'\n', u'\\n')
+
+def _format_value(value):
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def render():
+    """
+    Returns all the metrics (counters and the output of every collector) as a
+    string in the Prometheus text exposition format.
+    """
+    families = [
+        (a.name, 'counter', a.description, [(None, a.value)])
+        for a in COUNTERS.values()]
+    for collector in COLLECTORS:
+        try:
+            families.extend(collector())
+        except Exception as e:
+            # Don't let one broken collector take out all the metrics
+            logging.error(
+                "Error in metrics collector %s: %s" % (collector.__name__, e))
+    lines = []
+    for name, kind, description, samples in families:
+        lines.append(u'# HELP %s %s' % (name, description))
+        lines.append(u'# TYPE %s %s' % (name, kind))
+        for labels, value in samples:
+            suffix = u''
+            if isinstance(labels, tuple):
+                suffix, labels = labels
+            label_str = u''
+            if labels:
+                label_str = u'{%s}' % u','.join(
+                    u'%s="%s"' % (k, _escape(v))
+                    for k, v in sorted(labels.items()))
+            lines.append(u'%s%s%s %s' % (
+                name, suffix, label_str, _format_value(value)))
+    return u'\n'.join(lines) + u'\n'
+
+add_collector(process_metrics)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+# Meta
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+__doc__ = """
+.. _profiler.py:
+
+Sampling Profiler
+=================
+A low-overhead, statistical profiler that can be turned on for a little while
+on a live Gate One server to figure out where the CPU time is going (e.g. is it
+`terminal.Terminal.write`, `terminal.Terminal._spanify_screen`, or JSON
+encoding?).  It works by asking the kernel to send us a ``SIGPROF`` every
+*interval* seconds of CPU time (via :func:`signal.setitimer`) and recording the
+stack of whatever happened to be running at the time.  Since the timer only
+counts CPU time an idle server doesn't generate any samples at all.
+
+The results are saved in the "collapsed stack" format (one line per unique
+stack with the frames separated by semicolons followed by the number of times
+it was seen) which can be fed directly into tools like `FlameGraph
+<https://github.com/brendangregg/FlameGraph>`_ or `speedscope
+<https://www.speedscope.app/>`_.
+
+`profile` is what `gateone.core.server.ApplicationWebSocket.start_profiler`
+uses; it profiles the main (IOLoop) thread along with any
+`gateone.async.MultiprocessRunner` worker processes at the same time.
+
+.. note::
+
+    Only one profiler can run in a given process at a time since ``SIGPROF``
+    is a process-wide thing.
+"""
+
+import os, time, signal, logging, threading, tempfile
+from glob import glob
+
+from tornado.ioloop import IOLoop
+
+from gateone.core.locale import get_translation
+
+_ = get_translation()
+
+# Globals
+INTERVAL = 0.005 # Seconds of CPU time between samples
+ACTIVE = None # The SamplingProfiler currently running in this process (if any)
+
+class ProfilerBusy(Exception):
+    """
+    Raised when trying to start a `SamplingProfiler` when one is already
+    running.
+    """
+    pass
+
+class SamplingProfiler(object):
+    """
+    Records the stack of the main thread every *interval* seconds of CPU time
+    while running.  Example::
+
+        >>> profiler = SamplingProfiler()
+        >>> profiler.start()
+        >>> do_stuff()
+        >>> profiler.stop()
+        >>> profiler.save('/tmp/stuff.collapsed')
+
+    If *root* is given it will be used as the first frame of every stack (handy
+    when combining the results from several processes).
+    """
+    def __init__(self, interval=INTERVAL, root=None):
+        self.interval = interval
+        self.root = root
+        self.samples = 0
+        self.running = False
+        # (code object, ...) -> count.  Code objects are stored instead of
+        # strings so that the signal handler stays cheap.
+        self.stacks = {}
+        self._old_handler = None
+
+    def start(self):
+        """
+        Starts sampling.  Must be called from the main thread.  Raises
+        `ProfilerBusy` if another profiler is already running.
+        """
+        global ACTIVE
+        if ACTIVE:
+            raise ProfilerBusy(_("A profiler is already running."))
+        ACTIVE = self
+        self.running = True
+        self._old_handler = signal.signal(signal.SIGPROF, self._sample)
+        # Make sure system calls get restarted instead of raising EINTR:
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        """
+        Stops sampling.  If called from the main thread the original ``SIGPROF``
+        handler will be restored too.
+        """
+        global ACTIVE
+        if not self.running:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        if isinstance(threading.current_thread(), threading._MainThread):
+            signal.signal(signal.SIGPROF, self._old_handler or signal.SIG_DFL)
+        self.running = False
+        if ACTIVE is self:
+            ACTIVE = None
+
+    def _sample(self, signum, frame):
+        """
+        The ``SIGPROF`` handler; records the stack of *frame*.
+        """
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack = tuple(stack)
+        self.samples += 1
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def collapsed(self):
+        """
+        Returns the recorded stacks as a list of lines in the collapsed stack
+        format (most common stacks first).
+        """
+        labels = {} # Code object -> label
+        def label(code):
+            if code not in labels:
+                labels[code] = "%s (%s:%s)" % (
+                    code.co_name, os.path.basename(code.co_filename),
+                    code.co_firstlineno)
+            return labels[code]
+        out = []
+        for stack, count in sorted(
+                self.stacks.items(), key=lambda a: a[1], reverse=True):
+            frames = [label(a) for a in reversed(stack)]
+            if self.root:
+                frames.insert(0, self.root)
+            out.append("%s %s" % (";".join(frames), count))
+        return out
+
+    def save(self, path):
+        """
+        Saves the results to *path* in the collapsed stack format.
+        """
+        with open(path, 'w') as f:
+            for line in self.collapsed():
+                f.write(line + '\n')
+
+def profile_worker(path, seconds, interval=INTERVAL):
+    """
+    Meant to be called inside of a `gateone.async.MultiprocessRunner` worker
+    process:  Profiles the current process for *seconds* then saves the results
+    to *path*.<pid>.  Returns immediately (the profiler keeps running in the
+    background) with the PID or ``None`` if this worker is already being
+    profiled.
+    """
+    if ACTIVE:
+        return None
+    profiler = SamplingProfiler(interval, root='worker')
+    profiler.start()
+    def finish():
+        profiler.stop()
+        profiler.save('%s.%s' % (path, os.getpid()))
+    timer = threading.Timer(seconds, finish)
+    timer.daemon = True
+    timer.start()
+    # Hang on to the call for a moment so the other workers get a chance to
+    # pick up the remaining calls (there's no way to target a given worker):
+    time.sleep(0.1)
+    return os.getpid()
+
+def merge(paths, output):
+    """
+    Combines the collapsed stack files at *paths* into *output* (adding up the
+    counts of any stacks that appear in more than one).
+    """
+    stacks = {}
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                stack, _sep, count = line.rstrip('\n').rpartition(' ')
+                if not stack:
+                    continue
+                stacks[stack] = stacks.get(stack, 0) + int(count)
+    with open(output, 'w') as f:
+        for stack, count in sorted(
+                stacks.items(), key=lambda a: a[1], reverse=True):
+            f.write("%s %s\n" % (stack, count))
+
+def profile(seconds, path, callback, runner=None, interval=INTERVAL,
+        io_loop=None):
+    """
+    Profiles the main (IOLoop) thread for *seconds* and saves the results to
+    *path* in the collapsed stack format.  When done *callback* will be called
+    with the total number of samples that were taken.
+
+    If *runner* is a `gateone.async.MultiprocessRunner` its worker processes
+    will be profiled at the same time (their stacks will start with 'worker'
+    instead of 'ioloop').  Workers that are started in the middle of the
+    profiling run won't be included.
+
+    Raises `ProfilerBusy` if the profiler is already running.
+    """
+    from gateone.async import MultiprocessRunner
+    io_loop = io_loop or IOLoop.current()
+    profiler = SamplingProfiler(interval, root='ioloop')
+    profiler.start()
+    temp_dir = tempfile.mkdtemp(prefix='go_profile')
+    worker_prefix = os.path.join(temp_dir, 'worker')
+    if isinstance(runner, MultiprocessRunner):
+        workers = runner.max_workers
+        if not workers:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        for i in range(workers):
+            runner.call(profile_worker, worker_prefix, seconds, interval,
+                memoize=False)
+    main_path = os.path.join(temp_dir, 'ioloop')
+    def stop():
+        profiler.stop()
+        profiler.save(main_path)
+        # Give the workers a moment to save their results before merging:
+        io_loop.add_timeout(time.time() + 1, finish)
+    def finish():
+        paths = [main_path] + glob(worker_prefix + '.*')
+        try:
+            merge(paths, path)
+        finally:
+            for temp_path in paths:
+                os.remove(temp_path)
+            os.rmdir(temp_dir)
+        samples = 0
+        with open(path) as f:
+            for line in f:
+                samples += int(line.rsplit(' ', 1)[1])
+        logging.info(_("Profiling complete (%s samples): %s") % (
+            samples, path))
+        callback(samples)
+    io_loop.add_timeout(time.time() + seconds, stop)
@@ -337,6 +337,7 @@ import socket
 import pty
 import atexit
 import ssl
+import fcntl
 import hashlib
 import copy
 from functools import partial
@@ -367,6 +368,8 @@ try:
     import tornado.template
     import tornado.netutil
     from tornado.websocket import WebSocketHandler, WebSocketClosedError
+    from tornado.iostream import StreamClosedError
+    from tornado import gen
     from tornado.escape import json_decode
     from tornado.options import options
     from tornado import locale
@@ -408,9 +411,13 @@ from .utils import merge_handlers, none_fix, convert_to_timedelta, short_hash
 from .utils import json_encode, recursive_chown, ChownError, get_or_cache
 from .utils import write_pid, read_pid, remove_pid, drop_privileges
 from .utils import check_write_permissions, valid_hostname
-from .utils import total_seconds, MEMO, bind
+from .utils import total_seconds, MEMO, bind, convert_to_bytes
 from .configuration import apply_cli_overrides, define_options, SettingsError
-from .configuration import get_settings
+from .configuration import get_settings, settings_generation
+from .filewatch import FileWatcher
+from . import metrics
+from . import profiler
+from . import workers
 from onoff import OnOffMixin
 
 # Setup our base loggers (these get overwritten in main())
@@ -442,6 +449,8 @@ TIMEOUT = timedelta(days=5) # Gets overridden by options.session_timeout
 SESSION_WATCHER = None
 CLEANER = None # Log and leftover session data cleaner PeriodicCallback
 FILE_CACHE = {}
+CPU_ASYNC = None # Replaced with a MultiprocessRunner (or ThreadedRunner) in main()
+IO_ASYNC = None # Replaced with a ThreadedRunner in main()
 APPLICATIONS = {}
 PLUGINS = {}
 PLUGIN_HOOKS = {} # Gives plugins the ability to hook into various things.
@@ -590,6 +599,16 @@ def policy_list_users(cls, policy):
     cls.error = _("You do not have permission to list connected users.")
     return policy.get('list_users', True)
 
+def policy_profile_server(cls, policy):
+    """
+    Called by :func:`gateone_policies`, returns True if the user is
+    authorized to profile the Gate One server via the
+    :meth:`ApplicationWebSocket.start_profiler` method.  It makes this
+    determination by checking the `['gateone']['profile_server']` policy.
+    """
+    cls.error = _("You do not have permission to profile the server.")
+    return policy.get('profile_server', False) # Default deny
+
 def gateone_policies(cls):
     """
     This function gets registered under 'gateone' in the
@@ -602,6 +621,7 @@ def gateone_policies(cls):
 
         * Who can send messages to other users (including broadcasts).
         * Who can retrieve a list of connected users.
+        * Who can profile the server (nobody unless explicitly allowed).
     """
     instance = cls.instance # ApplicationWebSocket instance
     function = cls.function # Wrapped function
@@ -610,11 +630,16 @@ def gateone_policies(cls):
     policy_functions = {
         'send_user_message': policy_send_user_message,
         'broadcast': policy_broadcast,
-        'list_server_users': policy_list_users
+        'list_server_users': policy_list_users,
+        'start_profiler': policy_profile_server,
     }
+    # These are only allowed if a policy explicitly says so:
+    admin_functions = ('start_profiler',)
     user = instance.current_user
     policy = applicable_policies('gateone', user, instance.ws.policies)
     if not policy: # Empty RUDict
+        if function.__name__ in admin_functions:
+            return policy_functions[function.__name__](cls, policy)
         return True # A world without limits!
     if function.__name__ in policy_functions:
         return policy_functions[function.__name__](cls, policy)
@@ -679,6 +704,8 @@ def timeout_sessions():
             if SESSION_WATCHER:
                 SESSION_WATCHER.stop() # Stop ourselves
                 SESSION_WATCHER = None # So authenticate() will know to start it
+            # No point in watching files if no one is connected:
+            ApplicationWebSocket._stop_file_watcher()
         for session in list(SESSIONS.keys()):
             if "last_seen" not in SESSIONS[session]:
                 # Session is in the process of being created.  We'll check it
@@ -696,6 +723,8 @@ def timeout_sessions():
                         for callback in SESSIONS[session]["timeout_callbacks"]:
                             callback(session)
                 del SESSIONS[session]
+                if workers.REGISTRY:
+                    workers.REGISTRY.unregister(session)
     except Exception as e:
         logger.error(_(
             "Exception encountered in timeout_sessions(): {exception}".format(
@@ -918,9 +947,38 @@ class DownloadHandler(BaseHandler):
     these files are generated by the terminal emulator (e.g. cat somefile.pdf)
     but it can be used by applications and plugins as a way to serve up
     all sorts of (temporary/transient) files to users.
+
+    Files are streamed to the client in `chunk_size` chunks (so memory use
+    stays constant regardless of the size of the file) and single HTTP
+    ``Range`` requests are supported (so interrupted downloads can be resumed).
+    If a gzip-compressed copy of the file exists alongside it (e.g.
+    ``recording.html.gz``) and the client accepts gzip it will be sent instead.
+
+    .. note::
+
+        Files are always sent exactly as they are on disk (Tornado's
+        on-the-fly gzip compression is disabled for this handler) so
+        ``Content-Length``, ``Content-Range``, and ``Etag`` always refer to the
+        bytes being sent.
     """
     # NOTE:  This is a modified version of torando.web.StaticFileHandler
+    chunk_size = 64 * 1024
+
+    def prepare(self):
+        """
+        Removes Tornado's `~tornado.web.GZipContentEncoding` transform (if
+        the ``gzip`` setting enabled it) so it doesn't re-compress what we send.
+        """
+        self._transforms = [
+            t for t in self._transforms
+            if not isinstance(t, tornado.web.GZipContentEncoding)]
+
+    @tornado.web.authenticated
+    def head(self, path):
+        return self.get(path, include_body=False)
+
     @tornado.web.authenticated
+    @gen.coroutine
     def get(self, path, include_body=True):
         session_dir = self.settings['session_dir']
         user = self.current_user
@@ -929,47 +987,144 @@ class DownloadHandler(BaseHandler):
         else:
             logger.error(_("DownloadHandler: Could not determine use session"))
             return # Something is wrong
-        filepath = os.path.join(session_dir, session, 'downloads', path)
+        downloads_dir = os.path.join(session_dir, session, 'downloads')
+        filepath = os.path.join(downloads_dir, path)
         abspath = os.path.abspath(filepath)
+        if not abspath.startswith(os.path.abspath(downloads_dir) + os.sep):
+            raise tornado.web.HTTPError(403, "%s is not a file", path)
         if not os.path.exists(abspath):
             self.set_status(404)
             self.write(self.get_error_html(404))
             return
         if not os.path.isfile(abspath):
             raise tornado.web.HTTPError(403, "%s is not a file", path)
-        import stat, mimetypes
-        stat_result = os.stat(abspath)
-        modified = datetime.fromtimestamp(stat_result[stat.ST_MTIME])
-        self.set_header("Last-Modified", modified)
+        import mimetypes
         mime_type, encoding = mimetypes.guess_type(abspath)
         if mime_type:
             self.set_header("Content-Type", mime_type)
+        variant = self.get_variant(abspath)
+        stat_result = os.stat(variant)
+        size = stat_result.st_size
+        modified = datetime.fromtimestamp(int(stat_result.st_mtime))
+        etag = '"%x-%x"' % (int(stat_result.st_mtime), size)
+        if variant != abspath: # Each representation gets its own ETag
+            etag = etag[:-1] + '-gzip"'
+        self.set_header("Last-Modified", modified)
+        self.set_header("Etag", etag)
+        self.set_header("Accept-Ranges", "bytes")
         # Set the Cache-Control header to private since this file is not meant
         # to be public.
         self.set_header("Cache-Control", "private")
         # Add some additional headers
         self.set_header('Access-Control-Allow-Origin', '*')
-        # Check the If-Modified-Since, and don't send the result if the
-        # content has not been modified
+        if self.not_modified(etag, modified):
+            self.set_status(304)
+            return
+        start, end = 0, size
+        byte_range = self.get_range(etag, modified, size)
+        if byte_range is False:
+            self.set_status(416) # Range Not Satisfiable
+            self.set_header("Content-Range", "bytes */%s" % size)
+            return
+        elif byte_range:
+            start, end = byte_range
+            self.set_status(206) # Partial Content
+            self.set_header(
+                "Content-Range", "bytes %s-%s/%s" % (start, end - 1, size))
+        self.set_header("Content-Length", end - start)
+        if not include_body:
+            assert self.request.method == "HEAD"
+            return
+        # Finally, deliver the file (one chunk at a time)
+        with io.open(variant, "rb") as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break # File got truncated while we were sending it
+                remaining -= len(chunk)
+                self.write(chunk)
+                try:
+                    yield self.flush()
+                except StreamClosedError:
+                    return # Client went away
+
+    def get_variant(self, abspath):
+        """
+        Returns the path to the pre-compressed (.gz) variant of *abspath* if
+        the client accepts gzip encoding and it is up-to-date.  Otherwise
+        *abspath* is returned as-is.
+        """
+        self.set_header("Vary", "Accept-Encoding")
+        accept_encoding = self.request.headers.get("Accept-Encoding", "")
+        if 'gzip' not in accept_encoding:
+            return abspath
+        gz_path = abspath + '.gz'
+        try:
+            if os.stat(gz_path).st_mtime < os.stat(abspath).st_mtime:
+                return abspath # Stale
+        except OSError:
+            return abspath # No .gz
+        self.set_header("Content-Encoding", "gzip")
+        return gz_path
+
+    def not_modified(self, etag, modified):
+        """
+        Returns `True` if the client's cached copy (as indicated by its
+        ``If-None-Match`` or ``If-Modified-Since`` headers) is still good.
+        """
+        inm_value = self.request.headers.get("If-None-Match")
+        if inm_value is not None:
+            etags = [e.strip() for e in inm_value.split(',')]
+            return etag in etags or '*' in etags
         ims_value = self.request.headers.get("If-Modified-Since")
         if ims_value is not None:
             import email.utils
             date_tuple = email.utils.parsedate(ims_value)
-            if_since = datetime.fromtimestamp(time.mktime(date_tuple))
-            if if_since >= modified:
-                self.set_status(304)
-                return
-        # Finally, deliver the file
-        with io.open(abspath, "rb") as file:
-            data = file.read()
-            hasher = hashlib.sha1()
-            hasher.update(data)
-            self.set_header("Etag", '"%s"' % hasher.hexdigest())
-            if include_body:
-                self.write(data)
+            if date_tuple:
+                if_since = datetime.fromtimestamp(time.mktime(date_tuple))
+                return if_since >= modified
+        return False
+
+    def get_range(self, etag, modified, size):
+        """
+        Parses the request's ``Range`` header and returns the ``(start, end)``
+        (end is exclusive) of the requested bytes.  Returns `None` if the
+        whole file should be sent or `False` if the range can't be satisfied.
+
+        Only single ranges are supported (multiple ranges will result in the
+        whole file being sent which is allowed by RFC 7233).  Invalid ranges
+        (e.g. 'bytes=5-3') are ignored as are ranges of empty files.
+        """
+        range_value = self.request.headers.get("Range", "")
+        if not range_value.startswith("bytes=") or ',' in range_value:
+            return None
+        if_range = self.request.headers.get("If-Range")
+        if if_range and if_range != etag:
+            import email.utils
+            date_tuple = email.utils.parsedate(if_range)
+            if not date_tuple: # Must be an ETag that doesn't match
+                return None
+            if datetime.fromtimestamp(time.mktime(date_tuple)) != modified:
+                return None # File changed; send the whole thing
+        if not size:
+            return None # Nothing to take a range of
+        start, sep, end = range_value[6:].strip().partition('-')
+        try:
+            if not start: # Suffix range (e.g. 'bytes=-500' means last 500)
+                start = max(size - int(end), 0)
+                end = size
             else:
-                assert self.request.method == "HEAD"
-                self.set_header("Content-Length", len(data))
+                start = int(start)
+                end = int(end) + 1 if end else size
+        except ValueError:
+            return None # Invalid ranges are ignored
+        if start < 0 or end < start:
+            return None # e.g. 'bytes=5-3' (also invalid)
+        if start >= size:
+            return False # Valid but not satisfiable
+        return (start, min(end, size))
 
     def get_error_html(self, status_code, **kwargs):
         self.require_setting("static_url")
@@ -986,6 +1141,84 @@ class DownloadHandler(BaseHandler):
             "message": httplib.responses[status_code],
         }
 
+class MetricsHandler(BaseHandler):
+    """
+    Serves up Gate One's runtime metrics (see :ref:`metrics.py`) in the
+    Prometheus text format.  Clients must either be logged in (i.e. have a
+    valid 'gateone_user' cookie while some form of authentication is enabled)
+    or use HTTP Basic authentication with one of the configured `api_keys`
+    (the API key as the username and its secret as the password).  The latter
+    is what you'll want to give your Prometheus server::
+
+        scrape_configs:
+          - job_name: 'gateone'
+            scheme: https
+            basic_auth:
+              username: <API key>
+              password: <secret>
+            static_configs:
+              - targets: ['gateone.company.com:443']
+    """
+    def api_key_authenticated(self):
+        """
+        Returns ``True`` if the client provided a valid API key and secret via
+        HTTP Basic authentication.
+        """
+        import base64, hmac
+        header = self.request.headers.get('Authorization', '')
+        if not header.startswith('Basic '):
+            return False
+        try:
+            credentials = base64.b64decode(header[6:]).decode('utf-8')
+            api_key, secret = credentials.split(':', 1)
+        except (TypeError, ValueError):
+            return False
+        api_keys = self.settings.get('api_keys') or {}
+        if api_key not in api_keys:
+            return False
+        return hmac.compare_digest(
+            api_keys[api_key].encode('utf-8'), secret.encode('utf-8'))
+
+    def get(self):
+        user = self.current_user
+        if not (user and self.settings.get('auth')) and (
+                not self.api_key_authenticated()):
+            self.set_header('WWW-Authenticate', 'Basic realm="Gate One"')
+            raise tornado.web.HTTPError(401)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.set_header('Cache-Control', 'no-cache')
+        self.write(metrics.render())
+
+def server_metrics():
+    """
+    Metrics collector (see :ref:`metrics.py`) for things that are tracked by
+    the server itself:  Sessions, WebSocket connections (and how much data is
+    waiting to be written to them), and the queue depth of `CPU_ASYNC` and
+    `IO_ASYNC`.
+    """
+    buffered = [
+        a.write_buffer_size for a in list(ApplicationWebSocket.instances)]
+    queues = []
+    for name, runner in (('cpu', CPU_ASYNC), ('io', IO_ASYNC)):
+        if runner and (name == 'io' or runner is not IO_ASYNC):
+            queues.append(({'runner': name}, runner.pending))
+    return [
+        ('gateone_sessions', 'gauge', 'Number of user sessions.',
+            [(None, len(SESSIONS))]),
+        ('gateone_websockets', 'gauge', 'Number of open WebSockets.',
+            [(None, len(buffered))]),
+        ('gateone_websocket_write_buffer_bytes', 'gauge',
+            'Bytes waiting to be written to WebSockets (total).',
+            [(None, sum(buffered))]),
+        ('gateone_websocket_write_buffer_max_bytes', 'gauge',
+            'Bytes waiting to be written to the most backed up WebSocket.',
+            [(None, max(buffered) if buffered else 0)]),
+        ('gateone_async_pending', 'gauge',
+            'Calls queued or running in CPU_ASYNC/IO_ASYNC.', queues),
+    ]
+
+metrics.add_collector(server_metrics)
+
 class MainHandler(BaseHandler):
     """
     Renders index.html which loads Gate One.
@@ -1184,10 +1417,13 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
     """
     instances = set()
     # These three attributes handle watching files for changes:
-    watched_files = {}     # Format: {<file path>: <modification time>}
-    file_update_funcs = {} # Format: {<file path>: <function called on update>}
-    file_watcher = None    # Will be replaced with a PeriodicCallback
+    file_watcher = FileWatcher()
+    # Format: {<file path>: <modification time>}
+    watched_files = file_watcher.watched_files
+    # Format: {<file path>: <function called on update>}
+    file_update_funcs = file_watcher.file_update_funcs
     prefs = {} # Gets updated with every call to initialize()
+    prefs_generation = 0 # settings_generation() when load_prefs() last ran
     def __init__(self, application, request, **kwargs):
         self.actions = {
             'go:ping': self.pong,
@@ -1206,6 +1442,7 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
             'go:set_dimensions': self.set_dimensions,
             'go:license_info': self.license_info,
             'go:debug': self.debug,
+            'go:start_profiler': self.start_profiler,
         }
         # Setup some instance-specific loggers that we can later update with
         # more metadata
@@ -1244,48 +1481,20 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
     @classmethod
     def file_checker(cls):
         """
-        A `Tornado.IOLoop.PeriodicCallback` that regularly checks all files
-        registered in the `ApplicationWebSocket.watched_files` dict for changes.
-
-        If changes are detected the corresponding function(s) in
+        Checks all files registered in the
+        `ApplicationWebSocket.watched_files` dict for changes right now.  If
+        changes are detected the corresponding function(s) in
         `ApplicationWebSocket.file_update_funcs` will be called.
+
+        .. note::
+
+            There's normally no need to call this since the
+            `ApplicationWebSocket.file_watcher` (a
+            :class:`~gateone.core.filewatch.FileWatcher`) will be notified of
+            changes by inotify (or regularly poll for them if inotify isn't
+            available).
         """
-        #logging.debug("file_checker()") # Noisy so I've commented it out
-        if not SESSIONS:
-            # No connected sessions; no point in watching files
-            cls.file_watcher.stop()
-            # Also remove the broadcast file so we know to start up the
-            # file_watcher again if a user connects.
-            session_dir = options.session_dir
-            broadcast_file = os.path.join(session_dir, 'broadcast') # Default
-            broadcast_file = cls.prefs['*']['gateone'].get(
-                'broadcast_file', broadcast_file) # If set, use that
-            del cls.watched_files[broadcast_file]
-            del cls.file_update_funcs[broadcast_file]
-            os.remove(broadcast_file)
-        for path, mtime in list(cls.watched_files.items()):
-            if not os.path.exists(path):
-                # Someone deleted something they shouldn't have
-                logger.error(_(
-                    "{path} has been removed.  Removing from file "
-                    "checker.".format(path=path)))
-                del cls.watched_files[path]
-                del cls.file_update_funcs[path]
-                continue
-            current_mtime = os.stat(path).st_mtime
-            if current_mtime == mtime:
-                continue
-            try:
-                cls.watched_files[path] = current_mtime
-                cls.file_update_funcs[path]()
-            except Exception as e:
-                logger.error(_(
-                    "Exception encountered trying to execute the file update "
-                    "function for {path}...".format(path=path)))
-                logger.error(e)
-                if options.logging == 'debug':
-                    import traceback
-                    traceback.print_exc(file=sys.stdout)
+        cls.file_watcher.check()
 
     @classmethod
     def watch_file(cls, path, func):
@@ -1293,13 +1502,32 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
         A classmethod that registers the given file *path* and *func* in
         `ApplicationWebSocket.watched_files` and
         `ApplicationWebSocket.file_update_funcs`, respectively.  The given
-        *func* will be called (by `ApplicationWebSocket.file_checker`) whenever
+        *func* will be called (by `ApplicationWebSocket.file_watcher`) whenever
         the file at *path* is modified.
         """
         logging.debug("watch_file('{path}', {func}())".format(
             path=path, func=func.__name__))
-        cls.watched_files.update({path: os.stat(path).st_mtime})
-        cls.file_update_funcs.update({path: func})
+        cls.file_watcher.watch(path, func)
+
+    @classmethod
+    def _stop_file_watcher(cls):
+        """
+        Stops the `ApplicationWebSocket.file_watcher` and removes the broadcast
+        file so that :meth:`ApplicationWebSocket._start_file_watcher` knows to
+        start it up again when a user connects.  Called by
+        :func:`timeout_sessions` when there are no more user sessions (no point
+        in watching files if no one is around).
+        """
+        if not cls.file_watcher.running:
+            return
+        cls.file_watcher.stop()
+        session_dir = options.session_dir
+        broadcast_file = os.path.join(session_dir, 'broadcast') # Default
+        broadcast_file = cls.prefs['*']['gateone'].get(
+            'broadcast_file', broadcast_file) # If set, use that
+        cls.file_watcher.unwatch(broadcast_file)
+        if os.path.exists(broadcast_file):
+            os.remove(broadcast_file)
 
     @classmethod
     def load_prefs(cls):
@@ -1310,18 +1538,26 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
         .. note::
 
             This ``classmethod`` gets called automatically whenever a change is
-            detected inside Gate One's ``settings_dir``.
+            detected inside Gate One's ``settings_dir``.  If the change didn't
+            actually modify any settings (according to
+            :func:`~gateone.core.configuration.settings_generation`) nothing
+            will be reloaded and the policy cache will be left alone.
         """
+        prefs = get_settings(options.settings_dir)
+        generation = settings_generation(options.settings_dir)
+        if generation == cls.prefs_generation:
+            # Something in the settings dir changed but not the settings
+            return
         logger.info(_(
-            "Settings have been modified.  Reloading from %s"
+            "Settings have been modified.  Reloaded from %s"
             % options.settings_dir))
-        prefs = get_settings(options.settings_dir)
         # Only overwrite our settings if everything is proper
         if 'gateone' not in prefs['*']:
             # NOTE: get_settings() records its own errors too
             logger.info(_("Settings have NOT been loaded."))
             return
         cls.prefs = prefs
+        cls.prefs_generation = generation
         # Reset the memoization dict so that everything using
         # applicable_policies() gets the latest & greatest settings
         MEMO.clear()
@@ -1374,8 +1610,15 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
         broadcast_file = os.path.join(session_dir, 'broadcast')
         broadcast_file = cls.prefs['*']['gateone'].get(
             'broadcast_file', broadcast_file)
-        with io.open(broadcast_file) as f:
+        with io.open(broadcast_file, 'r+') as f:
+            # When running more than one worker process they'll all notice the
+            # update; whoever gets the lock first empties the file and relays
+            # the message to the others.
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
             message = f.read()
+            if message:
+                f.seek(0)
+                f.truncate() # Empty it out
         if message:
             message = _("(Broadcast) %s") % message.rstrip()
             metadata = {'clients': []}
@@ -1392,7 +1635,6 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
             msg_log.info("Broadcast %s" % message, metadata=metadata)
             message_dict = {'go:user_message': message}
             cls._deliver(message_dict, upn="AUTHENTICATED")
-            io.open(broadcast_file, 'w').write(u'') # Empty it out
 
     def initialize(self, apps=None, **kwargs):
         """
@@ -1535,7 +1777,20 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
         parsed_origin = urlparse(origin)
         self.origin = parsed_origin.netloc.lower()
         host = self.request.headers.get("Host")
-        if self.origin == host: # Reality check: Do we care?
+        hosts = [host]
+        if workers.WORKER is not None and host and ':' in host:
+            # Clients get redirected to their worker's own port on the same
+            # host (from a page served on the main port) so the origin should
+            # match the Host as it would be on the main port
+            hostname, port = host.rsplit(':', 1)
+            main_port = self.settings['port']
+            if port == str(workers.worker_port(main_port)):
+                default_port = 443 if parsed_origin.scheme == 'https' else 80
+                if main_port == default_port:
+                    hosts.append(hostname)
+                else:
+                    hosts.append("%s:%s" % (hostname, main_port))
+        if self.origin in hosts: # Reality check: Do we care?
             # If the origin matches the "Host" header it means that the user is
             # legitimately accessing Gate One directly.  We really only need to
             # worry about origins if the connection is coming from some external
@@ -1760,6 +2015,9 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
             if not SESSIONS[user['session']]['client_ids']:
                 # Update 'last_seen' with a datetime object for accuracy
                 SESSIONS[user['session']]['last_seen'] = datetime.now()
+                if workers.REGISTRY:
+                    workers.REGISTRY.register(
+                        user['session'], user=user, connected=False)
         if user and 'upn' in user:
             self.auth_log.info(
                 _("WebSocket closed (%s %s).") % (user['upn'], client_address))
@@ -1773,6 +2031,26 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
                 app.on_close()
         self.trigger("go:close")
 
+    @property
+    def write_buffer_size(self):
+        """
+        The number of bytes that have been written to this WebSocket that are
+        still waiting to be sent to the client.
+        """
+        stream = getattr(self.ws_connection, 'stream', None)
+        return getattr(stream, '_write_buffer_size', 0)
+
+    def output_backlogged(self):
+        """
+        Returns True if more than the `max_client_buffer` setting worth of
+        data is waiting to be sent to the client (i.e. it's on a slow link and
+        isn't keeping up).  Applications can check this to avoid sending
+        messages that will be out of date by the time they arrive anyway (e.g.
+        intermediate screen updates).
+        """
+        limit = self.settings.get('max_client_buffer', 4194304)
+        return self.write_buffer_size > limit
+
     def on_pong(self, timestamp):
         """
         Records the latency of clients (from the server's perspective) via a
@@ -2195,6 +2473,22 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
                 self.write_message(json_encode(reauth))
                 return
         if self.current_user and 'session' in self.current_user:
+            if workers.WORKER is not None:
+                owner = workers.worker_for(self.current_user['session'])
+                if owner != workers.WORKER:
+                    # This session lives in another worker process; have the
+                    # client reconnect directly to that one
+                    url = workers.worker_url(
+                        self.request.host,
+                        self.settings['port'],
+                        owner,
+                        ssl=self.request.protocol == 'https',
+                        url_prefix=self.settings['url_prefix'])
+                    logging.debug(
+                        "Redirecting session to worker %s: %s" % (owner, url))
+                    message = {'go:reconnect_worker': url}
+                    self.write_message(json_encode(message))
+                    return
             self.session = self.current_user['session']
         else:
             self.auth_log.error(_("Authentication failed for unknown user"))
@@ -2247,6 +2541,9 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
             SESSIONS[self.session]['client_ids'].append(self.client_id)
             if self.location not in SESSIONS[self.session]['locations']:
                 SESSIONS[self.session]['locations'][self.location] = {}
+        if workers.REGISTRY:
+            workers.REGISTRY.register(
+                self.session, user=self.current_user, connected=True)
         # A shortcut:
         self.locations = SESSIONS[self.session]['locations']
         # Call applications' authenticate() functions (if any)
@@ -2351,9 +2648,8 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
 
     def _start_file_watcher(self):
         """
-        Starts up the :attr:`ApplicationWebSocket.file_watcher`
-        `~tornado.ioloop.PeriodicCallback` (which regularly calls
-        :meth:`ApplicationWebSocket.file_checker` and immediately starts it
+        Starts up the :attr:`ApplicationWebSocket.file_watcher` (a
+        :class:`~gateone.core.filewatch.FileWatcher`) and immediately starts it
         watching the broadcast file for changes (if not already watching it).
 
         The path to the broadcast file defaults to '*settings_dir*/broadcast'
@@ -2379,42 +2675,47 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
             maintenance in 5 minutes.  Pleas save your work." >
             /tmp/gateone/broadcast`
 
-        The interval in which it performs this check is controlled via the
-        `file_check_interval` setting. This setting is not included in
-        Gate One's 10server.conf by default but can be added if needed to
-        override the default value of 5 seconds.  Example:
+        On Linux the file watcher uses inotify so there's no periodic work
+        involved at all.  Everywhere else (or if inotify can't be initialized)
+        it will fall back to checking for changes every `file_check_interval`.
+        The backend can be forced via the `file_watch_backend` setting ("auto",
+        "inotify", or "poll") and events that arrive within the
+        `file_watch_debounce` window will be batched together (so a single save
+        only results in a single reload).  None of these settings are included
+        in Gate One's 10server.conf by default but they can be added if needed
+        to override the default values.  Example:
 
         .. code-block:: javascript
 
             {
                 "*": {
                     "gateone": {
-                        "file_check_interval": "5s"
+                        "file_check_interval": "5s",
+                        "file_watch_backend": "auto",
+                        "file_watch_debounce": "250"
                     }
                 }
             }
         """
         cls = ApplicationWebSocket
+        watcher = cls.file_watcher
         broadcast_file = os.path.join(self.settings['session_dir'], 'broadcast')
         broadcast_file = self.prefs['*']['gateone'].get(
             'broadcast_file', broadcast_file)
         if broadcast_file not in cls.watched_files:
             # No broadcast file means the file watcher isn't running
             touch(broadcast_file)
-            interval = self.prefs['*']['gateone'].get(
-                'file_check_interval', "5s")
-            td = convert_to_timedelta(interval)
-            interval = ((
-                td.microseconds +
-                (td.seconds + td.days * 24 * 3600) *
-                10**6) / 10**6) * 1000
+            gateone_prefs = self.prefs['*']['gateone']
+            interval = convert_to_timedelta(
+                gateone_prefs.get('file_check_interval', "5s"))
+            watcher.interval = total_seconds(interval) * 1000
+            watcher.debounce = convert_to_timedelta(
+                gateone_prefs.get('file_watch_debounce', "250"))
+            watcher.backend = gateone_prefs.get('file_watch_backend', 'auto')
             cls.watch_file(broadcast_file, cls.broadcast_file_update)
-            io_loop = tornado.ioloop.IOLoop.current()
-            cls.file_watcher = tornado.ioloop.PeriodicCallback(
-                cls.file_checker, interval, io_loop=io_loop)
-            cls.file_watcher.start()
         if options.settings_dir not in cls.watched_files:
             cls.watch_file(options.settings_dir, cls.load_prefs)
+        watcher.start()
 
     def list_applications(self):
         """
@@ -3476,7 +3777,7 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
         self.trigger('go:user_list', filtered_users)
 
     @classmethod
-    def _deliver(cls, message, upn="AUTHENTICATED", session=None):
+    def _deliver(cls, message, upn="AUTHENTICATED", session=None, relay=True):
         """
         Writes the given *message* (string) to all users matching *upn* using
         the write_message() function.  If *upn* is not provided or is
@@ -3484,6 +3785,10 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
 
         Alternatively a *session* ID may be specified instead of a *upn*.  This
         is useful when more than one user shares a UPN (i.e. ANONYMOUS).
+
+        If Gate One is running more than one worker process the *message* will
+        also be relayed to the users in the other workers (unless *relay* is
+        ``False``).
         """
         logging.debug("_deliver(%s, upn=%s, session=%s)" %
             (message, upn, session))
@@ -3498,12 +3803,17 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
                 instance.write_message(message)
             elif user and upn == user.get('upn', None):
                 instance.write_message(message)
+        if relay and workers.BUS:
+            workers.BUS.publish('deliver', message, upn=upn, session=session)
 
     @classmethod
     def _list_connected_users(cls):
         """
         Returns a tuple of user objects representing the users that are
         currently connected (and authenticated) to this Gate One server.
+
+        When running more than one worker process users connected to the other
+        workers will be included (one per session).
         """
         logging.debug("_list_connected_users()")
         out = []
@@ -3512,6 +3822,10 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
                 out.append(instance.current_user)
             except AttributeError:
                 continue
+        if workers.REGISTRY:
+            for info in workers.REGISTRY.sessions().values():
+                if info['worker'] != workers.WORKER and info['connected']:
+                    out.append(info['user'])
         return tuple(out)
 
     def license_info(self):
@@ -3592,6 +3906,76 @@ class ApplicationWebSocket(WebSocketHandler, OnOffMixin):
         except ImportError:
             pass # Oh well
 
+    @require(authenticated(), policies('gateone'))
+    def start_profiler(self, settings=None):
+        """
+        Runs the sampling profiler (see `gateone.core.profiler`) on the Gate
+        One server for *settings['seconds']* (default: 30, max: 600) and
+        tells the client where it can download the results when it's done
+        (via 'go:notice' and 'go:profile').  Only users with the
+        'profile_server' policy are allowed to execute this action.  Example:
+
+        .. code-block:: javascript
+
+            GateOne.ws.send(JSON.stringify({"go:start_profiler": {"seconds": 60}}));
+
+        The results will be saved in the user's 'logs' directory (e.g.
+        *user_dir*/<user>/logs/profiles/) and linked into their session's
+        'downloads' directory so they can be retrieved via `DownloadHandler`.
+        The file will be in the "collapsed stack" format which can be turned
+        into a flame graph with tools like FlameGraph or speedscope.
+        """
+        if not settings:
+            settings = {}
+        try:
+            seconds = int(settings.get('seconds', 30))
+        except (TypeError, ValueError):
+            seconds = 30
+        seconds = min(max(seconds, 1), 600)
+        upn = self.current_user['upn']
+        session = self.current_user['session']
+        now = datetime.now().strftime('%Y%m%d%H%M%S')
+        profile_dir = os.path.join(self.settings['user_dir'], upn, 'logs',
+            'profiles')
+        if not os.path.exists(profile_dir):
+            mkdir_p(profile_dir)
+        profile_path = os.path.join(profile_dir, '%s.collapsed' % now)
+        def done(samples):
+            filename = 'profile-%s.txt' % now
+            downloads = os.path.join(
+                self.settings['session_dir'], session, 'downloads')
+            if not os.path.exists(downloads):
+                mkdir_p(downloads)
+            link_path = os.path.join(downloads, filename)
+            try:
+                os.symlink(profile_path, link_path)
+            except OSError: # Not supported or it already exists; copy it
+                import shutil
+                shutil.copy(profile_path, link_path)
+            url = "%sdownloads/%s" % (self.base_url, filename)
+            message = {
+                'go:notice': _(
+                    "Profiling complete (%s samples): "
+                    "<a target='_blank' href='%s'>%s</a>") % (
+                        samples, url, filename),
+                'go:profile': {'url': url, 'samples': samples},
+            }
+            try:
+                self.write_message(message)
+            except WebSocketClosedError:
+                pass # They can still get it from their logs directory
+        try:
+            profiler.profile(seconds, profile_path, done, runner=CPU_ASYNC)
+        except profiler.ProfilerBusy:
+            self.write_message({'go:notice': _(
+                "The profiler is already running.  Try again later.")})
+            return
+        self.logger.info(_(
+            "Profiling the server for %s seconds (requested by %s)") % (
+                seconds, upn))
+        self.write_message({'go:notice': _(
+            "Profiling the server for %s seconds...") % seconds})
+
 class ErrorHandler(tornado.web.RequestHandler):
     """
     Generates an error response with status_code for all requests.
@@ -3695,6 +4079,7 @@ class GateOneApp(tornado.web.Application):
                 ApplicationWebSocket, dict(apps=APPLICATIONS)),
             (r"%sauth" % url_prefix, AuthHandler),
             (r"%sdownloads/(.*)" % url_prefix, DownloadHandler),
+            (r"%smetrics" % url_prefix, MetricsHandler),
             (r"%sdocs/(.*)" % url_prefix, tornado.web.StaticFileHandler, {
                 "path": docs_path,
                 "default_filename": "index.html"
@@ -4437,6 +4822,8 @@ def main(installed=True):
             continue # These don't belong
         if option not in go_settings:
             go_settings[option] = options[option]
+    go_settings['max_client_buffer'] = convert_to_bytes(
+        str(go_settings['max_client_buffer']))
     https_server = tornado.httpserver.HTTPServer(
         GateOneApp(settings=go_settings, web_handlers=web_handlers),
         ssl_options=ssl_options)
@@ -4460,8 +4847,13 @@ def main(installed=True):
         logger.info(_("Gate One has been configured."))
         sys.exit(0)
     try: # Start your engines!
+        # NOTE: Sockets get bound up front (instead of using listen()) so they
+        # can be shared by all the worker processes (if processes > 1).
+        sockets = []
+        redirect_sockets = []
+        listen_addresses = [] # So the workers can listen on their own ports
         if go_settings.get('enable_unix_socket', False):
-            https_server.add_socket(
+            sockets.append(
                 tornado.netutil.bind_unix_socket(
                     go_settings['unix_socket_path'],
                     # Tornado uses octal encoding
@@ -4489,12 +4881,15 @@ def main(installed=True):
                             "http://{addr}:80/ will be redirected to...".format(
                                 addr=addr)
                         ))
-                        https_redirect.listen(port=80, address=addr)
+                        redirect_sockets.extend(
+                            tornado.netutil.bind_sockets(80, address=addr))
                     logger.info(_(
                         "Listening on {proto}{address}:{port}/".format(
                             proto=proto, address=addr, port=go_settings['port'])
                     ))
-                    https_server.listen(port=go_settings['port'], address=addr)
+                    sockets.extend(tornado.netutil.bind_sockets(
+                        go_settings['port'], address=addr))
+                    listen_addresses.append(addr)
         elif address == '':
             # Listen on all addresses (including IPv6)
             if go_settings['https_redirect']:
@@ -4504,14 +4899,29 @@ def main(installed=True):
                         "  Please pick one or the other."))
                     sys.exit(1)
                 logger.info(_("http://*:80/ will be redirected to..."))
-                https_redirect.listen(port=80, address="")
+                redirect_sockets.extend(
+                    tornado.netutil.bind_sockets(80, address=""))
             logger.info(_(
                 "Listening on {proto}*:{port}/".format(
                     proto=proto, port=go_settings['port'])))
             try: # Listen on all IPv4 and IPv6 addresses
-                https_server.listen(port=go_settings['port'], address="")
+                sockets.extend(tornado.netutil.bind_sockets(
+                    go_settings['port'], address=""))
+                listen_addresses.append("")
             except socket.error: # Fall back to all IPv4 addresses
-                https_server.listen(port=go_settings['port'], address="0.0.0.0")
+                sockets.extend(tornado.netutil.bind_sockets(
+                    go_settings['port'], address="0.0.0.0"))
+                listen_addresses.append("0.0.0.0")
+        processes = go_settings.get('processes', 1) or 1
+        worker_sockets = {} # Each worker also gets a port of its own
+        if processes > 1:
+            for worker_id in range(processes):
+                worker_port = workers.worker_port(
+                    go_settings['port'], worker_id)
+                worker_sockets[worker_id] = []
+                for addr in listen_addresses:
+                    worker_sockets[worker_id].extend(
+                        tornado.netutil.bind_sockets(worker_port, address=addr))
         # NOTE:  To have Gate One *not* listen on a TCP/IP address you may set
         #        address=None
         # Check to see what group owns /dev/pts and use that for supl_groups
@@ -4525,6 +4935,33 @@ def main(installed=True):
         os.close(tempfd2)
         if uid != os.getuid():
             drop_privileges(uid, gid, [tty_gid])
+        write_pid(go_settings['pid_file'])
+        pid = read_pid(go_settings['pid_file'])
+        logger.info(_("Process running with pid " + pid))
+        if processes > 1:
+            workers_dir = os.path.join(go_settings['session_dir'], 'workers')
+            logger.info(_(
+                "Starting {0} worker processes...").format(processes))
+            # NOTE: Only the worker processes return from fork_workers()
+            worker_id = workers.fork_workers(processes, workers_dir)
+            for other_id, other_sockets in worker_sockets.items():
+                if other_id == worker_id:
+                    https_server.add_sockets(other_sockets)
+                    continue
+                for sock in other_sockets:
+                    sock.close()
+            workers.start(workers_dir)
+            workers.BUS.on('deliver',
+                partial(ApplicationWebSocket._deliver, relay=False))
+            logger.info(_(
+                "Worker {worker} running with pid {pid} (port {port})").format(
+                    worker=worker_id,
+                    pid=os.getpid(),
+                    port=workers.worker_port(go_settings['port'])))
+        https_server.add_sockets(sockets)
+        if redirect_sockets:
+            tornado.httpserver.HTTPServer(https_redirect).add_sockets(
+                redirect_sockets)
         global CPU_ASYNC
         global IO_ASYNC
         IO_ASYNC = ThreadedRunner()
@@ -4558,9 +4995,6 @@ def main(installed=True):
             if CPU_ASYNC != IO_ASYNC:
                 CPU_ASYNC.shutdown(wait=False)
             IO_ASYNC.shutdown(wait=False)
-        write_pid(go_settings['pid_file'])
-        pid = read_pid(go_settings['pid_file'])
-        logger.info(_("Process running with pid " + pid))
         tornado.ioloop.IOLoop.instance().start()
     except socket.error as e:
         import errno, pwd
@@ -4588,12 +5022,13 @@ def main(installed=True):
         logger.info(_("Caught KeyboardInterrupt.  Killing sessions..."))
     finally:
         tornado.ioloop.IOLoop.instance().stop()
-        import shutil
-        logger.info(_(
-            "Clearing cache_dir: {0}").format(go_settings['cache_dir']))
-        shutil.rmtree(go_settings['cache_dir'], ignore_errors=True)
-        remove_pid(go_settings['pid_file'])
-        logger.info(_("pid file removed."))
+        if workers.WORKER is None: # Workers leave this to the main process
+            import shutil
+            logger.info(_(
+                "Clearing cache_dir: {0}").format(go_settings['cache_dir']))
+            shutil.rmtree(go_settings['cache_dir'], ignore_errors=True)
+            remove_pid(go_settings['pid_file'])
+            logger.info(_("pid file removed."))
 
 if __name__ == "__main__":
     main()
@@ -151,21 +151,22 @@ class AutoExpireDict(dict):
     .. note::
 
         Only works if there's a running instances of `tornado.ioloop.IOLoop`.
+        The `~tornado.ioloop.PeriodicCallback` gets created (using
+        ``IOLoop.current()``) when the first key is added so creating an
+        `AutoExpireDict` at import time won't create an IOLoop (which would
+        prevent Gate One from forking worker processes).
     """
     def __init__(self, *args, **kwargs):
-        self.io_loop = IOLoop.current()
+        self._key_watcher = None
         self.creation_times = {}
         if 'timeout' in kwargs:
             self.timeout = kwargs.pop('timeout')
         if 'interval' in kwargs:
             self.interval = kwargs.pop('interval')
         super(AutoExpireDict, self).__init__(*args, **kwargs)
-        # Set the start time on every key
+        # Set the start time on every key (also starts the key watcher)
         for k in self.keys():
-            self.creation_times[k] = datetime.now()
-        self._key_watcher = PeriodicCallback(
-            self._timeout_checker, self.interval, io_loop=self.io_loop)
-        self._key_watcher.start() # Will shut down at the next interval if empty
+            self.renew(k)
 
     @property
     def timeout(self):
@@ -204,11 +205,30 @@ class AutoExpireDict(dict):
         if isinstance(value, timedelta):
             value = total_seconds(value) * 1000 # PeriodicCallback uses ms
         self._interval = value
-        # Restart the PeriodicCallback
-        if hasattr(self, '_key_watcher'):
+        # Restart the PeriodicCallback (if running) with the new interval
+        if getattr(self, '_key_watcher', None):
+            self._key_watcher.stop()
+            self._key_watcher = None
+            if self.creation_times:
+                self._start_key_watcher()
+
+    def _start_key_watcher(self):
+        """
+        Starts up the key watcher (``self._key_watcher``) if it isn't already
+        running.
+        """
+        if not self._key_watcher:
+            self._key_watcher = PeriodicCallback(
+                self._timeout_checker, self.interval)
+        if not self._key_watcher._running:
+            self._key_watcher.start()
+
+    def _stop_key_watcher(self):
+        """
+        Stops the key watcher (``self._key_watcher``) if it is running.
+        """
+        if self._key_watcher:
             self._key_watcher.stop()
-        self._key_watcher = PeriodicCallback(
-            self._timeout_checker, value, io_loop=self.io_loop)
 
     def renew(self, key):
         """
@@ -216,8 +236,7 @@ class AutoExpireDict(dict):
         """
         self.creation_times[key] = datetime.now() # Set/renew the start time
         # Start up the key watcher if it isn't already running
-        if not self._key_watcher._running:
-            self._key_watcher.start()
+        self._start_key_watcher()
 
     def __setitem__(self, key, value):
         """
@@ -239,7 +258,7 @@ class AutoExpireDict(dict):
         Ensures that our `tornado.ioloop.PeriodicCallback`
         (``self._key_watcher``) gets stopped.
         """
-        self._key_watcher.stop()
+        self._stop_key_watcher()
 
     def update(self, *args, **kwargs):
         """
@@ -257,19 +276,20 @@ class AutoExpireDict(dict):
         super(AutoExpireDict, self).clear()
         self.creation_times.clear()
         # Shut down the key watcher right away
-        self._key_watcher.stop()
+        self._stop_key_watcher()
 
     def _timeout_checker(self):
         """
         Walks ``self`` and removes keys that have passed the expiration point.
         """
         if not self.creation_times:
-            self._key_watcher.stop() # Nothing left to watch
+            self._stop_key_watcher() # Nothing left to watch
         for key, starttime in list(self.creation_times.items()):
             if datetime.now() - starttime > self.timeout:
                 del self[key]
 
 MEMO = {}
+MEMO_STATS = {'hits': 0, 'misses': 0} # How often MEMO saved us a call
 class memoize(object):
     """
     A memoization decorator that works with multiple arguments as well as
@@ -294,9 +314,11 @@ class memoize(object):
         if string not in MEMO:
             # Commented out because it is REALLY noisy.  Uncomment to debug
             #logging.debug("memoize cache miss (%s)" % self.fn.__name__)
+            MEMO_STATS['misses'] += 1
             MEMO[string] = self.fn(*args, **kwargs)
-        #else:
+        else:
             #logging.debug("memoize cache hit (%s)" % self.fn.__name__)
+            MEMO_STATS['hits'] += 1
         return MEMO[string]
 
 # Functions
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+# Meta
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+__doc__ = """
+.. _workers.py:
+
+Worker Processes
+================
+Lets Gate One spread its users over several processes (the `processes`
+setting) so a single busy IOLoop doesn't wind up limiting everyone.  Here's
+how it works:
+
+    * The listening sockets are bound once and shared by all the workers (they
+      get forked via `tornado.process.fork_processes` after that).  Whichever
+      worker the kernel hands a new connection to will serve the page and
+      accept the WebSocket.
+    * Every session belongs to exactly one worker (see `worker_for`).  If the
+      WebSocket that authenticates a session lands on the wrong worker the
+      client gets sent a `go:reconnect_worker` message telling it to reconnect
+      directly to the right one.  Each worker listens on its own port for this
+      purpose (`worker_port`).  This keeps all of a session's terminals (and
+      its entry in `SESSIONS` and `PERSIST`) inside a single process.
+    * Things that need to reach users in other workers (broadcasts, user
+      messages) are relayed over a `WorkerBus`: A Unix datagram socket per
+      worker inside the `session_dir`.
+    * A `SessionRegistry` (files in the `session_dir`) keeps track of which
+      sessions (and users) live where so things like
+      :meth:`~gateone.core.server.ApplicationWebSocket.list_server_users` can
+      see the whole server.
+
+When `processes` is 1 (the default) none of this gets used and `WORKER` will
+remain ``None``.
+
+Docstrings
+----------
+"""
+
+# Python stdlib
+import os, io, json, socket, errno, hashlib, logging, tempfile
+
+# Tornado stuff
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado import process
+
+# Our stuff
+from onoff import OnOffMixin
+
+# Globals
+WORKER = None # The ID of this worker process (None == not using workers)
+PROCESSES = 1 # Total number of worker processes
+BUS = None # WorkerBus instance (once started)
+REGISTRY = None # SessionRegistry instance (once started)
+MAX_DATAGRAM = 65507 # Bigger messages can't be relayed
+
+def worker_for(session, processes=None):
+    """
+    Returns the ID of the worker that *session* belongs to.  The same session
+    always maps to the same worker (for a given number of *processes*; default
+    is `PROCESSES`).
+    """
+    if processes is None:
+        processes = PROCESSES
+    if not isinstance(session, bytes):
+        session = session.encode('utf-8')
+    return int(hashlib.sha1(session).hexdigest(), 16) % processes
+
+def worker_port(port, worker_id=None):
+    """
+    Returns the port that *worker_id* (default: this worker) listens on for
+    direct connections.  Workers use the ports immediately following the main
+    *port* (e.g. 8001, 8002 for two workers on port 8000).
+    """
+    if worker_id is None:
+        worker_id = WORKER
+    return port + 1 + worker_id
+
+def worker_url(host, port, worker_id, ssl=True, url_prefix='/'):
+    """
+    Returns the WebSocket URL of *worker_id* given the *host* (i.e. the Host
+    header; the port will be replaced) and main *port* the client connected to.
+    """
+    hostname = host
+    if hostname.startswith('['): # IPv6 address
+        hostname = hostname[:hostname.index(']') + 1]
+    elif ':' in hostname:
+        hostname = hostname.rsplit(':', 1)[0]
+    return "{proto}://{hostname}:{port}{url_prefix}ws".format(
+        proto="wss" if ssl else "ws",
+        hostname=hostname,
+        port=worker_port(port, worker_id),
+        url_prefix=url_prefix)
+
+def fork_workers(processes, workers_dir):
+    """
+    Forks *processes* worker processes (via
+    `tornado.process.fork_processes`) and returns the ID of the worker we're
+    running in.  The parent process never returns from this function; it sticks
+    around to restart any workers that die unexpectedly.
+
+    The bus sockets and registry in *workers_dir* get cleaned out (they're all
+    stale at this point) before forking.
+    """
+    global WORKER
+    global PROCESSES
+    if os.path.isdir(workers_dir):
+        for dirpath, dirnames, filenames in os.walk(workers_dir):
+            for filename in filenames:
+                os.remove(os.path.join(dirpath, filename))
+    PROCESSES = processes
+    WORKER = process.fork_processes(processes)
+    return WORKER
+
+def start(workers_dir, io_loop=None):
+    """
+    Starts this worker's `WorkerBus` and `SessionRegistry` (stored as `BUS`
+    and `REGISTRY`).  Must be called after `fork_workers`.
+
+    Also starts keeping an eye on the main process; if it goes away (e.g. it
+    was killed) this worker's IOLoop will be stopped so it can shut down too.
+    """
+    global BUS
+    global REGISTRY
+    io_loop = io_loop or IOLoop.current()
+    BUS = WorkerBus(workers_dir, WORKER, PROCESSES, io_loop=io_loop)
+    BUS.start()
+    REGISTRY = SessionRegistry(os.path.join(workers_dir, 'sessions'), WORKER)
+    parent = os.getppid()
+    def check_parent():
+        if os.getppid() != parent:
+            logging.info(
+                "Worker %s: Main process has exited.  Shutting down." % WORKER)
+            io_loop.stop()
+    PeriodicCallback(check_parent, 5000).start()
+
+class WorkerBus(OnOffMixin):
+    """
+    A simple message bus between the worker processes.  Each worker binds a
+    Unix datagram socket at ``<bus_dir>/<worker_id>.sock``;  :meth:`publish`
+    sends a message to all the *other* workers which will :meth:`trigger` the
+    event of the same name when it arrives.  Example::
+
+        >>> bus = WorkerBus('/tmp/gateone/workers', 0, 4)
+        >>> bus.start()
+        >>> bus.on('deliver', deliver_locally)
+        >>> bus.publish('deliver', message, upn='AUTHENTICATED')
+
+    Arguments must be JSON-serializable.  Delivery is best-effort (it's a local
+    socket so they'll only be dropped if a worker isn't keeping up or isn't
+    running).
+    """
+    def __init__(self, bus_dir, worker_id, processes, io_loop=None):
+        self.bus_dir = bus_dir
+        self.worker_id = worker_id
+        self.processes = processes
+        self.io_loop = io_loop
+        self.sock = None
+
+    def socket_path(self, worker_id):
+        """Returns the path to the bus socket of *worker_id*."""
+        return os.path.join(self.bus_dir, '%s.sock' % worker_id)
+
+    def start(self):
+        """
+        Binds our socket and starts listening for messages from other workers.
+        """
+        if not os.path.isdir(self.bus_dir):
+            os.makedirs(self.bus_dir, 0o700)
+        path = self.socket_path(self.worker_id)
+        if os.path.exists(path):
+            os.remove(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.bind(path)
+        if not self.io_loop:
+            self.io_loop = IOLoop.current()
+        self.io_loop.add_handler(
+            self.sock.fileno(), self._handle_read, IOLoop.READ)
+
+    def stop(self):
+        """Stops listening and removes our socket."""
+        if not self.sock:
+            return
+        self.io_loop.remove_handler(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        try:
+            os.remove(self.socket_path(self.worker_id))
+        except OSError:
+            pass
+
+    def publish(self, event, *args, **kwargs):
+        """
+        Sends *event* (along with *args* and *kwargs*) to all the other workers.
+        """
+        message = json.dumps([event, args, kwargs]).encode('utf-8')
+        if len(message) > MAX_DATAGRAM:
+            logging.error(
+                "WorkerBus: %s message too large to relay (%s bytes)" % (
+                    event, len(message)))
+            return
+        for worker_id in range(self.processes):
+            if worker_id == self.worker_id:
+                continue
+            try:
+                self.sock.sendto(message, self.socket_path(worker_id))
+            except socket.error as e:
+                # ENOENT/ECONNREFUSED: Worker hasn't started (or is restarting)
+                # EAGAIN: Worker isn't keeping up
+                logging.warning(
+                    "WorkerBus: Could not send %s to worker %s: %s" % (
+                        event, worker_id, e))
+
+    def _handle_read(self, fd, events):
+        """
+        Called by the IOLoop whenever there are messages waiting; triggers the
+        corresponding events.
+        """
+        while True:
+            try:
+                data = self.sock.recv(MAX_DATAGRAM)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            try:
+                event, args, kwargs = json.loads(data.decode('utf-8'))
+            except ValueError:
+                logging.error("WorkerBus: Received a malformed message")
+                continue
+            kwargs = dict((str(k), v) for k, v in kwargs.items())
+            try:
+                self.trigger(event, *args, **kwargs)
+            except Exception as e:
+                logging.error(
+                    "WorkerBus: Error handling %s: %s" % (event, e))
+
+class SessionRegistry(object):
+    """
+    Keeps track of which worker each session lives in (and some details about
+    its user) so that workers can look up sessions belonging to other workers.
+    Each session is a small JSON file inside *registry_dir* that only the
+    owning worker (*worker_id*) writes to.
+    """
+    def __init__(self, registry_dir, worker_id):
+        self.registry_dir = registry_dir
+        self.worker_id = worker_id
+        if not os.path.isdir(registry_dir):
+            os.makedirs(registry_dir, 0o700)
+
+    def register(self, session, **info):
+        """
+        Records that *session* lives in this worker along with *info* (e.g.
+        the user's 'upn' and whether or not they're 'connected').
+        """
+        info['worker'] = self.worker_id
+        fd, temp_path = tempfile.mkstemp(dir=self.registry_dir, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(info).encode('utf-8'))
+        os.rename(temp_path, os.path.join(self.registry_dir, session))
+
+    def unregister(self, session):
+        """Removes *session* from the registry."""
+        try:
+            os.remove(os.path.join(self.registry_dir, session))
+        except OSError:
+            pass
+
+    def lookup(self, session):
+        """
+        Returns the info registered for *session* or ``None`` if it isn't
+        registered.
+        """
+        try:
+            with io.open(os.path.join(self.registry_dir, session), 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def sessions(self):
+        """
+        Returns a dict of all registered sessions and their info.
+        """
+        out = {}
+        for session in os.listdir(self.registry_dir):
+            if session.startswith('.'):
+                continue # Still being written
+            info = self.lookup(session)
+            if info:
+                out[session] = info
+        return out
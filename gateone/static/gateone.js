@@ -2524,6 +2524,21 @@ GateOne.Base.update(GateOne.Net, {
             takeAction();
         }
     },
+    reconnectWorker: function(url) {
+        /**:GateOne.Net.reconnectWorker(url)
+
+        Called when the Gate One server is running more than one worker process and our session lives in a different one than the one we connected to.  Reconnects directly to the given *url* (our worker).
+        */
+        logDebug("GateOne.Net.reconnectWorker(" + url + ")");
+        go.Net.workerURL = url;
+        clearTimeout(go.Net.sslErrorTimeout);
+        go.Net.sslErrorTimeout = null;
+        go.ws.onclose = function() { // Don't want connectionError() to be called
+            logDebug(gettext("WebSocket Closed"));
+        }
+        go.ws.close();
+        go.Net.connect();
+    },
     sendDimensions: function(term, /*opt*/ctrl_l) {
         /**:GateOne.Net.sendDimensions()
 
@@ -2550,6 +2565,7 @@ GateOne.Base.update(GateOne.Net, {
         This function is attached to the WebSocket's ``onclose`` event and shouldn't be called directly.
         */
         go.Net.connectionProblem = true;
+        go.Net.workerURL = null; // Start over at the main URL (it'll redirect us)
         // Stop trying to ping the server since we're no longer connected
         clearInterval(go.Net.keepalivePing);
         go.Net.keepalivePing = null;
@@ -2615,6 +2631,10 @@ GateOne.Base.update(GateOne.Net, {
             }
             go.wsURL = "ws://" + host + "/ws";
         }
+        if (go.Net.workerURL) {
+            // The server told us to connect directly to our worker process
+            go.wsURL = go.Net.workerURL;
+        }
         logDebug("GateOne.Net.connect(" + go.wsURL + ")");
         if (go.ws && go.ws.close) {
             go.ws.close();
@@ -2949,6 +2969,7 @@ go.Net.actions = {
     'go:blacklisted': go.Net.blacklisted,
     'go:locations': go.Net.locationsAction,
     'go:reauthenticate': go.Net.reauthenticate,
+    'go:reconnect_worker': go.Net.reconnectWorker,
  // This is here because it needs to happen before most calls to init():
     'go:register_translation': go.i18n.registerTranslationAction
 }
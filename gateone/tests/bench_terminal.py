@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+# Meta
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+__doc__ = """\
+Terminal Emulator Benchmarks
+============================
+Measures the performance of the `terminal.Terminal` emulator using the corpus
+of streams created by ``make_corpus.py`` (the corpus will be generated
+automatically if it doesn't exist).  For each stream and terminal size the
+following will be measured:
+
+    * ``write_mb_per_sec``: `Terminal.write` throughput (the stream is written
+      in chunks just like `termio` does it).
+    * ``dump_html_ms``: The average time it takes to call `Terminal.dump_html`
+      (it gets called every few chunks like it would be when clients are
+      getting screen updates).
+    * ``memory_kb``: How much the process' peak memory use (RSS) increased
+      while processing the stream.
+
+Each combination runs in its own process (so memory measurements don't bleed
+into each other) and doesn't require a running Gate One server.  Streams that
+need an optional module that isn't installed (e.g. ``inline_image`` needs PIL
+to render images) are skipped and marked as such in the results.  The results
+are output as JSON so they can be saved and compared between commits::
+
+    python bench_terminal.py --output before.json
+    # ...make some changes...
+    python bench_terminal.py --output after.json
+    python bench_terminal.py --compare before.json after.json
+
+Run with ``--help`` for all the options.
+"""
+
+import os, sys, time, json, subprocess, platform, resource
+from optparse import OptionParser
+
+TESTS_DIR = os.path.split(os.path.abspath(__file__))[0]
+GATEONE_DIR = os.path.split(TESTS_DIR)[0]
+sys.path.insert(0, os.path.split(GATEONE_DIR)[0]) # So we can import terminal
+sys.path.insert(0, TESTS_DIR) # So we can import make_corpus
+
+from make_corpus import STREAMS, STREAM_SIZE, make_corpus
+
+# Globals
+SIZES = '24x80,50x132,100x250'
+CHUNK_SIZE = 4096 # What termio typically gets per read
+DUMP_EVERY = 16 # Call dump_html() once every this many chunks (and at the end)
+# Streams that can't be emulated without an optional module (stream -> module):
+REQUIREMENTS = {
+    'inline_image': 'PIL', # Terminal.dump_html() needs it to render images
+}
+
+def missing_requirement(name):
+    """
+    Returns the name of the module the stream with the given *name* needs (see
+    `REQUIREMENTS`) if it can't be imported.  Otherwise returns ``None``.
+    """
+    module = REQUIREMENTS.get(name)
+    if not module:
+        return None
+    try:
+        __import__(module)
+    except ImportError:
+        return module
+    return None
+
+def max_rss():
+    """Returns the peak resident set size of this process in KB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss = rss / 1024 # Reported in bytes on Mac OS X
+    return rss
+
+def run_case(stream_path, rows, cols, chunk_size=CHUNK_SIZE, repeat=3):
+    """
+    Writes the stream at *stream_path* to a *rows* x *cols* `terminal.Terminal`
+    *repeat* times and returns a dict of the (best) results.
+    """
+    import tempfile, shutil
+    from terminal import Terminal
+    with open(stream_path, 'rb') as f:
+        stream = f.read()
+    chunks = [
+        stream[i:i+chunk_size] for i in range(0, len(stream), chunk_size)]
+    temp_dir = tempfile.mkdtemp(prefix='go_bench') # For captured images
+    rss_before = max_rss()
+    best_write = best_dump = None
+    try:
+        for i in range(repeat):
+            term = Terminal(rows=rows, cols=cols, temppath=temp_dir,
+                linkpath=temp_dir)
+            write_time = dump_time = 0.0
+            dumps = 0
+            for count, chunk in enumerate(chunks, 1):
+                start = time.time()
+                term.write(chunk)
+                write_time += time.time() - start
+                if count % DUMP_EVERY == 0 or count == len(chunks):
+                    start = time.time()
+                    term.dump_html()
+                    dump_time += time.time() - start
+                    dumps += 1
+            if best_write is None or write_time < best_write:
+                best_write = write_time
+            if dumps and (best_dump is None or dump_time/dumps < best_dump):
+                best_dump = dump_time/dumps
+            term.close_captured_fds()
+            del term
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return {
+        'stream': os.path.splitext(os.path.basename(stream_path))[0],
+        'rows': rows,
+        'cols': cols,
+        'bytes': len(stream),
+        'write_seconds': round(best_write, 4),
+        'write_mb_per_sec': round(
+            (len(stream) / 1048576.0) / max(best_write, 1e-9), 3),
+        'dump_html_ms': round((best_dump or 0) * 1000, 3),
+        'memory_kb': max_rss() - rss_before,
+    }
+
+def git_revision():
+    """
+    Returns the current git commit (so results can be associated with it) or
+    ``None`` if it can't be determined.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=GATEONE_DIR, stderr=devnull).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_all(corpus_dir, sizes=SIZES, streams=None, chunk_size=CHUNK_SIZE,
+        repeat=3, stream_size=STREAM_SIZE):
+    """
+    Runs `run_case` (in a separate process) for every stream in *corpus_dir*
+    (or just those in *streams*) at every size in *sizes* (e.g. '24x80,50x132')
+    and returns a dict containing all the results.  Any streams missing from
+    *corpus_dir* will be generated (*stream_size* bytes each).
+    """
+    streams = streams or list(STREAMS.keys())
+    missing = [
+        a for a in streams
+        if not os.path.exists(os.path.join(corpus_dir, '%s.stream' % a))]
+    if missing:
+        sys.stderr.write("Generating corpus in %s...\n" % corpus_dir)
+        make_corpus(corpus_dir, stream_size, names=missing)
+    results = []
+    for name in streams:
+        stream_path = os.path.join(corpus_dir, '%s.stream' % name)
+        missing_module = missing_requirement(name)
+        if missing_module:
+            sys.stderr.write(
+                "%s... SKIPPED (requires %s which isn't installed)\n" % (
+                    name, missing_module))
+            results.append({
+                'stream': name, 'skipped': 'requires %s' % missing_module})
+            continue
+        for size in sizes.split(','):
+            rows, cols = size.split('x')
+            sys.stderr.write("%s (%s)... " % (name, size))
+            try:
+                output = subprocess.check_output([
+                    sys.executable, os.path.abspath(__file__),
+                    '--case', stream_path,
+                    '--rows', rows, '--cols', cols,
+                    '--chunk-size', str(chunk_size),
+                    '--repeat', str(repeat)])
+            except subprocess.CalledProcessError as e:
+                # Record the failure so it shows up in the results
+                sys.stderr.write("FAILED\n")
+                result = {
+                    'stream': name, 'rows': int(rows), 'cols': int(cols),
+                    'error': 'exit status %s' % e.returncode}
+            else:
+                result = json.loads(output.decode('utf-8'))
+                sys.stderr.write("%s MB/s\n" % result['write_mb_per_sec'])
+            results.append(result)
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'chunk_size': chunk_size,
+        'results': results,
+    }
+
+def compare(old, new):
+    """
+    Prints a table comparing the results in *old* to the ones in *new* (both
+    should be dicts as returned by `run_all`).
+    """
+    old_results = dict(
+        ((a['stream'], a['rows'], a['cols']), a) for a in old['results']
+        if 'error' not in a and 'skipped' not in a)
+    print("%-14s %-8s %12s %12s %12s" % (
+        'Stream', 'Size', 'write MB/s', 'dump_html', 'memory'))
+    for result in new['results']:
+        if 'error' in result or 'skipped' in result:
+            continue
+        key = (result['stream'], result['rows'], result['cols'])
+        if key not in old_results:
+            continue
+        before = old_results[key]
+        def change(metric):
+            if not before[metric]:
+                return 'n/a'
+            return '%+.1f%%' % (
+                (result[metric] - before[metric]) * 100.0 / before[metric])
+        print("%-14s %-8s %12s %12s %12s" % (
+            result['stream'], '%sx%s' % (result['rows'], result['cols']),
+            change('write_mb_per_sec'), change('dump_html_ms'),
+            change('memory_kb')))
+
+def main(args=sys.argv):
+    usage = '\t%prog [options]'
+    parser = OptionParser(usage=usage)
+    parser.add_option("--corpus",
+        dest="corpus",
+        default=os.path.join(TESTS_DIR, 'corpus'),
+        help="Directory containing the corpus (see make_corpus.py).")
+    parser.add_option("--sizes",
+        dest="sizes",
+        default=SIZES,
+        help="Terminal sizes to test (rows x columns).  Default: %s" % SIZES)
+    parser.add_option("-s", "--size",
+        dest="size",
+        default=STREAM_SIZE,
+        type="int",
+        help="Size of each stream if the corpus needs to be generated.")
+    parser.add_option("--streams",
+        dest="streams",
+        default=None,
+        help="Comma-separated list of streams to test (default: all).")
+    parser.add_option("--chunk-size",
+        dest="chunk_size",
+        default=CHUNK_SIZE,
+        type="int",
+        help="Size of the chunks written to the terminal at a time.")
+    parser.add_option("--repeat",
+        dest="repeat",
+        default=3,
+        type="int",
+        help="How many times to run each test (the best result is used).")
+    parser.add_option("-o", "--output",
+        dest="output",
+        default=None,
+        help="Save the results (JSON) to this file instead of stdout.")
+    parser.add_option("--compare",
+        dest="compare",
+        default=False,
+        action="store_true",
+        help="Compare two previously-saved results: --compare <old> <new>")
+    # These are used internally to run each case in a subprocess:
+    parser.add_option("--case", dest="case", default=None,
+        help="Run a single stream (used internally).")
+    parser.add_option("--rows", dest="rows", default=24, type="int",
+        help="Number of rows (only used with --case).")
+    parser.add_option("--cols", dest="cols", default=80, type="int",
+        help="Number of columns (only used with --case).")
+    (options, args) = parser.parse_args(args=args[1:])
+    if options.compare:
+        if len(args) != 2:
+            parser.error("--compare requires two result files")
+        with open(args[0]) as f:
+            old = json.load(f)
+        with open(args[1]) as f:
+            new = json.load(f)
+        compare(old, new)
+        return
+    if options.case:
+        result = run_case(options.case, options.rows, options.cols,
+            chunk_size=options.chunk_size, repeat=options.repeat)
+        print(json.dumps(result))
+        return
+    streams = None
+    if options.streams:
+        streams = options.streams.split(',')
+    results = run_all(options.corpus, options.sizes, streams,
+        chunk_size=options.chunk_size, repeat=options.repeat,
+        stream_size=options.size)
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
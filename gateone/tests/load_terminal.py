@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+# Meta
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+__doc__ = """\
+Terminal Application Load Generator
+===================================
+Simulates a number of users typing away in (and running noisy commands inside
+of) Gate One terminals over the WebSocket--exactly like the web client does
+it--and measures how the server holds up:
+
+    * ``latency_ms``: Keystroke-to-echo latency (p50/p90/p99/max).  That is,
+      how long it takes from the moment a `terminal:write_chars` message is sent
+      until a `terminal:termupdate` containing the typed character arrives.
+    * ``termupdates``/``termupdate_bytes``: How many screen updates were sent
+      to the clients (and how big they were) in total and per second.
+    * ``server_cpu``: How much CPU time the Gate One server process used
+      (Linux only since it comes from /proc).
+
+By default a Gate One server will be spawned on localhost (using a temporary
+settings directory and ``/bin/sh`` as the terminal command) and shut down when
+the test is complete.  Example::
+
+    python load_terminal.py --users 20 --noisy 0.25 --duration 60
+
+Use ``--url`` to run the test against a server that's already running instead
+(the default ``/bin/sh`` command isn't guaranteed in that case so make sure the
+server's `default_command` is a shell).  If the server uses API authentication
+provide the ``--api_key`` and ``--secret`` to use.  The results are output as
+JSON (like ``bench_terminal.py``).
+
+.. note::
+
+    If you're running Gate One from a source checkout (not installed) you'll
+    need to run ``python setup.py egg_info`` once beforehand (which is what
+    ``run_gateone.py`` does) so Gate One can find its applications.
+"""
+
+import os, sys, time, json, random, socket, string, shutil, tempfile
+import subprocess, re
+from datetime import timedelta
+from optparse import OptionParser
+
+TESTS_DIR = os.path.split(os.path.abspath(__file__))[0]
+GATEONE_DIR = os.path.split(TESTS_DIR)[0]
+sys.path.insert(0, os.path.split(GATEONE_DIR)[0]) # So we can import gateone
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.locks import Condition
+from tornado.httpclient import HTTPRequest
+from tornado.websocket import websocket_connect
+from tornado.escape import json_encode, json_decode
+
+from gateone.core.utils import create_signature
+from bench_terminal import git_revision
+
+# Globals
+RE_HTML_TAGS = re.compile(r'<[^>]+>')
+# Runs entirely within the shell (no external commands) so it's portable:
+NOISY_COMMAND = (
+    'i=0; while [ $i -lt %d ]; do '
+    'echo "$i: The quick brown fox jumps over the lazy dog"; i=$((i+1)); '
+    'done\r')
+TERMINAL_CONF = {
+    "*": {
+        "terminal": {
+            "commands": {
+                "sh": {
+                    "command": "/bin/sh",
+                    "description": "Load testing shell",
+                    "dtach": False
+                }
+            },
+            "default_command": "sh",
+            "dtach": False,
+            "session_logging": False,
+            "syslog_session_logging": False
+        }
+    }
+}
+
+def percentile(values, percent):
+    """
+    Returns the given *percent* (0-100) of the (sorted) list of *values*.
+    """
+    if not values:
+        return None
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+def free_port():
+    """Returns a TCP port on localhost that isn't in use."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def cpu_time(pid):
+    """
+    Returns the total (user + system) CPU time used by the process with the
+    given *pid* in seconds.  Returns ``None`` if it can't be determined (e.g.
+    not on Linux).
+    """
+    try:
+        with open('/proc/%s/stat' % pid) as f:
+            # The command name (2nd field) can contain spaces so skip past it:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except (IOError, OSError):
+        return None
+    # utime and stime are the 14th and 15th fields (counting from 1)
+    ticks = int(fields[11]) + int(fields[12])
+    return float(ticks) / os.sysconf('SC_CLK_TCK')
+
+class GateOneServer(object):
+    """
+    Starts up a Gate One server on localhost:*port* using a temporary directory
+    for all its settings, sessions, logs, etc.  *extra_args* will be passed to
+    the server on the command line.  Call `stop` to shut it down and clean up.
+    """
+    def __init__(self, port, extra_args=None):
+        self.port = port
+        self.base_dir = tempfile.mkdtemp(prefix='go_load')
+        settings_dir = os.path.join(self.base_dir, 'settings')
+        logs_dir = os.path.join(self.base_dir, 'logs')
+        os.mkdir(settings_dir)
+        os.mkdir(logs_dir)
+        with open(os.path.join(settings_dir, '50terminal.conf'), 'w') as f:
+            f.write(json.dumps(TERMINAL_CONF, indent=4))
+        args = [
+            '--settings_dir=%s' % settings_dir,
+            '--address=127.0.0.1',
+            '--port=%s' % port,
+            '--disable_ssl',
+            '--session_dir=%s' % os.path.join(self.base_dir, 'sessions'),
+            '--user_dir=%s' % os.path.join(self.base_dir, 'users'),
+            '--cache_dir=%s' % os.path.join(self.base_dir, 'cache'),
+            '--pid_file=%s' % os.path.join(self.base_dir, 'gateone.pid'),
+            '--log_file_prefix=%s' % os.path.join(logs_dir, 'gateone.log'),
+            '--logging=warning',
+        ] + (extra_args or [])
+        env = os.environ.copy()
+        pythonpath = os.path.split(GATEONE_DIR)[0]
+        if env.get('PYTHONPATH'):
+            pythonpath += os.pathsep + env['PYTHONPATH']
+        env['PYTHONPATH'] = pythonpath
+        self.output = open(os.path.join(self.base_dir, 'output.txt'), 'w')
+        self.process = subprocess.Popen([
+            sys.executable, '-c',
+            'from gateone.core.server import main; main(installed=False)'
+        ] + args, cwd=self.base_dir, env=env,
+            stdout=self.output, stderr=subprocess.STDOUT)
+        self.pid = self.process.pid
+
+    def wait_until_ready(self, timeout=30):
+        """
+        Waits (up to *timeout* seconds) for the server to start accepting
+        connections.  Raises `RuntimeError` (including the server's output) if
+        it doesn't.
+        """
+        start = time.time()
+        while time.time() - start < timeout:
+            if self.process.poll() is not None:
+                break # It died
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 1).close()
+                return
+            except socket.error:
+                time.sleep(0.25)
+        self.output.flush()
+        with open(self.output.name) as f:
+            output = f.read()
+        self.stop()
+        raise RuntimeError("Gate One server failed to start:\n%s" % output)
+
+    def stop(self):
+        """Shuts down the server and removes its temporary directory."""
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait()
+            except OSError:
+                pass
+        self.output.close()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+class SimulatedUser(object):
+    """
+    A Gate One client that connects to *url*, opens a terminal, and then types
+    (random) comments into the shell until *deadline* (a `time.time` value).
+    If *noisy* the user will also run a command that spews *noise_lines* of
+    output every few commands.
+
+    If *api_auth* is given (an ``(api_key, secret)`` tuple) API authentication
+    will be used.
+
+    Results are recorded in `self.latencies` (seconds), `self.termupdates`,
+    `self.termupdate_bytes`, and `self.timeouts` (keystrokes whose echo
+    never arrived).
+    """
+    def __init__(self, url, deadline, number, noisy=False, noise_lines=2000,
+            typing_delay=0.15, rows=24, cols=80, api_auth=None):
+        self.url = url
+        self.deadline = deadline
+        self.number = number
+        self.noisy = noisy
+        self.noise_lines = noise_lines
+        self.typing_delay = typing_delay
+        self.rows = rows
+        self.cols = cols
+        self.api_auth = api_auth
+        self.rng = random.Random(number)
+        self.conn = None
+        self.screen = u''
+        self.update = Condition()
+        self.authenticated = False
+        self.latencies = []
+        self.termupdates = 0
+        self.termupdate_bytes = 0
+        self.timeouts = 0
+
+    def send(self, action, value):
+        self.conn.write_message(json_encode({action: value}))
+
+    def auth_object(self):
+        """Returns the 'auth' value to use with `go:authenticate`."""
+        if not self.api_auth:
+            return None
+        api_key, secret = self.api_auth
+        upn = 'loaduser%s' % self.number
+        timestamp = str(int(time.time() * 1000))
+        return {
+            'api_key': api_key,
+            'upn': upn,
+            'timestamp': timestamp,
+            'signature': create_signature(secret, api_key, upn, timestamp),
+            'signature_method': 'HMAC-SHA1',
+            'api_version': '1.0'
+        }
+
+    @gen.coroutine
+    def read_messages(self):
+        """
+        Reads messages from the server (until the connection is closed) and
+        records/notifies on the ones we care about.
+        """
+        while True:
+            message = yield self.conn.read_message()
+            if message is None:
+                break
+            if not isinstance(message, type(u'')):
+                continue # Binary message (e.g. a file); don't care
+            try:
+                message = json_decode(message)
+            except ValueError:
+                continue
+            if not isinstance(message, dict):
+                continue
+            if 'go:set_username' in message:
+                self.authenticated = True
+            if 'terminal:termupdate' in message:
+                self.termupdates += 1
+                self.termupdate_bytes += len(json_encode(message))
+                screen = message['terminal:termupdate']['screen']
+                self.screen = RE_HTML_TAGS.sub(
+                    u'', u'\n'.join(a for a in screen if a))
+            self.update.notify_all()
+
+    @gen.coroutine
+    def wait_for(self, condition, timeout=10):
+        """
+        Waits (up to *timeout* seconds) for *condition* (a function) to return
+        True.  Returns False if it timed out.
+        """
+        end = time.time() + timeout
+        while not condition():
+            remaining = end - time.time()
+            if remaining <= 0:
+                raise gen.Return(False)
+            yield self.update.wait(timeout=timedelta(seconds=remaining))
+        raise gen.Return(True)
+
+    @gen.coroutine
+    def type_text(self, text):
+        """
+        Types *text* one character at a time (recording the latency of each).
+        Returns False if we timed out waiting for the echo.
+        """
+        tag = u''.join(self.rng.choice(string.ascii_lowercase) for i in range(8))
+        typed = u'#%s' % tag # Comment with a unique tag so the echo is unique
+        self.send('terminal:write_chars', {'term': 1, 'chars': typed})
+        yield self.wait_for(lambda: typed in self.screen)
+        for char in text:
+            typed += char
+            start = time.time()
+            self.send('terminal:write_chars', {'term': 1, 'chars': char})
+            echoed = yield self.wait_for(lambda: typed in self.screen)
+            if not echoed:
+                self.timeouts += 1
+                raise gen.Return(False)
+            self.latencies.append(time.time() - start)
+            delay = self.rng.uniform(0.5, 1.5) * self.typing_delay
+            yield gen.sleep(delay)
+        self.send('terminal:write_chars', {'term': 1, 'chars': u'\r'})
+        raise gen.Return(True)
+
+    @gen.coroutine
+    def run(self):
+        """Connects, authenticates, opens a terminal, and starts typing."""
+        origin = self.url.replace('ws', 'http', 1).rsplit('/', 1)[0]
+        request = HTTPRequest(self.url, headers={'Origin': origin})
+        self.conn = yield websocket_connect(request)
+        reader = self.read_messages()
+        self.send('go:authenticate', {
+            'auth': self.auth_object(),
+            'container': 'gateone',
+            'prefix': 'go_',
+            'location': 'default',
+        })
+        if not (yield self.wait_for(lambda: self.authenticated)):
+            raise RuntimeError("User %s failed to authenticate" % self.number)
+        self.send('terminal:new_terminal', {
+            'term': 1, 'rows': self.rows, 'columns': self.cols})
+        if not (yield self.wait_for(lambda: self.termupdates)):
+            raise RuntimeError("User %s never got a terminal" % self.number)
+        commands = 0
+        while time.time() < self.deadline:
+            words = u' '.join(
+                self.rng.choice(string.ascii_lowercase) * self.rng.randint(2, 7)
+                for i in range(self.rng.randint(2, 5)))
+            yield self.type_text(words)
+            commands += 1
+            if self.noisy and commands % 3 == 0:
+                self.send('terminal:write_chars', {
+                    'term': 1, 'chars': NOISY_COMMAND % self.noise_lines})
+        self.conn.close()
+        yield reader
+
+@gen.coroutine
+def run_load(url, users=10, duration=30, noisy=0.2, noise_lines=2000,
+        typing_delay=0.15, rows=24, cols=80, api_auth=None, server_pid=None):
+    """
+    Runs *users* `SimulatedUser` instances against *url* for *duration* seconds
+    and returns a dict of the results.  *noisy* is the fraction of users that
+    will be running noisy commands.  If *server_pid* is given the server's CPU
+    use will be included.
+    """
+    deadline = time.time() + duration
+    simulated = [
+        SimulatedUser(url, deadline, i,
+            noisy=i < int(round(users * noisy)),
+            noise_lines=noise_lines,
+            typing_delay=typing_delay,
+            rows=rows, cols=cols, api_auth=api_auth)
+        for i in range(users)]
+    cpu_before = cpu_time(server_pid) if server_pid else None
+    start = time.time()
+    yield [user.run() for user in simulated]
+    elapsed = time.time() - start
+    cpu_after = cpu_time(server_pid) if server_pid else None
+    latencies = sorted(a for user in simulated for a in user.latencies)
+    termupdates = sum(a.termupdates for a in simulated)
+    termupdate_bytes = sum(a.termupdate_bytes for a in simulated)
+    def ms(seconds):
+        if seconds is None:
+            return None
+        return round(seconds * 1000, 2)
+    results = {
+        'users': users,
+        'noisy_users': len([a for a in simulated if a.noisy]),
+        'duration': round(elapsed, 2),
+        'rows': rows,
+        'cols': cols,
+        'keystrokes': len(latencies),
+        'timeouts': sum(a.timeouts for a in simulated),
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p90': ms(percentile(latencies, 90)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1] if latencies else None),
+        },
+        'termupdates': termupdates,
+        'termupdates_per_sec': round(termupdates / elapsed, 2),
+        'termupdate_bytes': termupdate_bytes,
+        'termupdate_bytes_per_sec': int(termupdate_bytes / elapsed),
+    }
+    if cpu_before is not None and cpu_after is not None:
+        results['server_cpu'] = {
+            'seconds': round(cpu_after - cpu_before, 2),
+            'percent': round((cpu_after - cpu_before) * 100 / elapsed, 1),
+        }
+    raise gen.Return(results)
+
+def main(args=sys.argv):
+    usage = '\t%prog [options]'
+    parser = OptionParser(usage=usage)
+    parser.add_option("-u", "--users",
+        dest="users", default=10, type="int",
+        help="Number of simulated users.  Default: 10")
+    parser.add_option("-d", "--duration",
+        dest="duration", default=30, type="float",
+        help="How long to run the test (in seconds).  Default: 30")
+    parser.add_option("--noisy",
+        dest="noisy", default=0.2, type="float",
+        help="Fraction of the users that will periodically run commands that "
+             "output lots of text.  Default: 0.2")
+    parser.add_option("--noise_lines",
+        dest="noise_lines", default=2000, type="int",
+        help="How many lines each noisy command will output.  Default: 2000")
+    parser.add_option("--typing_delay",
+        dest="typing_delay", default=0.15, type="float",
+        help="Average delay between keystrokes (in seconds).  Default: 0.15")
+    parser.add_option("--size",
+        dest="size", default="24x80",
+        help="Size of each terminal (rows x columns).  Default: 24x80")
+    parser.add_option("--url",
+        dest="url", default=None,
+        help="Test the Gate One server at this WebSocket URL (e.g. "
+             "'wss://gateone.company.com/ws') instead of spawning one.")
+    parser.add_option("--pid",
+        dest="pid", default=None, type="int",
+        help="PID of the server at --url (to measure its CPU use).")
+    parser.add_option("--api_key",
+        dest="api_key", default=None,
+        help="Use API authentication with this key (requires --secret).")
+    parser.add_option("--secret",
+        dest="secret", default=None,
+        help="The secret that goes with --api_key.")
+    parser.add_option("-o", "--output",
+        dest="output", default=None,
+        help="Save the results (JSON) to this file instead of stdout.")
+    (options, args) = parser.parse_args(args=args[1:])
+    rows, cols = [int(a) for a in options.size.split('x')]
+    api_auth = None
+    if options.api_key:
+        if not options.secret:
+            parser.error("--api_key requires --secret")
+        api_auth = (options.api_key, options.secret)
+    server = None
+    url = options.url
+    server_pid = options.pid
+    if not url:
+        port = free_port()
+        extra_args = []
+        if api_auth:
+            extra_args = [
+                '--auth=api', '--api_keys=%s:%s' % api_auth]
+        server = GateOneServer(port, extra_args)
+        sys.stderr.write("Starting Gate One on port %s...\n" % port)
+        server.wait_until_ready()
+        url = 'ws://127.0.0.1:%s/ws' % port
+        server_pid = server.pid
+    try:
+        sys.stderr.write("Running %s users for %ss...\n" % (
+            options.users, options.duration))
+        results = IOLoop.current().run_sync(lambda: run_load(url,
+            users=options.users,
+            duration=options.duration,
+            noisy=options.noisy,
+            noise_lines=options.noise_lines,
+            typing_delay=options.typing_delay,
+            rows=rows, cols=cols,
+            api_auth=api_auth,
+            server_pid=server_pid))
+    finally:
+        if server:
+            server.stop()
+    results.update({
+        'revision': git_revision(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+    })
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+# Meta
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+__doc__ = """\
+Terminal Benchmark Corpus Generator
+===================================
+Generates a set of recorded-style terminal output streams that are
+representative of what Gate One's terminal emulator has to deal with in the
+real world (build log floods, ``ls --color``, full-screen editors, htop,
+256-color art, CJK text, and inline images).  The streams are generated from a
+fixed random seed so the same corpus can be recreated on any machine (which
+means benchmark results can be compared between commits).
+
+Usage::
+
+    python make_corpus.py [--size <bytes per stream>] [<output dir>]
+
+The output directory defaults to 'corpus' (next to this script).  Each stream
+gets saved as <name>.stream.  These are used by ``bench_terminal.py``.
+"""
+
+import os, sys, random, struct, zlib
+from collections import OrderedDict
+from optparse import OptionParser
+
+ESC = b'\x1b'
+WORDS = (
+    b'gateone terminal server session websocket handler tornado ioloop '
+    b'emulator renditions scrollback capture multiplex pattern expect log '
+    b'settings plugin application policy authenticate bookmarks playback'
+).split()
+CJK = (
+    u'漢字仮名文字日本語中文'
+    u'한국어電腦終端機会話記録'
+)
+# The emulator handles somewhere around 1MB/s so this keeps things reasonable:
+STREAM_SIZE = 262144 # Default size of each stream
+ACCENTED = u'caf\xe9 na\xefve r\xe9sum\xe9 \xfcber se\xf1or ćevap'
+COMBINING = u'e\u0301 a\u0308 o\u0302 n\u0303 '
+
+def _words(rng, count):
+    return b' '.join(rng.choice(WORDS) for i in range(count))
+
+def _cup(row, col):
+    "Cursor position (1-based)"
+    return ESC + ('[%d;%dH' % (row, col)).encode('ascii')
+
+def build_log(rng):
+    """A compiler spewing output as fast as it can (with the odd warning)."""
+    target = rng.choice(WORDS).decode('ascii')
+    line = (u'gcc -O2 -Wall -fPIC -I/usr/include/python2.7 -c src/%s/%s.c '
+            u'-o build/temp.linux-x86_64-2.7/src/%s.o\r\n' % (
+        target, rng.choice(WORDS).decode('ascii'), target)).encode('utf-8')
+    if rng.random() < 0.05:
+        line += (ESC + b'[01m' + ESC + b'[Ksrc/' + rng.choice(WORDS) +
+            b'.c:' + str(rng.randint(1, 2000)).encode('ascii') + b':' +
+            ESC + b'[m' + ESC + b'[K ' + ESC + b'[01;35m' + ESC +
+            b'[Kwarning: ' + ESC + b'[m' + ESC + b'[K' + _words(rng, 6) +
+            b'\r\n')
+    return line
+
+def ls_color(rng):
+    """A long ``ls -l --color=auto`` listing."""
+    color = rng.choice([b'01;34', b'01;32', b'01;36', b'00', b'01;31'])
+    name = b'_'.join(rng.choice(WORDS) for i in range(rng.randint(1, 3)))
+    return (
+        b'-rw-r--r--  1 bsmith users ' +
+        str(rng.randint(0, 99999999)).rjust(8).encode('ascii') +
+        b' Sep  9 21:07 ' + ESC + b'[' + color + b'm' + name + ESC + b'[0m\r\n')
+
+def vim_edit(rng):
+    """
+    Someone editing a file in vim (cursor movement, scrolling regions, line
+    insertion/deletion, and status line updates).
+    """
+    out = b''
+    if rng.random() < 0.02: # Open/redraw the whole thing
+        out += ESC + b'[?1049h' + ESC + b'[1;24r' + ESC + b'[H' + ESC + b'[2J'
+        for row in range(1, 24):
+            out += _cup(row, 1) + ESC + b'[K' + _words(rng, rng.randint(0, 10))
+        out += _cup(24, 1) + ESC + b'[7m"file.py" 600L, 18221C' + ESC + b'[m'
+    action = rng.random()
+    row = rng.randint(1, 23)
+    if action < 0.5: # Typing
+        out += _cup(row, rng.randint(1, 60)) + _words(rng, 1) + b' '
+    elif action < 0.7: # Scrolling down
+        out += ESC + b'[1;23r' + _cup(23, 1) + b'\n' + ESC + b'[1;24r'
+        out += _cup(23, 1) + _words(rng, 8)
+    elif action < 0.85: # Insert/delete lines
+        out += _cup(row, 1) + rng.choice([ESC + b'[L', ESC + b'[M'])
+        out += _words(rng, 5)
+    else: # Status line update
+        out += _cup(24, 60) + ESC + b'[K' + (
+            u'%d,%d' % (row, rng.randint(1, 80))).encode('ascii')
+    return out
+
+def htop(rng):
+    """Full-screen redraws of htop (lots of colors and positioning)."""
+    out = ESC + b'[H'
+    for cpu in range(1, 5):
+        used = rng.randint(0, 30)
+        out += _cup(cpu, 3) + str(cpu).encode('ascii') + ESC + b'[1m[' + (
+            ESC + b'[32m' + b'|' * used + ESC + b'[31m' + b'|' * (used // 3) +
+            ESC + b'[m' + b' ' * (40 - used - used // 3)) + ESC + b'[1m]' + (
+            ESC + b'[m')
+    out += _cup(6, 1) + ESC + b'[30;42m  PID USER      PRI  NI  VIRT   RES' + (
+        b'   SHR S CPU% MEM%   TIME+  Command' + ESC + b'[K' + ESC + b'[m')
+    for row in range(7, 24):
+        out += _cup(row, 1) + (u'%5d bsmith     20   0  %4dM  %4dM  %4dM '
+            % (rng.randint(1, 32768), rng.randint(1, 999),
+               rng.randint(1, 999), rng.randint(1, 99))).encode('ascii')
+        out += ESC + b'[32mS' + ESC + b'[m ' + (u'%4.1f %4.1f' % (
+            rng.random() * 100, rng.random() * 10)).encode('ascii')
+        out += b'  0:00.00 ' + ESC + b'[1m' + rng.choice(WORDS) + ESC + b'[m'
+        out += ESC + b'[K'
+    return out
+
+def color_art(rng):
+    """256-color "art" (every character has a different rendition)."""
+    out = b''
+    for col in range(80):
+        out += (ESC + (u'[38;5;%dm' % rng.randint(0, 255)).encode('ascii') +
+            ESC + (u'[48;5;%dm' % rng.randint(0, 255)).encode('ascii') +
+            rng.choice([b'\xe2\x96\x80', b'\xe2\x96\x84', b'#', b' ']))
+    return out + ESC + b'[0m\r\n'
+
+def utf8_cjk(rng):
+    """Multibyte text; CJK (double-width), accented, and combining chars."""
+    line = u''.join(rng.choice(CJK) for i in range(rng.randint(5, 35)))
+    line += u' ' + ACCENTED + u' ' + COMBINING
+    return line.encode('utf-8') + b'\r\n'
+
+def _png(width, height, rng):
+    "Returns a (valid) PNG image of random noise."
+    def chunk(kind, data):
+        crc = zlib.crc32(kind + data) & 0xffffffff
+        return struct.pack('>I', len(data)) + kind + data + struct.pack(
+            '>I', crc)
+    rows = b''
+    for y in range(height):
+        rows += b'\x00' + bytes(bytearray(
+            rng.randint(0, 255) for x in range(width * 3)))
+    return (b'\x89PNG\r\n\x1a\n' +
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+        chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+def inline_image(rng):
+    """A shell session that cat's the occasional image to the terminal."""
+    out = (ESC + b'[1;34mbsmith' + ESC + b'[0m@host:~ $ ls\r\n' +
+        _words(rng, 8) + b'\r\n')
+    if rng.random() < 0.1:
+        out += (ESC + b'[1;34mbsmith' + ESC + b'[0m@host:~ $ cat plot.png\r\n'
+            + _png(64, 48, rng) + b'\r\n')
+    return out
+
+# Name -> function that returns a random chunk of that type of output
+STREAMS = OrderedDict([
+    ('build_log', build_log),
+    ('ls_color', ls_color),
+    ('vim_edit', vim_edit),
+    ('htop', htop),
+    ('color_art', color_art),
+    ('utf8_cjk', utf8_cjk),
+    ('inline_image', inline_image),
+])
+
+def generate(name, size=STREAM_SIZE, seed=1):
+    """
+    Returns roughly *size* bytes of the stream with the given *name* (see
+    `STREAMS`).  The same *seed* always results in the same output.
+    """
+    rng = random.Random(seed)
+    func = STREAMS[name]
+    out = []
+    total = 0
+    while total < size:
+        chunk = func(rng)
+        out.append(chunk)
+        total += len(chunk)
+    return b''.join(out)
+
+def make_corpus(path, size=STREAM_SIZE, names=None):
+    """
+    Writes each stream in `STREAMS` (or just *names*) to *path* as
+    <name>.stream.  Returns a list of the paths that were written.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    written = []
+    for name in (names or STREAMS.keys()):
+        stream_path = os.path.join(path, '%s.stream' % name)
+        with open(stream_path, 'wb') as f:
+            f.write(generate(name, size))
+        written.append(stream_path)
+    return written
+
+def main(args=sys.argv):
+    usage = '\t%prog [options] [<output dir>]'
+    parser = OptionParser(usage=usage)
+    parser.add_option("-s", "--size",
+        dest="size",
+        default=STREAM_SIZE,
+        type="int",
+        help="Approximate size (in bytes) of each stream.  Default: %d" % (
+            STREAM_SIZE))
+    (options, args) = parser.parse_args(args=args[1:])
+    if args:
+        path = args[0]
+    else:
+        path = os.path.join(os.path.split(os.path.abspath(__file__))[0],
+            'corpus')
+    for stream_path in make_corpus(path, options.size):
+        print("Wrote %s" % stream_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the bookmarks plugin's `BookmarksDB`:  Syncing, deleting, and the
+journal (including compaction).
+"""
+
+# Import Python built-ins
+import os, sys, json, shutil, tempfile, unittest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', '..'))
+from gateone.applications.terminal.plugins.bookmarks import bookmarks
+from gateone.applications.terminal.plugins.bookmarks.bookmarks import BookmarksDB
+
+# Globals
+DELETED = "web+deleted:bookmarks/"
+
+def bookmark(url, name, updateSequenceNum=1, tags=None):
+    return {
+        'url': url,
+        'name': name,
+        'tags': tags or [],
+        'notes': '',
+        'visits': 0,
+        'updated': 0,
+        'created': 0,
+        'updateSequenceNum': updateSequenceNum,
+        'images': {},
+    }
+
+class TestBookmarksDB(unittest.TestCase):
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp(prefix='bookmarks')
+        os.mkdir(os.path.join(self.user_dir, 'bsmith'))
+        self.journal_compact = bookmarks.JOURNAL_COMPACT
+
+    def tearDown(self):
+        bookmarks.JOURNAL_COMPACT = self.journal_compact
+        shutil.rmtree(self.user_dir)
+
+    def reopen(self):
+        return BookmarksDB(self.user_dir, 'bsmith')
+
+    def test_sync_since_usn(self):
+        db = self.reopen()
+        db.sync_bookmarks([
+            bookmark('http://a/', u'A'),
+            bookmark('http://b/', u'B'),
+            bookmark('http://c/', u'C'),
+        ])
+        self.assertEqual(
+            [a['url'] for a in db.get_bookmarks(1)], ['http://b/', 'http://c/'])
+        # A newer copy from the client gets a new USN...
+        db.sync_bookmarks([bookmark('http://a/', u'A2', updateSequenceNum=5)])
+        self.assertEqual(
+            [(a['url'], a['updateSequenceNum']) for a in db.get_bookmarks(2)],
+            [('http://c/', 3), ('http://a/', 4)])
+        # ...and an older one gets the server's copy sent back
+        updates = db.sync_bookmarks([bookmark('http://b/', u'Old B', 0)])
+        self.assertEqual([a['name'] for a in updates], [u'B'])
+        self.assertEqual(db.get_highest_USN(), 4)
+        # Everything survives a restart (via the journal)
+        self.assertTrue(os.path.exists(db.journal_path))
+        self.assertEqual(self.reopen().bookmarks, db.bookmarks)
+
+    def test_delete(self):
+        db = self.reopen()
+        db.sync_bookmarks([
+            bookmark('http://a/', u'A'),
+            bookmark('http://b/', u'B'),
+            bookmark('http://c/', u'C'),
+        ])
+        db.delete_bookmark({'url': 'http://a/'})
+        self.assertFalse('http://a/' in db.index)
+        deleted = db.index[DELETED]
+        self.assertEqual([a['url'] for a in deleted['notes']], ['http://a/'])
+        db.delete_bookmark({'url': 'http://nope/'}) # Not there; no change
+        db.delete_bookmark({'url': 'http://b/'})
+        # Clients that synced before the delete find out about it
+        self.assertEqual(db.get_highest_USN(), 4)
+        self.assertEqual([a['url'] for a in db.get_bookmarks(3)], [DELETED])
+        reopened = self.reopen()
+        self.assertEqual(sorted(reopened.index), ['http://c/', DELETED])
+        self.assertEqual(
+            [a['url'] for a in reopened.index[DELETED]['notes']],
+            ['http://a/', 'http://b/'])
+        self.assertEqual(reopened.usn_index, db.usn_index)
+
+    def test_compaction(self):
+        bookmarks.JOURNAL_COMPACT = 5
+        db = self.reopen()
+        names = [u'caf\xe9 %s' % i for i in range(4)] + [u'\u65e5\u672c']
+        db.sync_bookmarks(
+            [bookmark('http://%s/' % i, name) for i, name in enumerate(names)])
+        # Compacted right away since the journal is bigger than the snapshot
+        self.assertFalse(os.path.exists(db.journal_path))
+        for i in range(3):
+            db.sync_bookmarks([bookmark(
+                'http://%s/' % i, u'new ' + names[i], updateSequenceNum=9)])
+        self.assertEqual(db.journal_entries, 3)
+        self.assertTrue(os.path.exists(db.journal_path))
+        self.assertEqual(self.reopen().bookmarks, db.bookmarks)
+        db.rename_tag('nope', 'still nope') # No changes; nothing journaled
+        self.assertEqual(db.journal_entries, 3)
+        db.sync_bookmarks([
+            bookmark('http://3/', u'new ' + names[3], updateSequenceNum=9),
+            bookmark('http://4/', u'new ' + names[4], updateSequenceNum=9)])
+        # That made 5 changes so everything got folded into bookmarks.json
+        self.assertFalse(os.path.exists(db.journal_path))
+        self.assertEqual(db.journal_entries, 0)
+        with open(db.bookmarks_path) as f:
+            on_disk = json.load(f)
+        self.assertEqual(
+            [a['name'] for a in on_disk], [u'new ' + name for name in names])
+        reopened = self.reopen()
+        self.assertEqual(reopened.bookmarks, db.bookmarks)
+        self.assertEqual(reopened.usn_index, db.usn_index)
+
+if __name__ == "__main__":
+    unittest.main()
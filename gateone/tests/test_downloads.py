@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests `DownloadHandler`:  Conditional and ``Range`` requests, the
+pre-compressed (.gz) variant, and that nothing outside of the user's
+'downloads' directory can be retrieved.
+"""
+
+# Import Python built-ins
+import os, sys, gzip, json, time, shutil, tempfile, unittest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', '..'))
+from gateone.core.server import DownloadHandler
+
+# Tornado stuff
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+# Globals
+SECRET = 'not so secret'
+SESSION = 'ZjYwNjRhNDM0MWIyNGJjMjgzZjQ2M2U5MzAwMmQxZDZhN'
+DATA = b''.join(b'line %04d\n' % i for i in range(1000)) # Very compressible
+
+class TestDownloads(AsyncHTTPTestCase):
+    def setUp(self):
+        self.session_dir = tempfile.mkdtemp(prefix='downloads')
+        self.downloads_dir = os.path.join(self.session_dir, SESSION, 'downloads')
+        os.makedirs(self.downloads_dir)
+        for name in ('plain.html', 'both.html'):
+            with open(os.path.join(self.downloads_dir, name), 'wb') as f:
+                f.write(DATA)
+        gz_path = os.path.join(self.downloads_dir, 'both.html.gz')
+        with gzip.open(gz_path, 'wb') as f:
+            f.write(DATA)
+        with open(os.path.join(self.session_dir, 'secret.txt'), 'w') as f:
+            f.write('secret')
+        super(TestDownloads, self).setUp()
+
+    def tearDown(self):
+        super(TestDownloads, self).tearDown()
+        shutil.rmtree(self.session_dir)
+
+    def get_app(self):
+        return tornado.web.Application([
+            (r"/downloads/(.*)", DownloadHandler),
+        ], session_dir=self.session_dir, cookie_secret=SECRET, gzip=True,
+            login_url='/auth', static_url=self.session_dir)
+
+    def fetch(self, path, gzip=False, method='GET', **headers):
+        user = json.dumps({'upn': 'bob', 'session': SESSION})
+        cookie = tornado.web.create_signed_value(SECRET, 'gateone_user', user)
+        headers['Cookie'] = 'gateone_user=%s' % cookie.decode('utf-8')
+        if gzip:
+            headers['Accept-Encoding'] = 'gzip'
+        return super(TestDownloads, self).fetch(
+            '/downloads/%s' % path, method=method, headers=headers,
+            decompress_response=False, follow_redirects=False)
+
+    def test_get(self):
+        for gzip in (False, True): # Never gets compressed on the fly
+            response = self.fetch('plain.html', gzip=gzip)
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body, DATA)
+            self.assertEqual(
+                int(response.headers['Content-Length']), len(DATA))
+            self.assertFalse('Content-Encoding' in response.headers)
+            self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+
+    def test_head(self):
+        response = self.fetch('plain.html', method='HEAD')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b'')
+        self.assertEqual(int(response.headers['Content-Length']), len(DATA))
+
+    def test_range(self):
+        for gzip in (False, True):
+            response = self.fetch('plain.html', gzip=gzip, Range='bytes=10-19')
+            self.assertEqual(response.code, 206)
+            self.assertEqual(response.body, DATA[10:20])
+            self.assertEqual(response.headers['Content-Length'], '10')
+            self.assertEqual(
+                response.headers['Content-Range'], 'bytes 10-19/%s' % len(DATA))
+            self.assertFalse('Content-Encoding' in response.headers)
+        response = self.fetch('plain.html', Range='bytes=-5')
+        self.assertEqual(response.body, DATA[-5:])
+        response = self.fetch('plain.html', Range='bytes=%s-' % len(DATA))
+        self.assertEqual(response.code, 416)
+        self.assertEqual(
+            response.headers['Content-Range'], 'bytes */%s' % len(DATA))
+        # Invalid ranges get ignored
+        for byte_range in ('bytes=5-3', 'bytes=x-y', 'lines=1-2'):
+            response = self.fetch('plain.html', Range=byte_range)
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body, DATA)
+        # ...and so do ranges of empty files
+        open(os.path.join(self.downloads_dir, 'empty.txt'), 'w').close()
+        for byte_range in ('bytes=0-', 'bytes=0-9', 'bytes=-5'):
+            response = self.fetch('empty.txt', Range=byte_range)
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body, b'')
+            self.assertEqual(response.headers['Content-Length'], '0')
+
+    def test_conditional(self):
+        etag = self.fetch('plain.html').headers['Etag']
+        modified = self.fetch('plain.html').headers['Last-Modified']
+        response = self.fetch('plain.html', **{'If-None-Match': etag})
+        self.assertEqual(response.code, 304)
+        response = self.fetch('plain.html', **{'If-Modified-Since': modified})
+        self.assertEqual(response.code, 304)
+        # If-Range:  Only send part of it if the client's copy is current
+        for if_range in (etag, modified):
+            response = self.fetch(
+                'plain.html', Range='bytes=0-9', **{'If-Range': if_range})
+            self.assertEqual(response.code, 206)
+            self.assertEqual(response.body, DATA[:10])
+        for if_range in ('"stale"', 'Thu, 01 Jan 2004 00:00:00 GMT'):
+            response = self.fetch(
+                'plain.html', Range='bytes=0-9', **{'If-Range': if_range})
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body, DATA)
+
+    def test_gz_variant(self):
+        response = self.fetch('both.html', gzip=True)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertTrue('Accept-Encoding' in response.headers['Vary'])
+        with open(os.path.join(self.downloads_dir, 'both.html.gz'), 'rb') as f:
+            self.assertEqual(response.body, f.read())
+        identity = self.fetch('both.html')
+        self.assertEqual(identity.body, DATA)
+        self.assertFalse('Content-Encoding' in identity.headers)
+        # Different representations get different ETags
+        gz_etag = response.headers['Etag']
+        self.assertNotEqual(gz_etag, identity.headers['Etag'])
+        response = self.fetch('both.html', **{'If-None-Match': gz_etag})
+        self.assertEqual(response.code, 200)
+        response = self.fetch(
+            'both.html', gzip=True, **{'If-None-Match': gz_etag})
+        self.assertEqual(response.code, 304)
+        # Ranges refer to the compressed bytes
+        response = self.fetch('both.html', gzip=True, Range='bytes=0-1')
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, b'\x1f\x8b')
+        # A stale .gz is ignored
+        past = time.time() - 60
+        os.utime(
+            os.path.join(self.downloads_dir, 'both.html.gz'), (past, past))
+        response = self.fetch('both.html', gzip=True)
+        self.assertEqual(response.body, DATA)
+        self.assertFalse('Content-Encoding' in response.headers)
+
+    def test_traversal(self):
+        for path in ('..%2Fsecret.txt', '..%2F..%2F' + SESSION, '..%2F'):
+            response = self.fetch(path)
+            self.assertEqual(response.code, 403)
+        self.assertEqual(self.fetch('missing.html').code, 404)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests termio's emulator processes (termio/emulation.py) by running real
+programs in a small `EmulatorPool`.
+"""
+
+# Import Python built-ins
+import os, sys, unittest
+from datetime import timedelta
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', '..'))
+from termio.emulation import EmulatorPool, EmulatedMultiplex
+from termio.termio import MULTIPLEX_STATS
+
+# Tornado stuff
+from tornado.testing import AsyncTestCase
+
+class TestEmulation(AsyncTestCase):
+    def setUp(self):
+        super(TestEmulation, self).setUp()
+        self.pool = EmulatorPool(2, io_loop=self.io_loop)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.stop()
+        super(TestEmulation, self).tearDown()
+
+    def wait_for(self, condition, timeout=10):
+        """Waits (running the IOLoop) until *condition()* returns True."""
+        def check():
+            if condition():
+                self.stop()
+            else:
+                self.io_loop.add_timeout(timedelta(milliseconds=20), check)
+        check()
+        self.wait(timeout=timeout)
+
+    def test_output_and_exit(self):
+        m = EmulatedMultiplex(self.pool, 'echo hello; read line; echo $line')
+        exited = []
+        m.add_callback(m.CALLBACK_EXIT, lambda: exited.append(True))
+        m.spawn(rows=10, cols=40)
+        self.wait_for(lambda: 'hello' in u''.join(m.dump()))
+        m.write(u'goodbye\n')
+        self.wait_for(lambda: exited)
+        scrollback, screen = m.dump_html(full=True)
+        self.assertTrue(any('goodbye' in line for line in screen))
+        self.assertFalse(m.isalive())
+        # Rendering gets counted in the emulator process (not here too)
+        calls = MULTIPLEX_STATS['dump_html_calls']
+        m.dump_html(client_id='2')
+        self.assertEqual(MULTIPLEX_STATS['dump_html_calls'], calls)
+        # Each client gets its own diff
+        self.assertEqual(m.dump_html(client_id='1')[1], screen)
+        self.assertEqual(m.dump_html(client_id='1')[1], [''] * len(screen))
+
+    def test_events_and_history(self):
+        m = EmulatedMultiplex(self.pool, 'printf "\\033]0;My Title\\007"; seq 30; cat')
+        titles = []
+        import terminal
+        m.spawn(rows=10, cols=40)
+        m.term.add_callback(terminal.CALLBACK_TITLE,
+            lambda: titles.append(m.term.get_title()))
+        self.wait_for(lambda: m.term.history_count >= 21)
+        self.assertEqual(titles, [u'My Title'])
+        future = m.term.get_history(0, 2, html=False)
+        self.io_loop.add_future(future, lambda f: self.stop())
+        self.wait()
+        first, lines = future.result()
+        self.assertEqual((first, [a.strip() for a in lines]), (0, ['1', '2']))
+        m.terminate()
+
+    def test_least_loaded(self):
+        terminals = [EmulatedMultiplex(self.pool, 'cat') for i in range(4)]
+        for m in terminals:
+            m.spawn()
+        self.assertEqual(
+            sorted(len(e.terminals) for e in self.pool.emulators), [2, 2])
+        for m in terminals:
+            m.terminate()
+        self.wait_for(lambda: not any(m.isalive() for m in terminals))
+
+    def test_migrate(self):
+        # Re-attaching to a dtach session would bring back the same program;
+        # starting a fresh 'cat' is close enough for testing the plumbing.
+        m = EmulatedMultiplex(self.pool, 'cat')
+        m.reattach_cmd = 'cat'
+        m.spawn()
+        first = m.emulator
+        other = [e for e in self.pool.emulators if e is not first][0]
+        self.assertTrue(m.migrate(other))
+        self.assertTrue(m.emulator is other)
+        self.assertFalse(m.tid in first.terminals)
+        m.write(u'still here\n')
+        self.wait_for(lambda: 'still here' in u''.join(m.dump()))
+        self.assertTrue(m.isalive())
+        m.terminate()
+
+    def test_expect(self):
+        m = EmulatedMultiplex(self.pool, 'cat')
+        matches = []
+        m.spawn(rows=10, cols=40)
+        # Checked against the screen...
+        m.expect(u'^pong$', lambda m, match: matches.append(match),
+            preprocess=False)
+        self.assertFalse(m.forward_output)
+        m.write(u'pong\n')
+        self.wait_for(lambda: matches)
+        self.assertEqual(matches, [u'pong'])
+        self.assertEqual(m._patterns, [])
+        # ...or the raw output
+        m.expect(u'\x1b\\[1mbold', lambda m, match: matches.append(match))
+        self.assertTrue(m.forward_output)
+        m.write(u'\x1b[1mbold\x1b[0m\n')
+        self.wait_for(lambda: len(matches) == 2)
+        self.assertEqual(matches[1], b'\x1b[1mbold')
+        # Timeouts call the errorback
+        timeouts = []
+        m.expect(u'^never$', lambda m, match: matches.append(match),
+            errorback=lambda m: timeouts.append(m), timeout=0.1)
+        self.wait_for(lambda: timeouts)
+        self.assertEqual(timeouts, [m])
+        self.assertEqual(len(matches), 2)
+        m.terminate()
+
+if __name__ == "__main__":
+    unittest.main()
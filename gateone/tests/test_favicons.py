@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the bookmarks plugin's favicon cache against a local Tornado server that
+stands in for the sites being bookmarked.
+"""
+
+# Import Python built-ins
+import os, sys, shutil, tempfile, unittest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(
+    tests_dir, '..', 'applications', 'terminal', 'plugins', 'bookmarks'))
+import favicons
+
+# Tornado stuff
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+# Globals
+ICON = b'\x00\x00\x01\x00fake icon data'
+REQUESTS = [] # Paths requested from the stand-in server
+
+class PageHandler(tornado.web.RequestHandler):
+    """
+    Serves a page with an icon link in its <head> followed by a huge <body>
+    that should never get downloaded.
+    """
+    @tornado.web.asynchronous
+    def get(self):
+        REQUESTS.append(self.request.path)
+        self.write(
+            '<html><head><title>Test</title>'
+            '<link rel="shortcut icon" href="/static/icon.png" type="image/png">'
+            '</head><body>')
+        self.flush()
+        # Don't finish; the cache has to stop reading at </head>
+
+class IconHandler(tornado.web.RequestHandler):
+    def get(self):
+        REQUESTS.append(self.request.path)
+        self.set_header('Content-Type', 'image/png')
+        self.write(ICON)
+
+class NoIconHandler(tornado.web.RequestHandler):
+    def get(self):
+        REQUESTS.append(self.request.path)
+        self.write('<html><head><title>Nope</title></head><body></body></html>')
+
+# Unit Tests
+class TestIconLinkParser(unittest.TestCase):
+    def test_finds_link(self):
+        html = ('<html><head><link rel="stylesheet" href="/a.css">'
+                '<link rel="icon" href="/i.ico"></head></html>')
+        self.assertEqual(
+            favicons.find_icon_link(html), ('/i.ico', 'image/x-icon'))
+
+    def test_stops_at_body(self):
+        html = ('<html><head></head><body>'
+                '<link rel="icon" href="/i.ico"></body></html>')
+        self.assertEqual(favicons.find_icon_link(html), None)
+
+class TestFaviconCache(AsyncHTTPTestCase):
+    def get_app(self):
+        return tornado.web.Application([
+            (r"/page", PageHandler),
+            (r"/static/icon.png", IconHandler),
+            (r"/noicon", NoIconHandler),
+        ])
+
+    def setUp(self):
+        super(TestFaviconCache, self).setUp()
+        del REQUESTS[:]
+        self.cache_dir = tempfile.mkdtemp(prefix='favicons')
+        self.cache = favicons.FaviconCache(
+            self.cache_dir, fetch_timeout=2, io_loop=self.io_loop)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        super(TestFaviconCache, self).tearDown()
+
+    def get_icons(self, *urls):
+        results = []
+        def callback(result):
+            results.append(result)
+            if len(results) == len(urls):
+                self.stop()
+        for url in urls:
+            self.cache.get(url, callback)
+        self.wait()
+        return results
+
+    def test_concurrent_fetches_are_shared(self):
+        results = self.get_icons(
+            self.get_url('/page'), self.get_url('/page?again'))
+        self.assertEqual(results, [(ICON, 'image/png')] * 2)
+        self.assertEqual(self.cache.fetches, 1)
+        self.assertEqual(REQUESTS, ['/page', '/static/icon.png'])
+
+    def test_cache_survives_restart(self):
+        self.get_icons(self.get_url('/page'))
+        cache = favicons.FaviconCache(self.cache_dir, io_loop=self.io_loop)
+        origin = favicons.get_origin(self.get_url('/'))
+        self.assertEqual(cache.lookup(origin), (ICON, 'image/png'))
+
+    def test_negative_cache(self):
+        self.assertEqual(self.get_icons(self.get_url('/noicon')), [None])
+        self.assertEqual(REQUESTS, ['/noicon']) # /favicon.ico is a 404
+        self.assertEqual(self.get_icons(self.get_url('/noicon')), [None])
+        self.assertEqual(REQUESTS, ['/noicon'])
+        self.assertEqual(self.cache.fetches, 1)
+
+if __name__ == "__main__":
+    unittest.main()
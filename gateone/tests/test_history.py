@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests `terminal.Terminal`'s scrollback history (`Terminal.get_history`).
+"""
+
+# Import Python built-ins
+import os, sys, unittest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', '..'))
+import terminal
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        self.term = terminal.Terminal(rows=5, cols=40)
+        self.term.write(u'plain 0\r\n')
+        # Bold red that starts on one line and ends two lines later:
+        self.term.write(u'plain \x1b[1;31mred 1\r\nred 2\r\nred 3\x1b[0m plain\r\n')
+        self.term.write(u'\x1b[4munderlined 4\r\n\x1b[0mplain 5\r\n')
+        for i in range(6, 12):
+            self.term.write(u'line %s\r\n' % i)
+
+    def test_plain(self):
+        first, lines = self.term.get_history(0, 3, html=False)
+        self.assertEqual(first, 0)
+        self.assertEqual(
+            [a.rstrip() for a in lines], [u'plain 0', u'plain red 1', u'red 2'])
+
+    def test_ranges(self):
+        count = self.term.history_count
+        full = self.term.get_history(0, count)[1]
+        for a, b, c in [(0, 2, 4), (1, 3, count), (0, 1, 6), (2, 3, 5)]:
+            first = self.term.get_history(a, b)[1]
+            second = self.term.get_history(b, c)[1]
+            self.assertEqual(first + second, self.term.get_history(a, c)[1])
+            self.assertEqual(first + second, full[a:c])
+        # Every line stands on its own
+        for line in full:
+            if line:
+                self.assertEqual(line.count(u'<span'), line.count(u'</span>'))
+        self.assertEqual(full[0], u'plain 0')
+        for line in full[1:4]:
+            self.assertTrue(u'bold">red' in line)
+        self.assertTrue(u'underline">underlined 4</span>' in full[4])
+        self.assertEqual(full[6], u'line 6')
+
+    def test_cache_stats(self):
+        from terminal import terminal as terminal_module
+        stats = terminal_module.HTML_CACHE_STATS
+        html_cache = terminal_module.HTML_CACHE
+        terminal_module.HTML_CACHE = None
+        try: # No cache means no lookups (and thus no misses)
+            before = dict(stats)
+            self.term.get_history(0, 6)
+            self.assertEqual(stats, before)
+        finally:
+            terminal_module.HTML_CACHE = html_cache
+        if html_cache is None:
+            return # Tornado isn't available
+        html_cache.clear()
+        before = dict(stats)
+        self.term.get_history(0, 6)
+        self.assertEqual(stats['misses'] - before['misses'], 6)
+        self.assertEqual(stats['hits'], before['hits'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests gateone/core/log.py's `JSONAdapter`.
+"""
+
+# Import Python built-ins
+import os, sys, logging, unittest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', '..'))
+from gateone.core.log import JSONAdapter
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+class TestJSONAdapter(unittest.TestCase):
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger('gateone.test_log')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+        self.adapter = JSONAdapter(self.logger, {'app': 'test'})
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_caller(self):
+        self.adapter.info("hello %s", "world")
+        self.adapter.debug("not enabled")
+        try:
+            1/0
+        except ZeroDivisionError:
+            self.adapter.exception("oops")
+        first, second = self.handler.records
+        self.assertEqual(first.getMessage(), u'{"app": "test"} hello world')
+        self.assertEqual(first.funcName, 'test_caller')
+        self.assertEqual(
+            os.path.basename(first.pathname).split('.')[0], 'test_log')
+        self.assertEqual(second.funcName, 'test_caller')
+        self.assertTrue(second.exc_info)
+
+    def test_metadata(self):
+        self.adapter.warning("hi", metadata={'user': u'b\xf6b'})
+        self.assertEqual(
+            self.handler.records[0].getMessage(),
+            u'{"app": "test", "user": "b\xf6b"} hi')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the logging plugin's full-text index (log_index.py) using .golog files
+written by `termio.SessionRecorder`.
+"""
+
+# Import Python built-ins
+import os, sys, shutil, sqlite3, tempfile, unittest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', '..'))
+from termio import SessionRecorder
+from gateone.applications.terminal.plugins.logging import log_index
+
+class TestLogIndex(unittest.TestCase):
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp(prefix='log_index')
+        os.mkdir(os.path.join(self.user_dir, 'logs'))
+        self.log_path = os.path.join(
+            self.user_dir, 'logs', '20140101000000000000-127.0.0.1.golog')
+        self.timestamp = 1400000000000
+
+    def tearDown(self):
+        shutil.rmtree(self.user_dir)
+
+    def append(self, *frames):
+        """Appends *frames* to the log (just like a running terminal would)."""
+        recorder = SessionRecorder(self.log_path)
+        for frame in frames:
+            self.timestamp += 1
+            recorder.record(frame, timestamp=str(self.timestamp).encode('ascii'))
+        recorder.close()
+
+    def indexed_lines(self):
+        db = sqlite3.connect(os.path.join(self.user_dir, log_index.INDEX_NAME))
+        try:
+            return [a[0] for a in db.execute(
+                "SELECT lines_text.text FROM lines "
+                "JOIN lines_text ON lines_text.rowid = lines.id "
+                "ORDER BY lines.frame, lines.id")]
+        finally:
+            db.close()
+
+    def test_append(self):
+        self.append(b'{}', b'first line\r\n', b'$ ec\x1b[1')
+        matches = log_index.search(self.user_dir, 'first line')
+        self.assertEqual(matches[0]['matches'][0]['frame'], 0)
+        self.assertEqual(self.indexed_lines(), [u'first line', u'$ ec'])
+        # The rest of the command (and the escape sequence) comes later
+        self.append(b'mho across\x1b[0m\r\n', b'$ ')
+        self.assertEqual(log_index.update_index(self.user_dir), 1)
+        self.assertEqual(
+            self.indexed_lines(), [u'first line', u'$ echo across', u'$ '])
+        matches = log_index.search(self.user_dir, 'echo across')
+        self.assertEqual(len(matches[0]['matches']), 1)
+        self.assertEqual(matches[0]['matches'][0]['frame'], 1)
+        # Nothing changed; nothing gets re-indexed
+        self.assertEqual(log_index.update_index(self.user_dir), 0)
+
+if __name__ == "__main__":
+    unittest.main()
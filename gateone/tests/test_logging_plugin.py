@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the logging plugin's (logging_plugin.py) flattened log retrieval and
+exporting using .golog files written by `termio.SessionRecorder`.
+"""
+
+# Import Python built-ins
+import os, sys, re, json, shutil, logging, tempfile, unittest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', '..'))
+from termio import SessionRecorder
+from gateone.applications.terminal.plugins.logging import logging_plugin
+
+# Globals
+START = 1400000000000 # Timestamp of the first line
+RE_TAGS = re.compile(r'<[^>]+>')
+RE_LINE = re.compile(r'line \d+$') # Lines are prefixed with their date/time
+
+class ListQueue(list):
+    """
+    Holds onto whatever gets put() in it as-is (so modifying something after
+    it was put() would show).
+    """
+    def put(self, item):
+        self.append(item)
+
+class TestRetrieveLogFlat(unittest.TestCase):
+    def setUp(self):
+        self.users_dir = tempfile.mkdtemp(prefix='logging_plugin')
+        os.mkdir(os.path.join(self.users_dir, 'logs'))
+        self.log_filename = '20140101000000000000-127.0.0.1.golog'
+        recorder = SessionRecorder(
+            os.path.join(self.users_dir, 'logs', self.log_filename))
+        metadata = {'rows': 24, 'columns': 80, 'start_date': START,
+            'end_date': START + 100, 'frames': 26}
+        recorder.record(
+            json.dumps(metadata).encode('utf-8'), timestamp=str(START).encode())
+        for i in range(25):
+            recorder.record(
+                b'line %02d\r\n' % i, timestamp=str(START + i).encode())
+        recorder.close()
+        self.chunk_lines = logging_plugin.FLAT_CHUNK_LINES
+        logging_plugin.FLAT_CHUNK_LINES = 10
+
+    def tearDown(self):
+        logging_plugin.FLAT_CHUNK_LINES = self.chunk_lines
+        shutil.rmtree(self.users_dir)
+
+    def retrieve(self, **settings):
+        """
+        Returns a list of (offset, complete, lines) for each chunk that
+        `_retrieve_log_flat` produced.
+        """
+        settings.update({
+            'user': 'test',
+            'users_dir': self.users_dir,
+            'log_filename': self.log_filename,
+        })
+        queue = ListQueue()
+        logging_plugin._retrieve_log_flat(queue, settings)
+        out = []
+        for message in queue:
+            chunk = message['terminal:logging_log_flat']
+            self.assertEqual(chunk['result'], 'Success')
+            lines = [
+                RE_LINE.search(RE_TAGS.sub('', a)).group()
+                for a in chunk['log']]
+            out.append((chunk['offset'], chunk['complete'], lines))
+        return out
+
+    def test_chunks(self):
+        chunks = self.retrieve()
+        self.assertEqual(
+            [(a[0], a[1], len(a[2])) for a in chunks],
+            [(0, False, 10), (10, False, 10), (20, True, 5)])
+        self.assertEqual(
+            sum([a[2] for a in chunks], []),
+            ['line %02d' % i for i in range(25)])
+
+    def test_exact_chunks(self):
+        chunks = self.retrieve(limit="20")
+        self.assertEqual(
+            [(a[0], a[1], len(a[2])) for a in chunks],
+            [(0, False, 10), (10, True, 10)])
+        # Nothing at all still gets a (complete) chunk
+        chunks = self.retrieve(limit="30,5")
+        self.assertEqual(chunks, [(25, True, [])])
+
+    def test_limit(self):
+        chunks = self.retrieve(limit="5,12")
+        self.assertEqual(
+            [(a[0], a[1]) for a in chunks], [(5, False), (15, True)])
+        self.assertEqual(
+            sum([a[2] for a in chunks], []),
+            ['line %02d' % i for i in range(5, 17)])
+
+    def test_start_end(self):
+        chunks = self.retrieve(start=START + 10, end=START + 14)
+        lines = sum([a[2] for a in chunks], [])
+        self.assertEqual(lines, ['line %02d' % i for i in range(10, 15)])
+
+class FakeTerminalApp(object):
+    """
+    Just enough of a `TerminalApplication` to call `export_logs` with.
+    """
+    def __init__(self, user_dir, policy):
+        self.policy = policy
+        self.term_log = logging.getLogger('gateone.test_logging_plugin')
+        self.messages = []
+        self.current_user = {'upn': 'admin'}
+        self.ws = self
+        self.settings = {'user_dir': user_dir}
+
+    def write_message(self, message):
+        self.messages.append(message)
+
+class TestExportLogs(unittest.TestCase):
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp(prefix='logging_plugin')
+        for user in ('alice', 'bob'):
+            logs_dir = os.path.join(self.user_dir, user, 'logs')
+            os.makedirs(logs_dir)
+            recorder = SessionRecorder(
+                os.path.join(logs_dir, '20140101000000000000.golog'))
+            recorder.record(json.dumps({'rows': 24, 'columns': 80}).encode(),
+                timestamp=str(START).encode())
+            recorder.record(b'%s was here\r\n' % user.encode(),
+                timestamp=str(START + 1).encode())
+            recorder.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.user_dir)
+
+    def test_policy(self):
+        app = FakeTerminalApp(self.user_dir, policy={})
+        logging_plugin.export_logs(app, {})
+        self.assertEqual(list(app.messages[0].keys()), ['go:notice'])
+        self.assertFalse(
+            os.path.exists(os.path.join(self.user_dir, 'admin', 'exports')))
+
+    def test_export(self):
+        output_dir = os.path.join(self.user_dir, 'admin', 'exports', 'now')
+        queue = ListQueue()
+        logging_plugin._export_logs(queue, {
+            'user_dir': self.user_dir,
+            'users': ['bob', '../alice'],
+            'start': None,
+            'end': None,
+            'processes': 1,
+            'output_dir': output_dir,
+            'render_settings': {},
+        })
+        result = queue[0]['terminal:logging_export_complete']
+        self.assertEqual((result['exported'], result['errors']), (1, []))
+        self.assertEqual(os.listdir(output_dir), ['bob'])
+        html_path = os.path.join(output_dir, 'bob', '20140101000000000000.html')
+        with open(html_path, 'rb') as f:
+            self.assertTrue(b'bob was here' in f.read())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests logviewer.py's HTML playback export using .golog files written by
+`termio.SessionRecorder`.
+"""
+
+# Import Python built-ins
+import os, sys, io, re, json, shutil, tempfile, unittest, subprocess
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', '..'))
+from termio import SessionRecorder
+from gateone.applications.terminal import logviewer
+
+# Globals
+START = 1400000000000
+# The CSS includes comments with the (temporary) paths it was rendered in:
+RE_TEMP_DIR = re.compile(br'/logviewer[^/]+/')
+
+def make_log(path, lines=10):
+    """Writes a .golog to *path* containing *lines* lines of output."""
+    recorder = SessionRecorder(path)
+    metadata = {'rows': 24, 'columns': 80, 'start_date': START,
+        'end_date': START + lines, 'frames': lines + 1}
+    recorder.record(
+        json.dumps(metadata).encode('utf-8'), timestamp=str(START).encode())
+    for i in range(lines):
+        recorder.record(
+            b'\x1b[1mline\x1b[0m %02d\r\n' % i,
+            timestamp=str(START + i).encode())
+    recorder.close()
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='logviewer')
+        self.log_paths = []
+        for i in range(2):
+            path = os.path.join(self.temp_dir, '2014010100000000000%s.golog' % i)
+            make_log(path, lines=10 + i)
+            self.log_paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_export(self):
+        export_dir = os.path.join(self.temp_dir, 'exported')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.check_output([
+            sys.executable, logviewer.__file__.replace('.pyc', '.py'),
+            '--export=%s' % export_dir, '--processes=2'] + self.log_paths,
+            env=env)
+        bundle = logviewer.playback_bundle()
+        for log_path in self.log_paths:
+            name = os.path.basename(log_path).replace('.golog', '.html')
+            html_path = os.path.join(export_dir, name)
+            self.assertTrue(html_path.encode('utf-8') in output)
+            expected = io.BytesIO()
+            logviewer.write_html_playback(log_path, expected, bundle)
+            with io.open(html_path, 'rb') as f:
+                self.assertEqual(
+                    RE_TEMP_DIR.sub(b'', f.read()),
+                    RE_TEMP_DIR.sub(b'', expected.getvalue()))
+        self.assertEqual(
+            sorted(os.listdir(export_dir)),
+            ['20140101000000000000.html', '20140101000000000001.html'])
+
+if __name__ == "__main__":
+    unittest.main()
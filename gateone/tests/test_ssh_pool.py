@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests ssh_connect.py's pooled (ControlMaster/ControlPersist) connections using
+a fake ssh command that pretends to be a master when the control socket
+doesn't exist and a client when it does.  No network required.
+
+Also tests the ssh plugin's bookkeeping for pooled connections (`SSH_POOL`)
+and running commands on the (shared) sub-channel via `execute_command` (using
+a local shell in place of the sub-channel).
+"""
+
+# Import Python built-ins
+import os, sys, stat, shutil, tempfile, unittest, subprocess
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', '..'))
+from termio import Multiplex
+from gateone.core.log import go_logger
+from gateone.applications.terminal.plugins.ssh import ssh
+
+# Tornado stuff
+from tornado.testing import AsyncTestCase
+SSH_CONNECT = os.path.join(
+    tests_dir, '..', 'applications', 'terminal', 'plugins', 'ssh', 'scripts',
+    'ssh_connect.py')
+
+# Globals
+FAKE_SSH = """\
+#!/bin/sh
+# Records how it was called and emulates ssh's ControlMaster=auto behavior
+for arg in "$@"; do
+    case "$arg" in
+        -S*) socket=$(echo "${arg#-S}" | tr -d "'") ;;
+    esac
+done
+if [ -e "$socket" ]; then
+    echo "client $socket $*" >> "%(log)s"
+else
+    touch "$socket"
+    echo "master $socket $*" >> "%(log)s"
+fi
+"""
+
+class TestSSHPool(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='ssh_pool')
+        self.log_path = os.path.join(self.temp_dir, 'ssh.log')
+        self.ssh_path = os.path.join(self.temp_dir, 'ssh')
+        with open(self.ssh_path, 'w') as f:
+            f.write(FAKE_SSH % {'log': self.log_path})
+        os.chmod(self.ssh_path, stat.S_IRWXU)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def connect(self, user, session, *args):
+        """
+        Runs ssh_connect.py (as *user* in *session*) to user@localhost:22.
+        """
+        env = os.environ.copy()
+        env.update({
+            'GO_USER': user,
+            'GO_USER_DIR': self.temp_dir,
+            'GO_SESSION': session,
+        })
+        cmd = [
+            sys.executable, SSH_CONNECT, '-c', self.ssh_path,
+            '-S', os.path.join(
+                self.temp_dir, 'ssh_pool', '%SHORT_USER%', '%SHORT_SOCKET%'),
+        ] + list(args) + ['user', 'localhost', '22']
+        with open(os.devnull) as devnull:
+            subprocess.check_output(cmd, env=env, stdin=devnull)
+        with open(self.log_path) as f:
+            return f.read().splitlines()[-1].split()
+
+    def test_pooled_connections(self):
+        first = self.connect('alice', 'session1', '--persist=600')
+        self.assertEqual(first[0], 'master')
+        self.assertTrue('-oControlMaster=auto' in first)
+        self.assertTrue('-oControlPersist=600' in first)
+        self.assertFalse('-M' in first)
+        # Another session belonging to the same user shares the master
+        second = self.connect('alice', 'session2', '--persist=600')
+        self.assertEqual(second[0], 'client')
+        self.assertEqual(second[1], first[1])
+        # ...but other users get their own
+        third = self.connect('bob', 'session3', '--persist=600')
+        self.assertEqual(third[0], 'master')
+        self.assertNotEqual(third[1], first[1])
+
+    def test_without_persist(self):
+        first = self.connect('alice', 'session1')
+        self.assertEqual(first[0], 'master')
+        self.assertTrue('-M' in first)
+        self.assertFalse('-oControlMaster=auto' in first)
+        second = self.connect('alice', 'session1')
+        self.assertEqual(second[0], 'client')
+        self.assertFalse('-M' in second)
+
+class FakeTerminalApp(object):
+    """
+    Just enough of a `TerminalApplication` to call the ssh plugin's functions.
+    """
+    def __init__(self, socket_path, session='session1'):
+        self.loc_terms = {
+            1: {'ssh_socket': socket_path,
+                'ssh_connect_string': 'ssh://user@localhost:22'},
+            2: {'ssh_socket': socket_path,
+                'ssh_connect_string': 'ssh://user@localhost:22'},
+        }
+        self.ssh_log = go_logger('gateone.test_ssh_pool')
+        self.current_user = {'upn': 'alice'}
+        self.messages = []
+        self.ws = self
+        self.session = session
+        self.location = 'default'
+
+    def write_message(self, message):
+        self.messages.append(message)
+
+class TestPoolTracking(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='ssh_pool')
+        self.socket_path = os.path.join(self.temp_dir, 'socket')
+        open(self.socket_path, 'w').close() # Pretend the master is up
+
+    def tearDown(self):
+        ssh.SSH_POOL.clear()
+        shutil.rmtree(self.temp_dir)
+
+    def test_attach_detach(self):
+        app = FakeTerminalApp(self.socket_path)
+        ssh.attach_to_pool(app, 1)
+        ssh.attach_to_pool(app, 2)
+        info = ssh.get_pool_info(app, 1)
+        self.assertEqual(info['terminals'], 2)
+        self.assertTrue(info['connected'])
+        ssh.detach_from_pool(app, 1)
+        self.assertEqual(ssh.get_pool_info(app, 2)['terminals'], 1)
+        # The entry goes away with the last terminal (even if the master
+        # is still around)
+        ssh.detach_from_pool(app, 2)
+        self.assertEqual(ssh.SSH_POOL, {})
+
+class FakeSubChannel(object):
+    """
+    Stands in for the `termio.Multiplex` that `open_sub_channel` creates.
+    """
+    def __init__(self, cmd, name):
+        self.cmd = cmd
+    def isalive(self):
+        return True
+    def spawn(self, rows=24, cols=80):
+        pass
+    def writeline(self, line):
+        pass
+
+class TestSubChannel(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='ssh_pool')
+        os.mkdir(os.path.join(self.temp_dir, 'alice'))
+        os.mkdir(os.path.join(self.temp_dir, 'alice', '.ssh'))
+
+    def tearDown(self):
+        ssh.OPEN_SUBCHANNELS.clear()
+        shutil.rmtree(self.temp_dir)
+
+    def open_sub_channel(self, socket_path, term):
+        app = FakeTerminalApp(socket_path)
+        app.settings = {'session_dir': self.temp_dir, 'user_dir': self.temp_dir}
+        app.new_multiplex = FakeSubChannel
+        return ssh.open_sub_channel(app, term)
+
+    def test_shared(self):
+        socket_path = os.path.join(self.temp_dir, 'socket')
+        m = self.open_sub_channel(socket_path, 1)
+        self.assertTrue("-S'%s'" % socket_path in m.cmd)
+        self.assertTrue(self.open_sub_channel(socket_path, 2) is m)
+        self.assertEqual(list(ssh.OPEN_SUBCHANNELS.keys()), [socket_path])
+
+    def test_without_socket(self):
+        for socket_path in (None, 'None'):
+            m1 = self.open_sub_channel(socket_path, 1)
+            m2 = self.open_sub_channel(socket_path, 2)
+            self.assertFalse(m1 is m2)
+            self.assertFalse('-S' in m1.cmd)
+            self.assertFalse(None in ssh.OPEN_SUBCHANNELS)
+            self.assertFalse('None' in ssh.OPEN_SUBCHANNELS)
+            ssh.OPEN_SUBCHANNELS.clear()
+
+class TestExecuteCommand(AsyncTestCase):
+    def setUp(self):
+        super(TestExecuteCommand, self).setUp()
+        self.io_loop.make_current()
+        self.socket_path = '/nonexistent/socket'
+        # A plain shell stands in for the sub-channel ssh would open
+        self.m = Multiplex('bash --norc --noprofile')
+        self.m.spawn(rows=100, cols=200)
+        ssh.OPEN_SUBCHANNELS[self.socket_path] = self.m
+        self.app = FakeTerminalApp(self.socket_path)
+
+    def tearDown(self):
+        ssh.terminate_sub_channel(self.m)
+        super(TestExecuteCommand, self).tearDown()
+
+    def test_concurrent_commands(self):
+        results = {}
+        def callback(name, output, m_instance):
+            results[name] = output
+            if len(results) == 3:
+                self.stop()
+        # Two terminals using the same master (and thus sub-channel)
+        ssh.execute_command(self.app, 1, 'echo one',
+            lambda *args: callback(1, *args))
+        ssh.execute_command(self.app, 2, 'sleep 0.2; echo two',
+            lambda *args: callback(2, *args))
+        ssh.execute_command(self.app, 2, 'echo three',
+            lambda *args: callback(3, *args))
+        self.assertEqual(len(ssh.COMMAND_QUEUES[self.m]), 3)
+        self.wait(timeout=10)
+        self.assertEqual(results, {1: 'one', 2: 'two', 3: 'three'})
+        self.assertFalse(self.m in ssh.COMMAND_QUEUES)
+        self.assertEqual(self.app.messages, [])
+
+if __name__ == "__main__":
+    unittest.main()
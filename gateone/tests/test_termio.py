@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests how `termio.MultiplexPOSIXIOLoop` writes to its child process (directly
+and immediately when called from the IOLoop; buffered when the child isn't
+keeping up; up to a limit) and the background writing done by
+`termio.SessionRecorder`.
+"""
+
+# Import Python built-ins
+import os, sys, time, gzip, errno, shutil, tempfile, threading, unittest
+from datetime import timedelta
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', '..'))
+import termio
+from termio import Multiplex, SessionRecorder
+
+# Tornado stuff
+from tornado.testing import AsyncTestCase
+
+class TestWrite(AsyncTestCase):
+    def setUp(self):
+        super(TestWrite, self).setUp()
+        self.io_loop.make_current()
+        self.m = Multiplex('cat')
+        self.m.spawn(rows=10, cols=40)
+
+    def tearDown(self):
+        self.m.terminate()
+        super(TestWrite, self).tearDown()
+
+    def wait_for(self, condition, timeout=10):
+        """Waits (running the IOLoop) until *condition()* returns True."""
+        def check():
+            if condition():
+                self.stop()
+            else:
+                self.io_loop.add_timeout(timedelta(milliseconds=20), check)
+        check()
+        self.wait(timeout=timeout)
+
+    def screen(self):
+        return u'\n'.join(self.m.dump())
+
+    def test_immediate_write(self):
+        self.m.write(u'caf\xe9\n') # Encoded once, straight to the fd
+        self.assertEqual(self.m._pending_input, b'')
+        self.wait_for(lambda: u'caf\xe9' in self.screen())
+
+    def test_pending_input(self):
+        # Way more than the pty will take at once
+        lines = u''.join(u'line %05d\n' % i for i in range(5000))
+        self.m.write(lines + u'END\n')
+        self.assertTrue(self.m._pending_input)
+        self.wait_for(lambda: not self.m._pending_input)
+        self.wait_for(lambda: u'END' in self.screen())
+
+    def test_write_from_thread(self):
+        thread = threading.Thread(target=self.m.write, args=(u'threaded\n',))
+        thread.start()
+        thread.join()
+        self.wait_for(lambda: u'threaded' in self.screen())
+
+class TestPendingInput(AsyncTestCase):
+    def setUp(self):
+        super(TestPendingInput, self).setUp()
+        self.io_loop.make_current()
+        self.m = Multiplex('sleep 60') # Never reads anything
+        self.m.spawn(rows=10, cols=40)
+
+    def tearDown(self):
+        if self.m.isalive():
+            self.m.terminate()
+        super(TestPendingInput, self).tearDown()
+
+    def pending(self):
+        return len(self.m._pending_input) - self.m._pending_offset
+
+    def test_limit(self):
+        self.m.write(b'x' * (termio.termio.MAX_PENDING_INPUT // 2))
+        self.assertTrue(self.pending() > 0)
+        self.m.write(b'x' * 10 * termio.termio.MAX_PENDING_INPUT)
+        self.assertEqual(self.pending(), termio.termio.MAX_PENDING_INPUT)
+
+    def test_write_error(self):
+        self.m.write(b'x' * 100000)
+        self.assertTrue(self.pending() > 0)
+        def broken_write(fd, data):
+            raise OSError(errno.EIO, os.strerror(errno.EIO))
+        write = os.write
+        os.write = broken_write
+        try: # The IOLoop says the fd is writable again...
+            self.m._ioloop_read_handler(self.m.fd, self.io_loop.WRITE)
+        finally:
+            os.write = write
+        self.assertEqual(self.pending(), 0)
+        self.assertFalse(self.m.isalive())
+
+class TestSessionRecorder(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='recorder')
+        self.path = os.path.join(self.temp_dir, 'test.golog')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_flush_interval(self):
+        recorder = SessionRecorder(self.path, flush_interval=0.1)
+        writer = termio.termio._WRITER
+        # Every frame must get flushed on time no matter when it arrives
+        for i in range(20):
+            recorder.record(b'frame %d' % i, timestamp=b'0')
+            deadline = time.time() + 2
+            while recorder.bytes_queued and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(recorder.bytes_queued, 0)
+        recorder.close()
+        # Closing the last recorder stops the writer
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(termio.termio._WRITER, None)
+        with gzip.open(self.path) as f:
+            self.assertEqual(f.read().count(b'frame'), 20)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the pieces of gateone/core/workers.py that don't require forking:  Session
+routing, the WorkerBus (two buses in the same process), the
+SessionRegistry, and how WebSocket origins get checked on worker ports.
+"""
+
+# Import Python built-ins
+import os, sys, shutil, tempfile, unittest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(tests_dir, '..', '..'))
+from gateone.core import workers
+from gateone.core.server import ApplicationWebSocket
+
+# Tornado stuff
+from tornado.testing import AsyncTestCase
+
+class TestRouting(unittest.TestCase):
+    def test_worker_for(self):
+        sessions = ['session%s' % i for i in range(100)]
+        owners = [workers.worker_for(s, 4) for s in sessions]
+        self.assertEqual(owners, [workers.worker_for(s, 4) for s in sessions])
+        self.assertEqual(set(owners), set(range(4)))
+        self.assertEqual(workers.worker_for(u'session0', 4), owners[0])
+
+    def test_worker_url(self):
+        self.assertEqual(
+            workers.worker_url('example.com:8000', 8000, 1),
+            'wss://example.com:8002/ws')
+        self.assertEqual(
+            workers.worker_url('[::1]:8000', 8000, 0, ssl=False,
+                url_prefix='/go/'),
+            'ws://[::1]:8001/go/ws')
+        self.assertEqual(
+            workers.worker_url('example.com', 443, 2),
+            'wss://example.com:446/ws')
+
+class TestWorkerBus(AsyncTestCase):
+    def setUp(self):
+        super(TestWorkerBus, self).setUp()
+        self.bus_dir = tempfile.mkdtemp(prefix='workers')
+        self.buses = [
+            workers.WorkerBus(self.bus_dir, i, 3, io_loop=self.io_loop)
+            for i in range(2)] # Worker 2 isn't running
+        for bus in self.buses:
+            bus.start()
+
+    def tearDown(self):
+        for bus in self.buses:
+            bus.stop()
+        shutil.rmtree(self.bus_dir)
+        super(TestWorkerBus, self).tearDown()
+
+    def test_publish(self):
+        received = []
+        def deliver(message, upn=None):
+            received.append((message, upn))
+            self.stop()
+        self.buses[1].on('deliver', deliver)
+        self.buses[0].on('deliver', self.fail) # Never sent to ourselves
+        self.buses[0].publish(
+            'deliver', {'go:user_message': u'hi'}, upn='AUTHENTICATED')
+        self.wait()
+        self.assertEqual(
+            received, [({'go:user_message': u'hi'}, 'AUTHENTICATED')])
+
+class TestSessionRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry_dir = tempfile.mkdtemp(prefix='registry')
+
+    def tearDown(self):
+        shutil.rmtree(self.registry_dir)
+
+    def test_register(self):
+        first = workers.SessionRegistry(self.registry_dir, 0)
+        second = workers.SessionRegistry(self.registry_dir, 1)
+        first.register('session1', user={'upn': 'alice'}, connected=True)
+        second.register('session2', user={'upn': 'bob'}, connected=False)
+        self.assertEqual(second.lookup('session1'), {
+            'worker': 0, 'user': {'upn': 'alice'}, 'connected': True})
+        self.assertEqual(
+            sorted(first.sessions().keys()), ['session1', 'session2'])
+        second.unregister('session2')
+        self.assertEqual(first.lookup('session2'), None)
+        self.assertEqual(list(first.sessions().keys()), ['session1'])
+
+class FakeRequest(object):
+    def __init__(self, host):
+        self.headers = {'Host': host}
+
+class FakeApplication(object):
+    settings = {'port': 8000}
+
+class TestCheckOrigin(unittest.TestCase):
+    def setUp(self):
+        self.worker = workers.WORKER
+        workers.WORKER = 1 # Listening on port 8002
+
+    def tearDown(self):
+        workers.WORKER = self.worker
+
+    def check_origin(self, origin, host, origins=(), port=8000):
+        ws = ApplicationWebSocket.__new__(ApplicationWebSocket)
+        ws.application = FakeApplication()
+        ws.application.settings = {'port': port}
+        ws.request = FakeRequest(host)
+        ws.prefs = {'*': {'gateone': {'origins': list(origins)}}}
+        return ws.check_origin(origin)
+
+    def test_worker_port(self):
+        # Pages come from the main port; WebSockets go to the worker's port
+        self.assertTrue(self.check_origin(
+            'https://example.com:8000', 'example.com:8002'))
+        self.assertTrue(self.check_origin(
+            'https://example.com', 'example.com:445', port=443))
+        self.assertTrue(self.check_origin(
+            'https://[::1]:8000', '[::1]:8002'))
+        # Same host but some other port isn't the same origin
+        self.assertFalse(self.check_origin(
+            'https://example.com:9999', 'example.com:8002'))
+        self.assertFalse(self.check_origin(
+            'http://example.com', 'example.com:8002'))
+        self.assertTrue(self.check_origin( # Same origin is always OK
+            'https://example.com:8002', 'example.com:8002'))
+        # ...unless it's in the "origins" setting
+        self.assertTrue(self.check_origin(
+            'https://example.com:9999', 'example.com:8002',
+            origins=['example.com:9999']))
+        self.assertTrue(self.check_origin(
+            'https://other.example.com', 'example.com:8002',
+            origins=['other.example.com']))
+        self.assertFalse(self.check_origin(
+            'https://example.com:9999', 'example.com:8002',
+            origins=['example.com:8000', 'other.example.com']))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -141,6 +141,16 @@ More information about how this works can be had by looking at the
 
 .. note:: There's more than one function that empties :attr:`Terminal.scrollback_buf` when called.  You'll just have to have a look around =)
 
+Scrollback History
+------------------
+Since :attr:`Terminal.scrollback_buf` gets emptied every time the screen is
+dumped the Terminal also keeps a separate, bounded history of every line that
+scrolled off the top of the screen in :attr:`Terminal.history` (up to
+:attr:`Terminal.max_history` lines).  Lines are stored as (trimmed) arrays of
+characters and rendition references just like :attr:`Terminal.screen` and
+:attr:`Terminal.renditions`.  Use :meth:`Terminal.get_history` to retrieve a
+range of lines as HTML or plain text.
+
 Class Docstrings
 ================
 """
@@ -151,7 +161,7 @@ from io import BytesIO
 from array import array
 from datetime import datetime, timedelta
 from functools import partial
-from collections import defaultdict
+from collections import defaultdict, deque
 from itertools import imap, izip
 try:
     from collections import OrderedDict
@@ -877,21 +887,22 @@ class AutoExpireDict(dict):
     .. note::
 
         Only works if there's a running instances of `tornado.ioloop.IOLoop`.
+        The `~tornado.ioloop.PeriodicCallback` gets created (using
+        ``IOLoop.current()``) when the first key is added so creating an
+        `AutoExpireDict` at import time won't create an IOLoop (which would
+        prevent Gate One from forking worker processes).
     """
     def __init__(self, *args, **kwargs):
-        self.io_loop = IOLoop.current()
+        self._key_watcher = None
         self.creation_times = {}
         if 'timeout' in kwargs:
             self.timeout = kwargs.pop('timeout')
         if 'interval' in kwargs:
             self.interval = kwargs.pop('interval')
         super(AutoExpireDict, self).__init__(*args, **kwargs)
-        # Set the start time on every key
+        # Set the start time on every key (also starts the key watcher)
         for k in self.keys():
-            self.creation_times[k] = datetime.now()
-        self._key_watcher = PeriodicCallback(
-            self._timeout_checker, self.interval, io_loop=self.io_loop)
-        self._key_watcher.start() # Will shut down at the next interval if empty
+            self.renew(k)
 
     @property
     def timeout(self):
@@ -930,11 +941,30 @@ class AutoExpireDict(dict):
         if isinstance(value, timedelta):
             value = total_seconds(value) * 1000 # PeriodicCallback uses ms
         self._interval = value
-        # Restart the PeriodicCallback
-        if hasattr(self, '_key_watcher'):
+        # Restart the PeriodicCallback (if running) with the new interval
+        if getattr(self, '_key_watcher', None):
+            self._key_watcher.stop()
+            self._key_watcher = None
+            if self.creation_times:
+                self._start_key_watcher()
+
+    def _start_key_watcher(self):
+        """
+        Starts up the key watcher (``self._key_watcher``) if it isn't already
+        running.
+        """
+        if not self._key_watcher:
+            self._key_watcher = PeriodicCallback(
+                self._timeout_checker, self.interval)
+        if not self._key_watcher._running:
+            self._key_watcher.start()
+
+    def _stop_key_watcher(self):
+        """
+        Stops the key watcher (``self._key_watcher``) if it is running.
+        """
+        if self._key_watcher:
             self._key_watcher.stop()
-        self._key_watcher = PeriodicCallback(
-            self._timeout_checker, value, io_loop=self.io_loop)
 
     def renew(self, key):
         """
@@ -942,8 +972,7 @@ class AutoExpireDict(dict):
         """
         self.creation_times[key] = datetime.now() # Set/renew the start time
         # Start up the key watcher if it isn't already running
-        if not self._key_watcher._running:
-            self._key_watcher.start()
+        self._start_key_watcher()
 
     def __setitem__(self, key, value):
         """
@@ -965,7 +994,7 @@ class AutoExpireDict(dict):
         Ensures that our `tornado.ioloop.PeriodicCallback`
         (``self._key_watcher``) gets stopped.
         """
-        self._key_watcher.stop()
+        self._stop_key_watcher()
 
     def update(self, *args, **kwargs):
         """
@@ -983,14 +1012,14 @@ class AutoExpireDict(dict):
         super(AutoExpireDict, self).clear()
         self.creation_times.clear()
         # Shut down the key watcher right away
-        self._key_watcher.stop()
+        self._stop_key_watcher()
 
     def _timeout_checker(self):
         """
         Walks ``self`` and removes keys that have passed the expiration point.
         """
         if not self.creation_times:
-            self._key_watcher.stop() # Nothing left to watch
+            self._stop_key_watcher() # Nothing left to watch
         for key, starttime in list(self.creation_times.items()):
             if datetime.now() - starttime > self.timeout:
                 del self[key]
@@ -1002,6 +1031,8 @@ try:
     HTML_CACHE = AutoExpireDict(timeout=timedelta(minutes=1), interval=30000)
 except ImportError:
     HTML_CACHE = None
+# Tracks how effective the HTML_CACHE is (lines rendered vs pulled from cache)
+HTML_CACHE_STATS = {'hits': 0, 'misses': 0}
 
 class FileType(object):
     """
@@ -1887,6 +1918,8 @@ class Terminal(object):
         self.double_width_left = False
         self.prev_char = u''
         self.max_scrollback = 1000 # Max number of lines kept in the buffer
+        self.max_history = 5000 # Max number of lines kept in self.history
+        self.init_history()
         self.initialize(rows, cols, em_dimensions)
 
     def initialize(self, rows=24, cols=80, em_dimensions=None):
@@ -2232,6 +2265,59 @@ class Terminal(object):
         self.scrollback_buf = []
         self.scrollback_renditions = []
 
+    def init_history(self):
+        """
+        Empties the scrollback history (:attr:`self.history`) and sets its size
+        to :attr:`self.max_history` lines.  :attr:`self.history_count` keeps
+        track of how many lines have ever been added to it so that lines can be
+        referenced by a stable index (see :meth:`Terminal.get_history`).
+        """
+        self.history = deque(maxlen=self.max_history)
+        self.history_count = 0
+
+    def add_history(self, line, rendition):
+        """
+        Adds *line* and its *rendition* to :attr:`self.history` (trimming off
+        any trailing blank space to save memory).  Lines that scroll off of the
+        alternate screen buffer or out of a scroll region that doesn't start at
+        the top of the screen aren't history so those get ignored.
+        """
+        if self.alt_screen or self.top_margin:
+            return
+        length = max(
+            len(line.tounicode().rstrip(u' ')),
+            len(rendition.tounicode().rstrip(unichr(1000))))
+        self.history.append((line[:length], rendition[:length]))
+        self.history_count += 1
+
+    def get_history(self, start=None, end=None, html=True):
+        """
+        Returns a tuple of ``(first, lines)`` where *lines* is a list of the
+        lines in :attr:`self.history` from index *start* to index *end* and
+        *first* is the index of the first line returned.  Indexes work like
+        Python slices (negative values count back from the most recent line)
+        except they refer to the position of the line in the overall history
+        (i.e. the oldest line ever added is 0, the next is 1, etc).  Lines that
+        have been dropped from the history (due to :attr:`self.max_history`)
+        are simply not returned.
+
+        If *html* is True (default) the lines will be returned as HTML (with
+        renditions converted to <span> elements).  Otherwise they will be plain
+        text.
+        """
+        dropped = self.history_count - len(self.history)
+        start, end, step = slice(start, end).indices(self.history_count)
+        start = max(start, dropped)
+        end = max(end, start)
+        history = list(self.history)[start - dropped:end - dropped]
+        if not history:
+            return (start, [])
+        lines = [a[0] for a in history]
+        if html:
+            renditions = [a[1] for a in history]
+            return (start, self._spanify_scrollback(lines, renditions))
+        return (start, [a.tounicode() for a in lines])
+
     def add_callback(self, event, callback, identifier=None):
         """
         Attaches the given *callback* to the given *event*.  If given,
@@ -2384,6 +2470,7 @@ class Terminal(object):
                 self.scrollback_buf.append(line)
                 rend = self.renditions.pop(0)
                 self.scrollback_renditions.append(rend)
+                self.add_history(line, rend)
         elif rows > self.rows: # Add rows at the bottom
             for i in xrange(rows - self.rows):
                 line = array('u', u' ' * self.cols)
@@ -2930,6 +3017,7 @@ class Terminal(object):
             # Remove top line's rendition information
             rend = self.renditions.pop(self.top_margin)
             self.scrollback_renditions.append(rend)
+            self.add_history(line, rend)
             # Insert a new empty rendition as well:
             self.renditions.insert(self.bottom_margin, empty_rend[:])
         # Execute our callback indicating lines have been updated
@@ -4232,17 +4320,21 @@ class Terminal(object):
         backgrounds = ('b0','b1','b2','b3','b4','b5','b6','b7')
         html_entities = {"&": "&amp;", '<': '&lt;', '>': '&gt;'}
         cursor_span = '<span class="%scursor">' % self.class_prefix
+        hits = misses = 0 # For HTML_CACHE_STATS
         for linecount, line in enumerate(screen):
             rendition = renditions[linecount]
             line_chars = line.tounicode()
             combined = line_chars + rendition.tounicode()
             cursor_line = True if linecount == cursorY else False
-            if not cursor_line and has_cache and combined in html_cache:
+            if not cursor_line and has_cache:
                 # Always re-render the line with the cursor (or just had it)
-                if cursor_span not in html_cache[combined]:
+                if (combined in html_cache
+                        and cursor_span not in html_cache[combined]):
                     # Use the cache...
                     results.append(html_cache[combined])
+                    hits += 1
                     continue
+                misses += 1
             if not len(line_chars.rstrip()) and not cursor_line:
                 results.append(line_chars)
                 continue # Line is empty so we don't need to process renditions
@@ -4325,14 +4417,21 @@ class Terminal(object):
             #       JavaScript) as blank lines.
         for whatever in xrange(spancount): # Bit of cleanup to be safe
             results[-1] += "</span>"
+        HTML_CACHE_STATS['hits'] += hits
+        HTML_CACHE_STATS['misses'] += misses
         return results
 
-    def _spanify_scrollback(self):
+    def _spanify_scrollback(self, lines=None, renditions=None):
         """
         Spanifies (turns renditions into `<span>` elements) everything inside
-        `self.scrollback` using `self.renditions`.  This differs from
-        `_spanify_screen` in that it doesn't apply any logic to detect the
-        location of the cursor (to make it just a tiny bit faster).
+        `self.scrollback` using `self.renditions` (or the given *lines* and
+        *renditions*).  This differs from `_spanify_screen` in that it doesn't
+        apply any logic to detect the location of the cursor (to make it just a
+        tiny bit faster).
+
+        Each line is rendered on its own (renditions that span more than one
+        line get closed at the end of each line and re-opened at the start of
+        the next) so the result for any given line is always the same.
         """
         # NOTE: See the comments in _spanify_screen() for details on this logic
         results = []
@@ -4340,32 +4439,36 @@ class Terminal(object):
         html_cache = HTML_CACHE
         has_cache = isinstance(html_cache, AutoExpireDict)
         screen = self.scrollback_buf
-        renditions = self.scrollback_renditions
+        if lines is not None:
+            screen = lines
+        if renditions is None:
+            renditions = self.scrollback_renditions
         rendition_classes = RENDITION_CLASSES
         renditions_store = self.renditions_store
-        spancount = 0
-        current_classes = set()
-        prev_rendition = None
         foregrounds = ('f0','f1','f2','f3','f4','f5','f6','f7')
         backgrounds = ('b0','b1','b2','b3','b4','b5','b6','b7')
         html_entities = {"&": "&amp;", '<': '&lt;', '>': '&gt;'}
         cursor_span = '<span class="%scursor">' % self.class_prefix
+        hits = misses = 0 # For HTML_CACHE_STATS
         for line, rendition in izip(screen, renditions):
             combined = (line + rendition).tounicode()
-            if has_cache and combined in html_cache:
+            if has_cache:
                 # Most lines should be in the cache because they were rendered
                 # while they were on the screen.
-                if cursor_span not in html_cache[combined]:
+                if (combined in html_cache
+                        and cursor_span not in html_cache[combined]):
                     results.append(html_cache[combined])
+                    hits += 1
                     continue
+                misses += 1
             if not len(line.tounicode().rstrip()):
                 results.append(line.tounicode())
                 continue # Line is empty so we don't need to process renditions
             outline = ""
-            if current_classes:
-                outline += '<span class="%s%s">' % (
-                    self.class_prefix,
-                    (" %s" % self.class_prefix).join(current_classes))
+            # Every line starts from scratch (renditions are stored per-cell)
+            spancount = 0
+            current_classes = set()
+            prev_rendition = None
             for char, rend in izip(line, rendition):
                 rend = renditions_store[rend] # Get actual rendition
                 if ord(char) >= special: # Special stuff =)
@@ -4422,8 +4525,8 @@ class Terminal(object):
                 results.append(outline)
             else:
                 results.append(None)
-        for whatever in xrange(spancount): # Bit of cleanup to be safe
-            results[-1] += "</span>"
+        HTML_CACHE_STATS['hits'] += hits
+        HTML_CACHE_STATS['misses'] += misses
         return results
 
     def dump_html(self, renditions=True):
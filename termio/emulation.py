@@ -0,0 +1,1141 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+# Meta
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+__doc__ = """\
+.. _emulation.py:
+
+Emulator Processes
+==================
+Normally each terminal's output gets read, run through the terminal emulator,
+and rendered to HTML right inside the process that's serving the users.  That
+work happens on the IOLoop so a single `yes | head -c 1G` slows down everyone
+else's keystrokes.  An `EmulatorPool` moves all of that into a handful of
+pooled emulator processes:
+
+    * Each emulator process (``python -m termio.emulation``) runs its own
+      IOLoop and regular `~termio.MultiplexPOSIXIOLoop` instances.  It reads
+      the PTYs, does the emulation, renders each screen to HTML, and sends
+      back only the lines that changed (along with any new scrollback and a
+      little bit of state like the title and modes).
+    * In the main process each terminal is an `EmulatedMultiplex`:  It has the
+      same API as a regular Multiplex (callbacks, `dump_html` with per-client
+      diffs, `write`, `resize`, `terminate`) but all it does is relay input
+      to its emulator and keep a copy of the most recent screen.
+    * New terminals go to whichever emulator is the least busy (CPU time as
+      reported by the emulators and then number of terminals).  Every so often
+      the pool checks whether one emulator is much busier than the rest; if so
+      its quietest terminal gets migrated somewhere else so it isn't stuck
+      behind a noisy neighbor.
+
+Messages travel over each emulator's stdin/stdout as length-prefixed JSON.
+If an emulator is slow to read (or the main process is) screen updates
+coalesce rather than pile up.
+
+Only terminals that can be re-attached (`EmulatedMultiplex.reattach_cmd`; e.g.
+dtach sessions) can be migrated:  The old emulator detaches and the new one
+re-attaches and sends a Ctrl-L so the program redraws its screen (just like
+when Gate One gets restarted).  The emulator's history doesn't come along for
+the ride.
+
+Things that only work with a local Multiplex:  Custom *terminal_emulator*
+classes and terminal emulator callbacks other than those in
+`FORWARDED_EVENTS`.  The *stream* passed to
+CALLBACK_UPDATE callbacks is ``None`` unless `EmulatedMultiplex.forward_output`
+is enabled.
+
+Example::
+
+    >>> pool = EmulatorPool(4)
+    >>> pool.start()
+    >>> m = EmulatedMultiplex(pool, 'top', log_path='/tmp/top.golog')
+    >>> m.add_callback(m.CALLBACK_UPDATE, send_screen_to_client)
+    >>> m.spawn(rows=40, cols=120)
+
+Docstrings
+----------
+"""
+
+# Python stdlib
+import os, sys, re, json, time, struct, signal, logging, subprocess
+from datetime import datetime, timedelta
+from functools import partial
+try:
+    from HTMLParser import HTMLParser
+except ImportError: # Python 3.X
+    from html.parser import HTMLParser
+
+# Tornado stuff
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.iostream import PipeIOStream, StreamClosedError
+from tornado.concurrent import Future
+
+# Our stuff
+import terminal
+from .termio import BaseMultiplex, MultiplexPOSIXIOLoop, ProgramTerminated
+from .termio import PatternTimer
+from .termio import MULTIPLEX_STATS, TIMING_SAMPLE_RATE
+from .termio import multiplex_stats, recording_stats
+
+# Globals
+HEADER = struct.Struct('!I') # Length of each message
+LOAD_INTERVAL = 1 # How often (seconds) emulators report how busy they are
+# Terminal emulator callbacks that get relayed to the main process:
+FORWARDED_EVENTS = (
+    terminal.CALLBACK_DSR,
+    terminal.CALLBACK_TITLE,
+    terminal.CALLBACK_BELL,
+    terminal.CALLBACK_OPT,
+    terminal.CALLBACK_MODE,
+    terminal.CALLBACK_RESET,
+    terminal.CALLBACK_LEDS,
+    terminal.CALLBACK_MESSAGE,
+)
+# Attributes of RemoteTerminal that get set on the real terminal emulator:
+FORWARDED_ATTRIBUTES = ('temppath', 'linkpath', 'icondir', 'encoding', 'title')
+# Terminal emulator methods that can be called remotely...
+TERMINAL_CALLS = ('write', 'set_title', 'clear_screen', 'abort_capture')
+# ...and the ones that return something:
+TERMINAL_REQUESTS = ('get_history',)
+# Multiplex keyword arguments that are also kept in the main process:
+LOCAL_SETTINGS = (
+    'log_path', 'user', 'term_id', 'additional_metadata', 'encoding', 'debug')
+RE_TAGS = re.compile(r'<[^>]*>')
+
+class EmulatorError(Exception):
+    """
+    Raised (or set on a `Future`) when an emulator couldn't do what was asked
+    (or went away before it could).
+    """
+    pass
+
+def encode_message(*message):
+    """
+    Returns *message* as JSON prefixed with its length (ready to be written to
+    the other side).
+    """
+    data = json.dumps(message).encode('utf-8')
+    return HEADER.pack(len(data)) + data
+
+@gen.coroutine
+def read_message(stream):
+    """
+    Reads the next message (see `encode_message`) from *stream* (an IOStream)
+    and returns it as a list.  Raises `StreamClosedError` when the other side
+    goes away.
+    """
+    header = yield stream.read_bytes(HEADER.size)
+    length, = HEADER.unpack(header)
+    data = yield stream.read_bytes(length)
+    raise gen.Return(json.loads(data.decode('utf-8')))
+
+# The emulator process side of things
+class EmulatorWorker(object):
+    """
+    Runs inside an emulator process.  Reads commands from the main process
+    (via the *reader_fd* pipe), runs the terminals it's been given, and writes
+    screen updates and events back via *writer_fd*.  Every command has a
+    corresponding ``do_<command>`` method.
+    """
+    def __init__(self, reader_fd, writer_fd, io_loop=None):
+        self.io_loop = io_loop or IOLoop.current()
+        self.reader = PipeIOStream(reader_fd)
+        self.writer = PipeIOStream(writer_fd)
+        self.terminals = {} # Terminal ID -> MultiplexPOSIXIOLoop
+        self.screens = {} # Terminal ID -> Screen as of the last update
+        self.states = {} # Terminal ID -> State as of the last update
+        self.streams = {} # Terminal ID -> Raw output (if forwarding)
+        self.dirty = set() # Terminals that need to be rendered
+        self.flushing = False
+        self.cpu_time = sum(os.times()[:2])
+        self.load_time = time.time()
+
+    def send(self, *message):
+        """Sends *message* to the main process."""
+        try:
+            self.writer.write(encode_message(*message))
+        except StreamClosedError:
+            pass # Main process went away; run() will notice
+
+    @gen.coroutine
+    def run(self):
+        """
+        Handles commands from the main process until it goes away at which
+        point all terminals get terminated and the IOLoop is stopped.
+        """
+        reporter = PeriodicCallback(self.report_load, LOAD_INTERVAL * 1000)
+        reporter.start()
+        while True:
+            try:
+                message = yield read_message(self.reader)
+            except StreamClosedError:
+                break
+            command, args = message[0], message[1:]
+            handler = getattr(self, 'do_%s' % command, None)
+            if not handler:
+                logging.error("Emulator: Unknown command: %s" % command)
+                continue
+            try:
+                handler(*args)
+            except Exception:
+                logging.exception("Emulator: Error handling %s" % command)
+        reporter.stop()
+        for m in list(self.terminals.values()):
+            m.terminate()
+        self.io_loop.stop()
+
+    def state(self, m):
+        """Returns the bits of *m*'s state that the main process mirrors."""
+        return {
+            'title': m.term.title,
+            'modes': m.term.expanded_modes,
+            'capture': bool(m.term.capture),
+            'history_count': m.term.history_count,
+            'ratelimiter_engaged': m.ratelimiter_engaged,
+            'bytes_read': m.bytes_read,
+        }
+
+    def updated(self, tid, stream=None):
+        """
+        Attached to each terminal's CALLBACK_UPDATE; marks it as needing to be
+        rendered at the next opportunity.
+        """
+        if stream is not None and tid in self.streams:
+            self.streams[tid].append(stream)
+        self.dirty.add(tid)
+        if not self.flushing:
+            self.flushing = True
+            self.io_loop.add_callback(self.flush)
+
+    def flush(self):
+        """
+        Renders (and sends) every terminal that's changed.  If the main
+        process hasn't finished reading the last batch yet we'll wait so that
+        updates to the same screen coalesce instead of piling up.
+        """
+        if self.writer.writing():
+            self.io_loop.add_timeout(timedelta(milliseconds=10), self.flush)
+            return
+        self.flushing = False
+        dirty, self.dirty = self.dirty, set()
+        for tid in dirty:
+            m = self.terminals.get(tid)
+            if m:
+                self.render(tid, m)
+
+    def render(self, tid, m):
+        """
+        Renders *m*'s screen to HTML and sends the lines that changed (since
+        the last time) to the main process.
+        """
+        stats = MULTIPLEX_STATS
+        stats['dump_html_calls'] += 1
+        if stats['dump_html_calls'] % TIMING_SAMPLE_RATE:
+            scrollback, screen = m.term.dump_html()
+        else: # Time this one
+            start = time.time()
+            scrollback, screen = m.term.dump_html()
+            stats['dump_html_seconds'] += time.time() - start
+            stats['dump_html_samples'] += 1
+        previous = self.screens.get(tid, [])
+        changes = [
+            [i, line] for i, line in enumerate(screen)
+            if i >= len(previous) or previous[i] != line]
+        self.screens[tid] = screen
+        stream = None
+        if self.streams.get(tid):
+            # latin-1 maps bytes 1:1 so they survive the trip through JSON
+            stream = b''.join(self.streams[tid]).decode('latin-1')
+            self.streams[tid] = []
+        state = self.state(m)
+        if (not changes and not scrollback and stream is None
+                and state == self.states.get(tid)):
+            return # Nothing new
+        self.states[tid] = dict(state, modes=dict(state['modes']))
+        self.send('update', tid, scrollback, len(screen), changes, stream, state)
+
+    def send_event(self, tid, event, *args):
+        """
+        Attached to each of the `FORWARDED_EVENTS`; relays the event (and its
+        arguments) to the main process.
+        """
+        m = self.terminals.get(tid)
+        if m:
+            self.send('event', tid, event, args, self.state(m))
+
+    def exited(self, tid):
+        """
+        Attached to each terminal's CALLBACK_EXIT; sends its final screen and
+        tells the main process it's gone.
+        """
+        m = self.terminals.pop(tid, None)
+        if not m:
+            return
+        self.render(tid, m)
+        for d in (self.screens, self.states, self.streams):
+            d.pop(tid, None)
+        self.dirty.discard(tid)
+        finalizing = bool(m.log_path and m.log)
+        self.send('exit', tid, m.exitstatus, finalizing)
+
+    def finalized(self, tid, future):
+        """
+        Attached to each terminal's CALLBACK_LOG_FINALIZED; relays the
+        resulting log metadata to the main process.
+        """
+        # NOTE: This can get called from the thread that finalized the log
+        self.io_loop.add_callback(self._finalized, tid, future)
+
+    def _finalized(self, tid, future):
+        try:
+            self.send('log_finalized', tid, future.result(), None)
+        except Exception as e:
+            self.send('log_finalized', tid, None, str(e))
+
+    def report_load(self):
+        """
+        Tells the main process how busy we've been (the fraction of a CPU used
+        since the last report) along with our `~termio.multiplex_stats` and
+        `~termio.recording_stats`.
+        """
+        now = time.time()
+        cpu_time = sum(os.times()[:2])
+        load = (cpu_time - self.cpu_time) / max(now - self.load_time, 0.001)
+        self.cpu_time, self.load_time = cpu_time, now
+        self.send('load', load, multiplex_stats(), recording_stats())
+
+    def do_spawn(self, tid, cmd, settings, attributes, magic,
+            rows, cols, env, em_dimensions):
+        """
+        Creates a `~termio.MultiplexPOSIXIOLoop` using *settings* and spawns
+        *cmd* inside of it.  *attributes* get set on its terminal emulator and
+        *magic* is a list of `FileType` classes to add to it (see
+        `do_magic`).
+        """
+        kwargs = dict((str(k), v) for k, v in settings['multiplex'].items())
+        m = MultiplexPOSIXIOLoop(cmd, **kwargs)
+        m.use_shell = settings['use_shell']
+        if settings['shell_command']:
+            m.shell_command = settings['shell_command']
+        m.add_callback(m.CALLBACK_UPDATE, partial(self.updated, tid))
+        m.add_callback(m.CALLBACK_EXIT, partial(self.exited, tid))
+        m.add_callback(
+            m.CALLBACK_LOG_FINALIZED, partial(self.finalized, tid))
+        self.terminals[tid] = m
+        m.spawn(rows, cols, env=env, em_dimensions=em_dimensions)
+        for event in FORWARDED_EVENTS:
+            m.term.add_callback(event, partial(self.send_event, tid, event))
+        for name, value in attributes.items():
+            setattr(m.term, name, value)
+        for filetype in magic:
+            self.do_magic(tid, *filetype)
+        self.send('spawned', tid, m.pid)
+
+    def do_write(self, tid, chars):
+        """Writes *chars* to the program running in *tid*."""
+        m = self.terminals.get(tid)
+        if m:
+            try:
+                m.write(chars)
+            except ProgramTerminated:
+                pass # Its exit is already on the way
+
+    def do_resize(self, tid, rows, cols, em_dimensions, ctrl_l):
+        """Resizes *tid* (see `~termio.MultiplexPOSIXIOLoop.resize`)."""
+        m = self.terminals.get(tid)
+        if m:
+            m.resize(rows, cols, em_dimensions=em_dimensions, ctrl_l=ctrl_l)
+            self.updated(tid)
+
+    def do_set(self, tid, name, value):
+        """Sets *name* to *value* on *tid*'s terminal emulator."""
+        m = self.terminals.get(tid)
+        if m and name in FORWARDED_ATTRIBUTES:
+            setattr(m.term, name, value)
+
+    def do_call(self, tid, method, args):
+        """Calls *method* (one of `TERMINAL_CALLS`) on *tid*'s emulator."""
+        m = self.terminals.get(tid)
+        if m and method in TERMINAL_CALLS:
+            getattr(m.term, method)(*args)
+            self.updated(tid)
+
+    def do_request(self, tid, request_id, method, args):
+        """
+        Calls *method* (one of `TERMINAL_REQUESTS`) on *tid*'s emulator and
+        sends back the result.
+        """
+        m = self.terminals.get(tid)
+        if not m or method not in TERMINAL_REQUESTS:
+            self.send('result', request_id, None, "Invalid request")
+            return
+        try:
+            result = getattr(m.term, method)(*args)
+        except Exception as e:
+            self.send('result', request_id, None, str(e))
+        else:
+            self.send('result', request_id, result, None)
+
+    def do_magic(self, tid, module, name, path):
+        """
+        Adds the `FileType` class *name* from *module* (loaded from *path* if
+        it can't be imported) to *tid*'s emulator.
+        """
+        m = self.terminals.get(tid)
+        if not m:
+            return
+        try:
+            if module not in sys.modules:
+                try:
+                    __import__(module)
+                except ImportError:
+                    import imp
+                    imp.load_source(module, path)
+            filetype = getattr(sys.modules[module], name)
+        except Exception as e:
+            logging.warning(
+                "Emulator: Could not load %s.%s: %s" % (module, name, e))
+            return
+        m.term.add_magic(filetype)
+
+    def do_forward_output(self, tid, enabled):
+        """
+        Turns on (or off) including the raw output of *tid* in its updates.
+        """
+        if enabled:
+            self.streams.setdefault(tid, [])
+        else:
+            self.streams.pop(tid, None)
+
+    def do_terminate(self, tid):
+        """Terminates *tid* (its exit will be reported as usual)."""
+        m = self.terminals.get(tid)
+        if m:
+            m.terminate()
+
+    def do_detach(self, tid):
+        """
+        Stops running *tid* without telling anyone (it's being migrated to
+        another emulator).  Its log is closed but not finalized since the new
+        emulator will keep appending to it.
+        """
+        m = self.terminals.pop(tid, None)
+        if not m:
+            return
+        for d in (self.screens, self.states, self.streams):
+            d.pop(tid, None)
+        self.dirty.discard(tid)
+        for callbacks in m.callbacks.values():
+            callbacks.clear()
+        if m.log:
+            m.log.close()
+        m.log_path = None
+        m.terminate()
+
+def main():
+    """
+    Entry point for emulator processes.  Our stdin and stdout are the pipes
+    to and from the main process.
+    """
+    # Move the pipes out of the way so nothing (e.g. a stray print()) can
+    # write garbage into them
+    reader_fd = os.dup(0)
+    writer_fd = os.dup(1)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    os.dup2(2, 1)
+    # Ctrl-C is the main process's business; we exit when it does
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    level = sys.argv[1] if len(sys.argv) > 1 else 'WARNING'
+    logging.basicConfig(
+        level=getattr(logging, level.upper(), logging.WARNING),
+        format="[E %(asctime)s emulator %(process)d] %(message)s")
+    io_loop = IOLoop.current()
+    worker = EmulatorWorker(reader_fd, writer_fd, io_loop=io_loop)
+    io_loop.add_callback(worker.run)
+    io_loop.start()
+
+# The main process side of things
+class Emulator(object):
+    """
+    An emulator process as seen from the main process.  Keeps track of the
+    terminals it's running and routes their messages to them.  Every message
+    from the emulator has a corresponding ``on_<message>`` method.
+    """
+    def __init__(self, pool, number):
+        self.pool = pool
+        self.number = number
+        self.process = None
+        self.reader = None
+        self.writer = None
+        self.terminals = {} # Terminal ID -> EmulatedMultiplex
+        self.finalizing = {} # Exited terminals that are finalizing their logs
+        self.requests = {} # Request ID -> Future
+        self.request_id = 0
+        self.load = 0.0 # Fraction of a CPU used (as of the last report)
+        self.stats = {} # The emulator's multiplex_stats()...
+        self.recording_stats = {} # ...and recording_stats()
+
+    def __repr__(self):
+        return "<Emulator %s pid: %s terminals: %s load: %.2f>" % (
+            self.number, self.process.pid if self.process else None,
+            len(self.terminals), self.load)
+
+    def start(self):
+        """Starts the emulator process and starts listening to it."""
+        to_reader, to_writer = os.pipe()
+        from_reader, from_writer = os.pipe()
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.pathsep.join(a for a in sys.path if a)
+        level = logging.getLevelName(logging.getLogger().getEffectiveLevel())
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'termio.emulation', level],
+            stdin=to_reader, stdout=from_writer, env=env, close_fds=True)
+        os.close(to_reader)
+        os.close(from_writer)
+        self.writer = PipeIOStream(to_writer)
+        self.reader = PipeIOStream(from_reader)
+        self.pool.io_loop.add_future(self.run(), lambda f: f.result())
+
+    def stop(self):
+        """
+        Stops the emulator process by closing its pipe (it'll terminate its
+        terminals on its way out).
+        """
+        if self.writer:
+            self.writer.close()
+
+    def send(self, *message):
+        """Sends *message* to the emulator process."""
+        try:
+            self.writer.write(encode_message(*message))
+        except StreamClosedError:
+            pass # It died; run() will take care of things
+
+    def request(self, tid, method, args):
+        """
+        Calls *method* on *tid*'s terminal emulator with *args* and returns a
+        `Future` that will resolve to the result.
+        """
+        future = Future()
+        self.request_id += 1
+        self.requests[self.request_id] = future
+        self.send('request', tid, self.request_id, method, args)
+        return future
+
+    @gen.coroutine
+    def run(self):
+        """
+        Handles messages from the emulator process until it goes away.
+        """
+        while True:
+            try:
+                message = yield read_message(self.reader)
+            except StreamClosedError:
+                break
+            event, args = message[0], message[1:]
+            try:
+                getattr(self, 'on_%s' % event)(*args)
+            except Exception:
+                logging.exception(
+                    "Error handling %s from emulator %s" % (event, self.number))
+        self.died()
+
+    def died(self):
+        """
+        Called when the emulator process goes away.  All its terminals are
+        reported as exited and it gets replaced (if the pool is still
+        running).
+        """
+        if self.pool.running:
+            logging.error("Emulator %s (pid: %s) exited unexpectedly" % (
+                self.number, self.process.pid))
+        self.writer.close()
+        self.process.poll() # Don't leave a zombie
+        for future in self.requests.values():
+            future.set_exception(EmulatorError("Emulator exited"))
+        self.requests = {}
+        for m in list(self.terminals.values()):
+            m._exited(None)
+        self.terminals = {}
+        self.pool.replace(self)
+
+    def on_spawned(self, tid, pid):
+        m = self.terminals.get(tid)
+        if m:
+            m.pid = pid
+
+    def on_update(self, tid, scrollback, rows, changes, stream, state):
+        m = self.terminals.get(tid)
+        if m:
+            m._updated(scrollback, rows, changes, stream, state)
+
+    def on_event(self, tid, event, args, state):
+        m = self.terminals.get(tid)
+        if m:
+            m._event(event, args, state)
+
+    def on_exit(self, tid, exitstatus, finalizing):
+        m = self.terminals.pop(tid, None)
+        if not m:
+            return
+        if finalizing:
+            self.finalizing[tid] = m
+        m._exited(exitstatus)
+
+    def on_log_finalized(self, tid, metadata, error):
+        m = self.finalizing.pop(tid, None)
+        if m:
+            m._log_finalized(metadata, error)
+
+    def on_result(self, request_id, result, error):
+        future = self.requests.pop(request_id, None)
+        if not future:
+            return
+        if error:
+            future.set_exception(EmulatorError(error))
+        else:
+            future.set_result(result)
+
+    def on_load(self, load, stats, recording):
+        self.load = load
+        self.stats = stats
+        self.recording_stats = recording
+
+class EmulatorPool(object):
+    """
+    A pool of *processes* emulator processes.  `EmulatedMultiplex` instances
+    get assigned to whichever one is the least busy when they're spawned.
+
+    Every *rebalance_interval* seconds the busiest emulator gets compared to
+    the least busy one.  If it's using more than *busy_threshold* of a CPU
+    (and more than twice as much as the other) its quietest terminal gets
+    migrated over (if it can be; see `EmulatedMultiplex.migrate`).
+    """
+    def __init__(self, processes, rebalance_interval=10, busy_threshold=0.5,
+            io_loop=None):
+        self.processes = processes
+        self.rebalance_interval = rebalance_interval
+        self.busy_threshold = busy_threshold
+        self.io_loop = io_loop or IOLoop.current()
+        self.emulators = []
+        self.running = False
+        self.migrations = 0
+        self.last_id = 0
+        self.rebalancer = None
+
+    def start(self):
+        """Starts all the emulator processes."""
+        self.running = True
+        for number in range(self.processes):
+            emulator = Emulator(self, number)
+            emulator.start()
+            self.emulators.append(emulator)
+        self.rebalancer = PeriodicCallback(
+            self.rebalance, self.rebalance_interval * 1000)
+        self.rebalancer.start()
+
+    def stop(self):
+        """Stops all the emulator processes."""
+        self.running = False
+        if self.rebalancer:
+            self.rebalancer.stop()
+        for emulator in self.emulators:
+            emulator.stop()
+
+    def replace(self, emulator):
+        """Replaces *emulator* (which died) with a fresh one."""
+        if not self.running or emulator not in self.emulators:
+            return
+        new_emulator = Emulator(self, emulator.number)
+        new_emulator.start()
+        self.emulators[self.emulators.index(emulator)] = new_emulator
+
+    def new_id(self):
+        """Returns a new (unique within this pool) terminal ID."""
+        self.last_id += 1
+        return self.last_id
+
+    def least_loaded(self):
+        """
+        Returns the least busy emulator:  The one using the least CPU (to the
+        nearest 10%) and then the one with the fewest terminals.
+        """
+        return min(self.emulators,
+            key=lambda e: (round(e.load, 1), len(e.terminals)))
+
+    def rebalance(self):
+        """
+        Migrates the quietest (migratable) terminal from the busiest emulator
+        to the least busy one if the busiest is busy enough to be slowing its
+        terminals down.  Terminals that output the least since the last check
+        are the ones that suffer the most (they're interactive) which is why
+        they're the ones that get moved.
+        """
+        candidates = {}
+        for emulator in self.emulators:
+            for m in emulator.terminals.values():
+                candidates[m] = m.bytes_read - m.rebalance_bytes
+                m.rebalance_bytes = m.bytes_read
+        if len(self.emulators) < 2:
+            return
+        busiest = max(self.emulators, key=lambda e: e.load)
+        idlest = min(self.emulators, key=lambda e: e.load)
+        if busiest.load < self.busy_threshold:
+            return
+        if idlest.load * 2 > busiest.load or len(busiest.terminals) < 2:
+            return
+        movable = [
+            m for m in busiest.terminals.values()
+            if m.reattach_cmd and m.isalive()]
+        if not movable:
+            return
+        quietest = min(movable, key=lambda m: candidates.get(m, 0))
+        if quietest.migrate(idlest):
+            self.migrations += 1
+
+    def multiplex_stats(self):
+        """
+        Returns the sum of every emulator's `~termio.multiplex_stats`.
+        """
+        return self._sum_stats('stats', multiplex_stats())
+
+    def recording_stats(self):
+        """
+        Returns the sum of every emulator's `~termio.recording_stats`.
+        """
+        return self._sum_stats('recording_stats', recording_stats())
+
+    def _sum_stats(self, attribute, totals):
+        totals = dict((key, 0) for key in totals)
+        for emulator in self.emulators:
+            for key, value in getattr(emulator, attribute).items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+class RemoteTerminal(object):
+    """
+    Stands in for an `EmulatedMultiplex`'s terminal emulator in the main
+    process.  Keeps a copy of the most recently rendered screen (and any
+    scrollback that hasn't been dumped yet) along with the title, modes, etc.
+    Setting any of the `FORWARDED_ATTRIBUTES` sets them on the real terminal
+    emulator too and the methods that change things (e.g. `write`) get
+    relayed.
+    """
+    def __init__(self, multiplex, rows, cols, em_dimensions=None,
+            encoding='utf-8', max_scrollback=1000):
+        self.__dict__.update({
+            'multiplex': multiplex,
+            'rows': rows,
+            'cols': cols,
+            'em_dimensions': em_dimensions,
+            'encoding': encoding,
+            'max_scrollback': max_scrollback,
+            'attributes': {}, # Forwarded attributes (for migration)
+            'magic': [], # Forwarded FileTypes (ditto)
+            'title': u"Gate One",
+            'expanded_modes': {},
+            'capture': False,
+            'history_count': 0,
+            'modified': False,
+            'screen': [],
+            'scrollback': [],
+            'callbacks': dict((event, {}) for event in FORWARDED_EVENTS),
+        })
+
+    def __setattr__(self, name, value):
+        self.__dict__[name] = value
+        if name in FORWARDED_ATTRIBUTES:
+            self.attributes[name] = value
+            self.multiplex._send('set', name, value)
+
+    def _update(self, scrollback, rows, changes, state):
+        """
+        Applies an update (new *scrollback*, lines that *changed*, and
+        *state*) from the emulator.
+        """
+        screen = self.screen
+        del screen[rows:]
+        screen.extend([u''] * (rows - len(screen)))
+        for index, line in changes:
+            screen[index] = line
+        self.scrollback.extend(scrollback)
+        del self.scrollback[:-self.max_scrollback]
+        self.__dict__['modified'] = True
+        self._update_state(state)
+
+    def _update_state(self, state):
+        self.__dict__.update({
+            'title': state['title'],
+            'expanded_modes': state['modes'],
+            'capture': state['capture'],
+            'history_count': state['history_count'],
+        })
+
+    def add_callback(self, event, callback, identifier=None):
+        """
+        Same as `terminal.Terminal.add_callback`.  Only the
+        `FORWARDED_EVENTS` will ever be called.
+        """
+        if not identifier:
+            identifier = callback.__hash__()
+        self.callbacks.setdefault(event, {})[identifier] = callback
+        return identifier
+
+    def remove_callback(self, event, identifier):
+        """Same as `terminal.Terminal.remove_callback`."""
+        del self.callbacks[event][identifier]
+
+    def remove_all_callbacks(self, identifier):
+        """Same as `terminal.Terminal.remove_all_callbacks`."""
+        for event, identifiers in self.callbacks.items():
+            identifiers.pop(identifier, None)
+
+    def get_title(self):
+        """Returns :attr:`self.title`"""
+        return self.title
+
+    def set_title(self, title):
+        """
+        Sets the title of the real terminal emulator (which will call its
+        CALLBACK_TITLE callbacks and by extension, ours).
+        """
+        self.__dict__['title'] = title
+        self.attributes['title'] = title
+        self.multiplex._send('call', 'set_title', [title])
+
+    def write(self, chars):
+        """
+        Writes *chars* to the real terminal emulator (as if it were output
+        from the program).
+        """
+        self.multiplex._send('call', 'write', [chars])
+
+    def clear_screen(self):
+        """Clears the real terminal emulator's screen."""
+        self.multiplex._send('call', 'clear_screen', [])
+
+    def abort_capture(self):
+        """Aborts any file capture in progress in the real emulator."""
+        self.multiplex._send('call', 'abort_capture', [])
+
+    def resize(self, rows, cols, em_dimensions=None):
+        """
+        Updates our dimensions (the real resizing happens via
+        `EmulatedMultiplex.resize`).
+        """
+        self.__dict__.update(rows=rows, cols=cols)
+        if em_dimensions:
+            self.__dict__['em_dimensions'] = em_dimensions
+
+    def add_magic(self, filetype):
+        """
+        Adds *filetype* (a `terminal.FileType` subclass) to the real terminal
+        emulator.  It has to be importable there (or at least loadable from
+        the file it was defined in).
+        """
+        import inspect
+        entry = [filetype.__module__, filetype.__name__,
+            inspect.getsourcefile(filetype)]
+        if entry in self.magic:
+            return
+        self.magic.append(entry)
+        self.multiplex._send('magic', *entry)
+
+    def get_history(self, start=None, end=None, html=True):
+        """
+        Returns a `Future` that resolves to the same thing as
+        `terminal.Terminal.get_history`:  ``(first, lines)``.
+        """
+        future = Future()
+        def got_history(f):
+            try:
+                first, lines = f.result()
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result((first, lines))
+        request = self.multiplex._request('get_history', [start, end, html])
+        request.add_done_callback(got_history)
+        return future
+
+    def dump_html(self):
+        """
+        Returns ``(scrollback, screen)`` just like
+        `terminal.Terminal.dump_html` (and empties our scrollback).
+        """
+        scrollback = self.scrollback
+        self.__dict__.update(scrollback=[], modified=False)
+        return (scrollback, list(self.screen))
+
+    def dump(self):
+        """
+        Returns the screen as a list of plain strings (the HTML with the tags
+        removed).
+        """
+        unescape = HTMLParser().unescape
+        return [unescape(RE_TAGS.sub(u'', line)) for line in self.screen]
+
+class EmulatedMultiplex(BaseMultiplex):
+    """
+    A Multiplex whose terminal runs in one of *pool*'s emulator processes.
+    Takes the same arguments as `~termio.BaseMultiplex` (other than
+    *terminal_emulator*).
+
+    If :attr:`reattach_cmd` is set (e.g. to ``dtach -a <socket>``) the
+    terminal can be migrated to another emulator.
+
+    :meth:`~termio.BaseMultiplex.expect` patterns are checked against our copy
+    of the screen whenever the emulator sends an update (preprocess patterns
+    need the program's raw output so adding one turns on
+    :attr:`forward_output`).  :meth:`~termio.BaseMultiplex.await` isn't
+    supported since it would block the IOLoop the updates arrive on.
+    """
+    def __init__(self, pool, cmd, **kwargs):
+        if kwargs.get('terminal_emulator'):
+            raise TypeError(
+                "Custom terminal emulators can't be used in emulator processes")
+        kwargs.pop('terminal_emulator', None)
+        local = dict((k, v) for k, v in kwargs.items() if k in LOCAL_SETTINGS)
+        super(EmulatedMultiplex, self).__init__(cmd, **local)
+        self.pool = pool
+        self.settings = kwargs
+        self.io_loop = pool.io_loop
+        self.tid = pool.new_id()
+        self.emulator = None
+        self.reattach_cmd = None
+        self.terminating = False
+        self.shell_command = ['/bin/sh', '-c']
+        self.use_shell = True
+        self.env = {}
+        self.em_dimensions = None
+        self.exitstatus = None
+        self.term = None
+        self.prev_output = {}
+        self.shared_scrollback = []
+        self.rebalance_bytes = 0 # bytes_read as of the last rebalance()
+        self.migrations = 0
+        self._forward_output = False
+        # Fires when expect() patterns time out:
+        self.scheduler = PatternTimer(self, self._timeout_checker, self.io_loop)
+        self._checking_patterns = False
+
+    @property
+    def forward_output(self):
+        """
+        If ``True`` the raw output of the program will be passed to the
+        CALLBACK_UPDATE callbacks as *stream* (like a local Multiplex does).
+        Defaults to ``False`` to save the trouble of sending everything twice.
+        """
+        return self._forward_output
+
+    @forward_output.setter
+    def forward_output(self, value):
+        self._forward_output = bool(value)
+        self._send('forward_output', self._forward_output)
+
+    def _send(self, command, *args):
+        if self.emulator:
+            self.emulator.send(command, self.tid, *args)
+
+    def _request(self, method, args):
+        if not self.emulator or not self._alive:
+            future = Future()
+            future.set_exception(EmulatorError("Terminal is not running"))
+            return future
+        return self.emulator.request(self.tid, method, args)
+
+    def _call_callback(self, callback, *args, **kwargs):
+        """
+        Like `~termio.MultiplexPOSIXIOLoop._call_callback`:  If we're running
+        inside our IOLoop *callback* gets called on its next iteration (via
+        :meth:`IOLoop.add_callback`).  Otherwise it gets called immediately.
+        """
+        if IOLoop.current(instance=False) is self.io_loop:
+            self.io_loop.add_callback(callback, *args, **kwargs)
+        else:
+            callback(*args, **kwargs)
+
+    def spawn(self,
+            rows=24, cols=80, env=None, em_dimensions=None, exitfunc=None):
+        """
+        Spawns our command in the least busy emulator.  Takes the same
+        arguments as `~termio.MultiplexPOSIXIOLoop.spawn`.
+        """
+        self.started = datetime.now()
+        rows = min(200, rows) # Max 200 to limit memory utilization
+        cols = min(500, cols) # Max 500 for the same reason
+        self.rows = rows
+        self.cols = cols
+        self.em_dimensions = em_dimensions
+        self.env = env or {}
+        self.exitfunc = exitfunc
+        self.term = RemoteTerminal(
+            self, rows, cols, em_dimensions, encoding=self.encoding)
+        self._alive = True
+        self._attach(self.pool.least_loaded(), self.cmd)
+
+    def _attach(self, emulator, cmd, title=None):
+        """
+        Starts running *cmd* in *emulator* (along with everything that's been
+        set on `term` so far).
+        """
+        self.emulator = emulator
+        emulator.terminals[self.tid] = self
+        settings = {
+            'multiplex': self.settings,
+            'use_shell': self.use_shell,
+            'shell_command': self.shell_command,
+        }
+        attributes = dict(self.term.attributes)
+        if title is not None:
+            attributes['title'] = title
+        emulator.send(
+            'spawn', self.tid, cmd, settings, attributes, self.term.magic,
+            self.rows, self.cols, self.env, self.em_dimensions)
+        if self._forward_output:
+            self._send('forward_output', True)
+
+    def migrate(self, emulator):
+        """
+        Moves this terminal to *emulator* by detaching from the current one
+        and running :attr:`reattach_cmd` in the new one.  Returns ``True`` if
+        the terminal was migrated.
+        """
+        if not self.reattach_cmd or not self._alive:
+            return False
+        if emulator is self.emulator:
+            return False
+        logging.info("Migrating terminal %s (%s) from emulator %s to %s" % (
+            self.term_id, self.tid, self.emulator.number, emulator.number))
+        self.emulator.terminals.pop(self.tid, None)
+        self._send('detach')
+        self.migrations += 1
+        self._attach(emulator, self.reattach_cmd, title=self.term.title)
+        self._send('write', u'\x0c') # Ctrl-L so the program redraws
+        return True
+
+    def isalive(self):
+        """Returns ``True`` if the program is still running."""
+        return self._alive
+
+    def write(self, chars):
+        """Writes *chars* to the program."""
+        if not self._alive:
+            raise ProgramTerminated("Child process is not running.")
+        self._send('write', chars)
+
+    def resize(self, rows, cols, em_dimensions=None, ctrl_l=True):
+        """Same as `~termio.MultiplexPOSIXIOLoop.resize`."""
+        if rows < 2:
+            rows = 24
+        if cols < 2:
+            cols = 80
+        self.rows = rows
+        self.cols = cols
+        self.term.resize(rows, cols, em_dimensions)
+        self._send('resize', rows, cols, em_dimensions, ctrl_l)
+
+    def _dump_term_html(self):
+        """
+        Returns our copy of the screen as HTML.  The actual rendering happens
+        (and gets counted in `MULTIPLEX_STATS`) in the emulator process.
+        """
+        return self.term.dump_html()
+
+    def set_encoding(self, encoding):
+        """Sets the encoding of the terminal emulator to *encoding*."""
+        self.encoding = encoding
+        self.term.encoding = encoding
+
+    def expect(self, patterns, callback, **kwargs):
+        """
+        Same as `~termio.BaseMultiplex.expect` (see the class docstring for
+        how patterns get checked).
+        """
+        ref = super(EmulatedMultiplex, self).expect(
+            patterns, callback, **kwargs)
+        if kwargs.get('preprocess', True) and not self._forward_output:
+            self.forward_output = True
+        self.scheduler.start()
+        return ref
+
+    def terminate(self):
+        """
+        Terminates the program.  The CALLBACK_EXIT callbacks get called once
+        the emulator confirms it's gone.
+        """
+        if self.terminating:
+            return
+        self.terminating = True
+        if self._alive and self.emulator:
+            self._send('terminate')
+        else:
+            self._exited(self.exitstatus)
+
+    def _updated(self, scrollback, rows, changes, stream, state):
+        """Called when the emulator sends us an update."""
+        self.term._update(scrollback, rows, changes, state)
+        self.bytes_read = state['bytes_read']
+        self.ratelimiter_engaged = state['ratelimiter_engaged']
+        if stream is not None:
+            stream = stream.encode('latin-1')
+        # Handle expect() patterns
+        if self._patterns and stream is not None:
+            self.preprocess(stream)
+        if self._patterns:
+            self.postprocess()
+        for callback in list(self.callbacks[self.CALLBACK_UPDATE].values()):
+            self._call_callback(callback, stream=stream)
+
+    def _event(self, event, args, state):
+        """
+        Called when the emulator relays one of the `FORWARDED_EVENTS`.
+        """
+        self.term._update_state(state)
+        for callback in list(self.term.callbacks.get(event, {}).values()):
+            callback(*args)
+
+    def _exited(self, exitstatus):
+        """Called when the program exits (or its emulator dies)."""
+        self._alive = False
+        self.emulator = None
+        if exitstatus is None:
+            exitstatus = 999 # Same as a local Multiplex when it can't tell
+        self.exitstatus = exitstatus
+        self.scheduler.stop()
+        self._patterns = []
+        for callback in list(self.callbacks[self.CALLBACK_EXIT].values()):
+            self._call_callback(callback)
+        if self.exitfunc:
+            self.exitfunc(self, self.exitstatus)
+            self.exitfunc = None
+        self.callbacks[self.CALLBACK_UPDATE] = {}
+        self.callbacks[self.CALLBACK_EXIT] = {}
+
+    def _log_finalized(self, metadata, error):
+        """
+        Called when the emulator has finished finalizing the log.  Calls the
+        CALLBACK_LOG_FINALIZED callbacks with a `Future` holding the result
+        (same as a local Multiplex).
+        """
+        future = Future()
+        if error:
+            future.set_exception(EmulatorError(error))
+        else:
+            future.set_result(metadata)
+        callbacks = self.callbacks[self.CALLBACK_LOG_FINALIZED]
+        self.callbacks[self.CALLBACK_LOG_FINALIZED] = {}
+        for callback in callbacks.values():
+            callback(future)
+
+if __name__ == "__main__":
+    main()
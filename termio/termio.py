@@ -96,13 +96,20 @@ Module Functions and Classes
 """
 
 # Stdlib imports
-import os, sys, time, struct, io, gzip, re, logging, signal
+import os, sys, time, struct, io, gzip, re, logging, signal, threading, socket
+import errno, atexit
+from collections import deque
 from datetime import timedelta, datetime
 from functools import partial
 from itertools import izip
 from concurrent.futures import ProcessPoolExecutor
 from json import loads as json_decode
 from json import dumps as json_encode
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+from .vtextract import VTTextExtractor
 
 # Inernationalization support
 _ = str # So pylint doesn't show a zillion errors about a missing _() function
@@ -123,6 +130,26 @@ RE_OPT_SSH_SEQ = re.compile(
 RE_TITLE_SEQ = re.compile(
     r'.*\x1b\][0-2]\;(.+?)(\x07|\x1b\\)', re.DOTALL|re.MULTILINE)
 EXTRA_DEBUG = False # For those times when you need to get dirty
+# How much input we'll hold onto for a program that isn't reading it (anything
+# beyond this gets discarded):
+MAX_PENDING_INPUT = 1024 * 1024
+# Totals from SessionRecorder instances that have been closed (for
+# recording_stats()):
+RECORDING_TOTALS = {'bytes_written': 0, 'bytes_dropped': 0, 'frames_dropped': 0}
+# Counters for all Multiplex instances in this process (see multiplex_stats()).
+# Timings are only taken for one out of every TIMING_SAMPLE_RATE calls so that
+# they're cheap enough to leave on all the time.
+TIMING_SAMPLE_RATE = 16
+MULTIPLEX_STATS = {
+    'bytes_read': 0, # Total output read from all terminal programs
+    'term_writes': 0, # Calls to term.write()
+    'term_write_samples': 0, # How many of those were timed...
+    'term_write_seconds': 0.0, # ...and how long they took
+    'dump_html_calls': 0,
+    'dump_html_samples': 0,
+    'dump_html_seconds': 0.0,
+    'ratelimiter_engaged': 0, # Times a noisy program kicked off the limiter
+}
 
 # Helper functions
 def debug_expect(m_instance, match, pattern):
@@ -178,7 +205,7 @@ def retrieve_last_frame(golog_path):
             return # Something wrong with the file
         distance += distance
     # Now that we're at the end, go back a bit and split from there
-    golog.seek(golog.tell() - chunk_size*2)
+    golog.seek(max(golog.tell() - chunk_size*2, 0))
     end_frames = golog.read().split(encoded_separator)
     if len(end_frames) > 1:
         # Very last item will be empty
@@ -370,6 +397,455 @@ class Pattern(object):
         self.timeout = timeout
         self.created = datetime.now()
 
+class _RecordingWriter(threading.Thread):
+    """
+    A single background thread that writes (and compresses) the buffered
+    output of every open `SessionRecorder`.  It sleeps until a recorder has
+    either buffered `SessionRecorder.flush_size` bytes or held onto data for
+    longer than `SessionRecorder.flush_interval` seconds.  If no recorders are
+    open it doesn't wake up at all.
+
+    Call `_RecordingWriter.stop` to have it flush everything and exit (this
+    happens automatically when the last recorder is closed and at exit).
+    """
+    def __init__(self):
+        super(_RecordingWriter, self).__init__(name="SessionRecorder")
+        self.daemon = True
+        self.recorders = set()
+        self.condition = threading.Condition()
+        self.pending = False # Set by wake() so wakeups are never missed
+        self.stopping = False
+
+    def add(self, recorder):
+        with self.condition:
+            self.recorders.add(recorder)
+            self.condition.notify()
+
+    def remove(self, recorder):
+        with self.condition:
+            self.recorders.discard(recorder)
+
+    def wake(self):
+        """
+        Wakes up the writer so it can check if anything needs flushing.
+        """
+        with self.condition:
+            self.pending = True
+            self.condition.notify()
+
+    def stop(self):
+        """
+        Tells the writer to flush whatever is left and exit.  Blocks until it
+        has.
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        deadline = None # When the next recorder will need to be flushed
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    if deadline is None:
+                        self.condition.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                self.pending = False
+                stopping = self.stopping
+                recorders = list(self.recorders)
+            deadline = None
+            now = time.time()
+            for recorder in recorders:
+                try:
+                    wait = recorder.flush_due(now)
+                    if stopping or wait == 0:
+                        recorder.flush()
+                    elif wait is not None:
+                        deadline = min(now + wait, deadline or now + wait)
+                except Exception as e:
+                    logging.error(
+                        "Error writing session log %s: %s" % (recorder.path, e))
+            if stopping:
+                return
+
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+def _stop_writer():
+    """
+    Stops the `_RecordingWriter` (if running) after it has written everything
+    it was holding onto.  Registered via `atexit` so that the interpreter
+    never gets torn down underneath it.
+    """
+    global _WRITER
+    with _WRITER_LOCK:
+        writer, _WRITER = _WRITER, None
+    if writer:
+        writer.stop()
+
+atexit.register(_stop_writer)
+
+class SessionRecorder(object):
+    """
+    Records frames of terminal output to the (gzip-compressed) .golog file at
+    *path*.
+
+    `SessionRecorder.record` only appends the frame to an in-memory buffer
+    (so it's cheap enough to call from the IOLoop for every chunk of output).
+    The actual compression and writing happens in batches in a background
+    thread whenever *flush_size* bytes have accumulated or the oldest buffered
+    frame is more than *flush_interval* seconds old.
+
+    If more than *max_buffer* bytes are waiting to be written new frames will
+    be dropped (and counted in `bytes_dropped`).  Callers should check
+    `SessionRecorder.backlogged` and stop reading output for a bit when it is
+    ``True`` so that it never comes to that.
+    """
+    def __init__(self, path,
+            max_buffer=4*1024*1024, flush_size=256*1024, flush_interval=1):
+        global _WRITER
+        self.path = path
+        self.max_buffer = max_buffer
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.frames = deque()
+        self.bytes_queued = 0 # Bytes currently waiting to be written
+        self.bytes_written = 0 # Uncompressed
+        self.bytes_dropped = 0
+        self.frames_dropped = 0
+        self.log = None # The gzip file object (opened by the writer thread)
+        self.closed = False
+        self._oldest = None # When the oldest buffered frame was recorded
+        self._lock = threading.Lock() # Protects self.frames
+        self._write_lock = threading.Lock() # Only one flush() at a time
+        with _WRITER_LOCK:
+            if not _WRITER:
+                _WRITER = _RecordingWriter()
+                _WRITER.start()
+            self._writer = _WRITER
+            self._writer.add(self)
+
+    def __repr__(self):
+        return "<SessionRecorder %s queued: %s written: %s dropped: %s>" % (
+            self.path, self.bytes_queued, self.bytes_written,
+            self.bytes_dropped)
+
+    @property
+    def backlogged(self):
+        """
+        ``True`` if more than half of *max_buffer* is waiting to be written.
+        """
+        return self.bytes_queued > self.max_buffer // 2
+
+    def stats(self):
+        """
+        Returns a dict containing `bytes_queued`, `bytes_written`,
+        `bytes_dropped`, and `frames_dropped`.
+        """
+        return {
+            'bytes_queued': self.bytes_queued,
+            'bytes_written': self.bytes_written,
+            'bytes_dropped': self.bytes_dropped,
+            'frames_dropped': self.frames_dropped,
+        }
+
+    def record(self, stream, timestamp=None):
+        """
+        Adds *stream* (bytes) to the buffer as a new frame using *timestamp*
+        (milliseconds since the epoch as bytes; defaults to now).  Returns
+        ``False`` if the frame had to be dropped because the buffer is full.
+        """
+        if timestamp is None:
+            # Using .encode() below ensures the result will be bytes
+            timestamp = str(int(round(time.time() * 1000))).encode('UTF-8')
+        # NOTE: I'm using an obscure unicode symbol in order to avoid
+        # conflicts.  We need to do our best to ensure that we can
+        # differentiate between terminal output and our log format...
+        # This should do the trick because it is highly unlikely that
+        # someone would be displaying this obscure unicode symbol on an
+        # actual terminal unless they were using Gate One to view a
+        # Gate One log file in vim or something =)
+        # "\xf3\xb0\xbc\x8f" == \U000f0f0f == U+F0F0F (Private Use Symbol)
+        frame = timestamp + b":" + stream + b"\xf3\xb0\xbc\x8f"
+        size = len(frame)
+        with self._lock:
+            if self.closed or self.bytes_queued + size > self.max_buffer:
+                self.bytes_dropped += size
+                self.frames_dropped += 1
+                return False
+            self.frames.append(frame)
+            self.bytes_queued += size
+            # Wake the writer if it needs to (re)calculate when to flush
+            wake = self._oldest is None or self.bytes_queued >= self.flush_size
+            if self._oldest is None:
+                self._oldest = time.time()
+        if wake:
+            self._writer.wake()
+        return True
+
+    def flush_due(self, now):
+        """
+        Returns 0 if the buffer should be flushed right away, the number of
+        seconds until it should be flushed, or ``None`` if it is empty.
+        """
+        oldest = self._oldest
+        if oldest is None:
+            return None
+        if self.bytes_queued >= self.flush_size:
+            return 0
+        return max(0, oldest + self.flush_interval - now)
+
+    def flush(self):
+        """
+        Compresses and writes everything in the buffer to the log as a single
+        block.
+        """
+        with self._write_lock:
+            with self._lock:
+                if not self.frames:
+                    return
+                frames, self.frames = self.frames, deque()
+                self._oldest = None
+            data = b"".join(frames)
+            try:
+                if not self.log:
+                    self.log = gzip.open(self.path, mode='ab')
+                self.log.write(data)
+                self.bytes_written += len(data)
+            except (IOError, OSError) as e:
+                logging.error(_(
+                    "Could not write to session log %s: %s" % (self.path, e)))
+                self.bytes_dropped += len(data)
+                self.frames_dropped += len(frames)
+            finally:
+                with self._lock:
+                    self.bytes_queued -= len(data)
+
+    def close(self):
+        """
+        Flushes anything remaining in the buffer and closes the log.  Blocks
+        until everything has been written.  If this was the last open recorder
+        the background writer gets stopped too.
+        """
+        global _WRITER
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        writer = None
+        with _WRITER_LOCK:
+            self._writer.remove(self)
+            if self._writer is _WRITER and not _WRITER.recorders:
+                writer, _WRITER = _WRITER, None
+        if writer:
+            writer.stop()
+        self.flush()
+        with self._write_lock:
+            if self.log:
+                self.log.close()
+                self.log = None
+        for key, value in self.stats().items():
+            if key in RECORDING_TOTALS:
+                RECORDING_TOTALS[key] += value
+
+def recording_stats():
+    """
+    Returns a dict containing the sum of `SessionRecorder.stats` for every
+    `SessionRecorder` (open or closed) in this process.
+    """
+    stats = dict(RECORDING_TOTALS, bytes_queued=0)
+    if _WRITER:
+        with _WRITER.condition:
+            recorders = list(_WRITER.recorders)
+        for recorder in recorders:
+            for key, value in recorder.stats().items():
+                stats[key] += value
+    return stats
+
+def multiplex_stats():
+    """
+    Returns a copy of `MULTIPLEX_STATS` (counters that cover every Multiplex
+    instance in this process).  The ``*_seconds`` values only include the
+    calls that were sampled (one out of every `TIMING_SAMPLE_RATE`).
+    """
+    return MULTIPLEX_STATS.copy()
+
+class _AuditSink(threading.Thread):
+    """
+    Delivers session audit lines to the local syslog daemon (via the `syslog`
+    module) or, if *address* is given, directly to the Unix datagram socket at
+    that path (e.g. '/dev/log').  Lines are queued by `SessionAuditLog` and
+    delivered in batches from this (background) thread so a slow syslog
+    daemon can never block the IOLoop.
+
+    If more than *max_queue* batches are waiting they will be dropped (and
+    counted in `lines_dropped`).  Each user is limited to *rate* lines per
+    second (with bursts of up to ten times that) via `_AuditSink.allow`.
+    """
+    def __init__(self, facility, address=None, rate=100, max_queue=10000):
+        super(_AuditSink, self).__init__(name="SessionAudit")
+        self.daemon = True
+        self.facility = facility
+        self.address = address
+        self.rate = rate
+        self.queue = queue.Queue(max_queue)
+        self.buckets = {} # {<user>: [<tokens>, <last refill>]}
+        self.lines_sent = 0
+        self.lines_dropped = 0
+        self.socket = None
+        if not address:
+            import syslog
+            # Sets up syslog messages to show up like this:
+            #   Sep 28 19:45:02 <hostname> gateone: <log message>
+            syslog.openlog('gateone', 0, facility)
+
+    def allow(self, user, count):
+        """
+        Returns how many of *count* lines *user* is allowed to log right now
+        (a simple token bucket).
+        """
+        now = time.time()
+        bucket = self.buckets.get(user)
+        if not bucket:
+            bucket = self.buckets[user] = [self.rate * 10, now]
+        tokens = min(self.rate * 10, bucket[0] + (now - bucket[1]) * self.rate)
+        allowed = int(min(count, tokens))
+        bucket[0] = tokens - allowed
+        bucket[1] = now
+        return allowed
+
+    def submit(self, lines):
+        """
+        Queues *lines* (a list of strings) for delivery.  Returns ``False`` if
+        the queue is full (the lines will be dropped).
+        """
+        try:
+            self.queue.put_nowait(lines)
+        except queue.Full:
+            self.lines_dropped += len(lines)
+            return False
+        return True
+
+    def run(self):
+        while True:
+            lines = self.queue.get()
+            while len(lines) < 1000: # Deliver whatever else is waiting too
+                try:
+                    lines = lines + self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self.deliver(lines)
+                self.lines_sent += len(lines)
+            except Exception as e:
+                self.lines_dropped += len(lines)
+                logging.error(_("Could not deliver audit log lines: %s" % e))
+
+    def deliver(self, lines):
+        """
+        Sends *lines* to syslog (or `self.address`).
+        """
+        if self.address:
+            if not self.socket:
+                self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            # LOG_INFO (6) is the priority
+            prefix = ('<%d>gateone: ' % (self.facility | 6)).encode('ascii')
+            for line in lines:
+                message = line.encode('ascii', 'xmlcharrefreplace')
+                try:
+                    self.socket.sendto(prefix + message, self.address)
+                except socket.error:
+                    self.socket.close() # Re-open on the next batch
+                    self.socket = None
+                    raise
+        else:
+            import syslog
+            for line in lines:
+                # Sylog really doesn't like any fancy encodings
+                line = line.encode('ascii', 'xmlcharrefreplace')
+                if str != bytes: # Python 3
+                    line = line.decode('ascii')
+                syslog.syslog(line)
+
+_AUDIT_SINKS = {}
+_AUDIT_LOCK = threading.Lock()
+
+def get_audit_sink(facility, address=None, rate=100):
+    """
+    Returns the (running) `_AuditSink` for the given *facility* and *address*
+    (creating it if necessary).  All terminals share the same sink.
+    """
+    key = (facility, address)
+    with _AUDIT_LOCK:
+        sink = _AUDIT_SINKS.get(key)
+        if not sink:
+            sink = _AUDIT_SINKS[key] = _AuditSink(facility, address, rate)
+            sink.start()
+        sink.rate = rate
+    return sink
+
+class SessionAuditLog(object):
+    """
+    Turns the raw output of a terminal program into plain-text lines suitable
+    for syslog:  Escape sequences and control characters are removed (by a
+    `~termio.vtextract.VTTextExtractor` so nothing gets mangled when split
+    between chunks), output is assembled into complete lines, and the result is
+    handed to the shared `_AuditSink` in a single batch per chunk of output.  Lines over *user*'s
+    rate limit are dropped (and a note about how many were suppressed is logged
+    once the rate goes back down).
+    """
+    def __init__(self, user, term_id, facility=None, address=None, rate=100,
+            max_line=4096):
+        if facility is None:
+            facility = 24 # LOG_DAEMON
+        self.user = user
+        self.term_id = term_id
+        self.max_line = max_line
+        self.buffer = u""
+        self.extractor = VTTextExtractor()
+        self.suppressed = 0
+        self.sink = get_audit_sink(facility, address, rate)
+
+    def write(self, stream):
+        """
+        Adds *stream* (the output of the terminal program) to the line buffer
+        and submits any complete lines to the sink.
+        """
+        data = self.buffer + self.extractor.feed(stream)
+        lines = data.split(u'\n')
+        self.buffer = lines.pop() # Incomplete (or empty) line
+        if len(self.buffer) > self.max_line: # Don't buffer forever
+            lines.append(self.buffer)
+            self.buffer = u""
+        if not lines:
+            return
+        prefix = u"%s %s: " % (self.user, self.term_id)
+        out = []
+        for line in lines:
+            # Only what comes after the last carriage return is visible
+            line = line.rstrip(u'\r').rsplit(u'\r', 1)[-1]
+            if line.strip():
+                out.append(prefix + line)
+        if not out:
+            return
+        allowed = self.sink.allow(self.user, len(out))
+        if allowed < len(out):
+            self.suppressed += len(out) - allowed
+            out = out[:allowed]
+            if not out:
+                return
+        if self.suppressed:
+            out.insert(0, prefix + u"(%s lines suppressed due to rate limit)"
+                % self.suppressed)
+            self.suppressed = 0
+        self.sink.submit(out)
+
 class BaseMultiplex(object):
     """
     A base class that all Multiplex types will inherit from.
@@ -382,7 +858,10 @@ class BaseMultiplex(object):
     :term_id: *string* - The terminal identifier to associated with this instance (only used in the logs to identify terminals).
     :syslog: *boolean* - Whether or not the session should be logged using the local syslog daemon.
     :syslog_facility: *integer* - The syslog facility to use when logging messages.  All possible facilities can be found in `utils.FACILITIES` (if you need a reference other than the syslog module).
+    :syslog_address: *string* - If given, syslog messages will be sent directly to the Unix datagram socket at this path (e.g. '/dev/log') instead of going through the syslog module.
+    :syslog_rate: *integer* - The maximum number of lines per second (per *user*) that will be sent to syslog.  Anything more will be dropped.
     :additional_metadata: *dict* - Anything in this dict will be included in the metadata frame of the log file.  Can only be key:value strings.
+    :log_settings: *dict* - Keyword arguments that will be passed to the `SessionRecorder` that writes to *log_path* (e.g. ``{'max_buffer': 1048576}``).
     :encoding: *string* - The encoding to use when writing or reading output.
     :debug: *boolean* - Used by the `expect` methods...  If set, extra debugging information will be output whenever a regular expression is matched.
 
@@ -415,7 +894,10 @@ class BaseMultiplex(object):
             term_id=None, # Also only for syslog output for the same reason
             syslog=False,
             syslog_facility=None,
+            syslog_address=None,
+            syslog_rate=100,
             additional_metadata=None, # Will be stored in the log (if any)
+            log_settings=None, # SessionRecorder keyword arguments
             encoding='utf-8',
             debug=False):
         self.encoding = encoding
@@ -434,12 +916,15 @@ class BaseMultiplex(object):
         if not terminal_emulator_kwargs:
             self.terminal_emulator_kwargs = {}
         self.log_path = log_path # Logs of the terminal output wind up here
-        self.log = None # Just a placeholder until it is opened
+        self.log = None # Becomes a SessionRecorder when output is first logged
+        # Passed to SessionRecorder (max_buffer, flush_size, flush_interval):
+        self.log_settings = log_settings or {}
         self.syslog = syslog # See "if self.syslog:" below
         self._alive = False
         self.ratelimiter_engaged = False
         self.capture_ratelimiter = False
         self.ctrl_c_pressed = False
+        self.bytes_read = 0 # Total output read from the underlying program
         self.capturing_timeout = timedelta(seconds=2)
         self.rows = 24
         self.cols = 80
@@ -456,22 +941,22 @@ class BaseMultiplex(object):
         # Configure syslog logging
         self.user = user
         self.term_id = term_id
-        self.syslog_buffer = ''
+        self.audit_log = None # Replaced with a SessionAuditLog (if syslog)
         self.additional_metadata = additional_metadata
         if self.syslog:
-            try:
-                import syslog
-            except ImportError:
-                logging.error(_(
-                    "The syslog module is required to log terminal sessions to "
-                    "syslog."))
-                sys.exit(1)
-            if not syslog_facility:
-                syslog_facility = syslog.LOG_DAEMON
-            syslog_facility = syslog_facility
-            # Sets up syslog messages to show up like this:
-            #   Sep 28 19:45:02 <hostname> gateone: <log message>
-            syslog.openlog('gateone', 0, syslog_facility)
+            if not syslog_address:
+                try:
+                    import syslog
+                except ImportError:
+                    logging.error(_(
+                        "The syslog module is required to log terminal "
+                        "sessions to syslog."))
+                    sys.exit(1)
+            self.audit_log = SessionAuditLog(
+                user, term_id,
+                facility=syslog_facility,
+                address=syslog_address,
+                rate=syslog_rate)
 
     def __repr__(self):
         """
@@ -599,67 +1084,31 @@ class BaseMultiplex(object):
         """
         #logging.debug('term_write() stream: %s' % repr(stream))
         # Write to the log (if configured)
-        separator = b"\xf3\xb0\xbc\x8f"
         if self.log_path:
-            # Using .encode() below ensures the result will be bytes
-            now = str(int(round(time.time() * 1000))).encode('UTF-8')
-            if not os.path.exists(self.log_path):
-                # Write the first frame as metadata
-                metadata = {
-                    'version': '1.0', # Log format version
-                    'rows': self.rows,
-                    'columns': self.cols,
-                    'term_id': self.term_id,
-                    'start_date': now.decode('UTF-8') # JSON needs strings
-                    # NOTE: end_date should be added later when the is read for
-                    # the first time by either the logviewer or the logging
-                    # plugin.
-                }
-                # Add any extra metadata to the first frame
-                if self.additional_metadata:
-                    metadata.update(self.additional_metadata)
-                # The hope is that we can use the first-frame-metadata paradigm
-                # to store all sorts of useful information about a log.
-                # NOTE: Using .encode() below to ensure it is bytes in Python 3
-                metadata_frame = json_encode(metadata).encode('UTF-8')
-                # Using concatenation of bytes below to ensure compatibility
-                # with both Python 2 and Python 3.
-                metadata_frame = now + b":" + metadata_frame + separator
-                self.log = gzip.open(self.log_path, mode='a')
-                self.log.write(metadata_frame)
-            if not self.log: # Only comes into play if the file already exists
-                self.log = gzip.open(self.log_path, mode='a')
-            # NOTE: I'm using an obscure unicode symbol in order to avoid
-            # conflicts.  We need to do our best to ensure that we can
-            # differentiate between terminal output and our log format...
-            # This should do the trick because it is highly unlikely that
-            # someone would be displaying this obscure unicode symbol on an
-            # actual terminal unless they were using Gate One to view a
-            # Gate One log file in vim or something =)
-            # "\xf3\xb0\xbc\x8f" == \U000f0f0f == U+F0F0F (Private Use Symbol)
-            output = now + b":" + stream + separator
-            self.log.write(output)
+            if not self.log:
+                self.log = SessionRecorder(self.log_path, **self.log_settings)
+                if not os.path.exists(self.log_path):
+                    # Write the first frame as metadata
+                    self._record_metadata()
+            self.log.record(stream)
         # NOTE: Gate One's log format is special in that it can be used for both
         # playing back recorded sessions *or* generating syslog-like output.
-        if self.syslog:
-            # Try and keep it as line-line as possible so we don't end up with
-            # a log line per character.
-            import syslog
-            if '\n' in stream:
-                for line in stream.splitlines():
-                    if self.syslog_buffer:
-                        line = self.syslog_buffer + line
-                        self.syslog_buffer = ''
-                    # Sylog really doesn't like any fancy encodings
-                    line = line.encode('ascii', 'xmlcharrefreplace')
-                    syslog.syslog("%s %s: %s" % (
-                        self.user, self.term_id, line))
-            else:
-                self.syslog_buffer += stream
+        if self.audit_log:
+            self.audit_log.write(stream)
         # Handle preprocess patterns (for expect())
         if self._patterns:
             self.preprocess(stream)
-        self.term.write(stream)
+        stats = MULTIPLEX_STATS
+        self.bytes_read += len(stream)
+        stats['bytes_read'] += len(stream)
+        stats['term_writes'] += 1
+        if stats['term_writes'] % TIMING_SAMPLE_RATE:
+            self.term.write(stream)
+        else: # Time this one
+            start = time.time()
+            self.term.write(stream)
+            stats['term_write_seconds'] += time.time() - start
+            stats['term_write_samples'] += 1
         # Handle post-process patterns (for expect())
         if self._patterns:
             self.postprocess()
@@ -667,6 +1116,30 @@ class BaseMultiplex(object):
             for callback in self.callbacks[self.CALLBACK_UPDATE].values():
                 self._call_callback(callback, stream=stream)
 
+    def _record_metadata(self):
+        """
+        Records the first frame of the log (:attr:`log_path`) which contains
+        metadata about the session.
+        """
+        now = str(int(round(time.time() * 1000))).encode('UTF-8')
+        metadata = {
+            'version': '1.0', # Log format version
+            'rows': self.rows,
+            'columns': self.cols,
+            'term_id': self.term_id,
+            'start_date': now.decode('UTF-8') # JSON needs strings
+            # NOTE: end_date should be added later when the is read for
+            # the first time by either the logviewer or the logging
+            # plugin.
+        }
+        # Add any extra metadata to the first frame
+        if self.additional_metadata:
+            metadata.update(self.additional_metadata)
+        # The hope is that we can use the first-frame-metadata paradigm
+        # to store all sorts of useful information about a log.
+        # NOTE: Using .encode() below to ensure it is bytes in Python 3
+        self.log.record(json_encode(metadata).encode('UTF-8'), timestamp=now)
+
     def preprocess(self, stream):
         """
         Handles preprocess patterns registered by :meth:`expect`.  That
@@ -815,7 +1288,7 @@ class BaseMultiplex(object):
             if self.term:
                 try:
                     modified = self.term.modified
-                    result = self.term.dump_html()
+                    result = self._dump_term_html()
                     if result:
                         scrollback, html = result
                         if scrollback:
@@ -854,6 +1327,21 @@ class BaseMultiplex(object):
                 traceback.print_exc(file=sys.stdout)
             return ([], [])
 
+    def _dump_term_html(self):
+        """
+        Returns the result of ``self.term.dump_html()`` (counting the call and
+        sampling how long it took in `MULTIPLEX_STATS`).
+        """
+        stats = MULTIPLEX_STATS
+        stats['dump_html_calls'] += 1
+        if stats['dump_html_calls'] % TIMING_SAMPLE_RATE:
+            return self.term.dump_html()
+        start = time.time() # Time this one
+        result = self.term.dump_html()
+        stats['dump_html_seconds'] += time.time() - start
+        stats['dump_html_samples'] += 1
+        return result
+
     def dump(self):
         """
         Dumps whatever is currently on the screen of the terminal emulator as
@@ -898,6 +1386,44 @@ class BaseMultiplex(object):
                 remaining_patterns = True
         return remaining_patterns
 
+    def _timeout_checker(self):
+        """
+        Runs `timeout_check` and if there are still non-sticky patterns in
+        :attr:`self._patterns`, re-arms :attr:`scheduler` for whichever one
+        will time out next.
+
+        .. note:: Subclasses that support :meth:`expect` timeouts must set :attr:`scheduler` (a `PatternTimer` that calls this method).
+        """
+        if not self._checking_patterns:
+            self._checking_patterns = True
+            remaining_patterns = self.timeout_check()
+            try:
+                if remaining_patterns:
+                    self.scheduler.start()
+                else:
+                    self.scheduler.stop()
+            except AttributeError:
+                pass # terminate() was called (no more self.scheduler)
+            self._checking_patterns = False
+
+    def next_timeout(self):
+        """
+        Returns the `datetime.datetime` when the next `Pattern` in
+        :attr:`BaseMultiplex._patterns` will time out (or ``None`` if none of
+        them will).  Sticky patterns that have already timed out don't count.
+        """
+        now = datetime.now()
+        deadlines = []
+        for pattern_obj in self._patterns:
+            if not pattern_obj.timeout:
+                continue # Waits forever
+            deadline = pattern_obj.created + pattern_obj.timeout
+            if pattern_obj.sticky and deadline <= now:
+                continue
+            deadlines.append(deadline)
+        if deadlines:
+            return min(deadlines)
+
     def expect(self, patterns, callback,
             optional=False,
             sticky=False,
@@ -1181,6 +1707,56 @@ class BaseMultiplex(object):
         raise NotImplementedError(_(
             "write() *must* be overridden by subclasses."))
 
+class PatternTimer(object):
+    """
+    Calls *callback* (`MultiplexPOSIXIOLoop._timeout_checker`) when the next
+    `Pattern` belonging to *multiplex* is due to time out (see
+    `BaseMultiplex.next_timeout`) using a single `IOLoop.add_timeout` instead of
+    checking at a regular interval.  Has the same `start`/`stop` interface as
+    `tornado.ioloop.PeriodicCallback`.
+
+    .. note::
+
+        Calling `start` when the timer is already running re-arms it for
+        whatever pattern is due next (which may have changed).
+    """
+    def __init__(self, multiplex, callback, io_loop):
+        self.multiplex = multiplex
+        self.callback = callback
+        self.io_loop = io_loop
+        self._timeout = None
+        self._deadline = None
+
+    @property
+    def _running(self):
+        return self._timeout is not None
+
+    def start(self):
+        """
+        Sets the timeout for the next pattern that will time out (if any).
+        """
+        deadline = self.multiplex.next_timeout()
+        if deadline == self._deadline:
+            return
+        self.stop()
+        if deadline:
+            self._deadline = deadline
+            delay = max((deadline - datetime.now()).total_seconds(), 0)
+            self._timeout = self.io_loop.add_timeout(
+                timedelta(seconds=delay), self._run)
+
+    def stop(self):
+        """Cancels the timeout (if any)."""
+        if self._timeout:
+            self.io_loop.remove_timeout(self._timeout)
+        self._timeout = None
+        self._deadline = None
+
+    def _run(self):
+        self._timeout = None
+        self._deadline = None
+        self.callback()
+
 class MultiplexPOSIXIOLoop(BaseMultiplex):
     """
     The MultiplexPOSIXIOLoop class takes care of executing a child process on
@@ -1209,13 +1785,18 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
         #self.io_loop.set_blocking_signal_threshold(2, self._blocked_io_handler)
         #signal.signal(signal.SIGALRM, self._blocked_io_handler)
         self.reenable_timeout = None
-        interval = 100 # A 0.1 second interval should be fast enough
-        self.scheduler = ioloop.PeriodicCallback(self._timeout_checker,interval)
+        # Fires when expect() patterns time out:
+        self.scheduler = PatternTimer(self, self._timeout_checker, self.io_loop)
         self.exitstatus = None
         self._checking_patterns = False
         self.read_timeout = datetime.now()
         self.capture_limit = -1 # Huge reads by default
         self.restore_rate = None
+        # Input the child wasn't ready to accept (starting at _pending_offset)
+        self._pending_input = bytearray()
+        self._pending_offset = 0
+        self._discarding_input = False # So we only log that once per backlog
+        self._handler_events = None # What we're watching self.fd for
 
     def __del__(self):
         """
@@ -1250,6 +1831,28 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
         except IOError:
             # Already been re-added...  Probably by write().  Ignore.
             pass
+        # Start watching for writability again if input is still waiting
+        self._update_handler(force=True)
+
+    def _update_handler(self, force=False):
+        """
+        Makes sure the IOLoop is watching `self.fd` for writability if (and
+        only if) there's pending input (see `_flush_input`).  Does nothing
+        while the rate limiter has the fd detached.  The IOLoop only gets
+        told when something changed unless *force* is True.
+        """
+        if self.ratelimiter_engaged:
+            return # _reenable_output() will call us again
+        events = self.io_loop.READ
+        if self._pending_input:
+            events |= self.io_loop.WRITE
+        if events == self._handler_events and not force:
+            return
+        try:
+            self.io_loop.update_handler(self.fd, events)
+            self._handler_events = events
+        except (KeyError, IOError, OSError):
+            pass # fd was closed/removed (program terminated)
 
     def __reset_sent_sigint(self):
         self.sent_sigint = False
@@ -1273,6 +1876,8 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
         if not wait:
             wait = 5000
         self.ratelimiter_engaged = True
+        self._handler_events = None
+        MULTIPLEX_STATS['ratelimiter_engaged'] += 1
         # CALLBACK_UPDATE is called here so the client can be made aware of the
         # fact that the rate limiter was engaged.
         for callback in self.callbacks[self.CALLBACK_UPDATE].values():
@@ -1392,11 +1997,14 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
             # Tell our IOLoop instance to start watching the child
             self.io_loop.add_handler(
                 fd, self._ioloop_read_handler, self.io_loop.READ)
+            self._handler_events = self.io_loop.READ
+            self._pending_input = bytearray()
+            self._pending_offset = 0
             self.prev_output = {}
             self.shared_scrollback = []
             # Set non-blocking so we don't wait forever for a read()
             import fcntl
-            fl = fcntl.fcntl(sys.stdin, fcntl.F_GETFL)
+            fl = fcntl.fcntl(self.fd, fcntl.F_GETFL)
             fcntl.fcntl(self.fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
             # Set the size of the terminal
             resize = partial(self.resize, rows, cols, ctrl_l=False)
@@ -1495,9 +2103,8 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
             pass
         self.scheduler.stop()
         # NOTE: Without this 'del' we end up with a memory leak every time
-        # a new instance of Multiplex is created.  Apparently the references
-        # inside of PeriodicCallback pointing to self prevents proper garbage
-        # collection.
+        # a new instance of Multiplex is created.  The PatternTimer references
+        # self which prevents proper garbage collection.
         del self.scheduler
         try:
             os.kill(self.pid, signal.SIGTERM)
@@ -1553,7 +2160,7 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
             return # No log to finalize so we're done.
         if not self.log:
             return # No log to finalize so we're done.
-        self.log.close() # Write it out
+        self.log.close() # Write out whatever is left in the buffer
         logging.info(_("Finalizing {path} (pid: {pid})").format(
             path=self.log_path, pid=self.pid))
         with ProcessPoolExecutor(max_workers=1) as pool:
@@ -1571,8 +2178,11 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
 
         .. note:: This method is not meant to be called directly...  The IOLoop should be the one calling it when it detects any given event on the fd.
         """
-        if event == self.io_loop.READ:
-            self._call_callback(self.read)
+        if not event & ~(self.io_loop.READ | self.io_loop.WRITE):
+            if event & self.io_loop.WRITE:
+                self._flush_input()
+            if event & self.io_loop.READ:
+                self._call_callback(self.read)
         else: # Child died
             logging.debug(_(
                 "Apparently fd %s just died (event: %s)" % (self.fd, event)))
@@ -1625,6 +2235,12 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
                         self.term_write(updated)
                         if self.ratelimiter_engaged or self.capture_ratelimiter:
                             break # Only allow one read per IOLoop loop
+                        if self.log and self.log.backlogged:
+                            # The session log can't keep up; stop reading for
+                            # a moment so it can catch up (instead of dropping
+                            # output from the recording)
+                            self._blocked_io_handler(wait=250)
+                            break
                         if self.capture_limit == 2048:
                             # Block for a little while: Enough to keep things
                             # moving but not fast enough to slow everyone else
@@ -1674,28 +2290,6 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
                 print("_read(): %s" % repr(result))
         return result
 
-    def _timeout_checker(self):
-        """
-        Runs `timeout_check` and if there are no more non-sticky
-        patterns in :attr:`self._patterns`, stops :attr:`scheduler`.
-        """
-        if not self._checking_patterns:
-            self._checking_patterns = True
-            remaining_patterns = self.timeout_check()
-            if not remaining_patterns:
-                # No reason to keep the PeriodicCallback going
-                logging.debug("Stopping self.scheduler (no remaining patterns)")
-                try:
-                    self.scheduler.stop()
-                except AttributeError:
-                # Now this is a neat trick:  The way IOLoop works with its
-                # stack_context thingamabob the scheduler doesn't actualy end up
-                # inside the MultiplexPOSIXIOLoop instance inside of this
-                # instance of _timeout_checker() *except* inside the main
-                # thread.  It is absolutely wacky but it works and works well :)
-                    pass
-            self._checking_patterns = False
-
     def read_raw(self, bytes=-1):
         """
         Reads the output from the underlying fd and returns the result.
@@ -1720,11 +2314,10 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
 
         Calls `_read` and checks if any timeouts have been reached
         in :attr:`self._patterns`.  Returns the result of :meth:`_read`.  This
-        is an override of `BaseMultiplex.read` that will create a
-        :class:`tornado.ioloop.PeriodicCallback` (as `self.scheduler`) that
-        executes :attr:`timeout_check` at a regular interval.  The
-        `PeriodicCallback` will automatically cancel itself if there are no more
-        non-sticky patterns in :attr:`self._patterns`.
+        is an override of `BaseMultiplex.read` that will start a `PatternTimer`
+        (as `self.scheduler`) that executes :attr:`timeout_check` when the next
+        pattern is due to time out.  It will automatically stop if there are no
+        more non-sticky patterns in :attr:`self._patterns`.
         """
         # 50ms basic output rate limit on everything
         rate_wait = timedelta(milliseconds=50)
@@ -1732,9 +2325,8 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
             result = self._read(bytes)
             self.read_timeout = datetime.now()
             remaining_patterns = self.timeout_check()
-            if remaining_patterns and not self.scheduler._running:
+            if remaining_patterns:
                 # Start 'er up in case we don't get any more output
-                logging.debug("Starting self.scheduler to check for timeouts")
                 self.scheduler.start()
             self.isalive() # This just ensures the exitfunc is called (if necessary)
             try:
@@ -1747,44 +2339,95 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
                 self.exitstatus = os.WEXITSTATUS(status)
             return result
 
+    def _flush_input(self):
+        """
+        Writes as much of `self._pending_input` to `self.fd` as the child will
+        accept without blocking.  Whatever is left over gets written once the
+        IOLoop says the fd is writable again.  If OSError exceptions (other
+        than the fd not being ready) are encountered, will run `terminate`.
+        """
+        pending = self._pending_input
+        while self._pending_offset < len(pending):
+            try:
+                written = os.write(
+                    self.fd, memoryview(pending)[self._pending_offset:])
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break # Child isn't reading; try again when it is
+                logging.error(_(
+                    "Encountered error writing to terminal program: %s") % e)
+                self._pending_input = bytearray()
+                self._pending_offset = 0
+                if self.isalive():
+                    self.terminate()
+                return
+            self._pending_offset += written
+        # Only move the remainder to the front once it's worth the copying
+        if self._pending_offset == len(pending):
+            del pending[:]
+            self._pending_offset = 0
+            self._discarding_input = False
+        elif self._pending_offset > len(pending) // 2:
+            del pending[:self._pending_offset]
+            self._pending_offset = 0
+        self._update_handler()
+
     def _write(self, chars):
         """
-        Writes *chars* to `self.fd` (pretty straightforward).  If IOError or
-        OSError exceptions are encountered, will run `terminate`.  All other
-        exceptions are logged but no action will be taken.
+        Writes *chars* to `self.fd` (pretty straightforward).  If the child
+        isn't ready for all of it the remainder will be written as soon as it
+        is (see `_flush_input`) but no more than `MAX_PENDING_INPUT` bytes will
+        be held onto (the rest gets discarded).  If OSError exceptions are
+        encountered, will run `terminate`.  All other exceptions are logged but
+        no action will be taken.
         """
         #logging.debug("MultiplexPOSIXIOLoop._write(%s)" % repr(chars))
         try:
-            with io.open(
-                self.fd, 'wt', encoding='UTF-8', closefd=False) as writer:
-                    writer.write(chars)
+            if not isinstance(chars, bytes):
+                chars = chars.encode('UTF-8')
             if self.ratelimiter_engaged:
-                if u'\x03' in chars: # Ctrl-C
+                if b'\x03' in chars: # Ctrl-C
                     # This will force self._read() to discard the buffer
                     self.ctrl_c_pressed = True
                 # Reattach the fd so the user can continue immediately
                 self._reenable_output()
+            self._pending_input += chars
+            self._flush_input()
+            excess = (len(self._pending_input) - self._pending_offset
+                - MAX_PENDING_INPUT)
+            if excess > 0:
+                del self._pending_input[-excess:]
+                if not self._discarding_input:
+                    self._discarding_input = True
+                    logging.warning(_(
+                        "%s: Discarding input (the program isn't reading "
+                        "it)") % self.term_id)
         except OSError as e:
             logging.error(_(
                 "Encountered error writing to terminal program: %s") % e)
+            self._pending_input = bytearray()
+            self._pending_offset = 0
             if self.isalive():
                 self.terminate()
-        except IOError as e:
-            # We can safely ignore most of these...  They tend to crop up when
-            # writing big chunks of data to dtach'd terminals.
-            if not 'raw write()' in e.message:
-                logging.error("write() exception: %s" % e)
         except Exception as e:
             logging.error("write() exception: %s" % e)
 
     def write(self, chars):
         """
-        Calls `_write(*chars*)` via `_call_callback` to ensure thread safety.
+        Writes *chars* to the child process.  When called from the IOLoop's own
+        thread (e.g. when handling a keystroke from a WebSocket) this happens
+        immediately; from any other thread `_write(*chars*)` gets called via
+        `_call_callback` to ensure thread safety.
         """
         if not self.isalive():
             raise ProgramTerminated(_("Child process is not running."))
-        write = partial(self._write, chars)
-        self._call_callback(write)
+        from tornado.ioloop import IOLoop
+        if self.io_loop is IOLoop.current(instance=False):
+            self._write(chars)
+        else:
+            self._call_callback(self._write, chars)
 
 # Here's an example of how termio compares to pexpect:
 #import pexpect
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2014 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+# Meta
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+__doc__ = """\
+.. _vtextract.py:
+
+VT Text Extractor
+=================
+Turns the raw output of a terminal program (escape sequences and all) into
+plain text.  Used anywhere Gate One needs to know what a program "said" without
+caring how it was drawn:  Capturing terminal output
+(`~gateone.applications.terminal.term_utils.capture_stream`), flattening
+session logs (`~gateone.applications.terminal.logviewer.flatten_log`), and
+session logging to syslog (`termio.SessionAuditLog`).
+
+Nearly all of the work is done by a single, precompiled regular expression in
+one pass over the text.  `VTTextExtractor` is stateful:  Multibyte characters and escape
+sequences that get split across chunks of output are held back until the rest
+of them arrives.  Example::
+
+    >>> from termio.vtextract import VTTextExtractor
+    >>> extractor = VTTextExtractor()
+    >>> extractor.feed(b'\\x1b[1;34mbsmith\\x1b[0m@host:~ $ ca\\xc3')
+    u'bsmith@host:~ $ ca'
+    >>> extractor.feed(b'\\xa9\\x1b]0;title\\x07\\r\\n')
+    u'\\xe9\\n'
+
+If you just want to strip a string that you already have in its entirety use
+`strip_vt`::
+
+    >>> strip_vt(u'\\x1b[1mbold\\x1b[m and \\x1b[32mgreen\\x1b[0m')
+    u'bold and green'
+
+The following transformations are performed:
+
+    * Character renditions (SGR sequences; colors, bold, etc) are removed unless
+      *preserve_renditions* is True.
+    * Cursor forward (e.g. ``\\x1b[5C``) becomes the equivalent number of spaces.
+    * Erase display (``\\x1b[2J``) becomes a form feed (``\\f``) if *form_feed*
+      is True (it's removed otherwise).
+    * ``\\r\\n`` becomes ``\\n``.
+    * All other escape sequences (CSI, OSC, DCS, etc) and control characters
+      other than ``\\t``, ``\\n``, and ``\\r`` are removed.
+
+To see how fast it is on your system run this module directly::
+
+    python -m termio.vtextract
+"""
+
+import re, codecs
+
+# Globals
+# Partial escape sequences longer than this will be treated as garbage
+MAX_PENDING = 4096
+# This gets filled out with the final characters of the CSI sequences that
+# RE_VT_STRIP (below) should remove (everything in @-~ minus what we keep).
+# NOTE: Every match starts with a single control character (so the regex engine
+# can skip over plain text quickly).  If that character is an ESC the rest of
+# the escape sequence has to match too.
+_RE_VT_STRIP = (
+    u'[\x00-\x08\x0b-\x0c\x0e-\x1f\x7f](?:(?<=\x1b)(?:'
+        u'\\[[0-?]*[ -/]*[{finals}]' # CSI
+        u'|[\\]PX^_][^\x07\x1b]*(?:\x07|\x1b\\\\)' # OSC, DCS, SOS, PM, APC
+        u'|[ #%()*+\\-./].' # Charset designations (and the like)
+        u'|[^\\[\\]PX^_ #%()*+\\-./\x00-\x1f]' # Everything else (2 chars)
+        u'|(?!\\[)' # ESC that isn't part of a valid sequence
+    u')|(?<!\x1b))' # Any other control character (on its own)
+)
+# Removes everything but cursor forward and erase display sequences:
+RE_VT_STRIP = re.compile(_RE_VT_STRIP.format(finals=u'@-BD-IK-~'))
+# Same as above but also leaves SGR sequences alone:
+RE_VT_STRIP_KEEP_SGR = re.compile(_RE_VT_STRIP.format(finals=u'@-BD-IK-ln-~'))
+# The sequences left behind by the above that get replaced with something else
+# (or removed if they're garbage):
+RE_VT_SPECIAL = re.compile(
+    u'\x1b\\[(?:([0-?]*)[ -/]*([CJ])|(?![0-?]*[ -/]*m))')
+# Matches anything at the end of a chunk that might be completed by the next one
+RE_VT_PARTIAL = re.compile(
+    u'(?:\x1b(?:\\[[0-?]*[ -/]*|[\\]PX^_][^\x07\x1b]*\x1b?|[ #%()*+\\-./])?'
+    u'|\r)\\Z'
+)
+
+class VTTextExtractor(object):
+    """
+    A stateful, streaming converter of terminal output to plain text.  Call
+    `feed` with each chunk of output (bytes or unicode) as it arrives and it
+    will return the (unicode) text contained within.  Call `flush` when there's
+    no more output to get whatever was being held back.
+
+    :param bool preserve_renditions: If True, SGR sequences (colors, bold, etc) will be left in the output as-is.
+    :param bool form_feed: If True, "erase display" sequences (e.g. clear screen) will be replaced with a form feed (``\\f``).
+    :param str encoding: The encoding to use when decoding bytes.
+    """
+    def __init__(self, preserve_renditions=False, form_feed=False,
+            encoding='utf-8'):
+        self.preserve_renditions = preserve_renditions
+        self.form_feed = form_feed
+        self.encoding = encoding
+        if preserve_renditions:
+            self.re_strip = RE_VT_STRIP_KEEP_SGR
+        else:
+            self.re_strip = RE_VT_STRIP
+        self.reset()
+
+    def reset(self):
+        """
+        Discards any partial characters or escape sequences being held back.
+        """
+        self.decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+        self.pending = u''
+
+    @property
+    def idle(self):
+        """
+        ``True`` if nothing (a partial escape sequence or multibyte character)
+        is being held back for the next call to `feed`.
+        """
+        return not self.pending and not self.decoder.getstate()[0]
+
+    def _replace(self, match):
+        """
+        Returns whatever should replace the cursor forward or erase display
+        sequence (or incomplete CSI sequence) in *match*.  Used with
+        `RE_VT_SPECIAL.sub`.
+        """
+        final = match.group(2)
+        if final == u'C':
+            count = match.group(1)
+            if count.isdigit():
+                return u' ' * min(int(count), 1000)
+            return u' '
+        elif final and self.form_feed and match.group(1) == u'2':
+            return u'\f'
+        return u''
+
+    def _extract(self, text):
+        """
+        Performs the actual conversion of *text* (which must be complete).
+        Everything gets removed in a single pass (in C) with the exception of
+        the sequences that need to be replaced with something (which are
+        comparatively rare).
+        """
+        text = self.re_strip.sub(u'', text)
+        if u'\r\n' in text:
+            text = text.replace(u'\r\n', u'\n')
+        if u'\x1b[' in text:
+            text = RE_VT_SPECIAL.sub(self._replace, text)
+        return text
+
+    def feed(self, data):
+        """
+        Returns the text contained within *data* (a chunk of terminal output).
+        Incomplete escape sequences (and multibyte characters) at the end of
+        *data* will be held back until the next call to `feed` (or `flush`).
+        """
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data)
+        if self.pending:
+            data = self.pending + data
+            self.pending = u''
+        if u'\x1b' in data or u'\r' in data:
+            partial = RE_VT_PARTIAL.search(data, max(0, len(data)-MAX_PENDING))
+            if partial:
+                self.pending = partial.group()
+                data = data[:partial.start()]
+        return self._extract(data)
+
+    def flush(self):
+        """
+        Returns whatever was being held back by `feed` (minus any incomplete
+        escape sequence) and resets the extractor.
+        """
+        data = self.pending + self.decoder.decode(b'', True)
+        self.reset()
+        partial = RE_VT_PARTIAL.search(data)
+        if partial and partial.group() != u'\r':
+            data = data[:partial.start()]
+        return self._extract(data)
+
+def strip_vt(text, preserve_renditions=False, form_feed=False):
+    """
+    Returns *text* (bytes or unicode) with all escape sequences and control
+    characters removed.  See `VTTextExtractor` for the meaning of the keyword
+    arguments.
+    """
+    extractor = VTTextExtractor(
+        preserve_renditions=preserve_renditions, form_feed=form_feed)
+    return extractor.feed(text) + extractor.flush()
+
+def benchmark(size=16777216, chunk_size=65536):
+    """
+    Feeds *size* bytes of fake (but realistic) terminal output through
+    `VTTextExtractor` in chunks of *chunk_size* and returns the throughput in
+    MB/s.
+    """
+    import time
+    sample = (
+        b'\x1b]0;bsmith@host:~\x07\x1b[1;34mbsmith\x1b[0m@host:~ $ ls -l\r\n'
+        b'drwxr-xr-x  2 bsmith users  4096 Sep  9 21:07 \x1b[01;34mdocs\x1b[0m'
+        b'\r\n-rw-r--r--  1 bsmith users 18221 Sep  9 21:07 caf\xc3\xa9.txt\r\n'
+        b'\x1b[?1049h\x1b[H\x1b[2J\x1b[7m  GNU nano 2.2.6  \x1b[m\x1b[3;5H'
+        b'Plain old text that just goes on and on without any escapes at all '
+        b'(which is what most terminal output looks like most of the time)\r\n'
+    )
+    stream = sample * (size // len(sample))
+    extractor = VTTextExtractor()
+    start = time.time()
+    for i in range(0, len(stream), chunk_size):
+        extractor.feed(stream[i:i+chunk_size])
+    extractor.flush()
+    elapsed = time.time() - start
+    return (len(stream) / 1048576.0) / elapsed
+
+if __name__ == "__main__":
+    for chunk_size in (1024, 65536):
+        print("VTTextExtractor (%6d byte chunks): %.1f MB/s" % (
+            chunk_size, benchmark(chunk_size=chunk_size)))